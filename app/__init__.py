@@ -1,16 +1,36 @@
 import os
 
 from flask import Flask
+from jinja2 import FileSystemBytecodeCache
 from flask_login import LoginManager
 
 basedir = os.path.abspath(os.path.dirname(__file__))
 
-db_filename = os.path.join(basedir, "trading_card_data.db")
+db_filename = os.environ.get("TRADING_CARD_DB", os.path.join(basedir, "trading_card_data.db"))
 schema_filename = os.path.join(basedir, "trading_card_schema.sql")
+# where the prebuilt database images that a new database is restored from are kept, see app/db_image.py
+image_dir = os.environ.get("TRADING_CARD_IMAGE_DIR", basedir)
+# where the scheduled and admin triggered online backups are written, see app/backup.py
+backup_dir = os.environ.get("TRADING_CARD_BACKUP_DIR", os.path.join(basedir, "backups"))
+# the directory of leagues and their members, the database files of the leagues are kept next to it, see app/leagues.py
+leagues_filename = os.environ.get("TRADING_CARD_LEAGUES", os.path.join(basedir, "trading_card_leagues.db"))
+league_schema_filename = os.path.join(basedir, "league_schema.sql")
+# where the compiled templates are kept between starts, so a new process does not compile them all again
+template_cache_dir = os.environ.get("TRADING_CARD_TEMPLATE_CACHE", os.path.join(basedir, "template_cache"))
+
+# where the fingerprinted and precompressed copies of the static files are built, see app/assets.py
+asset_dir = os.environ.get("TRADING_CARD_ASSET_DIR", os.path.join(basedir, "static_build"))
+# the per-season stats of the players, memory mapped by every process, see app/season_stats.py
+stats_filename = os.environ.get("TRADING_CARD_STATS", os.path.join(basedir, "season_stats.bin"))
 
 app = Flask(__name__)
 app.secret_key = "final_project"
+os.makedirs(template_cache_dir, exist_ok=True)
+app.jinja_env.bytecode_cache = FileSystemBytecodeCache(template_cache_dir)
 login = LoginManager(app)
 login.login_view = 'login'
 
-from app import query_engine, routes
+from app import query_engine, leagues, assets, season_stats, routes, commands
+from app.api import api
+
+app.register_blueprint(api)
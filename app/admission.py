@@ -0,0 +1,164 @@
+"""
+Admission control for the routes that write. Every User has a token bucket for each class of write route, and a
+global limit caps how many write requests are in flight. A client hammering a route is turned away at once with a
+429 and a Retry-After instead of queueing in front of the database's single writer with everybody else, and when too
+many writes are in flight new ones are shed with a 503 after a short wait.
+"""
+import math
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+from typing import Callable, Dict, Hashable, Optional, Tuple
+
+from flask import Response, jsonify, request
+from flask_login import current_user
+
+# (tokens per second, bucket size) of each class of write route: a User can make a burst of bucket size writes and
+# then keep up tokens per second of them
+ROUTE_RATES: Dict[str, Tuple[float, float]] = {
+    "cards": (2.0, 10),
+    "trades": (2.0, 10),
+    "wants": (2.0, 10),
+}
+# how many write requests may be in flight at once in this process
+MAX_WRITES_IN_FLIGHT = 8
+# how long a write request waits for one of them to finish before it is shed, in seconds
+WRITE_WAIT = 0.05
+# the Retry-After of a shed request, in seconds
+SHED_RETRY_AFTER = 1
+# how many buckets are kept before the least recently used one, which has most likely filled up again and is then the
+# same as no bucket, is dropped
+MAX_BUCKETS = 10000
+# the request methods that are admitted, the other ones only read
+WRITE_METHODS = frozenset(("POST", "PUT", "PATCH", "DELETE"))
+
+
+class TokenBucket:
+    __slots__ = ("tokens", "updated")
+
+    def __init__(self, tokens: float, updated: float):
+        self.tokens = tokens
+        self.updated = updated
+
+
+class AdmissionController:
+    """
+    AdmissionController decides whether a write request goes ahead. take() spends a token of the User's bucket for
+    the route class, enter() and leave() hold one of the in-flight slots for as long as the request runs. Its
+    decisions are counted for stats(). The buckets are kept in the order they were last used, so when there are
+    max_buckets of them the least recently used one is dropped in constant time.
+    """
+
+    def __init__(self, rates: Optional[Dict[str, Tuple[float, float]]] = None,
+                 max_in_flight: int = MAX_WRITES_IN_FLIGHT, wait: float = WRITE_WAIT,
+                 clock: Callable[[], float] = time.monotonic, max_buckets: int = MAX_BUCKETS):
+        self.rates = dict(ROUTE_RATES if rates is None else rates)
+        self.max_in_flight = max_in_flight
+        self.wait = wait
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.max_buckets = max_buckets
+        self.buckets: "OrderedDict[Tuple[Hashable, str], TokenBucket]" = OrderedDict()
+        self.slots = threading.BoundedSemaphore(max_in_flight)
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.admitted: Dict[str, int] = {route_class: 0 for route_class in self.rates}
+        self.limited: Dict[str, int] = {route_class: 0 for route_class in self.rates}
+        self.shed = 0
+
+    def take(self, key: Hashable, route_class: str) -> float:
+        """
+        Spend a token of the bucket of key for the route class
+
+        :return: 0 if a token was spent, otherwise how many seconds until the bucket has one
+        """
+        rate, size = self.rates[route_class]
+        now = self.clock()
+        with self.lock:
+            bucket = self.buckets.get((key, route_class))
+            if bucket is None:
+                while len(self.buckets) >= self.max_buckets:
+                    self.buckets.popitem(last=False)
+                bucket = self.buckets[(key, route_class)] = TokenBucket(size, now)
+            else:
+                self.buckets.move_to_end((key, route_class))
+                bucket.tokens = min(size, bucket.tokens + (now - bucket.updated) * rate)
+                bucket.updated = now
+            if bucket.tokens >= 1:
+                bucket.tokens -= 1
+                return 0.0
+            self.limited[route_class] += 1
+            return (1 - bucket.tokens) / rate
+
+    def enter(self, route_class: str) -> bool:
+        """
+        Take an in-flight slot, waiting at most wait seconds for one
+
+        :return: false if the request is to be shed
+        """
+        if not self.slots.acquire(timeout=self.wait):
+            with self.lock:
+                self.shed += 1
+            return False
+        with self.lock:
+            self.admitted[route_class] += 1
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        return True
+
+    def leave(self) -> None:
+        with self.lock:
+            self.in_flight -= 1
+        self.slots.release()
+
+    def stats(self) -> Dict[str, object]:
+        with self.lock:
+            return {
+                "admitted": dict(self.admitted),
+                "limited": dict(self.limited),
+                "shed": self.shed,
+                "in_flight": self.in_flight,
+                "peak_in_flight": self.peak_in_flight,
+                "max_in_flight": self.max_in_flight,
+                "buckets": len(self.buckets),
+            }
+
+
+admission = AdmissionController()
+
+
+def refuse(status: int, message: str, retry_after: float) -> Response:
+    """
+    :return: a response turning a request away, JSON for the API and text for the pages
+    """
+    if request.blueprint == "api":
+        response = jsonify(error=message)
+    else:
+        response = Response(message, mimetype="text/plain")
+    response.status_code = status
+    response.headers["Retry-After"] = str(max(1, math.ceil(retry_after)))
+    return response
+
+
+def write_admission(route_class: str) -> Callable:
+    """
+    Admit the write requests of a view, which must only be reached by logged in Users: 429 once the User is out of
+    tokens for the route class, 503 when no in-flight slot frees up in time. Requests that only read pass.
+    """
+    def decorator(view: Callable) -> Callable:
+        @wraps(view)
+        def admitted_view(*args, **kwargs):
+            if request.method not in WRITE_METHODS:
+                return view(*args, **kwargs)
+            retry_after = admission.take(current_user.unique_id, route_class)
+            if retry_after:
+                return refuse(429, "Too many requests, slow down", retry_after)
+            if not admission.enter(route_class):
+                return refuse(503, "Too busy, try again shortly", SHED_RETRY_AFTER)
+            try:
+                return view(*args, **kwargs)
+            finally:
+                admission.leave()
+        return admitted_view
+    return decorator
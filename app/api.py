@@ -0,0 +1,273 @@
+"""
+Versioned JSON API over the QueryEngine, for scripts and tools that do not want to drive the HTML forms
+"""
+import json
+from functools import wraps
+from typing import Any, Callable, Dict, Iterator, List
+
+from flask import Blueprint, Response, abort, jsonify, request, stream_with_context
+from flask_login import current_user, login_user, logout_user
+
+from app.auth import auth
+from app.models import Card, Trade, User, QueryEngineError, NoOutputError, ConflictError
+from app.admission import write_admission
+from app.leagues import leagues
+from app.query_engine import QueryEngine
+from app.season_stats import get_season_stats
+
+current_user: User
+
+api = Blueprint("api", __name__, url_prefix="/api/v1")
+
+
+def card_json(card: Card) -> Dict[str, Any]:
+    return {"id": card.id, "name": card.name, "team": card.team, "pos": card.pos, "age": card.age, "gp": card.gp,
+            "mpg": card.mpg, "fta": card.fta, "ft_pct": card.ft_pct, "two_pa": card.two_pa,
+            "two_p_pct": card.two_p_pct, "three_pa": card.three_pa, "three_p_pct": card.three_p_pct,
+            "shooting_pct": card.shooting_pct, "ppointspg": card.ppointspg, "reboundspg": card.reboundspg,
+            "assistspg": card.assistspg, "stealspg": card.stealspg, "blockspg": card.blockspg, "image": card.image,
+            "owned": card.owned, "owner": card.owner, "points": card.points}
+
+
+def user_json(u: User) -> Dict[str, Any]:
+    return {"id": u.unique_id, "name": u.name, "cards": sorted(u.cards), "score": u.score}
+
+
+def trade_json(t: Trade) -> Dict[str, Any]:
+    return {"id": t.unique_id, "user1_id": t.user1_id, "user1_cards": sorted(t.user1_cards),
+            "user1_confirmed": t.user1_confirmed, "user2_id": t.user2_id, "user2_cards": sorted(t.user2_cards),
+            "user2_confirmed": t.user2_confirmed}
+
+
+def ndjson(rows: Iterator[Dict[str, Any]]) -> Response:
+    """
+    Stream rows as newline delimited JSON, one row per line, without building the whole body first
+    """
+    lines = (json.dumps(row) + "\n" for row in rows)
+    return Response(stream_with_context(lines), mimetype="application/x-ndjson")
+
+
+def json_body(*fields: str) -> Dict[str, Any]:
+    """
+    :return: the JSON object sent with the request
+    :raise: 400 if the body is not a JSON object or misses one of the fields
+    """
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict) or any(field not in body for field in fields):
+        abort(400, f"Expected a JSON object with: {', '.join(fields)}")
+    return body
+
+
+def card_id_list(value: Any) -> List[int]:
+    """
+    :return: the card ids in a list from a JSON body
+    :raise TypeError: if value is not a list, a string would otherwise be taken for the cards of its digits
+    :raise ValueError: if an item of the list is not a card id
+    """
+    if not isinstance(value, list):
+        raise TypeError(value)
+    return [int(card_id) for card_id in value]
+
+
+def card_ids_body() -> List[int]:
+    """
+    :return: the card ids in {"card_ids": [...]} sent with the request
+    :raise: 400 if card_ids is not a list of card ids
+    """
+    try:
+        return card_id_list(json_body("card_ids")["card_ids"])
+    except (TypeError, ValueError):
+        abort(400, "card_ids must be a list of card ids")
+
+
+def league_engine() -> QueryEngine:
+    """
+    :return: the QueryEngine of the logged in User's league
+    """
+    return leagues.for_user(current_user.unique_id)
+
+
+def login_required(view: Callable) -> Callable:
+    """
+    Like flask_login.login_required but answers 401 instead of redirecting to the login page
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if not current_user.is_authenticated:
+            abort(401, "Log in first")
+        return view(*args, **kwargs)
+    return wrapper
+
+
+@api.errorhandler(NoOutputError)
+def not_found(err: NoOutputError):
+    return jsonify(error=err.message), 404
+
+
+@api.errorhandler(ConflictError)
+def conflict(err: ConflictError):
+    return jsonify(error=err.message), 409
+
+
+@api.errorhandler(QueryEngineError)
+def bad_request(err: QueryEngineError):
+    return jsonify(error=str(err.args[0]) if err.args else "Bad request"), 400
+
+
+@api.errorhandler(400)
+@api.errorhandler(401)
+@api.errorhandler(403)
+@api.errorhandler(404)
+def http_error(err):
+    return jsonify(error=err.description), err.code
+
+
+@api.route("/login", methods=['POST'])
+def login():
+    body = json_body("username", "password")
+    u = auth.login(body["username"], body["password"])
+    if u is None:
+        abort(401, "Incorrect username or password")
+    login_user(u, remember=bool(body.get("remember_me")))
+    return jsonify(user_json(u))
+
+
+@api.route("/logout", methods=['POST'])
+def logout():
+    logout_user()
+    return jsonify(ok=True)
+
+
+@api.route("/cards", methods=['GET'])
+@login_required
+def cards():
+    engine = league_engine()
+    available = request.args.get('available', type=int)
+    return ndjson(card_json(card) for card in engine.iter_cards() if not available or not card.owned)
+
+
+@api.route("/cards/<int:card_id>", methods=['GET'])
+@login_required
+def card(card_id: int):
+    engine = league_engine()
+    return jsonify(card_json(engine.get_card_from_id(card_id)))
+
+
+@api.route("/cards/<int:card_id>/seasons", methods=['GET'])
+@login_required
+def card_seasons(card_id: int):
+    league_engine().get_card_from_id(card_id)
+    season_stats = get_season_stats()
+    first = request.args.get('first', season_stats.first_season, type=int)
+    last = request.args.get('last', season_stats.last_season, type=int)
+    return jsonify(id=card_id, seasons=[dict(stats, season=season) for season, stats in season_stats.career(card_id)
+                                        if first <= season <= last],
+                   total=season_stats.aggregate([card_id], first, last).get(card_id))
+
+
+@api.route("/users", methods=['GET'])
+@login_required
+def users():
+    engine = league_engine()
+    return ndjson(user_json(u) for u in engine.iter_users())
+
+
+@api.route("/users/<int:user_id>", methods=['GET'])
+@login_required
+def user(user_id: int):
+    engine = league_engine()
+    return jsonify(user_json(engine.get_user_from_id(user_id)))
+
+
+@api.route("/me", methods=['GET'])
+@login_required
+def me():
+    engine = league_engine()
+    body = user_json(engine.get_user_from_id(current_user.unique_id))
+    body["trades"] = [trade_json(t) for t in engine.get_user_trades(current_user.unique_id)]
+    return jsonify(body)
+
+
+@api.route("/me/cards", methods=['POST'])
+@login_required
+@write_admission("cards")
+def add_cards():
+    """
+    Add the cards in {"card_ids": [...]} in one transaction, answering whether each one was added
+    """
+    engine = league_engine()
+    card_ids = card_ids_body()
+    return jsonify(added=engine.add_cards_to_user(current_user.unique_id, card_ids))
+
+
+@api.route("/me/cards", methods=['DELETE'])
+@login_required
+@write_admission("cards")
+def remove_cards():
+    """
+    Drop the cards in {"card_ids": [...]} in one transaction, all of them or none
+    """
+    engine = league_engine()
+    card_ids = card_ids_body()
+    engine.remove_cards_from_user(current_user.unique_id, card_ids)
+    return jsonify(removed=card_ids)
+
+
+@api.route("/trades", methods=['POST'])
+@login_required
+@write_admission("trades")
+def create_trades():
+    """
+    Offer the trades in {"trades": [{"own_cards": [...], "other_user_id": ..., "other_cards": [...]}, ...]} in one
+    transaction, answering whether each one was created
+    """
+    engine = league_engine()
+    try:
+        trades = [(card_id_list(trade["own_cards"]), int(trade["other_user_id"]), card_id_list(trade["other_cards"]))
+                  for trade in json_body("trades")["trades"]]
+    except (KeyError, TypeError, ValueError):
+        abort(400, "Each trade needs own_cards, other_user_id and other_cards, with lists of card ids")
+    return jsonify(created=engine.create_trades(current_user.unique_id, trades))
+
+
+def own_trade(trade_id: int) -> Trade:
+    t = league_engine().get_trade_from_id(trade_id)
+    if current_user.unique_id not in (t.user1_id, t.user2_id):
+        abort(403, "You are not part of that trade")
+    return t
+
+
+@api.route("/trades/<int:trade_id>", methods=['GET'])
+@login_required
+def trade(trade_id: int):
+    return jsonify(trade_json(own_trade(trade_id)))
+
+
+@api.route("/trades/<int:trade_id>", methods=['DELETE'])
+@login_required
+@write_admission("trades")
+def delete_trade(trade_id: int):
+    engine = league_engine()
+    own_trade(trade_id)
+    engine.delete_trade(trade_id)
+    return jsonify(deleted=trade_id)
+
+
+@api.route("/trades/<int:trade_id>/confirm", methods=['POST'])
+@login_required
+@write_admission("trades")
+def confirm_trade(trade_id: int):
+    engine = league_engine()
+    t = own_trade(trade_id)
+    confirmed = engine.user_confirm_trade(current_user, t)
+    return jsonify(confirmed=confirmed, trade=trade_json(t))
+
+
+@api.route("/trades/<int:trade_id>/unconfirm", methods=['POST'])
+@login_required
+@write_admission("trades")
+def unconfirm_trade(trade_id: int):
+    engine = league_engine()
+    t = own_trade(trade_id)
+    engine.user_unconfirm_trade(current_user, t)
+    return jsonify(trade=trade_json(t))
@@ -0,0 +1,204 @@
+"""
+Static assets and response compression. flask assets copies every file in app/static under a name holding a hash of
+its content, with gzip and, when the brotli package is installed, brotli compressed copies next to it, and writes the
+manifest of those names. Pages link them through asset_url(), so they are served from /assets with Cache-Control:
+immutable and the compressed copy the client accepts. The app only reads the manifest, on first use, and builds the
+assets itself only when there is none or in debug mode. Pages and JSON responses of COMPRESS_MIN_SIZE bytes or more
+are compressed as they are sent.
+"""
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import threading
+import zlib
+from typing import Dict, Iterable, Iterator, Optional, Union
+
+from flask import Response, abort, request, send_from_directory, url_for
+
+from app import app, asset_dir
+
+try:
+    import brotli
+except ImportError:  # brotli is optional, without it everything is gzip compressed
+    brotli = None
+
+# the file in the asset directory mapping each static file to its fingerprinted name
+MANIFEST_NAME = "manifest.json"
+# how many hex digits of the content hash go into the name of an asset
+FINGERPRINT_LENGTH = 12
+# the Cache-Control of fingerprinted assets, whose content never changes under the same name
+ASSET_CACHE_CONTROL = "public, max-age=31536000, immutable"
+# responses smaller than this many bytes are sent as they are, compressing them saves less than it costs
+COMPRESS_MIN_SIZE = 1024
+# the mimetypes of the responses that are compressed
+COMPRESS_MIMETYPES = frozenset(("text/html", "text/plain", "text/css", "application/json", "application/javascript"))
+# gzip level of the responses compressed as they are sent, the assets are compressed once with the best level
+GZIP_LEVEL = 6
+# brotli quality of the responses compressed as they are sent
+BROTLI_QUALITY = 5
+# the content codings that can be sent, best first, with the suffix of the precompressed assets
+ENCODINGS = (("br", ".br"), ("gzip", ".gz")) if brotli is not None else (("gzip", ".gz"),)
+
+
+def fingerprinted_name(filename: str, content: bytes) -> str:
+    """
+    :return: the name of an asset with the hash of its content before the extension, css/style.css becomes
+             css/style.0123456789ab.css
+    """
+    root, extension = os.path.splitext(filename)
+    return f"{root}.{hashlib.sha256(content).hexdigest()[:FINGERPRINT_LENGTH]}{extension}"
+
+
+def write_file(filename: str, content: bytes, replace: bool = False) -> None:
+    """
+    Write a file, unless it exists already and replace is false. A fingerprinted name that exists already holds the
+    same content. Other processes building at the same time only ever see complete files.
+    """
+    if not replace and os.path.exists(filename):
+        return
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    partial_filename = f"{filename}.{os.getpid()}.partial"
+    with open(partial_filename, "wb") as file:
+        file.write(content)
+    os.replace(partial_filename, filename)
+
+
+def build_assets(static_dir: str, build_dir: str) -> Dict[str, str]:
+    """
+    Fingerprint and precompress every file in static_dir into build_dir, and write the manifest there for the app and
+    servers in front of it. Only the copies that are missing are compressed, a fingerprinted name that exists already
+    holds the same content.
+
+    :return: the manifest, the fingerprinted name of each asset by its name in static_dir
+    """
+    manifest = {}
+    for directory, _, filenames in os.walk(static_dir):
+        for filename in filenames:
+            with open(os.path.join(directory, filename), "rb") as file:
+                content = file.read()
+            name = os.path.relpath(os.path.join(directory, filename), static_dir).replace(os.sep, "/")
+            manifest[name] = fingerprinted_name(name, content)
+            target = os.path.join(build_dir, manifest[name])
+            write_file(target, content)
+            if not os.path.exists(target + ".gz"):
+                write_file(target + ".gz", gzip.compress(content, compresslevel=9, mtime=0))
+            if brotli is not None and not os.path.exists(target + ".br"):
+                write_file(target + ".br", brotli.compress(content))
+    write_file(os.path.join(build_dir, MANIFEST_NAME), json.dumps(manifest, indent=2, sort_keys=True).encode(),
+               replace=True)
+    return manifest
+
+
+# the fingerprinted name of each asset by its name in app/static, see load_manifest()
+manifest: Optional[Dict[str, str]] = None
+manifest_lock = threading.Lock()
+
+
+def load_manifest() -> Dict[str, str]:
+    """
+    :return: the manifest of the assets, read on first use from the one flask assets wrote. Without one, and always in
+             debug mode, where the static files are edited between starts, the assets are built first.
+    """
+    global manifest
+    if manifest is None:
+        with manifest_lock:
+            if manifest is None:
+                manifest_filename = os.path.join(asset_dir, MANIFEST_NAME)
+                if app.debug or not os.path.exists(manifest_filename):
+                    manifest = build_assets(app.static_folder, asset_dir)
+                else:
+                    with open(manifest_filename, "rt") as manifest_file:
+                        manifest = json.load(manifest_file)
+    return manifest
+
+
+@app.template_global()
+def asset_url(filename: str) -> str:
+    """
+    :return: the URL of the fingerprinted copy of a static file, or its plain static URL if it has none
+    """
+    fingerprinted = load_manifest().get(filename)
+    if fingerprinted is not None:
+        return url_for("asset", filename=fingerprinted)
+    return url_for("static", filename=filename)
+
+
+def accepted_encoding() -> Optional[str]:
+    """
+    :return: the best of ENCODINGS the client accepts, None to send the response as it is
+    """
+    for encoding, _ in ENCODINGS:
+        if request.accept_encodings[encoding] > 0:
+            return encoding
+    return None
+
+
+@app.route("/assets/<path:filename>", methods=['GET'])
+def asset(filename: str):
+    if filename not in load_manifest().values():
+        abort(404)
+    encoding = accepted_encoding()
+    response = send_from_directory(asset_dir, filename + dict(ENCODINGS).get(encoding, ""),
+                                   mimetype=mimetypes.guess_type(filename)[0] or "application/octet-stream")
+    if encoding is not None:
+        response.headers["Content-Encoding"] = encoding
+    response.headers["Cache-Control"] = ASSET_CACHE_CONTROL
+    response.vary.add("Accept-Encoding")
+    return response
+
+
+def compress(data: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(data, quality=BROTLI_QUALITY)
+    return gzip.compress(data, compresslevel=GZIP_LEVEL)
+
+
+def compress_stream(chunks: Iterable[Union[str, bytes]], encoding: str, charset: str) -> Iterator[bytes]:
+    """
+    Compress a streamed response chunk by chunk. Every chunk is flushed, so the client can show each part of the page
+    as soon as it would have without compression.
+    """
+    if encoding == "br":
+        compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+    else:
+        compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)  # 31 makes a gzip stream rather than zlib
+    try:
+        for chunk in chunks:
+            if not chunk:
+                continue
+            data = chunk.encode(charset) if isinstance(chunk, str) else chunk
+            if encoding == "br":
+                yield compressor.process(data) + compressor.flush()
+            else:
+                yield compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        yield compressor.finish() if encoding == "br" else compressor.flush()
+    finally:
+        if hasattr(chunks, "close"):
+            chunks.close()
+
+
+@app.after_request
+def compress_response(response: Response) -> Response:
+    """
+    Compress pages and JSON with the best coding the client accepts, streamed ones as they are sent and the others
+    when they are COMPRESS_MIN_SIZE bytes or more
+    """
+    if (response.direct_passthrough or response.status_code in (204, 304) or
+            "Content-Encoding" in response.headers or response.mimetype not in COMPRESS_MIMETYPES):
+        return response
+    response.vary.add("Accept-Encoding")
+    encoding = accepted_encoding()
+    if encoding is None:
+        return response
+    if response.is_streamed:
+        response.response = compress_stream(response.response, encoding, response.charset)
+        response.headers.pop("Content-Length", None)
+    else:
+        data = response.get_data()
+        if len(data) < COMPRESS_MIN_SIZE:
+            return response
+        response.set_data(compress(data, encoding))
+    response.headers["Content-Encoding"] = encoding
+    return response
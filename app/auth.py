@@ -0,0 +1,195 @@
+"""
+Logging in and signing up. Logging in finds the league of the username in the league directory and then reads the
+User by the name index in one read, straight into the session cache the next requests load it from. Whether a
+username is free is first asked of a Bloom filter of every username, built before the first request and kept up to
+date with the new members of the directory, so most names that are free are found to be without a database read.
+"""
+import hashlib
+import math
+import threading
+import time
+from contextlib import nullcontext
+from datetime import datetime
+from typing import Dict, Iterator, Optional
+
+from app.leagues import LeagueRouter, leagues
+from app.login_helper import authenticate, hash_pw, is_good_user
+from app.models import NoOutputError, User
+
+# how many usernames the Bloom filter is sized for at first, it is rebuilt twice as large once there are more
+BLOOM_CAPACITY = 100000
+# the share of free usernames the filter wrongly reports as maybe taken, which are then looked up in the directory
+BLOOM_ERROR_RATE = 0.01
+# seconds between reads of the members that other processes added to the directory
+FILTER_REFRESH_INTERVAL = 1.0
+# how many members are read from the directory at a time while the filter is filled
+FILTER_PAGE = 10000
+
+
+class BloomFilter:
+    """
+    Set of strings answering "maybe in it" or "certainly not in it" in a fixed number of bits. The bit positions of a
+    string come from one blake2b digest by double hashing.
+    """
+
+    def __init__(self, capacity: int, error_rate: float = BLOOM_ERROR_RATE):
+        self.capacity = capacity
+        self.size = max(8, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def __positions(self, text: str) -> Iterator[int]:
+        digest = hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+        first, second = int.from_bytes(digest[:8], "little"), int.from_bytes(digest[8:], "little") | 1
+        return ((first + i * second) % self.size for i in range(self.hashes))
+
+    def add(self, text: str) -> None:
+        """
+        Add a string, counting it unless the filter already holds it or one colliding with it
+        """
+        if text in self:
+            return
+        for position in self.__positions(text):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, text: str) -> bool:
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self.__positions(text))
+
+
+class AuthService:
+    """
+    AuthService checks passwords and registers Users over the leagues of a LeagueRouter, and answers whether a
+    username is free. Usernames are never freed, Users moving between leagues keep theirs, so the filter only grows.
+    """
+
+    def __init__(self, router: LeagueRouter, capacity: int = BLOOM_CAPACITY,
+                 refresh_interval: float = FILTER_REFRESH_INTERVAL):
+        self.router = router
+        self.capacity = capacity
+        self.refresh_interval = refresh_interval
+        self.lock = threading.Lock()
+        self.usernames: Optional[BloomFilter] = None
+        self.last_member_id = 0
+        self.next_refresh = 0.0
+        self.refreshing = False
+        self.checks = 0
+        self.lookups = 0
+
+    def login(self, username: str, password: str) -> Optional[User]:
+        """
+        :return: the User if the password is theirs, None if it is not or there is no such User
+        """
+        try:
+            user_id, league_id = self.router.locate(username)
+            u = self.router.engine(league_id).get_login_user(user_id, username)
+        except NoOutputError:
+            return None
+        if not authenticate(u.hashed_pass, password):
+            return None
+        return u
+
+    def register(self, username: str, password: str, access: int) -> Optional[int]:
+        """
+        Add a new User, whose name the directory's unique index checks is free
+
+        :return: the id of the new User, None if the username is taken
+        """
+        user_id = self.router.add_user(username, hash_pw(password), access, datetime.utcnow())
+        if user_id is not None:
+            with self.lock:
+                if self.usernames is not None:
+                    self.usernames.add(username)
+        return user_id
+
+    def load(self) -> None:
+        """
+        Build the filter from every username in the directory
+        """
+        self.__rebuild(self.capacity)
+
+    def username_available(self, username: str) -> bool:
+        """
+        :return: whether a User could sign up with the username now, read from the directory only when the filter
+                 says it may be taken
+        """
+        if not is_good_user(username):
+            return False
+        self.__refresh()
+        with self.lock:
+            self.checks += 1
+            if self.usernames is not None and username not in self.usernames:
+                return True
+            self.lookups += 1
+        return not self.router.check_user_exists(username)
+
+    def stats(self) -> Dict[str, float]:
+        with self.lock:
+            return {
+                "usernames": self.usernames.count if self.usernames is not None else 0,
+                "capacity": self.usernames.capacity if self.usernames is not None else self.capacity,
+                "checks": self.checks,
+                "lookups": self.lookups,
+            }
+
+    def __fill(self, usernames: BloomFilter, after_id: int, shared: bool) -> int:
+        """
+        private function to add the usernames of the members with an id above after_id to the filter, reading the
+        directory a page at a time without the lock held
+
+        :param shared: whether the filter is the one in use, which pages are then added to with the lock held
+        :return: the id of the last member added, after_id if there were none
+        """
+        while True:
+            members = self.router.members_after(after_id, FILTER_PAGE)
+            with self.lock if shared else nullcontext():
+                for member_id, username in members:
+                    usernames.add(username)
+            if members:
+                after_id = members[-1][0]
+            if len(members) < FILTER_PAGE:
+                return after_id
+
+    def __rebuild(self, capacity: int) -> None:
+        """
+        private function to fill a new filter for capacity usernames from the directory without the lock held, and
+        then to swap it in with the lock held, after adding the members that joined while it was filled
+        """
+        usernames = BloomFilter(capacity)
+        last_member_id = self.__fill(usernames, 0, shared=False)
+        with self.lock:
+            self.last_member_id = self.__fill(usernames, last_member_id, shared=False)
+            self.usernames, self.capacity = usernames, capacity
+            self.next_refresh = time.monotonic() + self.refresh_interval
+
+    def __refresh(self) -> None:
+        """
+        private function to build the filter if it has not been, and to add the members other processes added to the
+        directory since the last refresh once refresh_interval has passed. One thread refreshes at a time and the
+        others go on with the filter as it is meanwhile. A filter that has grown past its capacity is rebuilt twice as
+        large and replaced.
+        """
+        with self.lock:
+            if self.refreshing or self.usernames is not None and time.monotonic() < self.next_refresh:
+                return
+            self.refreshing = True
+            usernames, last_member_id = self.usernames, self.last_member_id
+        try:
+            if usernames is None:
+                self.__rebuild(self.capacity)
+                return
+            last_member_id = self.__fill(usernames, last_member_id, shared=True)
+            with self.lock:
+                if self.usernames is not usernames:  # load() replaced it meanwhile
+                    return
+                self.last_member_id = last_member_id
+                self.next_refresh = time.monotonic() + self.refresh_interval
+            if usernames.count > usernames.capacity:
+                self.__rebuild(usernames.capacity * 2)
+        finally:
+            with self.lock:
+                self.refreshing = False
+
+
+auth = AuthService(leagues)
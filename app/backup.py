@@ -0,0 +1,215 @@
+"""
+Online backups of the database file, and logical exports of the Users, their Cards and the Trades to gzip compressed
+JSON lines that can be restored into a new database. The flask backup, export and restore commands run them from the
+command line.
+"""
+import glob
+import gzip
+import json
+import logging
+import os
+import threading
+import zlib
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterator, List, Optional, Union
+
+from app.models import Trade, User
+from app.query_engine import QueryEngine
+from app.storage import SQLiteBackend
+
+# how many database pages an online backup copies per step
+BACKUP_PAGES = 256
+# how long an online backup waits for writes between steps, in seconds, which also paces it
+BACKUP_PAUSE = 0.005
+# how often the scheduled backup runs
+BACKUP_INTERVAL = timedelta(days=1)
+# how many scheduled backups are kept
+BACKUP_KEEP = 7
+# version of the export format, written in the first line of every export
+EXPORT_FORMAT = 1
+
+logger = logging.getLogger(__name__)
+
+
+def format_time(value: Any) -> Optional[str]:
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def parse_time(value: Optional[str]) -> Optional[datetime]:
+    return datetime.fromisoformat(value) if value is not None else None
+
+
+def export_record(item: Union[User, Trade]) -> Dict[str, Any]:
+    """
+    :return: the JSON object a User or a Trade is exported as
+    """
+    if isinstance(item, User):
+        return {"type": "user", "id": item.unique_id, "name": item.name, "hashed_pass": item.hashed_pass,
+                "access": item.access, "last_seen": format_time(item.last_seen), "cards": sorted(item.cards),
+                "trades": sorted(item.trades)}
+    return {"type": "trade", "id": item.unique_id,
+            "user1_id": item.user1_id, "user1_cards": sorted(item.user1_cards), "user1_confirmed": item.user1_confirmed,
+            "user2_id": item.user2_id, "user2_cards": sorted(item.user2_cards), "user2_confirmed": item.user2_confirmed,
+            "created": format_time(item.created), "updated": format_time(item.updated)}
+
+
+def import_record(record: Dict[str, Any]) -> Union[User, Trade]:
+    """
+    :return: the User or Trade an exported JSON object holds
+    :raise ValueError: if the object is neither
+    """
+    if record.get("type") == "user":
+        return User(record["id"], record["name"], record["hashed_pass"], record["access"],
+                    parse_time(record["last_seen"]), set(record["cards"]), set(record["trades"]))
+    if record.get("type") == "trade":
+        return Trade(record["id"], record["user1_id"], set(record["user1_cards"]), record["user1_confirmed"],
+                     record["user2_id"], set(record["user2_cards"]), record["user2_confirmed"],
+                     created=parse_time(record["created"]), updated=parse_time(record["updated"]))
+    raise ValueError(f"Not a User or a Trade: {record}")
+
+
+def export_chunks(engine: QueryEngine) -> Iterator[bytes]:
+    """
+    Stream a logical export as gzip compressed JSON lines, a header line and then one line per User and per Trade.
+    Nothing but the current compression window is held in memory, so it can be sent as it is made.
+    """
+    compressor = zlib.compressobj(wbits=31)  # 31 makes a gzip file rather than a bare zlib stream
+    header = {"type": "export", "format": EXPORT_FORMAT, "exported": datetime.utcnow().isoformat()}
+    yield compressor.compress((json.dumps(header) + "\n").encode("utf-8"))
+    for item in engine.export_state():
+        chunk = compressor.compress((json.dumps(export_record(item)) + "\n").encode("utf-8"))
+        if chunk:
+            yield chunk
+    yield compressor.flush()
+
+
+def export_to_file(engine: QueryEngine, filename: str) -> None:
+    """
+    Write a logical export to filename, which only appears once it is complete
+    """
+    partial_filename = filename + ".partial"
+    with open(partial_filename, "wb") as file:
+        for chunk in export_chunks(engine):
+            file.write(chunk)
+    os.replace(partial_filename, filename)
+
+
+def read_export(filename: str) -> Iterator[Union[User, Trade]]:
+    """
+    Read the Users and Trades of a logical export
+
+    :raise ValueError: if the file is not an export in a format this version reads
+    """
+    with gzip.open(filename, "rt", encoding="utf-8") as file:
+        header = json.loads(file.readline() or "{}")
+        if header.get("type") != "export" or header.get("format") != EXPORT_FORMAT:
+            raise ValueError(f"{filename} is not an export of format {EXPORT_FORMAT}")
+        for line in file:
+            yield import_record(json.loads(line))
+
+
+def restore_from_file(engine: QueryEngine, filename: str):
+    """
+    Restore a logical export into the empty store of engine
+
+    :return: how many Users and how many Trades were restored
+    """
+    return engine.restore_state(read_export(filename))
+
+
+class BackupScheduler:
+    """
+    BackupScheduler makes online backups of an SQLite database into a directory, on demand and every interval, and
+    keeps the latest keep of them. Only one backup runs at a time.
+    """
+
+    def __init__(self, backend: SQLiteBackend, directory: str, interval: timedelta = BACKUP_INTERVAL,
+                 keep: int = BACKUP_KEEP, pages: int = BACKUP_PAGES, pause: float = BACKUP_PAUSE):
+        self.backend = backend
+        self.directory = directory
+        self.interval = interval
+        self.keep = keep
+        self.pages = pages
+        self.pause = pause
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread: Optional[threading.Thread] = None
+        self.progress = (0, 0)
+        self.last_backup: Optional[str] = None
+        self.last_error: Optional[str] = None
+
+    def backup_once(self) -> str:
+        """
+        Make a backup now and drop the oldest ones beyond keep
+
+        :return: the backup file
+        """
+        with self.lock:
+            os.makedirs(self.directory, exist_ok=True)
+            filename = os.path.join(self.directory,
+                                    f"trading_card_data-{datetime.utcnow().strftime('%Y%m%dT%H%M%S')}.db")
+            self.progress = (0, 0)
+            self.backend.backup(filename, self.pages, self.pause, self.__progress)
+            self.last_backup = filename
+            for old_backup in self.backups()[:-self.keep]:
+                os.remove(old_backup)
+            return filename
+
+    def backup_in_background(self) -> bool:
+        """
+        Start a backup on its own thread, for requests that should not wait for it
+
+        :return: false if a backup is already running
+        """
+        if self.lock.locked():
+            return False
+        threading.Thread(target=self.__backup_logged, name="database-backup", daemon=True).start()
+        return True
+
+    def backups(self) -> List[str]:
+        """
+        :return: the backup files in the directory, oldest first
+        """
+        return sorted(glob.glob(os.path.join(self.directory, "trading_card_data-*.db")))
+
+    def status(self) -> Dict[str, Any]:
+        remaining, total = self.progress
+        return {
+            "running": self.lock.locked(),
+            "pages_done": total - remaining,
+            "pages_total": total,
+            "last_backup": self.last_backup,
+            "last_error": self.last_error,
+            "backups": [os.path.basename(filename) for filename in self.backups()],
+        }
+
+    def start(self) -> None:
+        """
+        Start backing up every interval on a daemon thread, does nothing if already started
+        """
+        if self.thread is not None:
+            return
+        self.thread = threading.Thread(target=self.__run, name="backup-scheduler", daemon=True)
+        self.thread.start()
+
+    def stop(self) -> None:
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def __progress(self, remaining: int, total: int) -> None:
+        self.progress = (remaining, total)
+
+    def __backup_logged(self) -> None:
+        try:
+            self.backup_once()
+            self.last_error = None
+        except Exception as err:  # keep the scheduler alive, the next run may succeed
+            self.last_error = str(err)
+            logger.exception("Backing up the database failed")
+
+    def __run(self) -> None:
+        while not self.stopped.wait(self.interval.total_seconds()):
+            self.__backup_logged()
+
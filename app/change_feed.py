@@ -0,0 +1,78 @@
+"""
+Cache coherence between the processes sharing one database, through a change log kept in the database itself
+"""
+import threading
+import time
+import uuid
+from typing import Callable, List, Optional, Tuple
+
+from app.storage import StorageBackend
+
+# the longest a process keeps serving cached data after another process has changed it, in seconds
+CHANGE_POLL_INTERVAL = 0.5
+# how many change log rows are kept, a process that falls further behind than this drops all of its caches
+CHANGE_LOG_SIZE = 10000
+
+# kinds of change log rows
+CHANGE_USER = "user"  # the User with row id changed
+CHANGE_SCORES = "scores"  # team scores changed
+CHANGE_NEW_USER = "new_user"  # a User was added or deleted
+
+Change = Tuple[str, Optional[int]]
+
+
+class ChangeFeed:
+    """
+    ChangeFeed reads what the other processes writing to a shared store have changed. Every write logs what it made
+    stale along with the process it came from, and each process polls the log at most every CHANGE_POLL_INTERVAL,
+    only when the backend reports that something was committed since the last poll, and applies the changes made by
+    the others to its own caches.
+    """
+
+    def __init__(self, interval: float = CHANGE_POLL_INTERVAL):
+        self.origin = uuid.uuid4().hex
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.seq = 0
+        self.next_poll = 0.0
+        self.polls = 0
+        self.applied = 0
+        self.resets = 0
+
+    def start(self, seq: int) -> None:
+        """
+        Start following the log after seq, the latest change made before the caches were filled
+        """
+        self.seq = seq
+
+    def poll(self, backend: StorageBackend, apply: Callable[[Optional[List[Change]]], None]) -> None:
+        """
+        Apply the changes logged by other processes since the last poll, unless polled less than interval ago or
+        another thread is polling already
+
+        :param apply: called with the changes of the other processes, or with None when some of them have been dropped
+            from the log and every cache has to be dropped instead
+        """
+        now = time.monotonic()
+        if now < self.next_poll or not self.lock.acquire(blocking=False):
+            return
+        try:
+            self.next_poll = now + self.interval
+            if not backend.data_changed():
+                return
+            self.polls += 1
+            with backend.read() as tx:
+                changes = tx.changes_after(self.seq)
+                if changes is None:
+                    self.seq = tx.last_change_seq()
+                    self.resets += 1
+                    apply(None)
+                    return
+            if changes:
+                self.seq = changes[-1][0]
+                others = [(kind, row_id) for _, origin, kind, row_id in changes if origin != self.origin]
+                if others:
+                    self.applied += len(others)
+                    apply(others)
+        finally:
+            self.lock.release()
@@ -0,0 +1,188 @@
+"""
+flask commands for maintenance: flask backup, flask export, flask restore, the flask league commands, flask assets,
+the flask memory commands and flask stats
+"""
+import json
+import os
+from typing import Tuple
+
+import click
+
+from app import app, schema_filename, asset_dir, stats_filename
+from app.assets import build_assets
+from app.backup import BACKUP_PAGES, BACKUP_PAUSE, export_to_file, restore_from_file
+from app.diagnostics import TOP_SITES, TRACE_FRAMES, cache_sizes, census, profiler
+from app.leagues import leagues, DEFAULT_LEAGUE
+from app.models import QueryEngineError, NoOutputError
+from app.query_engine import QueryEngine, cards_filename
+from app.season_stats import build_stats
+from app.storage import SQLiteBackend
+
+
+def league_engine(league_id: int) -> QueryEngine:
+    try:
+        return leagues.engine(league_id)
+    except NoOutputError as err:
+        raise click.ClickException(err.message)
+
+
+@app.cli.command("backup")
+@click.argument("filename")
+@click.option("--league", "league_id", default=DEFAULT_LEAGUE, help="The id of the league to back up.")
+def backup_command(filename: str, league_id: int):
+    """Copy the database of a league to FILENAME while the app keeps running."""
+    engine = league_engine(league_id)
+    engine.initialize_database()
+    engine.backend.backup(filename, BACKUP_PAGES, BACKUP_PAUSE)
+
+
+@app.cli.command("export")
+@click.argument("filename")
+@click.option("--league", "league_id", default=DEFAULT_LEAGUE, help="The id of the league to export.")
+def export_command(filename: str, league_id: int):
+    """Export the Users, their Cards and the Trades of a league to FILENAME as gzip compressed JSON lines."""
+    export_to_file(league_engine(league_id), filename)
+
+
+@app.cli.command("restore")
+@click.argument("export_filename")
+@click.argument("db_filename")
+def restore_command(export_filename: str, db_filename: str):
+    """Restore an export into DB_FILENAME, a new database to use in place of the current one."""
+    if os.path.exists(db_filename):
+        raise click.ClickException(f"{db_filename} exists already, restore into a new database file")
+    target = QueryEngine(SQLiteBackend(db_filename, schema_filename, cards_filename), test_data=False)
+    users, trades = restore_from_file(target, export_filename)
+    target.backend.close()
+    click.echo(f"restored {users} users and {trades} trades into {db_filename}")
+
+
+@app.cli.group("league")
+def league_group():
+    """Create leagues and move Users between them."""
+
+
+@league_group.command("list")
+def league_list_command():
+    """List the leagues and their number of members."""
+    for league in leagues.leagues():
+        click.echo(f"{league.id}\t{league.name}\t{league.members} members\t{league.db_filename}")
+
+
+@league_group.command("create")
+@click.argument("name")
+def league_create_command(name: str):
+    """Create an empty league called NAME with its own database."""
+    try:
+        league = leagues.create_league(name)
+    except QueryEngineError as err:
+        raise click.ClickException(str(err))
+    click.echo(f"created league {league.id} in {league.db_filename}")
+
+
+@league_group.command("move")
+@click.argument("user_id", type=int)
+@click.argument("league_id", type=int)
+def league_move_command(user_id: int, league_id: int):
+    """Move the User USER_ID to the league LEAGUE_ID."""
+    try:
+        kept = leagues.move_user(user_id, league_id)
+    except NoOutputError as err:
+        raise click.ClickException(err.message)
+    click.echo(f"moved user {user_id} to league {league_id}, keeping cards {kept}")
+
+
+@league_group.command("rebalance")
+def league_rebalance_command():
+    """Move Users until every league has as many members as the others, give or take one."""
+    moves = leagues.rebalance()
+    for user_id, old_league_id, new_league_id in moves:
+        click.echo(f"moved user {user_id} from league {old_league_id} to league {new_league_id}")
+    click.echo(f"{len(moves)} users moved")
+
+
+@app.cli.command("assets")
+def assets_command():
+    """Fingerprint and precompress the static files, run after changing them."""
+    for name, fingerprinted in sorted(build_assets(app.static_folder, asset_dir).items()):
+        click.echo(f"{name} -> {fingerprinted}")
+
+
+@app.cli.command("stats")
+@click.argument("seasons", nargs=-1, required=True)
+def stats_command(seasons: Tuple[str, ...]):
+    """
+    Build the per-season stats file from SEASONS given as SEASON=CSV_FILE, each csv file in the format of the card
+    catalog. Running processes keep the file they mapped until they restart.
+    """
+    season_filenames = {}
+    for season in seasons:
+        year, _, filename = season.partition("=")
+        if not year.isdigit() or not filename:
+            raise click.BadParameter(f"expected SEASON=CSV_FILE, not {season}")
+        season_filenames[int(year)] = filename
+    build_stats(stats_filename, cards_filename, season_filenames)
+    click.echo(f"wrote {len(season_filenames)} seasons to {stats_filename}")
+
+
+@app.cli.group("memory")
+def memory_group():
+    """Find leaks and oversized caches, see also /admin/memory."""
+
+
+def echo_census(limit: int) -> None:
+    for entry in census()[:limit]:
+        click.echo(f"{entry['count']:10} {entry['size']:12} B  {entry['type']}")
+
+
+@memory_group.command("census")
+@click.option("--limit", default=TOP_SITES, help="How many types to list.")
+def memory_census_command(limit: int):
+    """Count the live objects and show the cache sizes of a freshly started app."""
+    echo_census(limit)
+    click.echo(json.dumps(cache_sizes(), indent=2))
+
+
+@memory_group.command("trace")
+@click.argument("paths", nargs=-1, required=True)
+@click.option("--user", "username", required=True, help="The User the pages are requested as.")
+@click.option("--requests", "rounds", default=100, help="How many times every page is requested.")
+@click.option("--frames", default=TRACE_FRAMES, help="How many frames of each allocation are traced.")
+@click.option("--limit", default=TOP_SITES, help="How many allocation sites and types to list.")
+def memory_trace_command(paths: Tuple[str, ...], username: str, rounds: int, frames: int, limit: int):
+    """
+    Request the pages PATHS as a User many times and show where the memory still held afterwards was allocated.
+    Every page is requested once before tracing starts, so what a first request fills in is not reported.
+    """
+    try:
+        user = leagues.get_user_from_username(username)
+    except NoOutputError as err:
+        raise click.ClickException(err.message)
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session["_user_id"] = user.get_id()
+        session["_fresh"] = True
+
+    def request_pages():
+        for path in paths:
+            response = client.get(path)
+            response.get_data()
+            if response.status_code >= 400:
+                raise click.ClickException(f"GET {path} returned {response.status_code}")
+
+    request_pages()
+    profiler.start(max(frames, 1))
+    try:
+        for _ in range(rounds):
+            request_pages()
+        report = profiler.snapshot(limit)
+    finally:
+        profiler.stop()
+    click.echo(f"traced {report['traced']} B, peak {report['traced_peak']} B over {rounds * len(paths)} requests")
+    for entry in report["modules"]:
+        click.echo(f"{entry['size_diff']:+12} B {entry['count_diff']:+8} blocks  {entry['module']}")
+    click.echo("")
+    for site in report["sites"]:
+        click.echo(f"{site['size_diff']:+12} B {site['count_diff']:+8} blocks  {site['site']}")
+    click.echo("")
+    echo_census(limit)
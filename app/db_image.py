@@ -0,0 +1,34 @@
+"""
+Build the prebuilt database image that new databases are restored from, instead of loading the Card data and the
+example data one write at a time on first start. Run with python -m app.db_image [image directory].
+"""
+import glob
+import os
+import sys
+
+from app import image_dir, schema_filename
+from app.query_engine import QueryEngine, cards_filename
+from app.storage import SQLiteBackend, database_image_filename
+
+
+def build_image(directory: str = image_dir) -> str:
+    """
+    Load a fresh in-memory database with the Card data and the example data and save it as the current image. Images
+    of older schemas or data in the directory are removed.
+
+    :return: the image file
+    """
+    backend = SQLiteBackend(":memory:", schema_filename, cards_filename)
+    QueryEngine(backend).initialize_database()
+    image_filename = database_image_filename(directory, schema_filename, cards_filename)
+    backend.save_image(image_filename)
+    backend.close()
+
+    for old_image in glob.glob(os.path.join(directory, "trading_card_image-*.db")):
+        if old_image != image_filename:
+            os.remove(old_image)
+    return image_filename
+
+
+if __name__ == "__main__":
+    print(build_image(*sys.argv[1:]))
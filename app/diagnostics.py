@@ -0,0 +1,208 @@
+"""
+Memory diagnostics for a running process. A MemoryProfiler starts and stops tracemalloc and diffs snapshots taken
+between two points, reporting the allocation sites that grew the most by the app.* module they are in. census()
+counts the live objects of the app's own classes and of the builtin containers, and cache_sizes() reports how full
+the caches of every open league are. They are served by /admin/memory and run by flask memory.
+"""
+import gc
+import os
+import sys
+import threading
+import tracemalloc
+from collections import defaultdict
+from typing import Any, Dict, List, Optional, Tuple
+
+from app import app, basedir
+from app.admission import admission
+from app.auth import auth
+from app.leagues import leagues
+
+try:
+    import resource
+except ImportError:  # not on Windows, the peak RSS is left out there
+    resource = None
+
+# how many frames of each allocation are traced, enough to get from Flask and Jinja down to the app module below them
+TRACE_FRAMES = 25
+# how many allocation sites a report lists
+TOP_SITES = 25
+# the module allocations are grouped under when no frame of theirs is in the app
+OTHER_MODULE = "other"
+# modules whose frames are never taken as the allocation site, flask memory trace sends its requests from app.commands
+CALLER_MODULES = frozenset(("app.commands",))
+# builtin types counted by census() next to the classes of the app, the sets and dicts made per request among them
+CENSUS_BUILTINS = (dict, list, set, frozenset, tuple)
+
+
+def app_module(filename: str) -> Optional[str]:
+    """
+    :return: the dotted name of the app module a source file is, app/storage.py is app.storage, None outside the app
+    """
+    path = os.path.abspath(filename)
+    if not path.startswith(basedir + os.sep) or not path.endswith(".py"):
+        return None
+    relative = os.path.relpath(path[:-len(".py")], os.path.dirname(basedir))
+    return relative.replace(os.sep, ".")
+
+
+def allocation_site(traceback: tracemalloc.Traceback) -> Tuple[str, str]:
+    """
+    :return: the module and the module:line of the most recent frame of an allocation that is in the app, or
+             OTHER_MODULE and the file:line of its most recent frame if none is
+    """
+    for frame in reversed(traceback):  # the frames run from the oldest to the most recent
+        module = app_module(frame.filename)
+        if module is not None and module not in CALLER_MODULES:
+            return module, f"{module}:{frame.lineno}"
+    if not len(traceback):
+        return OTHER_MODULE, OTHER_MODULE
+    return OTHER_MODULE, f"{traceback[-1].filename}:{traceback[-1].lineno}"
+
+
+def group_statistics(statistics: List[tracemalloc.StatisticDiff], limit: int = TOP_SITES) -> Dict[str, Any]:
+    """
+    Group the per traceback differences between two snapshots by allocation site and by module
+
+    :return: the grown bytes and blocks of every module and of the limit sites that grew the most, largest first
+    """
+    modules: Dict[str, List[int]] = defaultdict(lambda: [0, 0])
+    sites: Dict[str, List[int]] = defaultdict(lambda: [0, 0, 0])
+    for statistic in statistics:
+        module, site = allocation_site(statistic.traceback)
+        modules[module][0] += statistic.size_diff
+        modules[module][1] += statistic.count_diff
+        sites[site][0] += statistic.size_diff
+        sites[site][1] += statistic.count_diff
+        sites[site][2] += statistic.size
+    return {
+        "modules": [{"module": module, "size_diff": size, "count_diff": count}
+                    for module, (size, count) in sorted(modules.items(), key=lambda item: item[1][0], reverse=True)],
+        "sites": [{"site": site, "size_diff": size, "count_diff": count, "size": total}
+                  for site, (size, count, total) in sorted(sites.items(), key=lambda item: item[1][0],
+                                                           reverse=True)[:limit]],
+    }
+
+
+def peak_rss() -> Optional[int]:
+    """
+    :return: the peak resident set size of the process in bytes, None where it cannot be read
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024  # kilobytes everywhere but macOS
+
+
+class MemoryProfiler:
+    """
+    MemoryProfiler wraps tracemalloc for the process. start() takes a first snapshot, and every snapshot() after it
+    reports what was allocated since the one before and becomes the point the next one is compared with.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.previous: Optional[tracemalloc.Snapshot] = None
+        self.snapshots = 0
+
+    @property
+    def tracing(self) -> bool:
+        return tracemalloc.is_tracing()
+
+    def start(self, frames: int = TRACE_FRAMES) -> bool:
+        """
+        :return: whether tracing started, False if it was running already
+        """
+        with self.lock:
+            if tracemalloc.is_tracing():
+                return False
+            tracemalloc.start(frames)
+            self.previous = self.__take()
+            self.snapshots = 0
+            return True
+
+    def stop(self) -> bool:
+        """
+        :return: whether tracing stopped, False if it was not running
+        """
+        with self.lock:
+            if not tracemalloc.is_tracing():
+                return False
+            tracemalloc.stop()
+            self.previous = None
+            return True
+
+    def snapshot(self, limit: int = TOP_SITES) -> Dict[str, Any]:
+        """
+        Take a snapshot and compare it with the previous one
+
+        :raise ValueError: if tracing is not running
+        """
+        with self.lock:
+            if not tracemalloc.is_tracing() or self.previous is None:
+                raise ValueError("Memory tracing is not running")
+            gc.collect()
+            current = self.__take()
+            report = group_statistics(current.compare_to(self.previous, "traceback"), limit)
+            self.previous = current
+            self.snapshots += 1
+        return dict(report, snapshot=self.snapshots, **self.status())
+
+    def status(self) -> Dict[str, Any]:
+        traced, peak = tracemalloc.get_traced_memory()
+        return {
+            "tracing": tracemalloc.is_tracing(),
+            "frames": tracemalloc.get_traceback_limit(),
+            "traced": traced,
+            "traced_peak": peak,
+            "tracemalloc_overhead": tracemalloc.get_tracemalloc_memory(),
+            "peak_rss": peak_rss(),
+        }
+
+    @staticmethod
+    def __take() -> tracemalloc.Snapshot:
+        """
+        private function to take a snapshot without the allocations of tracemalloc and of the earlier snapshots
+        """
+        return tracemalloc.take_snapshot().filter_traces((tracemalloc.Filter(False, tracemalloc.__file__),
+                                                          tracemalloc.Filter(False, __file__, all_frames=True)))
+
+
+def census() -> List[Dict[str, Any]]:
+    """
+    Count the live objects the garbage collector tracks whose class is defined in the app, Card, User, Trade and the
+    others, and those of CENSUS_BUILTINS
+
+    :return: the qualified name, count and shallow size in bytes of each type, largest count first
+    """
+    gc.collect()
+    counts: Dict[str, List[int]] = defaultdict(lambda: [0, 0])
+    for obj in gc.get_objects():
+        kind = type(obj)
+        if kind in CENSUS_BUILTINS or str(getattr(kind, "__module__", "")).split(".")[0] == "app":
+            entry = counts[kind.__name__ if kind in CENSUS_BUILTINS else f"{kind.__module__}.{kind.__qualname__}"]
+            entry[0] += 1
+            entry[1] += sys.getsizeof(obj)
+    return [{"type": name, "count": count, "size": size}
+            for name, (count, size) in sorted(counts.items(), key=lambda item: item[1][0], reverse=True)]
+
+
+def cache_sizes() -> Dict[str, Any]:
+    """
+    :return: the stats of the caches of every league whose QueryEngine is open, and of the caches of the process
+    """
+    with leagues.lock:
+        engines = sorted(leagues.engines.items())
+    return {
+        "leagues": {league_id: {
+            "user_cache": engine.user_cache.stats(),
+            "search_cache": engine.search_cache.stats(),
+            "leaderboard_scores": len(engine.leaderboard.tree or ()),
+            "events": engine.events.stats(),
+        } for league_id, engine in engines},
+        "admission_buckets": admission.stats()["buckets"],
+        "usernames": auth.stats(),
+        "templates": len(app.jinja_env.cache) if app.jinja_env.cache is not None else 0,
+    }
+
+
+profiler = MemoryProfiler()
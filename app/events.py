@@ -0,0 +1,101 @@
+"""
+In-process publish/subscribe of trade events to the Users they concern
+"""
+import threading
+from collections import deque
+from typing import Any, Deque, Dict, Iterable, List, Optional, Set
+
+# how many undelivered events a subscriber may fall behind before it is dropped
+SUBSCRIBER_QUEUE = 100
+
+Event = Dict[str, Any]
+
+
+class Subscription:
+    """
+    One listener for the events of one User. Events queue up until the listener takes them, and a listener that lets
+    SUBSCRIBER_QUEUE of them pile up is evicted instead of growing without bound. The listener waits on a plain lock
+    that is held while nothing is queued, which is far lighter than a threading.Event when thousands sit idle.
+    """
+    __slots__ = ("user_id", "events", "ready", "evicted")
+
+    def __init__(self, user_id: int):
+        self.user_id = user_id
+        self.events: Deque[Event] = deque()
+        self.ready = threading.Lock()
+        self.ready.acquire()
+        self.evicted = False
+
+
+class EventHub:
+    """
+    EventHub fans events out to the Subscriptions of the Users they are published to. Publishing never blocks on a
+    subscriber, a full queue evicts its subscriber, which is told so and expected to reconnect and reload.
+    """
+
+    def __init__(self, max_queue: int = SUBSCRIBER_QUEUE):
+        self.max_queue = max_queue
+        self.lock = threading.Lock()
+        self.subscribers: Dict[int, Set[Subscription]] = {}
+        self.published = 0
+        self.evictions = 0
+
+    def subscribe(self, user_id: int) -> Subscription:
+        subscription = Subscription(user_id)
+        with self.lock:
+            self.subscribers.setdefault(user_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        with self.lock:
+            self.__remove(subscription)
+
+    def publish(self, user_ids: Iterable[int], event: Event) -> None:
+        """
+        Queue the event for every Subscription of the Users
+        """
+        with self.lock:
+            self.published += 1
+            for user_id in set(user_ids):
+                for subscription in list(self.subscribers.get(user_id, ())):
+                    if len(subscription.events) >= self.max_queue:
+                        subscription.evicted = True
+                        subscription.events.clear()
+                        self.__remove(subscription)
+                        self.evictions += 1
+                    else:
+                        subscription.events.append(event)
+                    if subscription.ready.locked():
+                        subscription.ready.release()
+
+    def take(self, subscription: Subscription, timeout: float) -> Optional[List[Event]]:
+        """
+        Wait for events of the Subscription
+
+        :param timeout: seconds to wait before giving up, so the caller can send a heartbeat
+        :return: the events queued since the last call, empty after a timeout (and rarely before it), None once the
+            Subscription has been evicted
+        """
+        subscription.ready.acquire(timeout=timeout)
+        with self.lock:
+            if subscription.evicted:
+                return None
+            events = list(subscription.events)
+            subscription.events.clear()
+            return events
+
+    def stats(self) -> Dict[str, int]:
+        with self.lock:
+            return {
+                "users": len(self.subscribers),
+                "subscriptions": sum(len(subscriptions) for subscriptions in self.subscribers.values()),
+                "published": self.published,
+                "evictions": self.evictions,
+            }
+
+    def __remove(self, subscription: Subscription) -> None:
+        subscriptions = self.subscribers.get(subscription.user_id)
+        if subscriptions is not None:
+            subscriptions.discard(subscription)
+            if not subscriptions:
+                del self.subscribers[subscription.user_id]
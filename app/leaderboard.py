@@ -0,0 +1,96 @@
+"""
+Rank lookups for the team score leaderboard
+"""
+import threading
+from typing import Callable, Iterable, List, Optional, Tuple
+
+# (lowest possible score, highest possible score, [(score, number of Users)])
+LeaderboardState = Tuple[int, int, List[Tuple[int, int]]]
+
+
+class Leaderboard:
+    """
+    Leaderboard counts the Users at every team score in a Fenwick tree indexed by score, so the rank of a score is
+    one prefix sum and a score change is two point updates, both O(log of the score range) however many Users there
+    are. The counts are loaded once and then kept current with the score changes of every write. Both happen on the
+    writer, so a change is never counted twice or missed.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.tree: Optional[List[int]] = None
+        self.lowest = 0
+        self.total = 0
+
+    @property
+    def loaded(self) -> bool:
+        return self.tree is not None
+
+    def load(self, read: Callable[[], LeaderboardState]) -> None:
+        """
+        Load the counts with read unless they are already loaded
+        """
+        with self.lock:
+            if self.tree is not None:
+                return
+            lowest, highest, counts = read()
+            self.lowest, self.total = lowest, 0
+            self.tree = [0] * (highest - lowest + 2)
+            for score, count in counts:
+                self.__add(score, count)
+
+    def reset(self) -> None:
+        """
+        Forget the counts, the next load reads them again. Called when changes were applied by a write that did not
+        commit after all.
+        """
+        with self.lock:
+            self.tree = None
+
+    def apply(self, changes: Iterable[Tuple[int, Optional[int], Optional[int]]]) -> bool:
+        """
+        Move Users between scores, does nothing until the counts are loaded
+
+        :param changes: (user_id, old score, new score) for each score a write changed, old is None for a new User and
+            new is None for a deleted one
+        :return: whether the changes were applied
+        """
+        with self.lock:
+            if self.tree is None:
+                return False
+            for _, old, new in changes:
+                if old is not None:
+                    self.__add(old, -1)
+                if new is not None:
+                    self.__add(new, 1)
+            return True
+
+    def rank(self, score: int) -> int:
+        """
+        :return: 1 plus the number of Users with a higher score, Users with the same score share a rank
+        """
+        with self.lock:
+            if self.tree is None:
+                raise RuntimeError("Leaderboard.rank() called before load()")
+            return 1 + self.total - self.__count_up_to(score)
+
+    def __index(self, score: int) -> int:
+        return min(max(score - self.lowest, 0), len(self.tree) - 2) + 1
+
+    def __add(self, score: int, count: int) -> None:
+        self.total += count
+        i = self.__index(score)
+        while i < len(self.tree):
+            self.tree[i] += count
+            i += i & -i
+
+    def __count_up_to(self, score: int) -> int:
+        """
+        :return: the number of Users with a score of at most score
+        """
+        count = 0
+        i = self.__index(score)
+        while i > 0:
+            count += self.tree[i]
+            i -= i & -i
+        return count
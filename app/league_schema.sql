@@ -0,0 +1,13 @@
+create table if not exists Leagues (
+    id integer primary key,
+    name text not null unique,
+    db_filename text not null
+);
+
+create table if not exists Members (
+    id integer primary key,
+    name text not null unique,
+    league_id integer not null references Leagues
+);
+
+create index if not exists members_league on Members (league_id);
@@ -0,0 +1,359 @@
+"""
+Leagues split the game over several databases. Every league has its own copy of the Cards in a database file of its
+own, so its members only compete, trade and rank with each other, and every league has its own writer. A small
+directory database lists the leagues and which league each User belongs to. The LeagueRouter answers which
+QueryEngine holds a User, and creates, fills and rebalances leagues for the flask league commands.
+"""
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from contextlib import closing
+from datetime import datetime
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from app import login, schema_filename, leagues_filename, league_schema_filename
+from app.models import League, User, NoOutputError, QueryEngineError
+from app.query_engine import QueryEngine, engine, cards_filename
+from app.storage import SQLiteBackend
+
+# the league kept in the main database, the one every User belongs to until more leagues are created
+DEFAULT_LEAGUE = 1
+DEFAULT_LEAGUE_NAME = "default"
+# how many Users' leagues are remembered before the least recently used one is dropped
+USER_LEAGUES_SIZE = 100000
+
+
+def league_filename(league_id: int) -> str:
+    """
+    :return: the name of the database file of a league, next to the league directory
+    """
+    return f"trading_card_league-{league_id}.db"
+
+
+def open_league_engine(db_filename: str) -> QueryEngine:
+    """
+    :return: a QueryEngine over the database of a league, which starts out with the Cards and nothing else
+    """
+    return QueryEngine(SQLiteBackend(db_filename, schema_filename, cards_filename), test_data=False)
+
+
+class LeagueRouter:
+    """
+    LeagueRouter finds the QueryEngine of the league a User belongs to. User ids are handed out by the directory, so
+    they stay unique across leagues and a User keeps its id when it moves. The league of each User is cached in an LRU
+    once it has been looked up, a User moved by another process is found again the first time its old league misses
+    it.
+    """
+
+    def __init__(self, directory_filename: str, default: QueryEngine,
+                 open_engine: Callable[[str], QueryEngine] = open_league_engine,
+                 cache_size: int = USER_LEAGUES_SIZE):
+        """
+        :param directory_filename: the league directory database, the league databases are kept next to it
+        :param default: the QueryEngine of the default league
+        :param open_engine: returns the QueryEngine of a league database file
+        :param cache_size: how many Users' leagues are cached
+        """
+        self.directory_filename = directory_filename
+        self.default = default
+        self.open_engine = open_engine
+        self.initialized = False
+        self.lock = threading.Lock()
+        self.move_lock = threading.Lock()
+        self.engines: Dict[int, QueryEngine] = {DEFAULT_LEAGUE: default}
+        self.cache_size = cache_size
+        self.cache_lock = threading.Lock()
+        self.user_leagues: "OrderedDict[int, int]" = OrderedDict()
+
+    def connect(self) -> sqlite3.Connection:
+        if not self.initialized:
+            self.initialize()
+        return sqlite3.connect(self.directory_filename)
+
+    def initialize(self) -> None:
+        """
+        Create the directory if it does not exist. A new directory holds the default league, whose members are the
+        Users already in the main database.
+        """
+        with self.lock:
+            if self.initialized:
+                return
+            with closing(sqlite3.connect(self.directory_filename)) as conn:
+                conn.execute("pragma journal_mode = wal")
+                with open(league_schema_filename, 'rt') as schema_file:
+                    conn.executescript(schema_file.read())
+                if conn.execute("select count(*) from Leagues").fetchone()[0] == 0:
+                    conn.execute("insert into Leagues (id, name, db_filename) values (?, ?, ?)",
+                                 (DEFAULT_LEAGUE, DEFAULT_LEAGUE_NAME,
+                                  getattr(self.default.backend, "db_filename", ":memory:")))
+                    conn.executemany("insert into Members (id, name, league_id) values (?, ?, ?)",
+                                     ((u.unique_id, u.name, DEFAULT_LEAGUE) for u in self.default.iter_users()))
+                    conn.commit()
+            self.initialized = True
+
+    def leagues(self) -> List[League]:
+        """
+        :return: every league with its number of members, by id
+        """
+        with closing(self.connect()) as conn:
+            rows = conn.execute("select Leagues.id, Leagues.name, Leagues.db_filename, count(Members.id) "
+                                "from Leagues left join Members on Members.league_id = Leagues.id "
+                                "group by Leagues.id order by Leagues.id").fetchall()
+        return [League(*row) for row in rows]
+
+    def create_league(self, name: str) -> League:
+        """
+        Create an empty league and its database
+
+        :raise QueryEngineError: if a league with that name exists already
+        """
+        with closing(self.connect()) as conn:
+            try:
+                league_id = conn.execute("insert into Leagues (name, db_filename) values (?, '')", (name,)).lastrowid
+            except sqlite3.IntegrityError:
+                raise QueryEngineError(f"A league named {name} exists already")
+            conn.execute("update Leagues set db_filename = ? where id = ?", (league_filename(league_id), league_id))
+            conn.commit()
+        self.engine(league_id).initialize_database()
+        return League(league_id, name, league_filename(league_id))
+
+    def engine(self, league_id: int) -> QueryEngine:
+        """
+        :return: the QueryEngine of the league, opened on first use
+        :raise NoOutputError: if there is no such league
+        """
+        league_engine = self.engines.get(league_id)
+        if league_engine is not None:
+            return league_engine
+        if not self.initialized:
+            self.initialize()
+        with self.lock:
+            if league_id not in self.engines:
+                with closing(sqlite3.connect(self.directory_filename)) as conn:
+                    row = conn.execute("select db_filename from Leagues where id = ?", (league_id,)).fetchone()
+                if row is None:
+                    raise NoOutputError(f"Leagues[id={league_id}]", f"No League with id: {league_id}")
+                directory = os.path.dirname(os.path.abspath(self.directory_filename))
+                self.engines[league_id] = self.open_engine(os.path.join(directory, row[0]))
+            return self.engines[league_id]
+
+    def all_engines(self) -> Iterator[Tuple[League, QueryEngine]]:
+        for league in self.leagues():
+            yield league, self.engine(league.id)
+
+    def __cached_league(self, user_id: int) -> Optional[int]:
+        """
+        private function to get the cached league of the User, None if it is not cached
+        """
+        with self.cache_lock:
+            league_id = self.user_leagues.get(user_id)
+            if league_id is not None:
+                self.user_leagues.move_to_end(user_id)
+            return league_id
+
+    def __cache_league(self, user_id: int, league_id: int) -> None:
+        """
+        private function to remember the league of the User, dropping the least recently used when the cache is full
+        """
+        with self.cache_lock:
+            self.user_leagues[user_id] = league_id
+            self.user_leagues.move_to_end(user_id)
+            while len(self.user_leagues) > self.cache_size:
+                self.user_leagues.popitem(last=False)
+
+    def __forget_league(self, user_id: int) -> Optional[int]:
+        """
+        private function to drop the cached league of the User
+
+        :return: the league that was cached, None if none was
+        """
+        with self.cache_lock:
+            return self.user_leagues.pop(user_id, None)
+
+    def league_of(self, user_id: int) -> int:
+        """
+        :return: the id of the league the User belongs to
+        :raise NoOutputError: if the User is in no league
+        """
+        league_id = self.__cached_league(int(user_id))
+        if league_id is not None:
+            return league_id
+        with closing(self.connect()) as conn:
+            row = conn.execute("select league_id from Members where id = ?", (int(user_id),)).fetchone()
+        if row is None:
+            raise NoOutputError(f"Members[id={user_id}]", f"No User with id: {user_id}")
+        self.__cache_league(int(user_id), row[0])
+        return row[0]
+
+    def for_user(self, user_id: int) -> QueryEngine:
+        """
+        :return: the QueryEngine of the league the User belongs to
+        """
+        return self.engine(self.league_of(user_id))
+
+    def get_session_user(self, user_id: int) -> User:
+        """
+        Get the logged in User from the QueryEngine of its league
+
+        :raise NoOutputError: if no User exists with the given user_id
+        """
+        try:
+            return self.for_user(user_id).get_session_user(user_id)
+        except NoOutputError:
+            # the cached league is stale if another process moved the User
+            if self.__forget_league(int(user_id)) is None:
+                raise
+            return self.for_user(user_id).get_session_user(user_id)
+
+    def locate(self, username: str) -> Tuple[int, int]:
+        """
+        :return: the id of the User with the username and the id of its league
+        :raise NoOutputError: if no User exists with the given username
+        """
+        with closing(self.connect()) as conn:
+            row = conn.execute("select id, league_id from Members where name = ?", (username,)).fetchone()
+        if row is None:
+            raise NoOutputError(f"Members[name={username}]", f"No User with username: {username}")
+        self.__cache_league(row[0], row[1])
+        return row[0], row[1]
+
+    def get_user_from_username(self, username: str) -> User:
+        """
+        :raise NoOutputError: if no User exists with the given username
+        """
+        return self.engine(self.locate(username)[1]).get_user_from_username(username)
+
+    def check_user_exists(self, username: str) -> bool:
+        with closing(self.connect()) as conn:
+            return conn.execute("select 1 from Members where name = ?", (username,)).fetchone() is not None
+
+    def members_after(self, after_id: int, limit: int) -> List[Tuple[int, str]]:
+        """
+        :return: (id, username) of at most limit Users of every league with an id above after_id, by id
+        """
+        with closing(self.connect()) as conn:
+            return conn.execute("select id, name from Members where id > ? order by id limit ?",
+                                (after_id, limit)).fetchall()
+
+    def add_user(self, username: str, hashed_pass: str, access: int, last_seen: datetime,
+                 league_id: Optional[int] = None) -> Optional[int]:
+        """
+        Add a new User to a league, the one with the fewest members unless league_id is given. The directory entry is
+        added first, which hands out the id and checks the username is free, and is removed again if the league
+        cannot add the User.
+
+        :return: the id of the new User, None if the username is taken
+        """
+        with closing(self.connect()) as conn:
+            if league_id is None:
+                league_id = conn.execute("select Leagues.id from Leagues left join Members "
+                                         "on Members.league_id = Leagues.id group by Leagues.id "
+                                         "order by count(Members.id), Leagues.id limit 1").fetchone()[0]
+            try:
+                user_id = conn.execute("insert into Members (name, league_id) values (?, ?)",
+                                       (username, league_id)).lastrowid
+            except sqlite3.IntegrityError:
+                return None
+            conn.commit()
+        self.__cache_league(user_id, league_id)
+        try:
+            self.engine(league_id).add_user(username, hashed_pass, access, last_seen, user_id)
+        except BaseException:
+            self.__forget_league(user_id)
+            with closing(self.connect()) as conn:
+                conn.execute("delete from Members where id = ?", (user_id,))
+                conn.commit()
+            raise
+        return user_id
+
+    def __point_to(self, user_id: int, league_id: int) -> None:
+        """
+        private function to point the directory entry of the User to a league
+        """
+        with closing(self.connect()) as conn:
+            conn.execute("update Members set league_id = ? where id = ?", (league_id, user_id))
+            conn.commit()
+        self.__cache_league(user_id, league_id)
+
+    def move_user(self, user_id: int, league_id: int) -> List[int]:
+        """
+        Move a User to another league, keeping its id, name and password. It keeps the Cards it had that are free in
+        its new league. Its open Trades are cancelled and its wants forgotten, its trade history stays behind. The
+        User is added to its new league before the directory points there, and only then removed from its old one.
+        When a step fails the steps before it are undone, the User stays in its old league and the move can be tried
+        again. A copy of the User left in the new league by a move that was cut short is replaced.
+
+        :return: the ids of the Cards the User kept
+        """
+        with self.move_lock:
+            source_id = self.league_of(user_id)
+            target = self.engine(league_id)
+            if source_id == league_id:
+                return sorted(target.get_user_from_id(user_id).cards)
+            source = self.engine(source_id)
+            u = source.get_user_from_id(user_id)
+            if target.check_user_exists(u.name):
+                target.remove_user(u.unique_id)
+            target.add_user(u.name, u.hashed_pass, u.access, u.last_seen, u.unique_id)
+            pointed = False
+            try:
+                card_ids = sorted(u.cards)
+                kept = [card_id for card_id, added in zip(card_ids, target.add_cards_to_user(u.unique_id, card_ids))
+                        if added]
+                self.__point_to(u.unique_id, league_id)
+                pointed = True
+                source.remove_user(u.unique_id)
+            except BaseException:
+                if pointed:
+                    self.__point_to(u.unique_id, source_id)
+                target.remove_user(u.unique_id)
+                raise
+            return kept
+
+    def rebalance(self) -> List[Tuple[int, int, int]]:
+        """
+        Move Users from the largest leagues to the smallest until no two leagues differ by more than one member. The
+        Users seen least recently are moved first, they are the least likely to be in the middle of something.
+
+        :return: (user_id, old league id, new league id) for each move
+        """
+        sizes = {league.id: league.members for league in self.leagues()}
+        candidates: Dict[int, Iterator[User]] = {}
+        moves = []
+        while sizes:
+            largest = max(sizes, key=lambda league_id: (sizes[league_id], -league_id))
+            smallest = min(sizes, key=lambda league_id: (sizes[league_id], league_id))
+            if sizes[largest] - sizes[smallest] <= 1:
+                break
+            if largest not in candidates:
+                members = sorted(self.engine(largest).iter_users(), key=lambda u: (u.last_seen, u.unique_id))
+                candidates[largest] = iter(members)
+            u = next(candidates[largest], None)
+            if u is None:
+                # the directory counts more members than the league has left, it has none to give
+                del sizes[largest]
+                continue
+            self.move_user(u.unique_id, smallest)
+            moves.append((u.unique_id, largest, smallest))
+            sizes[largest] -= 1
+            sizes[smallest] += 1
+        return moves
+
+    def close(self) -> None:
+        """
+        Close the databases of every league but the default one
+        """
+        with self.lock:
+            for league_id, league_engine in list(self.engines.items()):
+                if league_id != DEFAULT_LEAGUE:
+                    league_engine.backend.close()
+                    del self.engines[league_id]
+
+
+leagues = LeagueRouter(leagues_filename, engine)
+
+
+@login.user_loader
+def load_user(unique_id) -> User:
+    return leagues.get_session_user(int(unique_id))
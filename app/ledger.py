@@ -0,0 +1,25 @@
+"""
+Rebuilding who owns which Card from the ownership ledger
+"""
+from typing import Dict, Iterable, Tuple
+
+from app.models import EVENT_ACQUIRE, EVENT_DROP
+
+# how many ledger events may be appended after the latest snapshot before a new one is taken
+SNAPSHOT_INTERVAL = 10000
+
+
+def replay(owners: Dict[int, int], changes: Iterable[Tuple[str, int, int]]) -> Dict[int, int]:
+    """
+    Apply ownership changes in order to a state
+
+    :param owners: the state to start from as {card_id: user_id}, changed in place
+    :param changes: (kind, user_id, card_id) of acquire and drop events, other kinds are ignored
+    :return: owners
+    """
+    for kind, user_id, card_id in changes:
+        if kind == EVENT_ACQUIRE:
+            owners[card_id] = user_id
+        elif kind == EVENT_DROP:
+            owners.pop(card_id, None)
+    return owners
@@ -0,0 +1,57 @@
+"""
+Adding up the market moves of a write for the roll-ups. Every write that offers, trades, acquires or drops Cards adds
+its moves, in the same transaction, to a row of counters per Card for all time and to one per Card for each hour and
+day it moved in, so reading the market never looks at Users or Trades.
+"""
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from app.models import MARKET_STATS, MARKET_OFFERED, MARKET_TRADED, MARKET_ACQUIRED, MARKET_DROPPED, MARKET_GIVEN, \
+    MARKET_RECEIVED
+
+# the roll-up periods by name, with the length of their buckets
+MARKET_PERIODS = {"hour": timedelta(hours=1), "day": timedelta(days=1)}
+# the moves that start and end a holding
+HOLD_STARTS = frozenset((MARKET_ACQUIRED, MARKET_RECEIVED))
+HOLD_ENDS = frozenset((MARKET_DROPPED, MARKET_GIVEN))
+# the position of each counted move in a row of MARKET_STATS
+COUNTED = {MARKET_OFFERED: 0, MARKET_TRADED: 1, MARKET_ACQUIRED: 2, MARKET_DROPPED: 3}
+HOLDS, HELD_SECONDS = MARKET_STATS.index("holds"), MARKET_STATS.index("held_seconds")
+
+
+def bucket_start(period: str, at: datetime) -> datetime:
+    """
+    :return: the start of the bucket of the period at falls in, buckets are aligned to the hour and the day in UTC
+    """
+    if period == "hour":
+        return at.replace(minute=0, second=0, microsecond=0)
+    return at.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def tally(moves: Iterable[Tuple[int, str]], at: datetime, held_since: Callable[[int], Optional[datetime]]) \
+        -> Tuple[Dict[int, List[float]], Dict[int, Optional[datetime]]]:
+    """
+    Add up the moves of one write per Card. A holding that ends is counted with its length up to at, one whose start
+    is not known is not counted.
+
+    :param moves: (card_id, one of the MARKET_ moves of app.models) in the order they were made
+    :param at: when the write was made
+    :param held_since: reads when the holding of a Card started, as stored before the write
+    :return: the values to add to the counters of each Card, in MARKET_STATS order, and the new start of the holding
+             of each Card whose holding started or ended, None for the Cards left free
+    """
+    counters: Dict[int, List[float]] = {}
+    starts: Dict[int, Optional[datetime]] = {}
+    for card_id, move in moves:
+        row = counters.setdefault(card_id, [0] * len(MARKET_STATS))
+        if move in COUNTED:
+            row[COUNTED[move]] += 1
+        if move in HOLD_ENDS:
+            since = starts[card_id] if card_id in starts else held_since(card_id)
+            if since is not None:
+                row[HOLDS] += 1
+                row[HELD_SECONDS] += (at - since).total_seconds()
+            starts[card_id] = None
+        elif move in HOLD_STARTS:
+            starts[card_id] = at
+    return counters, starts
@@ -0,0 +1,589 @@
+"""
+StorageBackend that keeps everything in Python dicts and sets, for tests, benchmarks and throwaway games
+"""
+import bisect
+import itertools
+import sqlite3
+import threading
+from contextlib import contextmanager
+from dataclasses import replace
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterator, List, Optional, Set, Tuple
+
+from app.market import MARKET_PERIODS, bucket_start, tally
+from app.models import Card, Trade, User, ArchivedTrade, Dashboard, CardActivity, MarketBucket, CARD_SUMMARY_COLUMNS, \
+    MARKET_STATS, NoOutputError, ConflictError, copy_trade, copy_user, create_dashboard, trade_summary_row
+from app.search import PrefixIndex
+from app.storage import StorageBackend, StorageTransaction, read_card_rows
+
+TradeKey = Tuple[int, Tuple[int, ...], int, Tuple[int, ...]]
+
+
+class MemoryTransaction(StorageTransaction):
+    """
+    StorageTransaction over the dicts of a MemoryBackend. Rows are copied on the way in and out so callers never
+    hold a reference into the store. Every change records how to undo itself so a failed write can be rolled back.
+    """
+
+    def __init__(self, backend: "MemoryBackend", undo: Optional[List[Callable[[], None]]] = None):
+        super().__init__()
+        self.backend = backend
+        self.undo = undo
+
+    def __record(self, undo: Callable[[], None]) -> None:
+        if self.undo is None:
+            raise RuntimeError("MemoryBackend.read() transactions cannot write")
+        self.undo.append(undo)
+
+    def get_card(self, card_id: int) -> Card:
+        card = self.backend.cards.get(card_id)
+        if card is None:
+            raise NoOutputError(f"Cards[id={card_id}]", f"No Card with id: {card_id}")
+        return replace(card)
+
+    def get_card_by_name(self, card_name: str) -> Card:
+        card_id = self.backend.card_ids_by_name.get(card_name)
+        if card_id is None:
+            raise NoOutputError(f"Cards[name={card_name}]", f"No Card with name: {card_name}")
+        return replace(self.backend.cards[card_id])
+
+    def all_cards(self) -> List[Card]:
+        return [replace(card) for card in self.backend.cards.values()]
+
+    def available_cards(self) -> List[Card]:
+        return [replace(self.backend.cards[card_id]) for card_id in self.backend.available_card_ids]
+
+    def get_user(self, user_id: int) -> User:
+        u = self.backend.users.get(int(user_id))
+        if u is None:
+            raise NoOutputError(f"Users[id={user_id}]", f"No User with id: {user_id}")
+        return copy_user(u)
+
+    def get_user_by_name(self, username: str) -> User:
+        user_id = self.backend.user_ids_by_name.get(username)
+        if user_id is None:
+            raise NoOutputError(f"Users[name={username}]", f"No User with username: {username}")
+        return copy_user(self.backend.users[user_id])
+
+    def user_exists(self, username: str) -> bool:
+        return username in self.backend.user_ids_by_name
+
+    def all_users(self) -> List[User]:
+        return [copy_user(u) for u in self.backend.users.values()]
+
+    def card_names(self, card_ids: Set[int]) -> Dict[int, str]:
+        cards = self.backend.cards
+        return {card_id: cards[card_id].name for card_id in card_ids if card_id in cards}
+
+    def user_names(self, user_ids: Set[int]) -> Dict[int, str]:
+        users = self.backend.users
+        return {user_id: users[user_id].name for user_id in user_ids if user_id in users}
+
+    def cards_after(self, after_id: int, limit: int) -> List[Card]:
+        cards = self.backend.cards
+        card_ids = range(after_id + 1, len(cards) + 1)  # Cards are numbered from 1 and never removed
+        return [replace(cards[card_id]) for card_id in card_ids[:limit]]
+
+    def users_after(self, after_id: int, limit: int) -> List[User]:
+        users = self.backend.users
+        user_ids = itertools.islice((user_id for user_id in range(after_id + 1, self.backend.next_user_id)
+                                     if user_id in users), limit)
+        return [copy_user(users[user_id]) for user_id in user_ids]
+
+    def trades_after(self, after_id: int, limit: int) -> List[Trade]:
+        trade_ids = itertools.islice(sorted(trade_id for trade_id in self.backend.trades if trade_id > after_id), limit)
+        return [copy_trade(self.backend.trades[trade_id]) for trade_id in trade_ids]
+
+    def get_trade(self, trade_id: int) -> Trade:
+        t = self.backend.trades.get(int(trade_id))
+        if t is None:
+            raise NoOutputError(f"Trades[id={trade_id}]", f"No Trade with id: {trade_id}")
+        return copy_trade(t)
+
+    def find_trade(self, user1_id: int, user1_cards: List[int], user2_id: int, user2_cards: List[int],
+                   user1_confirmed: Optional[bool] = None, user2_confirmed: Optional[bool] = None) -> Optional[Trade]:
+        key = (int(user1_id), tuple(user1_cards), int(user2_id), tuple(user2_cards))
+        for trade_id in sorted(self.backend.trade_ids_by_values.get(key, ())):
+            t = self.backend.trades[trade_id]
+            if user1_confirmed is not None and t.user1_confirmed != bool(user1_confirmed):
+                continue
+            if user2_confirmed is not None and t.user2_confirmed != bool(user2_confirmed):
+                continue
+            return copy_trade(t)
+        return None
+
+    def insert_user(self, username: str, hashed_pass: str, access: int, last_seen: datetime) -> int:
+        backend = self.backend
+        if username in backend.user_ids_by_name:
+            raise sqlite3.IntegrityError("UNIQUE constraint failed: Users.name")
+        user_id = backend.next_user_id
+        backend.next_user_id += 1
+        backend.users[user_id] = User(user_id, str(username), str(hashed_pass), int(access), last_seen, set(), set())
+        backend.user_ids_by_name[username] = user_id
+        backend.user_search.add(user_id, username)
+        self.touched_users.add(user_id)
+        self.score_changes.append((user_id, None, 0))
+
+        def undo():
+            del backend.users[user_id]
+            del backend.user_ids_by_name[username]
+            backend.user_search.remove(user_id, username)
+            backend.next_user_id = user_id
+        self.__record(undo)
+        return user_id
+
+    def restore_user(self, u: User) -> None:
+        backend = self.backend
+        if u.unique_id in backend.users or u.name in backend.user_ids_by_name:
+            raise sqlite3.IntegrityError("UNIQUE constraint failed: Users")
+        previous_next_user_id = backend.next_user_id
+        backend.users[u.unique_id] = User(u.unique_id, u.name, u.hashed_pass, int(u.access), u.last_seen,
+                                          set(u.cards), set(u.trades))
+        backend.user_ids_by_name[u.name] = u.unique_id
+        backend.user_search.add(u.unique_id, u.name)
+        backend.next_user_id = max(backend.next_user_id, u.unique_id + 1)
+        self.touched_users.add(u.unique_id)
+        self.score_changes.append((u.unique_id, None, 0))
+
+        def undo():
+            del backend.users[u.unique_id]
+            del backend.user_ids_by_name[u.name]
+            backend.user_search.remove(u.unique_id, u.name)
+            backend.next_user_id = previous_next_user_id
+        self.__record(undo)
+        for card_id in u.cards:
+            self.__set_card(backend.cards[card_id], True, u.unique_id)
+
+    def restore_trade(self, t: Trade) -> None:
+        backend = self.backend
+        if t.unique_id in backend.trades:
+            raise sqlite3.IntegrityError("UNIQUE constraint failed: Trades.id")
+        previous_next_trade_id = backend.next_trade_id
+        key = (t.user1_id, tuple(sorted(t.user1_cards)), t.user2_id, tuple(sorted(t.user2_cards)))
+        backend.insert_trade_row(copy_trade(t), key)
+        backend.next_trade_id = max(backend.next_trade_id, t.unique_id + 1)
+
+        def undo():
+            backend.delete_trade_row(t.unique_id)
+            backend.next_trade_id = previous_next_trade_id
+        self.__record(undo)
+
+    def delete_user(self, user_id: int) -> None:
+        backend = self.backend
+        user_id = int(user_id)
+        u = backend.users.get(user_id)
+        if u is None:
+            raise NoOutputError(f"Users[id={user_id}]", f"No User with id: {user_id}")
+        wants = set(backend.wants.get(user_id, ()))
+        del backend.users[user_id]
+        del backend.user_ids_by_name[u.name]
+        backend.user_search.remove(user_id, u.name)
+        for card_id in wants:
+            backend.remove_want_row(user_id, card_id)
+        self.touched_users.add(user_id)
+        self.score_changes.append((user_id, u.score, None))
+
+        def undo():
+            backend.users[user_id] = u
+            backend.user_ids_by_name[u.name] = user_id
+            backend.user_search.add(user_id, u.name)
+            for card_id in wants:
+                backend.add_want_row(user_id, card_id)
+        self.__record(undo)
+
+    def set_last_seen(self, user_id: int, last_seen: datetime) -> None:
+        u = self.backend.users.get(int(user_id))
+        if u is None:
+            return
+        previous = u.last_seen
+        u.last_seen = last_seen
+        self.__record(lambda: setattr(u, "last_seen", previous))
+
+    def __check_user_version(self, u: User) -> User:
+        stored = self.backend.users.get(u.unique_id)
+        if stored is None or stored.version != u.version:
+            raise ConflictError("Users", u.unique_id)
+        self.touched_users.add(u.unique_id)
+        return stored
+
+    def set_user_cards(self, u: User, cards: List[int]) -> None:
+        stored = self.__check_user_version(u)
+        previous = stored.cards, stored.version
+        stored.cards, stored.version = set(cards), stored.version + 1
+        self.__record(lambda: (setattr(stored, "cards", previous[0]), setattr(stored, "version", previous[1])))
+        u.cards = set(cards)
+        u.version += 1
+
+    def set_user_trades(self, u: User, trades: List[int]) -> None:
+        stored = self.__check_user_version(u)
+        previous = stored.trades, stored.version
+        stored.trades, stored.version = set(trades), stored.version + 1
+        self.__record(lambda: (setattr(stored, "trades", previous[0]), setattr(stored, "version", previous[1])))
+        u.trades = set(trades)
+        u.version += 1
+
+    def __set_card(self, card: Card, owned: bool, owner: Optional[int]) -> None:
+        backend = self.backend
+        previous = card.owned, card.owner
+
+        def apply(values):
+            card.owned, card.owner = values
+            if card.owned:
+                backend.available_card_ids.discard(card.id)
+            else:
+                backend.available_card_ids.add(card.id)
+        apply((owned, owner))
+        self.__record(lambda: apply(previous))
+
+    def claim_card(self, card_id: int, user_id: int) -> bool:
+        card = self.backend.cards.get(int(card_id))
+        if card is None or card.owner is not None:
+            return False
+        self.__set_card(card, True, int(user_id))
+        return True
+
+    def release_card(self, card_id: int, user_id: int) -> None:
+        card = self.backend.cards.get(int(card_id))
+        if card is None or card.owner != int(user_id):
+            raise ConflictError("Cards", card_id)
+        self.__set_card(card, False, None)
+
+    def set_card_owned(self, card_id: int, owned: bool) -> None:
+        card = self.backend.cards.get(int(card_id))
+        if card is not None:
+            self.__set_card(card, owned, card.owner if owned else None)
+
+    def insert_trade(self, user1_id: int, user1_cards: List[int], user2_id: int, user2_cards: List[int]) -> int:
+        backend = self.backend
+        trade_id = backend.next_trade_id
+        backend.next_trade_id += 1
+        now = datetime.utcnow()
+        key = (int(user1_id), tuple(user1_cards), int(user2_id), tuple(user2_cards))
+        backend.insert_trade_row(Trade(trade_id, int(user1_id), set(user1_cards), False,
+                                       int(user2_id), set(user2_cards), False, created=now, updated=now), key)
+
+        def undo():
+            backend.delete_trade_row(trade_id)
+            backend.next_trade_id = trade_id
+        self.__record(undo)
+        return trade_id
+
+    def set_trade_confirmed(self, t: Trade, user_number: int, confirmed: bool) -> None:
+        column = {1: "user1_confirmed", 2: "user2_confirmed"}[user_number]
+        stored = self.backend.trades.get(t.unique_id)
+        if stored is None or stored.version != t.version:
+            raise ConflictError("Trades", t.unique_id)
+        previous = getattr(stored, column), stored.version, stored.updated
+        now = datetime.utcnow()
+        setattr(stored, column, bool(confirmed))
+        stored.version += 1
+        stored.updated = now
+        self.__record(lambda: (setattr(stored, column, previous[0]), setattr(stored, "version", previous[1]),
+                               setattr(stored, "updated", previous[2])))
+        setattr(t, column, bool(confirmed))
+        t.version += 1
+        t.updated = now
+
+    def archive_trade(self, trade_id: int, status: str) -> None:
+        backend = self.backend
+        if int(trade_id) not in backend.trades:
+            return
+        row = backend.delete_trade_row(int(trade_id))
+        t = row[0]
+        entry = ArchivedTrade(len(backend.archive) + 1, t.unique_id, t.user1_id, set(t.user1_cards),
+                              t.user1_confirmed, t.user2_id, set(t.user2_cards), t.user2_confirmed,
+                              t.created, t.updated, datetime.utcnow(), status)
+        backend.archive.append(entry)
+
+        def undo():
+            backend.archive.pop()
+            backend.insert_trade_row(*row)
+        self.__record(undo)
+
+    def stale_trade_ids(self, updated_before: datetime, limit: int) -> List[int]:
+        stale = [t for t in self.backend.trades.values() if t.updated < updated_before]
+        stale.sort(key=lambda t: t.updated)
+        return [t.unique_id for t in stale[:limit]]
+
+    def archived_trades(self, user_id: int, before_archive_id: Optional[int], limit: int) -> List[ArchivedTrade]:
+        archive = self.backend.archive
+        end = len(archive) if before_archive_id is None else min(len(archive), before_archive_id - 1)
+        page = []
+        for index in range(end - 1, -1, -1):
+            entry = archive[index]
+            if entry.user1_id == user_id or entry.user2_id == user_id:
+                page.append(replace(entry))
+                if len(page) >= limit:
+                    break
+        return page
+
+    def append_event(self, kind: str, user_id: Optional[int], card_id: Optional[int] = None,
+                     trade_id: Optional[int] = None) -> int:
+        backend = self.backend
+        backend.events.append((kind, user_id, card_id, trade_id))
+        backend.event_times.append(datetime.utcnow())
+        self.last_event_seq = len(backend.events)
+
+        def undo():
+            backend.events.pop()
+            backend.event_times.pop()
+        self.__record(undo)
+        return self.last_event_seq
+
+    def event_seq_at(self, at: datetime) -> int:
+        return bisect.bisect_right(self.backend.event_times, at)
+
+    def ownership_changes(self, after_seq: int, until_seq: int) -> Iterator[Tuple[str, int, int]]:
+        for kind, user_id, card_id, _ in self.backend.events[after_seq:until_seq]:
+            if card_id is not None:
+                yield kind, user_id, card_id
+
+    def latest_snapshot_seq(self) -> int:
+        snapshot_seqs = self.backend.snapshot_seqs
+        return snapshot_seqs[-1] if snapshot_seqs else 0
+
+    def snapshot_ownership(self, seq: int) -> None:
+        backend = self.backend
+        owners = {card.id: card.owner for card in backend.cards.values() if card.owner is not None}
+        index = bisect.bisect_left(backend.snapshot_seqs, seq)
+        replaced = index < len(backend.snapshot_seqs) and backend.snapshot_seqs[index] == seq
+        if replaced:
+            previous = backend.snapshots[index]
+            backend.snapshots[index] = owners
+            self.__record(lambda: backend.snapshots.__setitem__(index, previous))
+        else:
+            backend.snapshot_seqs.insert(index, seq)
+            backend.snapshots.insert(index, owners)
+            self.__record(lambda: (backend.snapshot_seqs.pop(index), backend.snapshots.pop(index)))
+
+    def snapshot_at(self, seq: int) -> Tuple[int, Dict[int, int]]:
+        index = bisect.bisect_right(self.backend.snapshot_seqs, seq) - 1
+        if index < 0:
+            return 0, {}
+        return self.backend.snapshot_seqs[index], dict(self.backend.snapshots[index])
+
+    def add_user_score(self, user_id: int, delta: int) -> None:
+        stored = self.backend.users[int(user_id)]
+        previous = stored.score
+        stored.score += delta
+        self.__record(lambda: setattr(stored, "score", previous))
+        self.touched_users.add(stored.unique_id)
+        self.score_changes.append((stored.unique_id, previous, stored.score))
+
+    def set_card_points(self, points: Dict[int, int]) -> None:
+        for card_id, card_points in points.items():
+            card = self.backend.cards[card_id]
+            previous = card.points
+            card.points = card_points
+            self.__record(lambda card=card, previous=previous: setattr(card, "points", previous))
+
+    def rescore_users(self) -> None:
+        totals: Dict[int, int] = {}
+        for card in self.backend.cards.values():
+            if card.owner is not None:
+                totals[card.owner] = totals.get(card.owner, 0) + card.points
+        for u in self.backend.users.values():
+            previous = u.score
+            u.score = totals.get(u.unique_id, 0)
+            self.__record(lambda u=u, previous=previous: setattr(u, "score", previous))
+
+    def score_counts(self) -> List[Tuple[int, int]]:
+        counts: Dict[int, int] = {}
+        for u in self.backend.users.values():
+            counts[u.score] = counts.get(u.score, 0) + 1
+        return list(counts.items())
+
+    def top_users(self, after: Optional[Tuple[int, int]], limit: int) -> List[User]:
+        # sorts every User, fine for the sizes this backend is meant for
+        ranked = sorted(self.backend.users.values(), key=lambda u: (-u.score, u.unique_id))
+        if after is not None:
+            ranked = [u for u in ranked if (-u.score, u.unique_id) > (-after[0], after[1])]
+        return [copy_user(u) for u in ranked[:limit]]
+
+    def add_want(self, user_id: int, card_id: int) -> None:
+        backend = self.backend
+        user_id, card_id = int(user_id), int(card_id)
+        if card_id in backend.wants.get(user_id, ()):
+            return
+        backend.add_want_row(user_id, card_id)
+        self.__record(lambda: backend.remove_want_row(user_id, card_id))
+
+    def remove_want(self, user_id: int, card_id: int) -> None:
+        backend = self.backend
+        user_id, card_id = int(user_id), int(card_id)
+        if card_id not in backend.wants.get(user_id, ()):
+            return
+        backend.remove_want_row(user_id, card_id)
+        self.__record(lambda: backend.add_want_row(user_id, card_id))
+
+    def user_wants(self, user_id: int) -> List[int]:
+        return list(self.backend.wants.get(int(user_id), ()))
+
+    def want_edges(self, user_id: int) -> List[Tuple[int, int]]:
+        cards = self.backend.cards
+        return [(card_id, cards[card_id].owner) for card_id in self.backend.wants.get(int(user_id), ())
+                if cards[card_id].owner is not None]
+
+    def wanters_of_cards_of(self, user_id: int) -> List[Tuple[int, int]]:
+        u = self.backend.users.get(int(user_id))
+        if u is None:
+            return []
+        return [(wanter_id, card_id) for card_id in u.cards for wanter_id in self.backend.wanters.get(card_id, ())]
+
+    def search_cards(self, text: str, limit: int) -> List[Card]:
+        return [replace(self.backend.cards[card_id]) for card_id in self.backend.card_search.search(text, limit)]
+
+    def search_users(self, text: str, limit: int) -> List[User]:
+        return [copy_user(self.backend.users[user_id]) for user_id in self.backend.user_search.search(text, limit)]
+
+    def dashboard(self, user_id: int) -> Dashboard:
+        # built from the dicts on every read, which costs about what storing it would
+        u = self.backend.users.get(int(user_id))
+        if u is None:
+            raise NoOutputError(f"Users[id={user_id}]", f"No User with id: {user_id}")
+        card_rows = [[getattr(self.backend.cards[card_id], column) for column in CARD_SUMMARY_COLUMNS]
+                     for card_id in sorted(u.cards)]
+        trade_rows = []
+        for trade_id in sorted(u.trades):
+            t = self.backend.trades[trade_id]
+            other_user_id = t.user2_id if t.user1_id == u.unique_id else t.user1_id
+            trade_rows.append(trade_summary_row(t, u.unique_id, self.backend.users[other_user_id].name))
+        return create_dashboard(u.unique_id, card_rows, trade_rows)
+
+    def record_market(self, moves: List[Tuple[int, str]], at: datetime) -> None:
+        backend = self.backend
+        counters, starts = tally(moves, at, backend.held_since.get)
+        tables = [backend.market] + [backend.rollups[period].setdefault(bucket_start(period, at), {})
+                                     for period in MARKET_PERIODS]
+        for table in tables:
+            for card_id, row in counters.items():
+                previous = table.get(card_id)
+                table[card_id] = [total + value for total, value in zip(previous or [0] * len(MARKET_STATS), row)]
+                self.__record(lambda table=table, card_id=card_id, previous=previous:
+                              table.__setitem__(card_id, previous) if previous is not None else table.pop(card_id))
+        for card_id, since in starts.items():
+            previous = backend.held_since.get(card_id)
+            backend.held_since[card_id] = since
+            self.__record(lambda card_id=card_id, previous=previous: backend.held_since.__setitem__(card_id, previous))
+
+    def card_activity(self, card_id: int) -> CardActivity:
+        if card_id not in self.backend.cards:
+            raise NoOutputError(f"Cards[id={card_id}]", f"No Card with id: {card_id}")
+        return self.__activity(card_id, self.backend.market.get(card_id), self.backend.held_since.get(card_id))
+
+    def market_leaders(self, stat: str, limit: int) -> List[CardActivity]:
+        return [self.__activity(card_id, row, self.backend.held_since.get(card_id))
+                for card_id, row in self.__highest(self.backend.market, stat, limit)]
+
+    def market_window(self, period: str, since: datetime, stat: str, limit: int) -> List[CardActivity]:
+        totals: Dict[int, List[float]] = {}
+        for start, cards in self.backend.rollups[period].items():
+            if start >= since:
+                for card_id, row in cards.items():
+                    total = totals.setdefault(card_id, [0] * len(MARKET_STATS))
+                    for column, value in enumerate(row):
+                        total[column] += value
+        return [self.__activity(card_id, row) for card_id, row in self.__highest(totals, stat, limit)]
+
+    def market_buckets(self, period: str, since: datetime) -> List[MarketBucket]:
+        return [MarketBucket(start, *(sum(column) for column in zip(*cards.values())))
+                for start, cards in sorted(self.backend.rollups[period].items()) if start >= since and cards]
+
+    def __activity(self, card_id: int, row: Optional[List[float]], held_since: Optional[datetime] = None) \
+            -> CardActivity:
+        return CardActivity(card_id, self.backend.cards[card_id].name, *(row or [0] * len(MARKET_STATS)), held_since)
+
+    @staticmethod
+    def __highest(rows: Dict[int, List[float]], stat: str, limit: int) -> List[Tuple[int, List[float]]]:
+        """
+        private function to pick the limit rows with the highest non-zero stat, by id among equal ones
+        """
+        column = MARKET_STATS.index(stat)
+        ranked = sorted((item for item in rows.items() if item[1][column] > 0),
+                        key=lambda item: (-item[1][column], item[0]))
+        return ranked[:limit]
+
+
+class MemoryBackend(StorageBackend):
+    """
+    StorageBackend keeping its data in dicts, with a set of unowned card ids and dict indexes on user names and trade
+    values so every lookup the QueryEngine makes is O(1). One lock serializes writers, readers share it too so they
+    never see half of a write.
+    """
+
+    def __init__(self, cards_filename: str):
+        self.cards_filename = cards_filename
+        self.lock = threading.RLock()
+        self.cards: Dict[int, Card] = {}
+        self.card_ids_by_name: Dict[str, int] = {}
+        self.available_card_ids: Set[int] = set()
+        self.users: Dict[int, User] = {}
+        self.user_ids_by_name: Dict[str, int] = {}
+        self.trades: Dict[int, Trade] = {}
+        self.trade_keys: Dict[int, TradeKey] = {}
+        self.trade_ids_by_values: Dict[TradeKey, Set[int]] = {}
+        self.archive: List[ArchivedTrade] = []  # archive_id is the position in the list plus one
+        # the ownership ledger, an event's seq is its position in the list plus one
+        self.events: List[Tuple[str, Optional[int], Optional[int], Optional[int]]] = []
+        self.event_times: List[datetime] = []
+        self.snapshot_seqs: List[int] = []
+        self.snapshots: List[Dict[int, int]] = []
+        self.wants: Dict[int, Set[int]] = {}
+        self.wanters: Dict[int, Set[int]] = {}
+        # the market counters of every Card that moved, in MARKET_STATS order, and when their holdings started
+        self.market: Dict[int, List[float]] = {}
+        self.held_since: Dict[int, Optional[datetime]] = {}
+        # the market counters of the Cards that moved in each bucket, by bucket start, for every roll-up period
+        self.rollups: Dict[str, Dict[datetime, Dict[int, List[float]]]] = {period: {} for period in MARKET_PERIODS}
+        self.card_search = PrefixIndex()
+        self.user_search = PrefixIndex()
+        self.next_user_id = 1
+        self.next_trade_id = 1
+
+    def initialize(self) -> bool:
+        with self.lock:
+            if self.cards:
+                return False
+            for card_id, row in enumerate(read_card_rows(self.cards_filename), start=1):
+                self.cards[card_id] = Card(card_id, False, **row)
+                self.card_ids_by_name[row["name"]] = card_id
+                self.card_search.add(card_id, f"{row['name']} {row['team']} {row['pos']}")
+                self.available_card_ids.add(card_id)
+            return True
+
+    def insert_trade_row(self, t: Trade, key: TradeKey) -> None:
+        self.trades[t.unique_id] = t
+        self.trade_keys[t.unique_id] = key
+        self.trade_ids_by_values.setdefault(key, set()).add(t.unique_id)
+
+    def add_want_row(self, user_id: int, card_id: int) -> None:
+        self.wants.setdefault(user_id, set()).add(card_id)
+        self.wanters.setdefault(card_id, set()).add(user_id)
+
+    def remove_want_row(self, user_id: int, card_id: int) -> None:
+        self.wants[user_id].discard(card_id)
+        self.wanters[card_id].discard(user_id)
+
+    def delete_trade_row(self, trade_id: int) -> Tuple[Trade, TradeKey]:
+        t = self.trades.pop(trade_id)
+        key = self.trade_keys.pop(trade_id)
+        same_values = self.trade_ids_by_values[key]
+        same_values.discard(trade_id)
+        if not same_values:
+            del self.trade_ids_by_values[key]
+        return t, key
+
+    @contextmanager
+    def read(self) -> Iterator[StorageTransaction]:
+        with self.lock:
+            yield MemoryTransaction(self)
+
+    def write(self, command: Callable[[StorageTransaction], Any]) -> Any:
+        with self.lock:
+            undo: List[Callable[[], None]] = []
+            try:
+                return command(MemoryTransaction(self, undo))
+            except Exception:
+                for step in reversed(undo):
+                    step()
+                raise
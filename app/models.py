@@ -0,0 +1,367 @@
+"""
+Data classes for the rows of the database and the errors raised while reading and writing them
+"""
+from dataclasses import dataclass, replace
+from datetime import datetime
+from typing import Tuple, List, Optional, Set
+
+from flask_login import UserMixin
+
+
+@dataclass
+class Card:
+    id: int
+    owned: bool
+    name: str
+    team: str
+    pos: str
+    age: int
+    gp: int
+    mpg: int
+    fta: int
+    ft_pct: int
+    two_pa: int
+    two_p_pct: int
+    three_pa: int
+    three_p_pct: int
+    shooting_pct: int
+    ppointspg: int
+    reboundspg: int
+    assistspg: int
+    stealspg: int
+    blockspg: int
+    image: str
+    owner: Optional[int] = None
+    points: Optional[int] = None
+
+    def __hash__(self):
+        return hash((self.id,
+                     self.owned,
+                     self.name,
+                     self.team,
+                     self.pos,
+                     self.age,
+                     self.gp,
+                     self.mpg,
+                     self.fta,
+                     self.ft_pct,
+                     self.two_pa,
+                     self.two_p_pct,
+                     self.three_pa,
+                     self.three_p_pct,
+                     self.shooting_pct,
+                     self.ppointspg,
+                     self.reboundspg,
+                     self.assistspg,
+                     self.stealspg,
+                     self.blockspg,
+                     self.image))
+
+
+def create_card(
+        card_data: Tuple[
+            int, int, str, str, str, int, int, int, int, int, int,
+            int, int, int, int, int, int, int, int, int, str]) -> Card:
+    return Card(
+        card_data[0],
+        bool(card_data[1]),
+        card_data[2],
+        card_data[3],
+        card_data[4],
+        card_data[5],
+        card_data[6],
+        card_data[7],
+        card_data[8],
+        card_data[9],
+        card_data[10],
+        card_data[11],
+        card_data[12],
+        card_data[13],
+        card_data[14],
+        card_data[15],
+        card_data[16],
+        card_data[17],
+        card_data[18],
+        card_data[19],
+        card_data[20],
+        card_data[21] if len(card_data) > 21 else None,
+        card_data[22] if len(card_data) > 22 else None)
+
+
+@dataclass
+class Trade:
+    unique_id: int
+    user1_id: int
+    user1_cards: Set[int]
+    user1_confirmed: bool
+    user2_id: int
+    user2_cards: Set[int]
+    user2_confirmed: bool
+    version: int = 0
+    created: Optional[datetime] = None
+    updated: Optional[datetime] = None
+
+    def __hash__(self):
+        return hash((self.unique_id, self.user1_id, self.user1_confirmed,
+                     self.user2_id, self.user2_confirmed))
+
+
+def create_trade(trade_data: Tuple[int, int, List[int], int, int, List[int], int]) -> Trade:
+    return Trade(trade_data[0], trade_data[1], set(trade_data[2]), bool(trade_data[3]),
+                 trade_data[4], set(trade_data[5]), bool(trade_data[6]),
+                 trade_data[7] if len(trade_data) > 7 else 0,
+                 trade_data[8] if len(trade_data) > 8 else None,
+                 trade_data[9] if len(trade_data) > 9 else None)
+
+
+# why a Trade left the Trades table
+TRADE_COMPLETED = "completed"
+TRADE_CANCELLED = "cancelled"
+TRADE_EXPIRED = "expired"
+
+
+@dataclass
+class ArchivedTrade:
+    archive_id: int
+    trade_id: int
+    user1_id: int
+    user1_cards: Set[int]
+    user1_confirmed: bool
+    user2_id: int
+    user2_cards: Set[int]
+    user2_confirmed: bool
+    created: Optional[datetime]
+    updated: Optional[datetime]
+    archived: datetime
+    status: str
+
+
+def create_archived_trade(row: Tuple) -> ArchivedTrade:
+    return ArchivedTrade(row[0], row[1], row[2], set(row[3]), bool(row[4]), row[5], set(row[6]), bool(row[7]),
+                         row[8], row[9], row[10], row[11])
+
+
+# what an entry of the ownership ledger records
+EVENT_ACQUIRE = "acquire"
+EVENT_DROP = "drop"
+EVENT_TRADE_CREATED = "trade_created"
+EVENT_TRADE_CONFIRMED = "trade_confirmed"
+EVENT_TRADE_UNCONFIRMED = "trade_unconfirmed"
+EVENT_TRADE_EXECUTED = "trade_executed"
+
+
+@dataclass
+class OwnershipEvent:
+    seq: int
+    at: datetime
+    kind: str
+    user_id: Optional[int]
+    card_id: Optional[int]
+    trade_id: Optional[int]
+
+
+def create_ownership_event(row: Tuple[int, datetime, str, Optional[int], Optional[int], Optional[int]]) \
+        -> OwnershipEvent:
+    return OwnershipEvent(*row)
+
+
+@dataclass(frozen=True)
+class TradeCycleStep:
+    """
+    One hand-off of a multi-party trade: giver gives the Card to receiver, who wants it
+    """
+    giver_id: int
+    card_id: int
+    receiver_id: int
+
+
+@dataclass
+class User(UserMixin):
+    unique_id: int
+    name: str
+    hashed_pass: str
+    access: int
+    last_seen: datetime
+    cards: Set[int]
+    trades: Set[int]
+    version: int = 0
+    score: int = 0
+
+    def get_id(self):
+        return self.unique_id
+
+    def __hash__(self):
+        return hash((self.unique_id, self.name, self.hashed_pass, self.access, self.last_seen))
+
+
+@dataclass(frozen=True)
+class League:
+    """
+    A group of Users playing with their own copy of the Cards, kept in a database file of its own
+    """
+    id: int
+    name: str
+    db_filename: str
+    members: int = 0
+
+
+@dataclass
+class CardSummary:
+    """
+    What the dashboard shows of a Card the User holds
+    """
+    id: int
+    name: str
+    pos: str
+    team: str
+    image: str
+    shooting_pct: float
+    ppointspg: float
+    reboundspg: float
+    assistspg: float
+
+
+# the Card columns a CardSummary is made of, in order
+CARD_SUMMARY_COLUMNS = ("id", "name", "pos", "team", "image", "shooting_pct", "ppointspg", "reboundspg", "assistspg")
+
+
+@dataclass
+class TradeSummary:
+    """
+    What the dashboard shows of an open Trade, seen from one of its Users
+    """
+    unique_id: int
+    other_user_id: int
+    other_user_name: str
+    own_cards: List[int]
+    other_cards: List[int]
+    own_confirmed: bool
+    other_confirmed: bool
+
+
+@dataclass
+class Dashboard:
+    """
+    The summary of a User's Cards and open Trades, kept up to date by every write that changes them
+    """
+    user_id: int
+    cards: List[CardSummary]
+    trades: List[TradeSummary]
+
+
+def create_dashboard(user_id: int, card_rows: List[List], trade_rows: List[List]) -> Dashboard:
+    return Dashboard(user_id, [CardSummary(*row) for row in card_rows],
+                     [TradeSummary(row[0], row[1], row[2], row[3], row[4], bool(row[5]), bool(row[6]))
+                      for row in trade_rows])
+
+
+def trade_summary_row(t: Trade, user_id: int, other_user_name: str) -> List:
+    """
+    :return: the row of a TradeSummary of the Trade as seen by the User, in the order create_dashboard() reads it
+    """
+    if t.user1_id == user_id:
+        return [t.unique_id, t.user2_id, other_user_name, sorted(t.user1_cards), sorted(t.user2_cards),
+                t.user1_confirmed, t.user2_confirmed]
+    return [t.unique_id, t.user1_id, other_user_name, sorted(t.user2_cards), sorted(t.user1_cards),
+            t.user2_confirmed, t.user1_confirmed]
+
+
+# what a write did to a Card, recorded in the market roll-ups. A holding of a Card starts when it is acquired from the
+# free Cards or received in a trade, and ends when it is dropped back or given away in a trade.
+MARKET_OFFERED = "offered"
+MARKET_TRADED = "traded"
+MARKET_ACQUIRED = "acquired"
+MARKET_DROPPED = "dropped"
+MARKET_GIVEN = "given"
+MARKET_RECEIVED = "received"
+# the counters kept per Card in the market roll-ups, in column order, holds counts the holdings that ended
+MARKET_STATS = (MARKET_OFFERED, MARKET_TRADED, MARKET_ACQUIRED, MARKET_DROPPED, "holds", "held_seconds")
+
+
+@dataclass
+class CardActivity:
+    """
+    The market counters of a Card, over all time or over the buckets of a roll-up period
+    """
+    card_id: int
+    name: str
+    offered: int = 0
+    traded: int = 0
+    acquired: int = 0
+    dropped: int = 0
+    holds: int = 0
+    held_seconds: float = 0.0
+    # when the current holding started, None if the Card is free or its holding started before the roll-ups
+    held_since: Optional[datetime] = None
+
+    @property
+    def average_hold(self) -> Optional[float]:
+        """
+        :return: the average length of the holdings of the Card that ended, in seconds, None if none has
+        """
+        return self.held_seconds / self.holds if self.holds else None
+
+
+@dataclass
+class MarketBucket:
+    """
+    The market counters of all Cards in one hour or day
+    """
+    start: datetime
+    offered: int = 0
+    traded: int = 0
+    acquired: int = 0
+    dropped: int = 0
+    holds: int = 0
+    held_seconds: float = 0.0
+
+
+def create_user(user_data: Tuple[int, str, str, int, datetime, List[int], List[int]]) -> User:
+    return User(user_data[0], user_data[1], user_data[2], user_data[3],
+                user_data[4], set(user_data[5]), set(user_data[6]),
+                user_data[7] if len(user_data) > 7 else 0,
+                user_data[8] if len(user_data) > 8 else 0)
+
+
+def copy_user(u: User) -> User:
+    return replace(u, cards=set(u.cards), trades=set(u.trades))
+
+
+def copy_trade(t: Trade) -> Trade:
+    return replace(t, user1_cards=set(t.user1_cards), user2_cards=set(t.user2_cards))
+
+
+class QueryEngineError(Exception):
+    """
+    Base class for exceptions raised by the QueryEngine and its storage backends
+    """
+    pass
+
+
+class NoOutputError(QueryEngineError):
+    """
+    This error is raised when a query returns zero rows
+    """
+
+    def __init__(self, query: str, message: str = "No output for query"):
+        self.query = query
+        self.message = message
+        super().__init__(self.message)
+
+    def __str__(self):
+        return f"{self.query} -> {self.message}"
+
+
+class ConflictError(QueryEngineError):
+    """
+    This error is raised when a compare-and-set update finds that a row changed after it was read
+    """
+
+    def __init__(self, table: str, row_id: int, message: str = "Row changed since it was read"):
+        self.table = table
+        self.row_id = row_id
+        self.message = message
+        super().__init__(self.message)
+
+    def __str__(self):
+        return f"{self.table}[{self.row_id}] -> {self.message}"
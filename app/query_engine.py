@@ -1,25 +1,40 @@
-import csv
-import json
 import os
 import sqlite3
-from dataclasses import dataclass
+import threading
 from datetime import datetime
-from typing import Tuple, List, Set
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple, Union
 
-from flask_login import UserMixin
-
-from app import login, db_filename, schema_filename, basedir
+from app import db_filename, schema_filename, basedir, image_dir
 from app.login_helper import hash_pw
+from app.models import Card, Trade, User, ArchivedTrade, TradeCycleStep, QueryEngineError, NoOutputError, ConflictError, \
+    Dashboard, TRADE_COMPLETED, TRADE_CANCELLED, TRADE_EXPIRED, EVENT_ACQUIRE, EVENT_DROP, EVENT_TRADE_CREATED, \
+    EVENT_TRADE_CONFIRMED, EVENT_TRADE_UNCONFIRMED, EVENT_TRADE_EXECUTED, CardActivity, MarketBucket, MARKET_STATS, \
+    MARKET_OFFERED, MARKET_TRADED, MARKET_ACQUIRED, MARKET_DROPPED, MARKET_GIVEN, MARKET_RECEIVED
+from app.change_feed import ChangeFeed, Change, CHANGE_LOG_SIZE, CHANGE_USER, CHANGE_SCORES, CHANGE_NEW_USER
+from app.events import EventHub
+from app.ledger import SNAPSHOT_INTERVAL, replay
+from app.market import MARKET_PERIODS
+from app.leaderboard import Leaderboard, LeaderboardState
+from app.scoring import ScoringFormula
+from app.search import SearchCache, SEARCH_LIMIT
+from app.storage import StorageBackend, StorageTransaction, SQLiteBackend
+from app.user_cache import UserCache
 
 MAX_CARDS = 5
-
-
-def json_list_adapter(l: List) -> bytes:
-    return json.dumps(l).encode("utf-8")
-
-
-def json_list_converter(data: bytes) -> List[int]:
-    return json.loads(data.decode("utf-8"))
+# how many times an optimistic write is attempted before giving up with a ConflictError
+MAX_RETRIES = 5
+# how many stale Trades are expired per write transaction
+EXPIRE_BATCH = 100
+# the most Users a multi-party trade can go around
+MAX_CYCLE_LENGTH = 4
+# how many rows each read of a streamed listing fetches
+STREAM_PAGE = 500
+# how many exported Users and Trades are restored per write transaction
+RESTORE_BATCH = 1000
+# how many Cards a market listing returns by default
+MARKET_LIMIT = 20
+
+cards_filename = os.path.join(basedir, "NBAdata.csv")
 
 
 def get_date():
@@ -28,124 +43,6 @@ def get_date():
     return d.strftime("%Y-%m-%d %H:%M:%S")
 
 
-@dataclass
-class Card:
-    id: int
-    owned: bool
-    name: str
-    team: str
-    pos: str
-    age: int
-    gp: int
-    mpg: int
-    fta: int
-    ft_pct: int
-    two_pa: int
-    two_p_pct: int
-    three_pa: int
-    three_p_pct: int
-    shooting_pct: int
-    ppointspg: int
-    reboundspg: int
-    assistspg: int
-    stealspg: int
-    blockspg: int
-    image: str
-
-    def __hash__(self):
-        return hash((self.id,
-                     self.owned,
-                     self.name,
-                     self.team,
-                     self.pos,
-                     self.age,
-                     self.gp,
-                     self.mpg,
-                     self.fta,
-                     self.ft_pct,
-                     self.two_pa,
-                     self.two_p_pct,
-                     self.three_pa,
-                     self.three_p_pct,
-                     self.shooting_pct,
-                     self.ppointspg,
-                     self.reboundspg,
-                     self.assistspg,
-                     self.stealspg,
-                     self.blockspg,
-                     self.image))
-
-
-def create_card(
-        card_data: Tuple[
-            int, int, str, str, str, int, int, int, int, int, int,
-            int, int, int, int, int, int, int, int, int, str]) -> Card:
-    return Card(
-        card_data[0],
-        bool(card_data[1]),
-        card_data[2],
-        card_data[3],
-        card_data[4],
-        card_data[5],
-        card_data[6],
-        card_data[7],
-        card_data[8],
-        card_data[9],
-        card_data[10],
-        card_data[11],
-        card_data[12],
-        card_data[13],
-        card_data[14],
-        card_data[15],
-        card_data[16],
-        card_data[17],
-        card_data[18],
-        card_data[19],
-        card_data[20])
-
-
-@dataclass
-class Trade:
-    unique_id: int
-    user1_id: int
-    user1_cards: Set[int]
-    user1_confirmed: bool
-    user2_id: int
-    user2_cards: Set[int]
-    user2_confirmed: bool
-
-    def __hash__(self):
-        return hash((self.unique_id, self.user1_id, self.user1_confirmed,
-                     self.user2_id, self.user2_confirmed))
-
-
-def create_trade(trade_data: Tuple[int, int, List[int], int, int, List[int], int]) -> Trade:
-    return Trade(trade_data[0], trade_data[1], set(trade_data[2]), bool(trade_data[3]),
-                 trade_data[4], set(trade_data[5]), bool(trade_data[6]))
-
-
-@dataclass
-class User(UserMixin):
-    unique_id: int
-    name: str
-    hashed_pass: str
-    access: int
-    last_seen: datetime
-    cards: Set[int]
-    trades: Set[int]
-
-    def get_id(self):
-        return self.unique_id
-
-    def __hash__(self):
-        return hash((self.unique_id, self.name, self.hashed_pass, self.access, self.last_seen))
-
-
-def create_user(user_data: Tuple[int, str, str, int, datetime, List[int], List[int]]) -> User:
-    return User(user_data[0], user_data[1], user_data[2], user_data[3],
-                user_data[4], set(user_data[5]), set(user_data[6]))
-
-
 def check_user_has_cards(user_cards: Set[int], cards: Set[int]):
     for card in cards:
         if card not in user_cards:
@@ -154,182 +51,364 @@ def check_user_has_cards(user_cards: Set[int], cards: Set[int]):
     return True
 
 
-@login.user_loader
-def load_user(unique_id) -> User:
-    return QueryEngine.get_user_from_id(unique_id)
-
-
-class QueryEngineError(Exception):
-    """
-    Base class for exceptions in this module
-    """
-    pass
-
-
-class NoOutputError(QueryEngineError):
-    """
-    This error is raised when a query returns zero rows
-    """
-
-    def __init__(self, query: str, message: str = "No output for query"):
-        self.query = query
-        self.message = message
-        super().__init__(self.message)
-
-    def __str__(self):
-        return f"{self.query} -> {self.message}"
-
-
 def check_trade_is_confirmed(t: Trade):
     return t.user1_confirmed and t.user2_confirmed
 
 
 class QueryEngine:
     """
-    QueryEngine organizes the functions used to interface with the database
+    QueryEngine organizes the functions used to interface with the database. It holds the rules of the game and
+    keeps its data in the StorageBackend it is bound to.
     """
-    initialized: bool = False
 
-    @staticmethod
-    def initialize_database():
+    def __init__(self, backend: StorageBackend, test_data: bool = True, scoring: Optional[ScoringFormula] = None):
+        """
+        :param backend: where the data is kept
+        :param test_data: whether to load the example users and trades when the backend starts out empty
+        :param scoring: how Cards are scored, the default ScoringFormula if None
+        """
+        self.backend = backend
+        self.test_data = test_data
+        self.initialized: bool = False
+        self.initialize_lock = threading.Lock()
+        self.conflicts: int = 0
+        self.user_cache = UserCache()
+        self.scoring = scoring if scoring is not None else ScoringFormula()
+        self.leaderboard = Leaderboard()
+        self.search_cache = SearchCache()
+        self.events = EventHub()
+        self.change_feed = ChangeFeed()
+
+    def initialize_database(self):
         """
         Private method to initialize the database
         """
-        db_exists = os.path.exists(db_filename)
-        if not db_exists:
-            load_database()
-        sqlite3.register_adapter(list, json_list_adapter)
-        sqlite3.register_converter("json", json_list_converter)
-        QueryEngine.initialized = True
+        with self.initialize_lock:
+            if self.initialized:
+                return
+            created = self.backend.initialize()
+            if self.backend.shared:
+                with self.backend.read() as tx:
+                    self.change_feed.start(tx.last_change_seq())
+            self.initialized = True
+            self.__sync_card_points()
 
-        if not db_exists:
-            QueryEngine.load_test_data()
+        if created and self.test_data:
+            self.load_test_data()
 
-    @staticmethod
-    def load_test_data() -> None:
+    def load_test_data(self) -> None:
         """
         load test data
         """
         date = datetime.utcnow()
         hashed_pw = hash_pw('test1234')
-        QueryEngine.add_user("chuck", hashed_pw, 3, date)
-        user_id = QueryEngine.get_user_from_username("chuck").unique_id
+        self.add_user("chuck", hashed_pw, 3, date)
+        user_id = self.get_user_from_username("chuck").unique_id
         for card_id in [1, 2, 3]:
-            QueryEngine.add_card_to_user(user_id, card_id)
+            self.add_card_to_user(user_id, card_id)
 
-        QueryEngine.add_user("nolan", hashed_pw, 3, date)
-        user_id = QueryEngine.get_user_from_username("nolan").unique_id
+        self.add_user("nolan", hashed_pw, 3, date)
+        user_id = self.get_user_from_username("nolan").unique_id
         for card_id in [4, 5, 6]:
-            QueryEngine.add_card_to_user(user_id, card_id)
+            self.add_card_to_user(user_id, card_id)
 
-        QueryEngine.add_user("dean", hashed_pw, 3, date)
-        user_id = QueryEngine.get_user_from_username("dean").unique_id
+        self.add_user("dean", hashed_pw, 3, date)
+        user_id = self.get_user_from_username("dean").unique_id
         for card_id in [7, 8, 9]:
-            QueryEngine.add_card_to_user(user_id, card_id)
+            self.add_card_to_user(user_id, card_id)
 
-        QueryEngine.add_user("george", hashed_pw, 3, date)
-        user_id = QueryEngine.get_user_from_username("george").unique_id
+        self.add_user("george", hashed_pw, 3, date)
+        user_id = self.get_user_from_username("george").unique_id
         for card_id in [10, 11, 12]:
-            QueryEngine.add_card_to_user(user_id, card_id)
-
-        QueryEngine.create_trade(1, [2], 2, [4])
-        QueryEngine.create_trade(3, [7, 8], 4, [10])
+            self.add_card_to_user(user_id, card_id)
+
+        self.create_trade(1, [2], 2, [4])
+        self.create_trade(3, [7, 8], 4, [10])
+
+    def set_scoring(self, scoring: ScoringFormula) -> None:
+        """
+        Score Cards with a different formula from now on. Every Card and every User's team score is recomputed.
+        """
+        self.scoring = scoring
+        self.__sync_card_points()
+
+    def __sync_card_points(self) -> None:
+        """
+        private function to store the points of every Card whose stored points do not match the scoring formula, and
+        then recompute every User's team score from scratch
+        """
+        with self.__read() as tx:
+            cards = tx.all_cards()
+        points = {card.id: self.scoring.card_points(card) for card in cards}
+        if all(card.points == points[card.id] for card in cards):
+            return
+
+        def command(tx: StorageTransaction):
+            tx.set_card_points(points)
+            tx.rescore_users()
+        self.__write(command)
+        self.leaderboard.reset()
+
+    def __read(self):
+        """
+        private function to return a read-only transaction, used as a context manager
+        """
+        if not self.initialized:
+            self.initialize_database()
+        return self.backend.read()
+
+    def __write(self, command: Callable[[StorageTransaction], Any]) -> Any:
+        """
+        private function to run a mutating command atomically in the backend. A command that grows the ownership ledger
+        SNAPSHOT_INTERVAL events past its latest snapshot also takes a new snapshot, and the Dashboards of the Users
+        whose Cards or Trades it changed and the market roll-ups of the Cards it moved are refreshed in the same
+        transaction. Team score changes are applied to the leaderboard on the writer, and undone by reloading it if the
+        write fails to commit. Once it has committed, the cached snapshots of the Users it touched are invalidated and
+        its trade events are published. In a shared store the write also logs what it made stale for the caches of the
+        other processes.
+
+        :param command: a function that takes the write transaction
+        :return: the result of the command once it has been committed
+        """
+        if not self.initialized:
+            self.initialize_database()
+        touched_users: Set[int] = set()
+        notifications: List[Tuple[Set[int], Dict[str, Any]]] = []
+        applied_scores = False
+
+        def run(tx: StorageTransaction) -> Any:
+            nonlocal applied_scores
+            result = command(tx)
+            if tx.last_event_seq is not None and tx.last_event_seq - tx.latest_snapshot_seq() >= SNAPSHOT_INTERVAL:
+                tx.snapshot_ownership(tx.last_event_seq)
+            if tx.market_moves:
+                tx.record_market(tx.market_moves, datetime.utcnow())
+            if tx.touched_users or tx.stale_dashboards:
+                tx.refresh_dashboards(tx.touched_users | tx.stale_dashboards)
+            if tx.score_changes:
+                applied_scores = self.leaderboard.apply(tx.score_changes)
+            touched_users.update(tx.touched_users)
+            notifications.extend(tx.notifications)
+            if self.backend.shared:
+                changes: List[Change] = [(CHANGE_USER, user_id) for user_id in tx.touched_users]
+                if tx.score_changes:
+                    changes.append((CHANGE_SCORES, None))
+                if any(old is None or new is None for _, old, new in tx.score_changes):
+                    changes.append((CHANGE_NEW_USER, None))
+                if changes:
+                    tx.log_changes(self.change_feed.origin, changes, CHANGE_LOG_SIZE)
+            return result
+
+        try:
+            result = self.backend.write(run)
+        except Exception:
+            if applied_scores:
+                self.leaderboard.reset()
+            raise
+        finally:
+            self.user_cache.invalidate(touched_users)
+        for user_ids, event in notifications:
+            self.events.publish(user_ids, event)
+        return result
 
     @staticmethod
-    def __get_connection() -> sqlite3.Connection:
+    def __notify(tx: StorageTransaction, kind: str, user_id: Optional[int], t: Trade) -> None:
         """
-        private function to return a sqlite3 connection
-        :return: a sqlite3 connection object
+        private function to publish a trade event to both Users of the Trade once the transaction has committed
+
+        :param kind: what happened, one of the EVENT_TRADE_ kinds or trade_ followed by the archive status
+        :param user_id: the id of the User who caused it, None if it was not caused by either User
         """
-        if not QueryEngine.initialized:
-            QueryEngine.initialize_database()
-        return sqlite3.connect(db_filename, detect_types=sqlite3.PARSE_DECLTYPES)
+        tx.notifications.append(({t.user1_id, t.user2_id}, {
+            "type": kind, "trade_id": t.unique_id, "user_id": user_id,
+            "user1_id": t.user1_id, "user2_id": t.user2_id}))
 
-    @staticmethod
-    def update_user_last_seen(u: User):
+    def __sync_caches(self) -> None:
         """
-        update the values of last seen
-        :param u: the user to update in the db
+        private function to apply what other processes sharing the store have changed to the caches, at most every
+        CHANGE_POLL_INTERVAL. Called before answering from a cache.
         """
-        query = "update Users set last_seen = ? where id = ?"
-        data = u.last_seen, u.unique_id
-
-        with QueryEngine.__get_connection() as conn:
-            try:
-                conn.execute(query, data)
-            except sqlite3.IntegrityError:
-                conn.rollback()
-            else:
-                conn.commit()
+        if not self.initialized:
+            self.initialize_database()
+        if self.backend.shared:
+            self.change_feed.poll(self.backend, self.__apply_changes)
 
-    @staticmethod
-    def get_all_users() -> Set[User]:
+    def __apply_changes(self, changes: Optional[List[Change]]) -> None:
         """
-        get a set of all the users
-        :return: a set of all the users
+        private function to drop what the changes of another process made stale, or every cache if changes is None
         """
-        query = "select * from Users"
+        if changes is None:
+            self.user_cache.clear()
+            self.leaderboard.reset()
+            self.search_cache.clear("users")
+            return
+        self.user_cache.invalidate({row_id for kind, row_id in changes if kind == CHANGE_USER})
+        kinds = {kind for kind, _ in changes}
+        if CHANGE_SCORES in kinds:
+            self.leaderboard.reset()
+        if CHANGE_NEW_USER in kinds:
+            self.search_cache.clear("users")
 
-        with QueryEngine.__get_connection() as conn:
-            output = conn.execute(query).fetchall()
+    def __optimistic(self, attempt: Callable[[], Any]) -> Any:
+        """
+        private function to run an optimistic write. The attempt reads what it needs without holding the write lock
+        and then submits compare-and-set updates, which raise ConflictError if a row changed in between. The attempt
+        is retried from the start at most MAX_RETRIES times.
 
-        if output is None:
-            raise NoOutputError(query, "No output for `get_all_users()`")
+        :raise ConflictError: if every attempt conflicted
+        """
+        for _ in range(MAX_RETRIES - 1):
+            try:
+                return attempt()
+            except ConflictError:
+                self.conflicts += 1
+        return attempt()
 
-        users: List[User] = []
-        for row in output:
-            users.append(create_user(row))
+    def update_user_last_seen(self, u: User):
+        """
+        update the values of last seen
+        :param u: the user to update in the db
+        """
+        user_id, last_seen = u.unique_id, u.last_seen
+        self.__write(lambda tx: tx.set_last_seen(user_id, last_seen))
+        self.user_cache.touch(user_id, last_seen)
 
-        return set(users)
+    def get_all_users(self) -> Set[User]:
+        """
+        get a set of all the users
+        :return: a set of all the users
+        """
+        with self.__read() as tx:
+            return set(tx.all_users())
 
-    @staticmethod
-    def get_all_card_ids() -> Set[int]:
+    def get_all_card_ids(self) -> Set[int]:
         """
         Get the ids of all the cards that exist in the database
 
         :return: A set of card ids as integers
+        """
+        with self.__read() as tx:
+            return {card.id for card in tx.all_cards()}
 
-        :raise NoOutputError: if the query returns zero rows
+    def get_all_cards(self) -> Set[Card]:
         """
-        query = "select id from Cards"
+        Get all the cards that exist in the database
 
-        with QueryEngine.__get_connection() as conn:
-            output = conn.execute(query).fetchall()
+        :return: A set of Cards
+        """
+        with self.__read() as tx:
+            return set(tx.all_cards())
 
-        if output is None:
-            raise NoOutputError(query, "No output for `get_all_card_ids()`")
+    def get_card_names(self, card_ids: Iterable[int]) -> Dict[int, str]:
+        """
+        Get the names of some Cards, without reading the rest of the catalog
 
-        card_ids: List[int] = []
-        for row in output:
-            card_ids.append(row[0])
+        :return: the names as {card_id: name}, ids of no Card are left out
+        """
+        with self.__read() as tx:
+            return tx.card_names({int(card_id) for card_id in card_ids})
 
-        return set(card_ids)
+    def get_user_names(self, user_ids: Iterable[int]) -> Dict[int, str]:
+        """
+        Get the names of some Users, without reading every User
 
-    @staticmethod
-    def get_all_cards() -> Set[Card]:
+        :return: the names as {user_id: name}, ids of Users that no longer exist are left out
         """
-        Get all the cards that exist in the database
+        with self.__read() as tx:
+            return tx.user_names({int(user_id) for user_id in user_ids})
 
-        :return: A set of Cards
+    def iter_cards(self) -> Iterator[Card]:
+        """
+        Iterate over every Card by id, reading STREAM_PAGE Cards at a time so no read is held open between pages
+        """
+        after_id = 0
+        while True:
+            with self.__read() as tx:
+                cards = tx.cards_after(after_id, STREAM_PAGE)
+            yield from cards
+            if len(cards) < STREAM_PAGE:
+                return
+            after_id = cards[-1].id
 
-        :raise NoOutputError: if the query returns zero rows
+    def iter_users(self) -> Iterator[User]:
         """
-        query = "select * from Cards"
+        Iterate over every User by id, reading STREAM_PAGE Users at a time so no read is held open between pages
+        """
+        after_id = 0
+        while True:
+            with self.__read() as tx:
+                users = tx.users_after(after_id, STREAM_PAGE)
+            yield from users
+            if len(users) < STREAM_PAGE:
+                return
+            after_id = users[-1].unique_id
 
-        with QueryEngine.__get_connection() as conn:
-            output = conn.execute(query).fetchall()
+    def export_state(self) -> Iterator[Union[User, Trade]]:
+        """
+        Iterate over every User, with the Cards it holds, and then every Trade, all as of the moment the iteration
+        started. Writes go on meanwhile, except with a MemoryBackend whose snapshot holds its lock until the end.
+        """
+        if not self.initialized:
+            self.initialize_database()
+        with self.backend.snapshot() as tx:
+            after_id = 0
+            while True:
+                users = tx.users_after(after_id, STREAM_PAGE)
+                yield from users
+                if len(users) < STREAM_PAGE:
+                    break
+                after_id = users[-1].unique_id
+            after_id = 0
+            while True:
+                trades = tx.trades_after(after_id, STREAM_PAGE)
+                yield from trades
+                if len(trades) < STREAM_PAGE:
+                    break
+                after_id = trades[-1].unique_id
 
-        if output is None:
-            raise NoOutputError(query, "No output for `get_all_cards()`")
+    def restore_state(self, items: Iterable[Union[User, Trade]]) -> Tuple[int, int]:
+        """
+        Load what export_state produced into this store, RESTORE_BATCH Users and Trades per write. Team scores are
+        recomputed at the end and the ownership ledger starts over from a snapshot of the restored owners.
 
-        cards: List[Card] = []
-        for row in output:
-            cards.append(create_card(row))
+        :return: how many Users and how many Trades were restored
+        :raise QueryEngineError: if the store has Users already
+        """
+        with self.__read() as tx:
+            if tx.users_after(0, 1):
+                raise QueryEngineError("Only an empty store can be restored into")
 
-        return set(cards)
+        counts = [0, 0]
 
-    @staticmethod
-    def get_card_from_id(card_id: int) -> Card:
+        def restore(batch: List[Union[User, Trade]]):
+            def command(tx: StorageTransaction):
+                for item in batch:
+                    if isinstance(item, User):
+                        tx.restore_user(item)
+                    else:
+                        tx.restore_trade(item)
+            self.__write(command)
+            counts[0] += sum(isinstance(item, User) for item in batch)
+            counts[1] += sum(not isinstance(item, User) for item in batch)
+
+        batch: List[Union[User, Trade]] = []
+        for item in items:
+            batch.append(item)
+            if len(batch) >= RESTORE_BATCH:
+                restore(batch)
+                batch = []
+        restore(batch)
+
+        def finish(tx: StorageTransaction):
+            tx.rescore_users()
+            tx.snapshot_ownership(tx.event_seq_at(datetime.utcnow()))
+        self.__write(finish)
+        self.leaderboard.reset()
+        self.user_cache.clear()
+        self.search_cache.clear("users")
+        return counts[0], counts[1]
+
+    def get_card_from_id(self, card_id: int) -> Card:
         """
         Get the Card with the given card_id
 
@@ -338,17 +417,10 @@ class QueryEngine:
 
         :raise NoOutputError: if a Card with the given card_id cannot be found
         """
-        query = "select * from Cards where id = ?"
-
-        with QueryEngine.__get_connection() as conn:
-            output = conn.execute(query, (card_id,)).fetchone()
+        with self.__read() as tx:
+            return tx.get_card(card_id)
 
-        if output is None:
-            raise NoOutputError(query, f"No Card with id: {card_id}")
-        return create_card(output)
-
-    @staticmethod
-    def get_card_from_name(card_name: str) -> Card:
+    def get_card_from_name(self, card_name: str) -> Card:
         """
         Get the Card with the given card_name
 
@@ -357,17 +429,10 @@ class QueryEngine:
 
         :raise NoOutputError: if a Card with the given card_name cannot be found
         """
-        query = "select * from Cards where name = ?"
+        with self.__read() as tx:
+            return tx.get_card_by_name(card_name)
 
-        with QueryEngine.__get_connection() as conn:
-            output = conn.execute(query, (card_name,)).fetchone()
-
-        if output is None:
-            raise NoOutputError(query, f"No Card with name: {card_name}")
-        return create_card(output)
-
-    @staticmethod
-    def get_trade_from_id(trade_id: int) -> Trade:
+    def get_trade_from_id(self, trade_id: int) -> Trade:
         """
         Get the Trade with the given trade_id
 
@@ -376,16 +441,11 @@ class QueryEngine:
 
         :raise NoOutputError: if a Trade with the given trade_id cannot be found
         """
-        query = "select * from Trades where id = ?"
+        with self.__read() as tx:
+            return tx.get_trade(trade_id)
 
-        with QueryEngine.__get_connection() as conn:
-            output = conn.execute(query, str(trade_id)).fetchone()
-        if output is None:
-            raise NoOutputError(query, f"No Trade with id: {trade_id}")
-        return create_trade(output)
-
-    @staticmethod
     def get_trade_from_values(
+            self,
             user1_id: int,
             user1_cards: List[int],
             user2_id: int,
@@ -401,21 +461,18 @@ class QueryEngine:
 
         :raise NoOutputError: if no trade exists with the given values
         """
-        query = "select * from Trades where user1_id = ? and user1_cards = ? and user2_id = ? and user2_cards = ?"
+        with self.__read() as tx:
+            t = tx.find_trade(user1_id, user1_cards, user2_id, user2_cards)
 
-        with QueryEngine.__get_connection() as conn:
-            output = conn.execute(query, (user1_id, user1_cards, user2_id, user2_cards)).fetchone()
+        if t is None:
+            raise NoOutputError("find_trade", f"No Trade with values "
+                                              f"user1_id: {user1_id}, "
+                                              f"user1_cards: {user1_cards}, "
+                                              f"user2_id: {user2_id}, "
+                                              f"user2_cards: {user2_cards}")
+        return t
 
-        if output is None:
-            raise NoOutputError(query, f"No Trade with values "
-                                       f"user1_id: {user1_id}, "
-                                       f"user1_cards: {user1_cards}, "
-                                       f"user2_id: {user2_id}, "
-                                       f"user2_cards: {user2_cards}")
-        return create_trade(output)
-
-    @staticmethod
-    def get_user_from_id(user_id: int) -> User:
+    def get_user_from_id(self, user_id: int) -> User:
         """
         Get the User with the given user_id
 
@@ -424,31 +481,29 @@ class QueryEngine:
 
         :raise NoOutputError: if no User exists with the given user_id
         """
-        query = "select * from Users where id = ?"
+        with self.__read() as tx:
+            return tx.get_user(user_id)
 
-        with QueryEngine.__get_connection() as conn:
-            output = conn.execute(query, (user_id,)).fetchone()
+    def get_session_user(self, user_id: int) -> User:
+        """
+        Get the User with the given user_id through the user cache. Used to load the logged in User on every request,
+        writes made by this process are seen immediately and writes made by other processes within
+        CHANGE_POLL_INTERVAL.
 
-        if output is None:
-            raise NoOutputError(query, f"No User with id: {user_id}")
-        return create_user(output)
+        :raise NoOutputError: if no User exists with the given user_id
+        """
+        self.__sync_caches()
+        return self.user_cache.get(int(user_id), self.get_user_from_id)
 
-    @staticmethod
-    def get_available_cards() -> Set[Card]:
+    def get_available_cards(self) -> Set[Card]:
         """
         Get the currently available cards that are not owned by other users
         :return: a set of the currently available Cards
         """
-        cards = QueryEngine.get_all_cards()
-        available_cards = []
-        for card in cards:
-            if not card.owned:
-                available_cards.append(card)
-
-        return set(available_cards)
+        with self.__read() as tx:
+            return set(tx.available_cards())
 
-    @staticmethod
-    def get_user_from_username(username: str) -> User:
+    def get_user_from_username(self, username: str) -> User:
         """
         Get the User with the given username
 
@@ -457,82 +512,86 @@ class QueryEngine:
 
         :raise NoOutputError: if no User exists with the given username
         """
-        query = "select * from Users where name = ?"
+        with self.__read() as tx:
+            return tx.get_user_by_name(username)
 
-        with QueryEngine.__get_connection() as conn:
-            output = conn.execute(query, (username,)).fetchone()
+    def get_login_user(self, user_id: int, username: str) -> User:
+        """
+        Get the User logging in through the user cache, with one read by the name index when it is not cached. The
+        User is then cached for the requests of its session, which load it with get_session_user.
 
-        if output is None:
-            raise NoOutputError(query, f"No User with username: {username}")
-        return create_user(output)
+        :param user_id: the id the league directory has for the username
+        :param username: the name of the User
+        :return: the User, whose hashed password the caller checks
+        :raise NoOutputError: if no User exists with the given username and user_id
+        """
+        def load(_: int) -> User:
+            with self.__read() as tx:
+                u = tx.get_user_by_name(username)
+            if u.unique_id != user_id:
+                raise NoOutputError(f"Users[name={username}]", f"No User with username {username} and id {user_id}")
+            return u
 
-    @staticmethod
-    def get_user_cards(user_id: int) -> Set[Card]:
+        self.__sync_caches()
+        return self.user_cache.get(int(user_id), load)
+
+    def get_user_cards(self, user_id: int) -> Set[Card]:
         """
         Get the Cards of the User with the given user_id
 
         :param user_id: the id of the User whose Cards will be returned
         :return: a set of the Cards that the User has
         """
-        u: User = QueryEngine.get_user_from_id(user_id)
-        user_cards: List[Card] = []
-        for card_id in u.cards:
-            user_cards.append(QueryEngine.get_card_from_id(card_id))
+        with self.__read() as tx:
+            u: User = tx.get_user(user_id)
+            return {tx.get_card(card_id) for card_id in u.cards}
 
-        return set(user_cards)
+    def get_dashboard(self, user_id: int) -> Dashboard:
+        """
+        Get the summary of the Cards and open Trades of the User with the given user_id, with one read
 
-    @staticmethod
-    def get_user_trades(user_id: int) -> Set[Trade]:
+        :raise NoOutputError: if no User exists with the given user_id
+        """
+        with self.__read() as tx:
+            return tx.dashboard(user_id)
+
+    def get_user_trades(self, user_id: int) -> Set[Trade]:
         """
         Get the Trades of the User with the given user_id
 
         :param user_id: the id of the User whose Trades will be returned
         :return: a set of the Trades that the User has
         """
-        u: User = QueryEngine.get_user_from_id(user_id)
-        user_trades: List[Trade] = []
-        for trade_id in u.trades:
-            user_trades.append(QueryEngine.get_trade_from_id(trade_id))
-
-        return set(user_trades)
+        with self.__read() as tx:
+            u: User = tx.get_user(user_id)
+            return {tx.get_trade(trade_id) for trade_id in u.trades}
 
-    @staticmethod
-    def set_card_owned(card_id: int):
+    def set_card_owned(self, card_id: int):
         """
         set the owned field of a Card to true
 
         :param card_id: the id of the Card that is now owned
         """
-        query = "update Cards set owned = ? where id = ?"
-        data = 1, card_id
-        with QueryEngine.__get_connection() as conn:
-            try:
-                conn.execute(query, data)
-            except sqlite3.IntegrityError:
-                conn.rollback()
-            else:
-                conn.commit()
+        self.__write(lambda tx: tx.set_card_owned(card_id, True))
 
-    @staticmethod
-    def set_card_not_owned(card_id: int):
+    def set_card_not_owned(self, card_id: int):
         """
         set the owned field of a Card to false
 
         :param card_id: the id of the Card that is now available
         """
-        query = "update Cards set owned = ? where id = ?"
-        data = 0, card_id
-
-        with QueryEngine.__get_connection() as conn:
-            try:
-                conn.execute(query, data)
-            except sqlite3.IntegrityError:
-                conn.rollback()
-            else:
-                conn.commit()
+        self.__write(lambda tx: QueryEngine.__set_card_not_owned(tx, card_id))
 
     @staticmethod
-    def add_user(username: str, hashed_pass: str, access: int, last_seen: datetime) -> None:
+    def __set_card_not_owned(tx: StorageTransaction, card_id: int):
+        owner = tx.get_card(card_id).owner
+        tx.set_card_owned(card_id, False)
+        if owner is not None:
+            tx.append_event(EVENT_DROP, owner, int(card_id))
+            tx.market_moves.append((int(card_id), MARKET_DROPPED))
+
+    def add_user(self, username: str, hashed_pass: str, access: int, last_seen: datetime,
+                 unique_id: Optional[int] = None) -> None:
         """
         Add a new User to the database with the given info
 
@@ -540,83 +599,58 @@ class QueryEngine:
         :param hashed_pass: the hashed password of the new User
         :param access: the access level of the new User
         :param last_seen: the str format of the date the new User was last seen
+        :param unique_id: the id of the new User, the next free id if None. Ids are handed out by the league
+            directory when Users are spread over several databases, see app/leagues.py.
+        :raise QueryEngineError: if a User with the username or id exists already
         """
-        query = "insert into Users (name, hashed_pass, access, last_seen, cards, trades) values (?, ?, ?, ?, ?, ?)"
-        data = str(username), str(hashed_pass), int(access), last_seen, list(), list()
-        with QueryEngine.__get_connection() as conn:
-            try:
-                conn.execute(query, data)
-            except sqlite3.IntegrityError:  # Database update failed, rollback changes from this transaction
-                conn.rollback()
-            else:  # Database update succeeded, commit transaction
-                conn.commit()
-
-    @staticmethod
-    def __add_trade(user1_id: int, user1_cards: List[int], user2_id: int, user2_cards: List[int]) -> None:
-        """
-        Internal method to add a new Trade without performing any checks, used by the public helper method/s
-        """
-        query = "insert into Trades (user1_id, user1_cards, user2_id, user2_cards) values (?, ?, ?, ?)"
-        data = int(user1_id), user1_cards, int(user2_id), user2_cards
+        def command(tx: StorageTransaction):
+            if unique_id is None:
+                tx.insert_user(username, hashed_pass, access, last_seen)
+            else:
+                tx.restore_user(User(unique_id, username, hashed_pass, access, last_seen, set(), set()))
 
-        with QueryEngine.__get_connection() as conn:
-            try:
-                conn.execute(query, data)
-            except sqlite3.IntegrityError:  # Database update failed, rollback changes from this transaction
-                conn.rollback()
-            else:  # Database update succeeded, commit transaction
-                conn.commit()
+        try:
+            self.__write(command)
+        except sqlite3.IntegrityError:  # the backend rolled back this command
+            raise QueryEngineError(f"A User named {username} or with id {unique_id} exists already"
+                                   if unique_id is not None else f"A User named {username} exists already")
+        self.search_cache.clear("users")
 
-    @staticmethod
-    def __check_trade_exists(
-            user1_id: int,
-            user1_cards: List[int],
-            user2_id: int,
-            user2_cards: List[int],
-            user1_confirmed: bool = False,
-            user2_confirmed: bool = False) -> bool:
+    def remove_user(self, user_id: int) -> User:
         """
-        Internal method to check if a trade with the given parameters exists
+        Remove a User from the database in one write. Its open Trades are cancelled, its Cards are dropped and its
+        wants forgotten first, its archived Trades and ledger events are kept.
 
-        :return: true if the trade exists, false if it does not
+        :return: the User as it was before it was removed
         """
-        query = "select 1 from Trades " \
-                "where " \
-                "user1_id = ? and user1_cards = ? and user1_confirmed = ? " \
-                "and user2_id = ? and user2_cards = ? and user2_confirmed = ? " \
-                "limit 1"
+        def command(tx: StorageTransaction) -> User:
+            u = tx.get_user(int(user_id))
+            for trade_id in u.trades:
+                QueryEngine.__delete_trade(tx, trade_id, TRADE_CANCELLED)
+            for card_id in u.cards:
+                QueryEngine.__remove_card_from_user(tx, tx.get_user(u.unique_id), card_id)
+            tx.delete_user(u.unique_id)
+            return u
 
-        data = user1_id, user1_cards, user1_confirmed, user2_id, user2_cards, user2_confirmed
-
-        with QueryEngine.__get_connection() as conn:
-            output = conn.execute(query, data).fetchall()
-
-            return len(output) > 0
+        removed = self.__write(command)
+        self.search_cache.clear("users")
+        return removed
 
     @staticmethod
-    def __add_trade_to_user(user_id: int, trade_id: int):
+    def __add_trade_to_user(tx: StorageTransaction, user_id: int, trade_id: int):
         """
         Internal method to add the trade_id to the trade ids of the User with the given user_id
 
         :param user_id: the id of the User
         :param trade_id: the id of the Trade
         """
-        u: User = QueryEngine.get_user_from_id(user_id)
+        u: User = tx.get_user(user_id)
         new_user_trades: List[int] = list(u.trades)
         new_user_trades.append(trade_id)
 
-        query = "update Users set trades = ? where id = ?"
-
-        with QueryEngine.__get_connection() as conn:
-            try:
-                conn.execute(query, (new_user_trades, user_id))
-            except sqlite3.IntegrityError:
-                conn.rollback()
-            else:
-                conn.commit()
+        tx.set_user_trades(u, new_user_trades)
 
-    @staticmethod
-    def check_valid_trade(user1_id: int, user1_cards: Set[int], user2_id: int, user2_cards: Set[int]) -> bool:
+    def check_valid_trade(self, user1_id: int, user1_cards: Set[int], user2_id: int, user2_cards: Set[int]) -> bool:
         """
         Check if a trade between user1 and user2 is valid with the given cards. If both users have all the cards that
         they say they do, then the trade is valid.
@@ -627,11 +661,20 @@ class QueryEngine:
         :param user2_cards: the cards being offered by user2
         :return: true if the trade is valid and false if it is not
         """
-        return check_user_has_cards(QueryEngine.get_user_from_id(user1_id).cards, user1_cards) \
-            and check_user_has_cards(QueryEngine.get_user_from_id(user2_id).cards, user2_cards)
+        with self.__read() as tx:
+            return QueryEngine.__check_valid_trade(tx, user1_id, user1_cards, user2_id, user2_cards)
 
     @staticmethod
-    def create_trade(user1_id: int, user1_cards: List[int], user2_id: int, user2_cards: List[int]):
+    def __check_valid_trade(
+            tx: StorageTransaction,
+            user1_id: int,
+            user1_cards: Set[int],
+            user2_id: int,
+            user2_cards: Set[int]) -> bool:
+        return check_user_has_cards(tx.get_user(user1_id).cards, user1_cards) \
+            and check_user_has_cards(tx.get_user(user2_id).cards, user2_cards)
+
+    def create_trade(self, user1_id: int, user1_cards: List[int], user2_id: int, user2_cards: List[int]) -> bool:
         """
         Create a new trade between two users.
 
@@ -639,177 +682,257 @@ class QueryEngine:
         :param user1_cards: the cards being offered by user1
         :param user2_id: the id of user2
         :param user2_cards: the cards being offered by user2
+        :return: true if the trade was created
         """
-        if QueryEngine.check_valid_trade(user1_id, set(user1_cards), user2_id, set(user2_cards)):
-            # if the trade does not exist already then we can create it
-            if not QueryEngine.__check_trade_exists(user1_id, user1_cards, user2_id, user2_cards):
-                # add trade to Trades table
-                QueryEngine.__add_trade(user1_id, user1_cards, user2_id, user2_cards)
+        return self.__write(
+            lambda tx: QueryEngine.__create_trade(tx, user1_id, user1_cards, user2_id, user2_cards))
 
-                # get the Trade from the database so that it now has the generated unique id
-                new_trade: Trade = QueryEngine.get_trade_from_values(user1_id, user1_cards, user2_id, user2_cards)
+    @staticmethod
+    def __create_trade(
+            tx: StorageTransaction,
+            user1_id: int,
+            user1_cards: List[int],
+            user2_id: int,
+            user2_cards: List[int]) -> bool:
+        if QueryEngine.__check_valid_trade(tx, user1_id, set(user1_cards), user2_id, set(user2_cards)):
+            # if the trade does not exist already then we can create it
+            if tx.find_trade(user1_id, user1_cards, user2_id, user2_cards, False, False) is None:
+                trade_id = tx.insert_trade(user1_id, user1_cards, user2_id, user2_cards)
+                tx.append_event(EVENT_TRADE_CREATED, user1_id, trade_id=trade_id)
+                tx.market_moves.extend((int(card_id), MARKET_OFFERED) for card_id in [*user1_cards, *user2_cards])
+                QueryEngine.__notify(tx, EVENT_TRADE_CREATED, user1_id, tx.get_trade(trade_id))
 
                 # add the Trade to both Users
-                QueryEngine.__add_trade_to_user(user1_id, new_trade.unique_id)
-                QueryEngine.__add_trade_to_user(user2_id, new_trade.unique_id)
+                QueryEngine.__add_trade_to_user(tx, user1_id, trade_id)
+                QueryEngine.__add_trade_to_user(tx, user2_id, trade_id)
                 return True
         return False
 
+    def create_trades(self, user_id: int, trades: List[Tuple[List[int], int, List[int]]]) -> List[bool]:
+        """
+        Create several Trades offered by the same User in one write
+
+        :param user_id: the id of the User offering the trades
+        :param trades: (cards offered, id of the other User, cards asked for) for each Trade
+        :return: whether each Trade was created, in order
+        """
+        return self.__write(lambda tx: [QueryEngine.__create_trade(tx, user_id, own_cards, other_user_id, other_cards)
+                                        for own_cards, other_user_id, other_cards in trades])
+
     @staticmethod
-    def __remove_trade_from_user(user_id: int, trade_id: int):
+    def __remove_trade_from_user(tx: StorageTransaction, user_id: int, trade_id: int):
         """
         Internal method to remove a trade_id from the trade ids of the User with the user_id
 
         :param user_id: the id of the User
         :param trade_id: the id of the Trade to be removed
         """
-        user_trades: List[int] = list(QueryEngine.get_user_from_id(user_id).trades)
+        u: User = tx.get_user(user_id)
+        user_trades: List[int] = list(u.trades)
         user_trades.remove(trade_id)
 
-        query = "update Users set trades = ? where id = ?"
-
-        with QueryEngine.__get_connection() as conn:
-            try:
-                conn.execute(query, (user_trades, user_id))
-            except sqlite3.IntegrityError:
-                conn.rollback()
-            else:
-                conn.commit()
+        tx.set_user_trades(u, user_trades)
 
-    @staticmethod
-    def __delete_trade(trade_id: int):
+    def delete_trade(self, trade_id: int):
         """
-        Internal method to delete a trade from the database
+        Delete a Trade from the database and remove it from both User's trade ids. The Trade is archived as cancelled.
 
         :param trade_id: the id of the Trade to be deleted
         """
-        with QueryEngine.__get_connection() as conn:
-            conn.execute("delete from Trades where id = ?", (trade_id,))
-            conn.commit()
+        self.__write(lambda tx: QueryEngine.__delete_trade(tx, trade_id, TRADE_CANCELLED))
 
     @staticmethod
-    def delete_trade(trade_id: int):
+    def __delete_trade(tx: StorageTransaction, trade_id: int, status: str):
+        t: Trade = tx.get_trade(trade_id)
+        QueryEngine.__remove_trade_from_user(tx, t.user1_id, trade_id)
+        QueryEngine.__remove_trade_from_user(tx, t.user2_id, trade_id)
+        tx.archive_trade(trade_id, status)
+        QueryEngine.__notify(tx, "trade_" + status, None, t)
+
+    def expire_trades(self, older_than: datetime, limit: int = EXPIRE_BATCH) -> int:
         """
-        Delete a Trade from the database and remove it from both User's trade ids
+        Archive at most limit open Trades that have not been updated since older_than, in one write
 
-        :param trade_id: the id of the Trade to be deleted
+        :param older_than: Trades last updated before this are expired
+        :param limit: the maximum number of Trades expired
+        :return: how many Trades were expired, less than limit once no stale Trades are left
         """
-        t: Trade = QueryEngine.get_trade_from_id(trade_id)
-        QueryEngine.__remove_trade_from_user(t.user1_id, trade_id)
-        QueryEngine.__remove_trade_from_user(t.user2_id, trade_id)
-        QueryEngine.__delete_trade(trade_id)
+        return self.__write(lambda tx: QueryEngine.__expire_trades(tx, older_than, limit))
 
     @staticmethod
-    def check_card_owned(card_id: int):
+    def __expire_trades(tx: StorageTransaction, older_than: datetime, limit: int) -> int:
+        trade_ids = tx.stale_trade_ids(older_than, limit)
+        for trade_id in trade_ids:
+            QueryEngine.__delete_trade(tx, trade_id, TRADE_EXPIRED)
+        return len(trade_ids)
+
+    def get_trade_history(self, user_id: int, before: Optional[int] = None, limit: int = 20) -> List[ArchivedTrade]:
+        """
+        Get a page of the archived Trades of a User, newest first
+
+        :param user_id: the id of the User
+        :param before: the archive_id of the last entry of the previous page, None for the first page
+        :param limit: the maximum number of entries returned
+        :return: a list of ArchivedTrade
+        """
+        with self.__read() as tx:
+            return tx.archived_trades(int(user_id), before, limit)
+
+    def check_card_owned(self, card_id: int):
         """
         check if a card is currently owned
 
         :param card_id: the id of the Card to check
         :return: true if it is owned and false if it is not owned
         """
-        c: Card = QueryEngine.get_card_from_id(card_id)
+        c: Card = self.get_card_from_id(card_id)
         return c.owned
 
-    @staticmethod
-    def unconfirm_all_trades(user_id: int):
+    def unconfirm_all_trades(self, user_id: int):
         """
         unconfirm all trades for a user
         :param user_id: the id of the user
         """
-        u = QueryEngine.get_user_from_id(user_id)
-        for trade_id in u.trades:
-            trade = QueryEngine.get_trade_from_id(trade_id)
-            QueryEngine.user_unconfirm_trade(u, trade)
+        self.__write(lambda tx: QueryEngine.__unconfirm_all_trades(tx, user_id))
 
     @staticmethod
-    def add_card_to_user(user_id: int, card_id: int) -> bool:
+    def __unconfirm_all_trades(tx: StorageTransaction, user_id: int):
+        u = tx.get_user(user_id)
+        for trade_id in u.trades:
+            trade = tx.get_trade(trade_id)
+            QueryEngine.__user_unconfirm_trade(tx, u.unique_id, trade)
+
+    def add_card_to_user(self, user_id: int, card_id: int) -> bool:
         """
-        Add the card_id to the card ids of the User with user_id
+        Add the card_id to the card ids of the User with user_id. Ownership is taken with a compare-and-set so two
+        users racing for the same Card cannot both get it.
 
         :param user_id: the id of the User who the card is being added to
         :param card_id: the id of the Card
         :return: true if succeeds false if fails
-        """
-        if not QueryEngine.check_card_owned(card_id):
-            u: User = QueryEngine.get_user_from_id(int(user_id))
-            if len(u.cards) < MAX_CARDS:
-                new_user_cards: List[int] = list(u.cards)
-                new_user_cards.append(int(card_id))
-
-                query = "update Users set cards = ? where id = ?"
 
-                with QueryEngine.__get_connection() as conn:
-                    try:
-                        conn.execute(query, (new_user_cards, user_id))
-                    except sqlite3.IntegrityError:
-                        conn.rollback()
-                    else:
-                        conn.commit()
-                        QueryEngine.set_card_owned(card_id)
-                        QueryEngine.unconfirm_all_trades(user_id)
-                        return True
-            else:
+        :raise ConflictError: if the User kept changing for MAX_RETRIES attempts
+        """
+        def attempt() -> bool:
+            if self.check_card_owned(card_id):
                 return False
+            u: User = self.get_user_from_id(int(user_id))
+            return self.__write(lambda tx: QueryEngine.__add_card_to_user(tx, u, card_id))
+
+        return self.__optimistic(attempt)
 
     @staticmethod
-    def remove_card_from_user(user_id: int, card_id: int):
+    def __add_card_to_user(tx: StorageTransaction, u: User, card_id: int, move: str = MARKET_ACQUIRED) -> bool:
+        """
+        :param move: how the User came by the Card, for the market roll-ups, MARKET_RECEIVED in a trade
+        """
+        if len(u.cards) >= MAX_CARDS:
+            return False
+        if not tx.claim_card(card_id, u.unique_id):
+            return False
+        new_user_cards: List[int] = list(u.cards)
+        new_user_cards.append(int(card_id))
+
+        tx.set_user_cards(u, new_user_cards)
+        tx.add_user_score(u.unique_id, tx.get_card(card_id).points or 0)
+        tx.append_event(EVENT_ACQUIRE, u.unique_id, int(card_id))
+        tx.market_moves.append((int(card_id), move))
+        QueryEngine.__unconfirm_all_trades(tx, u.unique_id)
+        return True
+
+    def remove_card_from_user(self, user_id: int, card_id: int):
         """
         Remove the card_id from the card ids of the User with user_id
 
         :param user_id: the id of the User who the Card is being removed from
         :param card_id: the id of the Card
+
+        :raise ConflictError: if the User kept changing for MAX_RETRIES attempts
+        """
+        def attempt():
+            u: User = self.get_user_from_id(int(user_id))
+            self.__write(lambda tx: QueryEngine.__remove_card_from_user(tx, u, card_id))
+
+        self.__optimistic(attempt)
+
+    @staticmethod
+    def __remove_card_from_user(tx: StorageTransaction, u: User, card_id: int, move: str = MARKET_DROPPED):
         """
-        user = QueryEngine.get_user_from_id(int(user_id))
-        user_cards: List[int] = list(user.cards)
+        :param move: how the Card left the User, for the market roll-ups, MARKET_GIVEN in a trade
+        """
+        user_cards: List[int] = list(u.cards)
         user_cards.remove(int(card_id))
 
-        query = "update Users set cards = ? where id = ?"
+        tx.set_user_cards(u, user_cards)
+        tx.release_card(card_id, u.unique_id)
+        tx.add_user_score(u.unique_id, -(tx.get_card(card_id).points or 0))
+        tx.append_event(EVENT_DROP, u.unique_id, int(card_id))
+        tx.market_moves.append((int(card_id), move))
+        for trade_id in u.trades:
+            trade = tx.get_trade(trade_id)
+            if int(card_id) in trade.user1_cards.union(trade.user2_cards):
+                QueryEngine.__delete_trade(tx, trade_id, TRADE_CANCELLED)
 
-        with QueryEngine.__get_connection() as conn:
-            try:
-                conn.execute(query, (user_cards, user_id))
-            except sqlite3.IntegrityError:
-                conn.rollback()
-            else:
-                conn.commit()
-                QueryEngine.set_card_not_owned(card_id)
-                for trade_id in user.trades:
-                    trade = QueryEngine.get_trade_from_id(trade_id)
-                    if int(card_id) in trade.user1_cards.union(trade.user2_cards):
-                        QueryEngine.delete_trade(trade_id)
+    def add_cards_to_user(self, user_id: int, card_ids: List[int]) -> List[bool]:
+        """
+        Add several Cards to the User in one write, each one as add_card_to_user would
 
-    @staticmethod
-    def user_unconfirm_trade(u: User, t: Trade):
+        :return: whether each Card was added, in order
+        """
+        def command(tx: StorageTransaction) -> List[bool]:
+            return [QueryEngine.__add_card_to_user(tx, tx.get_user(int(user_id)), card_id) for card_id in card_ids]
+
+        return self.__write(command)
+
+    def remove_cards_from_user(self, user_id: int, card_ids: List[int]):
+        """
+        Remove several Cards from the User in one write, either all of them or none
+
+        :raise QueryEngineError: if the User does not have one of the Cards
+        """
+        def command(tx: StorageTransaction):
+            missing = set(map(int, card_ids)) - tx.get_user(int(user_id)).cards
+            if missing or len(set(card_ids)) != len(card_ids):
+                raise QueryEngineError("User does not have the cards", user_id, sorted(missing))
+            for card_id in card_ids:
+                QueryEngine.__remove_card_from_user(tx, tx.get_user(int(user_id)), card_id)
+
+        self.__write(command)
+
+    def user_unconfirm_trade(self, u: User, t: Trade):
         """
         let the User unconfirm the trade
 
         :param u: the User who would like to unconfirm the trade
         :param t: the Trade that the User would like to unconfirm
         """
-        query: str
-        data: Tuple
-        if u.unique_id == t.user1_id:
-            t.user1_confirmed = False
-            query = "update Trades set user1_confirmed = ? where id = ?"
-            data = t.user1_confirmed, t.unique_id
-        elif u.unique_id == t.user2_id:
-            t.user2_confirmed = False
-            query = "update Trades set user2_confirmed = ? where id = ?"
-            data = t.user2_confirmed, t.unique_id
-        else:
-            raise QueryEngineError("User is not involved in trade", u, t)
+        user_id = u.unique_id  # read here, u may be a request-bound proxy
 
-        with QueryEngine.__get_connection() as conn:
-            try:
-                conn.execute(query, data)
-            except sqlite3.IntegrityError:
-                conn.rollback()
-            else:
-                conn.commit()
-                return True
+        def attempt():
+            trade: Trade = self.get_trade_from_id(t.unique_id)
+            result = self.__write(lambda tx: QueryEngine.__user_unconfirm_trade(tx, user_id, trade))
+            t.user1_confirmed, t.user2_confirmed = trade.user1_confirmed, trade.user2_confirmed
+            t.version = trade.version
+            return result
+
+        return self.__optimistic(attempt)
 
     @staticmethod
-    def user_confirm_trade(u: User, t: Trade) -> bool:
+    def __user_unconfirm_trade(tx: StorageTransaction, user_id: int, t: Trade):
+        if user_id == t.user1_id:
+            was_confirmed = t.user1_confirmed
+            tx.set_trade_confirmed(t, 1, False)
+        elif user_id == t.user2_id:
+            was_confirmed = t.user2_confirmed
+            tx.set_trade_confirmed(t, 2, False)
+        else:
+            raise QueryEngineError("User is not involved in trade", user_id, t)
+        if was_confirmed:
+            tx.append_event(EVENT_TRADE_UNCONFIRMED, user_id, trade_id=t.unique_id)
+            QueryEngine.__notify(tx, EVENT_TRADE_UNCONFIRMED, user_id, t)
+        return True
+
+    def user_confirm_trade(self, u: User, t: Trade) -> bool:
         """
         let the User confirm the trade
 
@@ -817,40 +940,41 @@ class QueryEngine:
         :param t: the Trade that the User would like to confirm
         :return: true if success false if fails
         """
-        query: str
-        data: Tuple
+        user_id = u.unique_id  # read here, u may be a request-bound proxy
+
+        def attempt() -> bool:
+            trade: Trade = self.get_trade_from_id(t.unique_id)
+            result = self.__write(lambda tx: QueryEngine.__user_confirm_trade(tx, user_id, trade))
+            t.user1_confirmed, t.user2_confirmed = trade.user1_confirmed, trade.user2_confirmed
+            t.version = trade.version
+            return result
+
+        return self.__optimistic(attempt)
+
+    @staticmethod
+    def __user_confirm_trade(tx: StorageTransaction, user_id: int, t: Trade) -> bool:
+        u: User = tx.get_user(user_id)
         if u.unique_id == t.user1_id:
-            if len(u.cards) + len(t.user1_cards) <= 5:
-                t.user1_confirmed = True
-                query = "update Trades set user1_confirmed = ? where id = ?"
-                data = t.user1_confirmed, t.unique_id
+            if len(u.cards) + len(t.user1_cards) <= MAX_CARDS:
+                tx.set_trade_confirmed(t, 1, True)
             else:
                 return False
         elif u.unique_id == t.user2_id:
-            if len(u.cards) + len(t.user2_cards) <= 5:
-                t.user2_confirmed = True
-                query = "update Trades set user2_confirmed = ? where id = ?"
-                data = t.user2_confirmed, t.unique_id
+            if len(u.cards) + len(t.user2_cards) <= MAX_CARDS:
+                tx.set_trade_confirmed(t, 2, True)
             else:
                 return False
         else:
             raise QueryEngineError("User is not involved in trade", u, t)
-
-        with QueryEngine.__get_connection() as conn:
-            try:
-                conn.execute(query, data)
-            except sqlite3.IntegrityError:
-                conn.rollback()
-            else:
-                conn.commit()
+        tx.append_event(EVENT_TRADE_CONFIRMED, u.unique_id, trade_id=t.unique_id)
+        QueryEngine.__notify(tx, EVENT_TRADE_CONFIRMED, u.unique_id, t)
 
         if t.user1_confirmed and t.user2_confirmed:
-            QueryEngine.do_trade(t.unique_id)
+            QueryEngine.__do_trade(tx, t.unique_id)
 
         return True
 
-    @staticmethod
-    def do_trade(trade_id: int) -> bool:
+    def do_trade(self, trade_id: int) -> bool:
         """
         Execute the trade with the given trade_id. The cards offered by user1 will be added to user2 and the cards
         offered by user2 will be added to user1
@@ -858,74 +982,303 @@ class QueryEngine:
         :param trade_id: the id of the Trade to execute
         :return: true if the trade succeeds and false if it does not
         """
-        t: Trade = QueryEngine.get_trade_from_id(trade_id)
+        return self.__write(lambda tx: QueryEngine.__do_trade(tx, trade_id))
+
+    @staticmethod
+    def __do_trade(tx: StorageTransaction, trade_id: int) -> bool:
+        t: Trade = tx.get_trade(trade_id)
         # check that trade is still valid
-        if QueryEngine.check_valid_trade(t.user1_id, t.user1_cards, t.user2_id, t.user2_cards) \
+        if QueryEngine.__check_valid_trade(tx, t.user1_id, t.user1_cards, t.user2_id, t.user2_cards) \
                 and check_trade_is_confirmed(t):
-            QueryEngine.delete_trade(trade_id)
-
-            user1_cards = QueryEngine.get_user_cards(t.user1_id)
-            if len(user1_cards) + len(t.user1_cards) > MAX_CARDS:
-                return False
-
-            user2_cards = QueryEngine.get_user_cards(t.user2_id)
-            if len(user2_cards) + len(t.user2_cards) > MAX_CARDS:
+            user1 = tx.get_user(t.user1_id)
+            user2 = tx.get_user(t.user2_id)
+            if len(user1.cards) + len(t.user1_cards) > MAX_CARDS \
+                    or len(user2.cards) + len(t.user2_cards) > MAX_CARDS:
+                QueryEngine.__delete_trade(tx, trade_id, TRADE_CANCELLED)
                 return False
+            QueryEngine.__delete_trade(tx, trade_id, TRADE_COMPLETED)
+            tx.append_event(EVENT_TRADE_EXECUTED, t.user1_id, trade_id=trade_id)
 
             # remove user1 cards from user1 and add them to user2
             for card in t.user1_cards:
-                QueryEngine.remove_card_from_user(t.user1_id, card)
-                QueryEngine.add_card_to_user(t.user2_id, card)
+                QueryEngine.__remove_card_from_user(tx, tx.get_user(t.user1_id), card, MARKET_GIVEN)
+                QueryEngine.__add_card_to_user(tx, tx.get_user(t.user2_id), card, MARKET_RECEIVED)
 
             # remove user2 cards from user2 and add them to user1
             for card in t.user2_cards:
-                QueryEngine.remove_card_from_user(t.user2_id, card)
-                QueryEngine.add_card_to_user(t.user1_id, card)
+                QueryEngine.__remove_card_from_user(tx, tx.get_user(t.user2_id), card, MARKET_GIVEN)
+                QueryEngine.__add_card_to_user(tx, tx.get_user(t.user1_id), card, MARKET_RECEIVED)
+            tx.market_moves.extend((int(card), MARKET_TRADED) for card in t.user1_cards | t.user2_cards)
             return True
         else:
             return False
 
+    def get_ownership_at(self, at: datetime) -> Dict[int, int]:
+        """
+        Rebuild who owned which Card at a point in time from the nearest ownership snapshot and the ledger after it
+
+        :param at: the point in time, in UTC
+        :return: {card_id: user_id} for every Card owned at that time
+        """
+        with self.__read() as tx:
+            return QueryEngine.__ownership_at_seq(tx, tx.event_seq_at(at))
+
+    def get_ownership_at_seq(self, seq: int) -> Dict[int, int]:
+        """
+        Rebuild who owned which Card right after the ownership event seq
+
+        :return: {card_id: user_id} for every Card owned at that point
+        """
+        with self.__read() as tx:
+            return QueryEngine.__ownership_at_seq(tx, seq)
+
+    @staticmethod
+    def __ownership_at_seq(tx: StorageTransaction, seq: int) -> Dict[int, int]:
+        snapshot_seq, owners = tx.snapshot_at(seq)
+        return replay(owners, tx.ownership_changes(snapshot_seq, seq))
+
+    def get_card_activity(self, card_id: int) -> CardActivity:
+        """
+        Get how often the Card was offered, traded, acquired and dropped and how long it was held, over all time
+
+        :raise NoOutputError: if a Card with the given card_id cannot be found
+        """
+        with self.__read() as tx:
+            return tx.card_activity(int(card_id))
+
+    def get_market_leaders(self, stat: str = MARKET_TRADED, limit: int = MARKET_LIMIT) -> List[CardActivity]:
+        """
+        Get the Cards with the most of a market stat over all time, read from the per Card counters only
+
+        :param stat: one of MARKET_STATS
+        :raise QueryEngineError: if stat is not one of MARKET_STATS
+        """
+        QueryEngine.__check_market(stat)
+        with self.__read() as tx:
+            return tx.market_leaders(stat, limit)
+
+    def get_market_window(self, period: str, since: datetime, stat: str = MARKET_TRADED,
+                          limit: int = MARKET_LIMIT) -> List[CardActivity]:
+        """
+        Get the Cards with the most of a market stat in the buckets of a roll-up period starting at or after since.
+        Only the roll-ups of the window are read, the holdings in it have no held_since.
+
+        :param period: one of MARKET_PERIODS, "hour" or "day"
+        :raise QueryEngineError: if period or stat is not known
+        """
+        QueryEngine.__check_market(stat, period)
+        with self.__read() as tx:
+            return tx.market_window(period, since, stat, limit)
+
+    def get_market_activity(self, period: str, since: datetime) -> List[MarketBucket]:
+        """
+        Get the totals over all Cards of every hour or day since since that had any market moves, oldest first
+
+        :raise QueryEngineError: if period is not one of MARKET_PERIODS
+        """
+        QueryEngine.__check_market(MARKET_TRADED, period)
+        with self.__read() as tx:
+            return tx.market_buckets(period, since)
+
+    @staticmethod
+    def __check_market(stat: str, period: Optional[str] = None) -> None:
+        if stat not in MARKET_STATS:
+            raise QueryEngineError(f"No market stat {stat}")
+        if period is not None and period not in MARKET_PERIODS:
+            raise QueryEngineError(f"No roll-up period {period}")
+
+    def get_user_rank(self, user_id: int) -> int:
+        """
+        Get the place of the User on the team score leaderboard, Users with the same score share a place
+
+        :param user_id: the id of the User
+        :return: 1 plus the number of Users with a higher score
+        """
+        self.__sync_caches()
+        self.__load_leaderboard()
+        u: User = self.get_user_from_id(user_id)
+        return self.leaderboard.rank(u.score)
+
+    def get_leaderboard(self, after: Optional[Tuple[int, int]] = None, limit: int = 50) -> List[Tuple[int, User]]:
+        """
+        Get a page of the team score leaderboard, highest score first
+
+        :param after: (score, user_id) of the last User of the previous page, None for the first page
+        :param limit: the maximum number of Users returned
+        :return: a list of (rank, User)
+        """
+        self.__sync_caches()
+        self.__load_leaderboard()
+        with self.__read() as tx:
+            users = tx.top_users(after, limit)
+        return [(self.leaderboard.rank(u.score), u) for u in users]
+
+    def __load_leaderboard(self) -> None:
+        """
+        private function to load the leaderboard counts the first time they are needed. The counts are read on the
+        writer so no score change can slip in between reading them and applying the next change.
+        """
+        if not self.leaderboard.loaded:
+            self.__write(lambda tx: self.leaderboard.load(lambda: self.__leaderboard_state(tx)))
+
+    @staticmethod
+    def __leaderboard_state(tx: StorageTransaction) -> LeaderboardState:
+        points = sorted(card.points or 0 for card in tx.all_cards())
+        lowest = sum(min(p, 0) for p in points[:MAX_CARDS])
+        highest = sum(max(p, 0) for p in points[-MAX_CARDS:])
+        return lowest, highest, tx.score_counts()
+
+    def add_want(self, user_id: int, card_id: int) -> bool:
+        """
+        Record that the User wants the Card. A want is a standing offer to give any one of the User's Cards for it in
+        a multi-party trade.
+
+        :return: false if the User already owns the Card
+        """
+        return self.__write(lambda tx: QueryEngine.__add_want(tx, int(user_id), int(card_id)))
+
+    @staticmethod
+    def __add_want(tx: StorageTransaction, user_id: int, card_id: int) -> bool:
+        if tx.get_card(card_id).owner == user_id:
+            return False
+        tx.add_want(user_id, card_id)
+        return True
+
+    def remove_want(self, user_id: int, card_id: int) -> None:
+        self.__write(lambda tx: tx.remove_want(int(user_id), int(card_id)))
+
+    def get_user_wants(self, user_id: int) -> Set[Card]:
+        """
+        :return: the Cards the User wants
+        """
+        with self.__read() as tx:
+            return {tx.get_card(card_id) for card_id in tx.user_wants(int(user_id))}
+
+    def find_trade_cycles(self, user_id: int, max_length: int = MAX_CYCLE_LENGTH,
+                          limit: int = 10) -> List[List[TradeCycleStep]]:
+        """
+        Find multi-party trades that give the User a Card they want. Users are the nodes of the want graph and there
+        is an edge from every User to the owner of each Card they want. The search walks forward from the User along
+        their wants, and a walk closes into a cycle at any User who wants one of the User's own Cards, found up front
+        from the card to wanters index. Each step only looks at the edges of one User, so the time taken grows with
+        the number of wants near the User and not with the number of Users.
+
+        :param user_id: the id of the User the trades are for
+        :param max_length: the most Users in one trade, 2 is a plain swap
+        :param limit: the maximum number of trades returned
+        :return: the trades found, shortest first, each as the steps going around the cycle
+        """
+        user_id = int(user_id)
+        with self.__read() as tx:
+            closers: Dict[int, int] = {}
+            for wanter_id, card_id in tx.wanters_of_cards_of(user_id):
+                if wanter_id != user_id:
+                    closers.setdefault(wanter_id, card_id)
+            if not closers:
+                return []
+
+            edges: Dict[int, List[Tuple[int, int]]] = {}
+
+            def edges_of(node: int) -> List[Tuple[int, int]]:
+                if node not in edges:
+                    edges[node] = tx.want_edges(node)
+                return edges[node]
+
+            cycles: List[List[TradeCycleStep]] = []
+            # walks as (wanter_id, card_id, owner_id) edges, extended one edge per round so shorter trades come first
+            paths: List[List[Tuple[int, int, int]]] = [[]]
+            for length in range(2, max_length + 1):
+                longer = []
+                for path in paths:
+                    node = path[-1][2] if path else user_id
+                    visited = {user_id}.union(step[2] for step in path)
+                    for card_id, owner_id in edges_of(node):
+                        # the last round only keeps walks that can close
+                        if owner_id not in visited and (length < max_length or owner_id in closers):
+                            longer.append(path + [(node, card_id, owner_id)])
+                paths = longer
+                for path in paths:
+                    last = path[-1][2]
+                    if last in closers:
+                        steps = [TradeCycleStep(owner_id, card_id, wanter_id) for wanter_id, card_id, owner_id in path]
+                        steps.append(TradeCycleStep(user_id, closers[last], last))
+                        cycles.append(steps)
+                        if len(cycles) >= limit:
+                            return cycles
+            return cycles
+
+    def execute_trade_cycle(self, steps: List[TradeCycleStep]) -> bool:
+        """
+        Carry out a multi-party trade in one write. Every giver must still own the Card they give and every receiver
+        must still want it, otherwise nothing changes. Every participant gives one Card and gets one back, so nobody
+        goes over MAX_CARDS.
+
+        :param steps: the trade as returned by find_trade_cycles
+        :return: true if the trade was carried out
+        """
+        return self.__write(lambda tx: QueryEngine.__execute_trade_cycle(tx, steps))
+
     @staticmethod
-    def check_user_exists(username: str) -> bool:
+    def __execute_trade_cycle(tx: StorageTransaction, steps: List[TradeCycleStep]) -> bool:
+        givers = [step.giver_id for step in steps]
+        if len(steps) < 2 or len(set(givers)) != len(givers) \
+                or set(givers) != {step.receiver_id for step in steps}:
+            return False
+        for step in steps:
+            if tx.get_card(step.card_id).owner != step.giver_id \
+                    or step.card_id not in tx.user_wants(step.receiver_id):
+                return False
+
+        for step in steps:
+            QueryEngine.__remove_card_from_user(tx, tx.get_user(step.giver_id), step.card_id, MARKET_GIVEN)
+        for step in steps:
+            if not QueryEngine.__add_card_to_user(tx, tx.get_user(step.receiver_id), step.card_id, MARKET_RECEIVED):
+                raise QueryEngineError("Card could not be handed over in trade cycle", step)
+            tx.remove_want(step.receiver_id, step.card_id)
+        tx.market_moves.extend((int(step.card_id), MARKET_TRADED) for step in steps)
+        return True
+
+    def search_cards(self, text: str, limit: int = SEARCH_LIMIT) -> List[Card]:
+        """
+        Find Cards by the start of any word of their name, team or position, ignoring case and accents
+
+        :param text: what the user typed so far
+        :param limit: the maximum number of Cards returned
+        :return: the Cards found, lowest id first
+        """
+        def search() -> List[int]:
+            with self.__read() as tx:
+                return [card.id for card in tx.search_cards(text, limit)]
+
+        # only the ids are cached, whether a Card is owned changes all the time
+        card_ids = self.search_cache.get("cards", text, limit, search)
+        with self.__read() as tx:
+            return [tx.get_card(card_id) for card_id in card_ids]
+
+    def search_users(self, text: str, limit: int = SEARCH_LIMIT) -> List[Tuple[int, str]]:
+        """
+        Find Users by the start of any word of their name, ignoring case and accents
+
+        :param text: what the user typed so far
+        :param limit: the maximum number of Users returned
+        :return: (user_id, name) of the Users found, lowest id first
+        """
+        def search() -> List[Tuple[int, str]]:
+            with self.__read() as tx:
+                return [(u.unique_id, u.name) for u in tx.search_users(text, limit)]
+
+        self.__sync_caches()
+        return self.search_cache.get("users", text, limit, search)
+
+    def check_user_exists(self, username: str) -> bool:
         """
         Check if a User with the given username exists in the database
 
         :param username: the username of the User
         :return: true if the User exists and false if it does not
         """
-        query = "select * from Users where name = ?"
-
-        with QueryEngine.__get_connection() as conn:
-            output = conn.execute(query, (username,)).fetchone()
-            if output is None:
-                return False
-            else:
-                return True
+        with self.__read() as tx:
+            return tx.user_exists(username)
 
 
-def load_database() -> None:
-    """
-    Load the database. Register adapters/converters. Create tables if they don't exist. Load Card data into Cards table.
-    """
-    conn: sqlite3.Connection
-    db_exists = os.path.exists(db_filename)
-    with sqlite3.connect(db_filename, detect_types=sqlite3.PARSE_DECLTYPES) as conn:
-        sqlite3.register_adapter(list, json_list_adapter)
-        sqlite3.register_converter("json", json_list_converter)
-        if not db_exists:
-            with open(schema_filename, 'rt') as schema_file:
-                schema = schema_file.read()
-            conn.executescript(schema)
-
-            with open(os.path.join(basedir, "NBAdata.csv"), 'r') as cards_file:
-                cards = csv.DictReader(cards_file)
-
-                sql = """insert into Cards (name, team, pos, age, gp, mpg, fta, ft_pct, two_pa, two_p_pct, three_pa, three_p_pct, shooting_pct, ppointspg, reboundspg, assistspg, stealspg, blockspg, image)
-                values (:NAME, :TEAM, :POS, :AGE, :GP, :MPG, :FTA, :FTpct, :2PA, :2Ppct, :3PA, :3Ppct, :SHOOTINGpct, :PPOINTSPG, :REBOUNDSPG, :ASSISTSPG, :STEALSPG, :BLOCKSPG, :IMAGE)
-                """
-
-                cursor = conn.cursor()
-                cursor.executemany(sql, cards)
-                cursor.close()
-
-        conn.commit()
+engine = QueryEngine(SQLiteBackend(db_filename, schema_filename, cards_filename, image_dir))
@@ -0,0 +1,188 @@
+"""
+Query plan checks. A StatementRegistry records every SQL statement the transactions of an SQLiteBackend run, through
+the connection class it hands the backend, with the parameters of its first use. check_plans() then runs EXPLAIN
+QUERY PLAN and times each of them against a database, and reports the statements that scan a whole table without
+being listed in EXPECTED_SCANS, and the plans that changed since a snapshot. benchmarks/query_plans.py runs the
+QueryEngine against a large seeded database to fill the registry and checks it against benchmarks/query_plans.json.
+"""
+import json
+import re
+import sqlite3
+import statistics
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Sequence, Type
+
+from app.models import MARKET_STATS
+from app.storage import MARKET_LEADERS
+
+# statements that are expected to read a whole table or index, and why that is fine
+EXPECTED_SCANS: Dict[str, str] = {
+    "select * from Users": "get_all_users lists every User",
+    "select * from Cards": "get_all_cards lists every Card, the catalog is small",
+    "update Users set score = 0 where score != 0": "rescoring after a change of the scoring formula touches every User",
+    "select score, count(*) from Users group by score": "the rank table counts every score, from the index alone",
+    "select * from Users order by score desc, id limit ?": "the first leaderboard page, the limit stops the walk",
+    **{MARKET_LEADERS.format(stat=stat): "the all time market leaders, CardMarket has at most a row per Card"
+       for stat in MARKET_STATS},
+}
+# how many times each statement is run for its timing
+TIMING_RUNS = 5
+# a statement whose median time grew by more than this factor since the snapshot is reported as slower
+SLOWER_FACTOR = 2.0
+
+
+def normalize(sql: str) -> str:
+    """
+    :return: the statement with its whitespace collapsed, which is how the registry and the snapshots key it
+    """
+    return re.sub(r"\s+", " ", sql).strip()
+
+
+@dataclass
+class Statement:
+    sql: str
+    parameters: Sequence[Any]
+    uses: int = 0
+
+
+@dataclass
+class PlanReport:
+    """
+    What check_plans() found: the plan and median time of every statement, the statements scanning a table
+    unexpectedly, the ones whose plan differs from the snapshot, and the ones that got slower than it
+    """
+    plans: Dict[str, Dict[str, Any]] = field(default_factory=dict)
+    unexpected_scans: Dict[str, List[str]] = field(default_factory=dict)
+    changed_plans: Dict[str, List[str]] = field(default_factory=dict)
+    slower: Dict[str, float] = field(default_factory=dict)
+    missing: List[str] = field(default_factory=list)
+
+    @property
+    def failed(self) -> bool:
+        return bool(self.unexpected_scans or self.changed_plans)
+
+
+class StatementRegistry:
+    """
+    StatementRegistry collects the distinct statements run on the connections made by connection_class()
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.statements: Dict[str, Statement] = {}
+
+    def record(self, sql: str, parameters: Sequence[Any]) -> None:
+        key = normalize(sql)
+        if key.lower().startswith(("pragma", "begin", "commit", "rollback", "savepoint", "release")):
+            return
+        with self.lock:
+            statement = self.statements.get(key)
+            if statement is None:
+                statement = self.statements[key] = Statement(key, parameters)
+            statement.uses += 1
+
+    def clear(self) -> None:
+        with self.lock:
+            self.statements.clear()
+
+    def connection_class(self) -> Type[sqlite3.Connection]:
+        """
+        :return: a sqlite3.Connection class recording its statements here, for the connection_factory of an
+            SQLiteBackend
+        """
+        registry = self
+
+        class RecordingConnection(sqlite3.Connection):
+            def execute(self, sql, parameters=()):
+                registry.record(sql, parameters)
+                return super().execute(sql, parameters)
+
+            def executemany(self, sql, seq_of_parameters):
+                seq_of_parameters = list(seq_of_parameters)
+                if seq_of_parameters:
+                    registry.record(sql, seq_of_parameters[0])
+                return super().executemany(sql, seq_of_parameters)
+
+        return RecordingConnection
+
+
+def explain(conn: sqlite3.Connection, statement: Statement) -> List[str]:
+    """
+    :return: the steps of the query plan of the statement, nested steps indented under their parent
+    """
+    rows = conn.execute("explain query plan " + statement.sql, statement.parameters).fetchall()
+    depth = {0: -1}
+    plan = []
+    for step_id, parent_id, _, detail in rows:
+        depth[step_id] = depth.get(parent_id, -1) + 1
+        plan.append("  " * depth[step_id] + detail)
+    return plan
+
+
+def full_scans(plan: List[str]) -> List[str]:
+    """
+    :return: the steps of a plan that read a whole table or index, virtual tables such as the search indexes answer
+        through their own index and do not count
+    """
+    return [step.strip() for step in plan
+            if step.strip().startswith("SCAN") and "VIRTUAL TABLE" not in step and "CONSTANT ROW" not in step]
+
+
+def time_statement(conn: sqlite3.Connection, statement: Statement, runs: int = TIMING_RUNS) -> float:
+    """
+    Run the statement runs times, each in a transaction that is rolled back so writes leave nothing behind
+
+    :return: the median time in milliseconds
+    """
+    timings = []
+    for _ in range(runs):
+        conn.execute("begin")
+        try:
+            start = time.perf_counter()
+            conn.execute(statement.sql, statement.parameters).fetchall()
+            timings.append((time.perf_counter() - start) * 1000)
+        except sqlite3.IntegrityError:  # a recorded insert of a row that exists by now
+            timings.append(0.0)
+        finally:
+            conn.rollback()
+    return statistics.median(timings)
+
+
+def check_plans(db_filename: str, statements: Sequence[Statement],
+                snapshot: Optional[Dict[str, Dict[str, Any]]] = None) -> PlanReport:
+    """
+    Explain and time every statement against the database, and compare them with EXPECTED_SCANS and a snapshot
+
+    :param snapshot: the plans of an earlier check_plans(), as saved by save_snapshot()
+    """
+    report = PlanReport()
+    with sqlite3.connect(db_filename, detect_types=sqlite3.PARSE_DECLTYPES, isolation_level=None) as conn:
+        for statement in sorted(statements, key=lambda s: s.sql):
+            plan = explain(conn, statement)
+            report.plans[statement.sql] = {"plan": plan, "ms": round(time_statement(conn, statement), 3),
+                                           "uses": statement.uses}
+            scans = full_scans(plan)
+            if scans and statement.sql not in EXPECTED_SCANS:
+                report.unexpected_scans[statement.sql] = scans
+            if snapshot is not None and statement.sql in snapshot:
+                before = snapshot[statement.sql]
+                if before["plan"] != plan:
+                    report.changed_plans[statement.sql] = before["plan"]
+                if before["ms"] > 0 and report.plans[statement.sql]["ms"] > before["ms"] * SLOWER_FACTOR:
+                    report.slower[statement.sql] = before["ms"]
+    if snapshot is not None:
+        report.missing = sorted(set(snapshot) - set(report.plans))
+    return report
+
+
+def load_snapshot(filename: str) -> Dict[str, Dict[str, Any]]:
+    with open(filename, "rt") as file:
+        return json.load(file)
+
+
+def save_snapshot(filename: str, report: PlanReport) -> None:
+    with open(filename, "wt") as file:
+        json.dump(report.plans, file, indent=2, sort_keys=True)
+        file.write("\n")
@@ -2,63 +2,188 @@
 # Charles Morgan, Nolan Jimmo, Dean Stuart, George Fafard
 
 # Beginning of the flask app for the interface of the project
-from datetime import datetime
-
-from flask import flash, render_template, request, redirect, url_for
+import json
+import os
+from datetime import datetime, timedelta
+from functools import wraps
+from typing import Dict
+
+from flask import (Response, abort, flash, get_flashed_messages, jsonify, render_template, request, redirect,
+                   stream_with_context, url_for)
 from flask_login import current_user, login_user, login_required, logout_user
 
-from app import app
-from app import login_db as db, login_helper as dc
+from app import app, backup_dir
+from app import login_helper as dc
+from app.auth import auth
 from app.query_engine import QueryEngine, User, NoOutputError, QueryEngineError
+from app.leagues import leagues, DEFAULT_LEAGUE
+from app.market import bucket_start
+from app.models import TradeCycleStep, MARKET_TRADED, MARKET_OFFERED, MARKET_ACQUIRED, MARKET_DROPPED
+from app.admission import admission, write_admission
+from app.backup import BackupScheduler, export_chunks
+from app.diagnostics import TOP_SITES, TRACE_FRAMES, cache_sizes, census, profiler
+from app.trade_sweeper import TradeSweeper
+from app.scoring import SCORE_SCALE
+from app.season_stats import get_season_stats
 
 current_user: User
 
+# last_seen is only written back when it is older than this, so most requests do not need a write
+LAST_SEEN_INTERVAL = timedelta(minutes=1)
+# how many archived trades are shown per page of the trade history
+TRADE_HISTORY_PAGE = 20
+# how many users are shown per page of the leaderboard
+LEADERBOARD_PAGE = 50
+# how many cards a search on the add cards page looks at
+CARD_SEARCH_PAGE = 50
+# seconds between the keep-alive comments sent on an idle trade event stream
+EVENT_HEARTBEAT = 15
+# the access level Users need for maintenance pages such as backups
+ADMIN_ACCESS = 3
+# how many pieces of template output a streamed page gathers before sending them
+STREAM_BUFFER = 100
+# the per-season stats shown on the page of a Card, with their column headings
+CARD_PAGE_STATS = [("gp", "GP"), ("mpg", "MPG"), ("ppointspg", "PPG"), ("reboundspg", "RPG"), ("assistspg", "APG"),
+                   ("shooting_pct", "Shooting %")]
+# how many cards each table of the market page lists
+MARKET_PAGE = 10
+# the market stats the market page can rank cards by, with their column headings
+MARKET_PAGE_STATS = [(MARKET_TRADED, "Traded"), (MARKET_OFFERED, "Offered"), (MARKET_ACQUIRED, "Acquired"),
+                     (MARKET_DROPPED, "Dropped"), ("holds", "Holdings")]
+# the hourly and daily buckets the market page shows the activity of
+MARKET_HOURS = 24
+MARKET_DAYS = 30
+# the daily buckets the trending cards of the market page are added up over
+MARKET_TRENDING_DAYS = 7
+
+# the trade sweeper and the backup scheduler of every league, by league id
+trade_sweepers: Dict[int, TradeSweeper] = {}
+backup_schedulers: Dict[int, BackupScheduler] = {}
+
+
+def league_backup_dir(league_id: int) -> str:
+    return backup_dir if league_id == DEFAULT_LEAGUE else os.path.join(backup_dir, f"league-{league_id}")
+
+
+@app.before_first_request
+def load_usernames():
+    auth.load()
+
+
+@app.before_first_request
+def start_trade_sweeper():
+    for league, engine in leagues.all_engines():
+        trade_sweepers[league.id] = TradeSweeper(engine)
+        trade_sweepers[league.id].start()
+        backup_schedulers[league.id] = BackupScheduler(engine.backend, league_backup_dir(league.id))
+        backup_schedulers[league.id].start()
+
+
+def stream_template(template_name: str, **context) -> Response:
+    """
+    Render a template as it is sent, for the pages listing many Users or Cards. The lists can be generators, which
+    are then only read as far as the page has been rendered, so the first bytes go out before the whole list has been
+    read and the page is never held in memory all at once. The request context stays available to the generators.
+    """
+    # the session is saved before the page is streamed, so the flashed messages must be taken out of it now
+    get_flashed_messages()
+    app.update_template_context(context)
+    stream = app.jinja_env.get_template(template_name).stream(context)
+    stream.enable_buffering(STREAM_BUFFER)
+    return Response(stream_with_context(stream), mimetype="text/html")
+
+
+def league_engine() -> QueryEngine:
+    """
+    :return: the QueryEngine of the logged in User's league
+    """
+    return leagues.for_user(current_user.unique_id)
+
+
+def admin_required(view):
+    """
+    Like login_required, and the logged in User also needs ADMIN_ACCESS
+    """
+    @wraps(view)
+    @login_required
+    def admin_view(*args, **kwargs):
+        if int(current_user.access) < ADMIN_ACCESS:
+            abort(403)
+        return view(*args, **kwargs)
+    return admin_view
+
+
+@app.template_filter('points')
+def points_filter(score: int) -> str:
+    return f"{score / SCORE_SCALE:.2f}"
+
+
+@app.template_filter('duration')
+def duration_filter(seconds: float) -> str:
+    if seconds is None:
+        return "-"
+    if seconds < 3600:
+        return f"{seconds / 60:.0f} min"
+    if seconds < 86400:
+        return f"{seconds / 3600:.1f} h"
+    return f"{seconds / 86400:.1f} d"
+
 
 @app.before_request
 def before_request():
     if current_user.is_authenticated:
-        current_user.last_seen = datetime.utcnow()
-        QueryEngine.update_user_last_seen(current_user)
+        now = datetime.utcnow()
+        if not isinstance(current_user.last_seen, datetime) or now - current_user.last_seen >= LAST_SEEN_INTERVAL:
+            current_user.last_seen = now
+            league_engine().update_user_last_seen(current_user)
 
 
 @app.route("/", methods=['GET', 'POST'])
 @app.route("/dashboard", methods=['GET', 'POST'])
 @login_required
 def dashboard():
-    user_cards = QueryEngine.get_user_cards(current_user.unique_id)
-    num_user_cards = len(user_cards)
-    user_trades = QueryEngine.get_user_trades(current_user.unique_id)
-    return render_template('dashboard.html', title="Dashboard", user_cards=user_cards, num_user_cards=num_user_cards,
-                           user_trades=user_trades)
+    summary = league_engine().get_dashboard(current_user.unique_id)
+    return render_template('dashboard.html', title="Dashboard", user_cards=summary.cards,
+                           num_user_cards=len(summary.cards), user_trades=summary.trades)
 
 
 @app.route("/add_cards", methods=['GET', 'POST'])
 @login_required
+@write_admission("cards")
 def add_cards():
+    engine = league_engine()
     if request.method == 'POST':
         card_id = int(request.form.get('card_id'))
-        success: bool = QueryEngine.add_card_to_user(current_user.unique_id, card_id)
+        success: bool = engine.add_card_to_user(current_user.unique_id, card_id)
         if not success:
             flash("You need to remove a card from your deck before adding a new one!")
             return redirect(url_for('dashboard'))
         return redirect(url_for('dashboard'))
-    available_cards = QueryEngine.get_available_cards()
-    return render_template("add_cards.html", title="Add Cards", available_cards=available_cards)
+    search = request.args.get('q', '')
+    if search:
+        available_cards = [card for card in engine.search_cards(search, CARD_SEARCH_PAGE) if not card.owned]
+    else:
+        available_cards = (card for card in engine.iter_cards() if not card.owned)
+    return stream_template("add_cards.html", title="Add Cards", available_cards=available_cards, search=search)
 
 
 @app.route("/remove_card", methods=['GET', 'POST'])
 @login_required
+@write_admission("cards")
 def remove_card():
+    engine = league_engine()
     if request.method == 'POST':
         card_id = int(request.form.get('card_id'))
         if card_id in current_user.cards:
-            QueryEngine.remove_card_from_user(current_user.unique_id, card_id)
+            engine.remove_card_from_user(current_user.unique_id, card_id)
         return redirect(url_for('dashboard'))
 
 
 @app.route("/create_trade", methods=['GET', 'POST'])
 @login_required
+@write_admission("trades")
 def create_trade():
+    engine = league_engine()
     if request.method == 'POST':
         own_card_ids = request.form.getlist('own_cards')
         for i in range(len(own_card_ids)):
@@ -67,64 +192,75 @@ def create_trade():
         for i in range(len(other_card_ids)):
             other_card_ids[i] = int(other_card_ids[i])
         other_user_id = int(request.form.get('other_user_id'))
-        if QueryEngine.create_trade(current_user.unique_id, own_card_ids, int(other_user_id), other_card_ids):
+        try:
+            created = engine.create_trade(current_user.unique_id, own_card_ids, other_user_id, other_card_ids)
+        except NoOutputError:
+            # the other User is not in the league of the current User
+            flash("There is no such user in your league")
+            return redirect(url_for('create_trade'))
+        if created:
             return redirect(url_for('dashboard'))
         else:
             flash("Failed to create trade")
             return redirect(url_for('create_trade'))
-    users = QueryEngine.get_all_users()
-    users.remove(current_user)
-    return render_template("create_trade.html", title="Create Trade", users=users)
+    return stream_template("create_trade.html", title="Create Trade")
 
 
 @app.route("/choose_user", methods=['GET', 'POST'])
 @login_required
 def choose_user():
+    engine = league_engine()
     if request.method == 'POST':
-        users = QueryEngine.get_all_users()
         username = request.form.get('users')
-        own_cards = QueryEngine.get_user_cards(current_user.unique_id)
-        other_user = QueryEngine.get_user_from_username(username)
-        other_cards = QueryEngine.get_user_cards(other_user.unique_id)
-        return render_template("create_trade.html", title="Create Trade", users=users, own_cards=own_cards,
+        try:
+            other_user = engine.get_user_from_username(username)
+        except NoOutputError:
+            flash(f"There is no user named {username}")
+            return redirect(url_for('create_trade'))
+        own_cards = engine.get_user_cards(current_user.unique_id)
+        other_cards = engine.get_user_cards(other_user.unique_id)
+        return stream_template("create_trade.html", title="Create Trade", own_cards=own_cards,
                                other_user=other_user, other_cards=other_cards)
 
 
 @app.route("/view_trade", methods=['GET', 'POST'])
 @login_required
 def view_trade():
+    engine = league_engine()
     if request.method == 'POST':
         trade_id = int(request.form.get('trade_id'))
-        trade = QueryEngine.get_trade_from_id(trade_id)
-        user1 = QueryEngine.get_user_from_id(trade.user1_id)
+        trade = engine.get_trade_from_id(trade_id)
+        user1 = engine.get_user_from_id(trade.user1_id)
         user1_cards = []
         for card_id in trade.user1_cards:
-            user1_cards.append(QueryEngine.get_card_from_id(card_id))
-        user2 = QueryEngine.get_user_from_id(trade.user2_id)
+            user1_cards.append(engine.get_card_from_id(card_id))
+        user2 = engine.get_user_from_id(trade.user2_id)
         user2_cards = []
         for card_id in trade.user2_cards:
-            user2_cards.append(QueryEngine.get_card_from_id(card_id))
+            user2_cards.append(engine.get_card_from_id(card_id))
         return render_template("view_trade.html", title="View Trade", trade=trade, user1=user1, user1_cards=user1_cards,
                                user2=user2, user2_cards=user2_cards)
 
 
 @app.route("/confirm_trade", methods=['GET', 'POST'])
 @login_required
+@write_admission("trades")
 def confirm_trade():
+    engine = league_engine()
     if request.method == 'POST':
         trade_id = int(request.form.get('trade_id'))
-        trade = QueryEngine.get_trade_from_id(trade_id)
-        if QueryEngine.user_confirm_trade(current_user, trade):
+        trade = engine.get_trade_from_id(trade_id)
+        if engine.user_confirm_trade(current_user, trade):
             try:
-                trade = QueryEngine.get_trade_from_id(trade_id)
-                user1 = QueryEngine.get_user_from_id(trade.user1_id)
+                trade = engine.get_trade_from_id(trade_id)
+                user1 = engine.get_user_from_id(trade.user1_id)
                 user1_cards = []
                 for card_id in trade.user1_cards:
-                    user1_cards.append(QueryEngine.get_card_from_id(card_id))
-                user2 = QueryEngine.get_user_from_id(trade.user2_id)
+                    user1_cards.append(engine.get_card_from_id(card_id))
+                user2 = engine.get_user_from_id(trade.user2_id)
                 user2_cards = []
                 for card_id in trade.user2_cards:
-                    user2_cards.append(QueryEngine.get_card_from_id(card_id))
+                    user2_cards.append(engine.get_card_from_id(card_id))
                 return render_template("view_trade.html", title="View Trade", trade=trade, user1=user1,
                                        user1_cards=user1_cards,
                                        user2=user2, user2_cards=user2_cards)
@@ -138,25 +274,27 @@ def confirm_trade():
 
 @app.route("/unconfirm_trade", methods=['GET', 'POST'])
 @login_required
+@write_admission("trades")
 def unconfirm_trade():
+    engine = league_engine()
     if request.method == 'POST':
         trade_id = int(request.form.get('trade_id'))
-        trade = QueryEngine.get_trade_from_id(trade_id)
+        trade = engine.get_trade_from_id(trade_id)
         try:
-            QueryEngine.user_unconfirm_trade(current_user, trade)
+            engine.user_unconfirm_trade(current_user, trade)
         except QueryEngineError as err:
             flash(err)
             return redirect(url_for('dashboard'))
         else:
-            trade = QueryEngine.get_trade_from_id(trade_id)
-            user1 = QueryEngine.get_user_from_id(trade.user1_id)
+            trade = engine.get_trade_from_id(trade_id)
+            user1 = engine.get_user_from_id(trade.user1_id)
             user1_cards = []
             for card_id in trade.user1_cards:
-                user1_cards.append(QueryEngine.get_card_from_id(card_id))
-            user2 = QueryEngine.get_user_from_id(trade.user2_id)
+                user1_cards.append(engine.get_card_from_id(card_id))
+            user2 = engine.get_user_from_id(trade.user2_id)
             user2_cards = []
             for card_id in trade.user2_cards:
-                user2_cards.append(QueryEngine.get_card_from_id(card_id))
+                user2_cards.append(engine.get_card_from_id(card_id))
             return render_template("view_trade.html", title="View Trade", trade=trade, user1=user1,
                                    user1_cards=user1_cards,
                                    user2=user2, user2_cards=user2_cards)
@@ -164,29 +302,248 @@ def unconfirm_trade():
 
 @app.route("/delete_trade", methods=['GET', 'POST'])
 @login_required
+@write_admission("trades")
 def delete_trade():
+    engine = league_engine()
     if request.method == 'POST':
         trade_id = int(request.form.get('trade_id'))
-        QueryEngine.delete_trade(int(trade_id))
+        engine.delete_trade(int(trade_id))
         return redirect(url_for('dashboard'))
 
 
+@app.route("/card/<int:card_id>", methods=['GET'])
+@login_required
+def view_card(card_id: int):
+    try:
+        card = league_engine().get_card_from_id(card_id)
+    except NoOutputError:
+        abort(404)
+    stats = [column for column, _ in CARD_PAGE_STATS]
+    season_stats = get_season_stats()
+    career = season_stats.career(card_id, stats)
+    first = request.args.get('first', career[0][0] if career else season_stats.first_season, type=int)
+    last = request.args.get('last', career[-1][0] if career else season_stats.last_season, type=int)
+    totals = season_stats.aggregate([card_id], first, last, stats).get(card_id)
+    highest = max([season["ppointspg"] for _, season in career], default=0) or 1
+    activity = league_engine().get_card_activity(card_id)
+    return render_template("card.html", title=card.name, card=card, career=career, columns=CARD_PAGE_STATS,
+                           first=first, last=last, totals=totals, highest=highest, activity=activity,
+                           market_columns=MARKET_PAGE_STATS)
+
+
+@app.route("/market", methods=['GET'])
+@login_required
+def market():
+    engine = league_engine()
+    stat = request.args.get('by', MARKET_TRADED)
+    if stat not in dict(MARKET_PAGE_STATS):
+        abort(400)
+    now = datetime.utcnow()
+    leaders = engine.get_market_leaders(stat, MARKET_PAGE)
+    trending = engine.get_market_window("day", bucket_start("day", now) - timedelta(days=MARKET_TRENDING_DAYS - 1),
+                                        stat, MARKET_PAGE)
+    hours = engine.get_market_activity("hour", bucket_start("hour", now) - timedelta(hours=MARKET_HOURS - 1))
+    days = engine.get_market_activity("day", bucket_start("day", now) - timedelta(days=MARKET_DAYS - 1))
+    return render_template("market.html", title="Market", stat=stat, columns=MARKET_PAGE_STATS, leaders=leaders,
+                           trending=trending, trending_days=MARKET_TRENDING_DAYS, hours=hours, days=days, now=now)
+
+
+@app.route("/trade_history", methods=['GET'])
+@login_required
+def trade_history():
+    engine = league_engine()
+    before = request.args.get('before', type=int)
+    trades = engine.get_trade_history(current_user.unique_id, before, TRADE_HISTORY_PAGE)
+    card_names = engine.get_card_names(card_id for t in trades for card_id in t.user1_cards | t.user2_cards)
+    user_names = engine.get_user_names(user_id for t in trades for user_id in (t.user1_id, t.user2_id))
+    next_before = trades[-1].archive_id if len(trades) == TRADE_HISTORY_PAGE else None
+    return render_template("trade_history.html", title="Trade History", trades=trades, card_names=card_names,
+                           user_names=user_names, next_before=next_before)
+
+
+@app.route("/leaderboard", methods=['GET'])
+@login_required
+def leaderboard():
+    engine = league_engine()
+    after_score = request.args.get('after_score', type=int)
+    after_id = request.args.get('after_id', type=int)
+    after = (after_score, after_id) if after_score is not None and after_id is not None else None
+    entries = engine.get_leaderboard(after, LEADERBOARD_PAGE)
+    user_rank = engine.get_user_rank(current_user.unique_id)
+    next_after = (entries[-1][1].score, entries[-1][1].unique_id) if len(entries) == LEADERBOARD_PAGE else None
+    return render_template("leaderboard.html", title="Leaderboard", entries=entries, user_rank=user_rank,
+                           next_after=next_after)
+
+
+@app.route("/wants", methods=['GET', 'POST'])
+@login_required
+@write_admission("wants")
+def wants():
+    engine = league_engine()
+    if request.method == 'POST':
+        card_id = int(request.form.get('card_id'))
+        if request.form.get('action') == 'remove':
+            engine.remove_want(current_user.unique_id, card_id)
+        elif not engine.add_want(current_user.unique_id, card_id):
+            flash("You already own that card!")
+        return redirect(url_for('wants'))
+    wanted_cards = engine.get_user_wants(current_user.unique_id)
+    wanted_ids = {card.id for card in wanted_cards}
+    other_cards = [card for card in engine.get_all_cards()
+                   if card.owner is not None and card.owner != current_user.unique_id and card.id not in wanted_ids]
+    return render_template("wants.html", title="Wants", wanted_cards=wanted_cards, other_cards=other_cards)
+
+
+def encode_trade_cycle(steps) -> str:
+    return ";".join(f"{step.giver_id}:{step.card_id}:{step.receiver_id}" for step in steps)
+
+
+def decode_trade_cycle(encoded: str):
+    return [TradeCycleStep(*(int(part) for part in step.split(":"))) for step in encoded.split(";")]
+
+
+@app.route("/trade_cycles", methods=['GET'])
+@login_required
+def trade_cycles():
+    engine = league_engine()
+    cycles = engine.find_trade_cycles(current_user.unique_id)
+    card_names = engine.get_card_names(step.card_id for cycle in cycles for step in cycle)
+    user_names = engine.get_user_names(user_id for cycle in cycles for step in cycle
+                                       for user_id in (step.giver_id, step.receiver_id))
+    return render_template("trade_cycles.html", title="Trade Cycles", cycles=cycles, card_names=card_names,
+                           user_names=user_names, encode_trade_cycle=encode_trade_cycle)
+
+
+@app.route("/execute_trade_cycle", methods=['POST'])
+@login_required
+@write_admission("trades")
+def execute_trade_cycle():
+    engine = league_engine()
+    steps = decode_trade_cycle(request.form.get('steps'))
+    if current_user.unique_id not in {step.receiver_id for step in steps}:
+        flash("You are not part of that trade!")
+    elif not engine.execute_trade_cycle(steps):
+        flash("That trade is no longer possible!")
+    return redirect(url_for('dashboard'))
+
+
+@app.route("/search/cards", methods=['GET'])
+@login_required
+def search_cards():
+    engine = league_engine()
+    cards = engine.search_cards(request.args.get('q', ''))
+    return jsonify([{"id": card.id, "name": card.name, "team": card.team, "pos": card.pos, "owned": card.owned}
+                    for card in cards])
+
+
+@app.route("/search/users", methods=['GET'])
+@login_required
+def search_users():
+    engine = league_engine()
+    users = engine.search_users(request.args.get('q', ''))
+    return jsonify([{"id": user_id, "name": name} for user_id, name in users])
+
+
+@app.route("/events/trades", methods=['GET'])
+@login_required
+def trade_events():
+    engine = league_engine()
+    subscription = engine.events.subscribe(current_user.unique_id)
+
+    def stream():
+        try:
+            yield "retry: 5000\n\n"
+            while True:
+                events = engine.events.take(subscription, EVENT_HEARTBEAT)
+                if events is None:
+                    # too far behind, the browser reconnects and reloads what it missed
+                    yield "event: evicted\ndata: {}\n\n"
+                    return
+                if not events:
+                    yield ": heartbeat\n\n"
+                for event in events:
+                    yield f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+        finally:
+            engine.events.unsubscribe(subscription)
+
+    return Response(stream(), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@app.route("/admin/backup", methods=['GET', 'POST'])
+@admin_required
+def admin_backup():
+    league_id = request.args.get('league', DEFAULT_LEAGUE, type=int)
+    if league_id not in backup_schedulers:
+        abort(404)
+    backup_scheduler = backup_schedulers[league_id]
+    if request.method == 'POST':
+        started = backup_scheduler.backup_in_background()
+        return jsonify(started=started, **backup_scheduler.status()), 202 if started else 409
+    return jsonify(backup_scheduler.status())
+
+
+@app.route("/admin/export", methods=['GET'])
+@admin_required
+def admin_export():
+    league_id = request.args.get('league', DEFAULT_LEAGUE, type=int)
+    try:
+        engine = leagues.engine(league_id)
+    except NoOutputError:
+        abort(404)
+    filename = f"trading_card_export-{league_id}-{datetime.utcnow().strftime('%Y%m%dT%H%M%S')}.jsonl.gz"
+    return Response(export_chunks(engine), mimetype="application/gzip",
+                    headers={"Content-Disposition": f"attachment; filename={filename}"})
+
+
+@app.route("/admin/admission", methods=['GET'])
+@admin_required
+def admin_admission():
+    return jsonify(admission.stats())
+
+
+@app.route("/admin/memory", methods=['GET'])
+@admin_required
+def admin_memory():
+    return jsonify(tracing=profiler.status(), census=census(), caches=cache_sizes())
+
+
+@app.route("/admin/memory/trace", methods=['POST', 'DELETE'])
+@admin_required
+def admin_memory_trace():
+    if request.method == 'POST':
+        changed = profiler.start(max(request.args.get('frames', TRACE_FRAMES, type=int), 1))
+    else:
+        changed = profiler.stop()
+    return jsonify(changed=changed, **profiler.status()), 200 if changed else 409
+
+
+@app.route("/admin/memory/snapshot", methods=['POST'])
+@admin_required
+def admin_memory_snapshot():
+    try:
+        return jsonify(profiler.snapshot(request.args.get('limit', TOP_SITES, type=int)))
+    except ValueError as err:
+        return jsonify(error=str(err)), 409
+
+
 @app.route("/view_users", methods=['GET', 'POST'])
 @login_required
 def view_users():
-    users = QueryEngine.get_all_users()
-    users.remove(current_user)
-    return render_template("view_users.html", title="View Users", users=users)
+    engine = league_engine()
+    users = (u for u in engine.iter_users() if u.unique_id != current_user.unique_id)
+    return stream_template("view_users.html", title="View Users", users=users)
 
 
 @app.route("/view_user", methods=['GET', 'POST'])
 @login_required
 def view_user():
+    engine = league_engine()
     if request.method == 'POST':
         user_id = int(request.form.get('user_id'))
-        user = QueryEngine.get_user_from_id(user_id)
-        user_cards = QueryEngine.get_user_cards(user_id)
-        user_trades = QueryEngine.get_user_trades(user_id)
+        user = engine.get_user_from_id(user_id)
+        user_cards = engine.get_user_cards(user_id)
+        user_trades = engine.get_user_trades(user_id)
         return render_template("view_user.html", title="View User", user=user, user_cards=user_cards,
                                user_trades=user_trades)
 
@@ -200,25 +557,15 @@ def login():
         password = request.form.get('password')
         remember_me = bool(request.form.get('remember_me'))
 
-        search_results = db.search_pass(username)
-        if search_results == -1:
-            flash("Incorrect username or password")
-            return redirect(url_for('login'))
-        elif dc.authenticate(search_results, password):
-            try:
-                user = QueryEngine.get_user_from_username(username)
-            except NoOutputError:
-                flash("Incorrect username or password")
-                return redirect(url_for('login'))
-            else:
-                login_user(user, remember=remember_me)
-                next_page = request.args.get('next_page')
-                if not next_page:
-                    next_page = url_for('dashboard')
-                return redirect(next_page)
-        else:
+        user = auth.login(username, password)
+        if user is None:
             flash("Incorrect username or password")
             return redirect(url_for('login'))
+        login_user(user, remember=remember_me)
+        next_page = request.args.get('next_page')
+        if not next_page:
+            next_page = url_for('dashboard')
+        return redirect(next_page)
     return render_template('login.html', title='Login')
 
 
@@ -237,13 +584,9 @@ def sign_up():
         password = request.form.get('password')
 
         if dc.is_good_user(username) and dc.is_good_pass(password):
-            if not QueryEngine.check_user_exists(username):
-                if db.register_user(username, password, 1) != -1:
-                    flash("Successfully create user", "alert-success")
-                    return redirect(url_for('login'))
-                else:
-                    flash("Unable to create new user", "alert-danger")
-                    return redirect(url_for('sign_up'))
+            if auth.register(username, password, 1) is not None:
+                flash("Successfully create user", "alert-success")
+                return redirect(url_for('login'))
             else:
                 flash("User already exists with that Username", "alert-danger")
                 return redirect(url_for('sign_up'))
@@ -251,3 +594,9 @@ def sign_up():
             flash("Username or Password not valid", "alert-danger")
             return redirect(url_for('sign_up'))
     return render_template("sign_up.html", title="Sign Up")
+
+
+@app.route("/sign_up/available", methods=['GET'])
+def username_available():
+    username = request.args.get('username', '')
+    return jsonify(username=username, available=auth.username_available(username))
@@ -0,0 +1,46 @@
+"""
+Fantasy scoring of Cards from their per-game stats
+"""
+from dataclasses import fields
+from typing import Dict, Optional
+
+from app.models import Card
+
+# scores are kept as integers in hundredths of a point so adding and removing Cards never drifts
+SCORE_SCALE = 100
+
+# points per unit of each Card stat
+DEFAULT_WEIGHTS = {
+    "ppointspg": 1.0,
+    "reboundspg": 1.2,
+    "assistspg": 1.5,
+    "stealspg": 3.0,
+    "blockspg": 3.0,
+    "shooting_pct": 10.0,
+    "ft_pct": 5.0,
+}
+
+NUMERIC_CARD_FIELDS = {field.name for field in fields(Card) if field.type in (int, float)} - {"id", "owned"}
+
+
+class ScoringFormula:
+    """
+    ScoringFormula is a weighted sum of Card stat columns. A User's team score is the sum of the scores of the Cards
+    they hold.
+    """
+
+    def __init__(self, weights: Optional[Dict[str, float]] = None):
+        """
+        :param weights: points per unit of each stat, keyed by Card field name, DEFAULT_WEIGHTS if None
+        :raise ValueError: if a weight names something that is not a numeric Card stat
+        """
+        self.weights = dict(DEFAULT_WEIGHTS if weights is None else weights)
+        unknown = set(self.weights) - NUMERIC_CARD_FIELDS
+        if unknown:
+            raise ValueError(f"Not numeric Card stats: {', '.join(sorted(unknown))}")
+
+    def card_points(self, card: Card) -> int:
+        """
+        :return: the score of the Card in hundredths of a point
+        """
+        return round(sum(weight * getattr(card, stat) for stat, weight in self.weights.items()) * SCORE_SCALE)
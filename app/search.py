@@ -0,0 +1,124 @@
+"""
+Accent and case insensitive prefix search over Card and User names
+"""
+import bisect
+import re
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+# the most results an autocomplete query returns
+SEARCH_LIMIT = 10
+# how many distinct queries keep their results cached
+SEARCH_CACHE_SIZE = 1024
+
+# letters and digits, split like the sqlite unicode61 tokenizer which treats "_" as a separator too
+WORD_PATTERN = re.compile(r"[^\W_]+")
+
+
+def fold(text: str) -> str:
+    """
+    Fold text for matching: accents are dropped and case is folded, so "Dončić" and "doncic" compare equal. This is
+    what the scraper does by hand for a fixed list of letters, done for every letter.
+    """
+    decomposed = unicodedata.normalize("NFKD", text)
+    return "".join(c for c in decomposed if not unicodedata.combining(c)).casefold()
+
+
+def search_words(text: str) -> List[str]:
+    """
+    :return: the folded words of text
+    """
+    return WORD_PATTERN.findall(fold(text)) if text else []
+
+
+def fts_prefix_query(text: str) -> Optional[str]:
+    """
+    Build an FTS5 query matching rows with a word starting with every word of text. Words are quoted so nothing the
+    user types is read as query syntax.
+
+    :return: the query, None if text has no words
+    """
+    words = search_words(text)
+    if not words:
+        return None
+    return " ".join(f'"{word}"*' for word in words)
+
+
+class PrefixIndex:
+    """
+    Sorted list of (word, row id) answering the same prefix queries with binary searches, for backends without FTS5
+    """
+
+    def __init__(self):
+        self.entries: List[Tuple[str, int]] = []
+
+    def add(self, row_id: int, text: str) -> None:
+        for word in set(search_words(text)):
+            bisect.insort(self.entries, (word, row_id))
+
+    def remove(self, row_id: int, text: str) -> None:
+        for word in set(search_words(text)):
+            i = bisect.bisect_left(self.entries, (word, row_id))
+            if i < len(self.entries) and self.entries[i] == (word, row_id):
+                del self.entries[i]
+
+    def search(self, text: str, limit: int) -> List[int]:
+        """
+        :return: the ids of at most limit rows with a word starting with every word of text, lowest id first
+        """
+        matches: Optional[Set[int]] = None
+        for word in search_words(text):
+            found = set()
+            i = bisect.bisect_left(self.entries, (word, -1))
+            while i < len(self.entries) and self.entries[i][0].startswith(word):
+                found.add(self.entries[i][1])
+                i += 1
+            matches = found if matches is None else matches & found
+        return sorted(matches)[:limit] if matches else []
+
+
+class SearchCache:
+    """
+    LRU cache of search results keyed by kind and folded query. Adding rows of a kind clears that kind, and results
+    computed while it was being cleared are not stored.
+    """
+
+    def __init__(self, capacity: int = SEARCH_CACHE_SIZE):
+        self.capacity = capacity
+        self.lock = threading.Lock()
+        self.entries: "OrderedDict[Tuple[str, str, int], list]" = OrderedDict()
+        self.generations: Dict[str, int] = {}
+
+    def get(self, kind: str, query: str, limit: int, search: Callable[[], list]) -> list:
+        """
+        :param search: called to get the results when they are not cached
+        :return: the results, shared with other callers so they must not be changed
+        """
+        key = kind, " ".join(search_words(query)), limit
+        with self.lock:
+            results = self.entries.get(key)
+            if results is not None:
+                self.entries.move_to_end(key)
+                return results
+            generation = self.generations.get(kind, 0)
+
+        results = search()
+
+        with self.lock:
+            if self.generations.get(kind, 0) == generation:
+                self.entries[key] = results
+                while len(self.entries) > self.capacity:
+                    self.entries.popitem(last=False)
+        return results
+
+    def clear(self, kind: str) -> None:
+        with self.lock:
+            self.generations[kind] = self.generations.get(kind, 0) + 1
+            for key in [key for key in self.entries if key[0] == kind]:
+                del self.entries[key]
+
+    def stats(self) -> Dict[str, int]:
+        with self.lock:
+            return {"size": len(self.entries), "capacity": self.capacity}
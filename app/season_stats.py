@@ -0,0 +1,211 @@
+"""
+Per-season player stats in a columnar file that is memory mapped. Each stat is one fixed-width float32 array holding,
+for every Card in order of id, one value per season, so the career of a Card is a contiguous slice of each array and
+nothing is read into memory until a page asks for it. Seasons a player did not play have 0 games. The file is built
+from one csv file per season, in the format of the card catalog, and is kept in the byte order of the machine that
+built it.
+
+File layout: the header (magic, first season, seasons, cards, stats), the stat names as STAT_NAME_SIZE bytes each,
+the Card ids as int32, then one float32 array of cards x seasons values per stat.
+"""
+import bisect
+import csv
+import mmap
+import operator
+import os
+import struct
+import threading
+from array import array
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from app import stats_filename
+from app.query_engine import cards_filename
+from app.storage import CARD_CSV_COLUMNS, read_card_rows
+
+MAGIC = b"TCSTATS1"
+HEADER = struct.Struct("<8sIIII")
+# bytes of each stat name in the file
+STAT_NAME_SIZE = 16
+# the stats kept per season, the numeric columns of the card catalog
+STAT_COLUMNS = [(column, header) for column, header, convert in CARD_CSV_COLUMNS if convert is not str]
+# stats that are totals over a season and are summed over a range of seasons, the others are per game or percentages
+# and are averaged weighted by the games played
+TOTAL_STATS = frozenset(column for column, _, convert in CARD_CSV_COLUMNS if convert is int)
+# the season the card catalog holds, the one a new stats file is built from
+CATALOG_SEASON = 2020
+
+
+def read_season(season_filename: str, card_ids: Dict[str, int]) -> Dict[int, Dict[str, float]]:
+    """
+    Read the stats of one season from a csv file in the format of the card catalog
+
+    :param card_ids: the id of every Card by its name, players without a Card are skipped
+    :return: the stats of each Card that played in the season, by Card id
+    """
+    stats = {}
+    with open(season_filename, "r") as season_file:
+        for row in csv.DictReader(season_file):
+            card_id = card_ids.get(row["NAME"])
+            if card_id is not None:
+                stats[card_id] = {column: float(row[header]) for column, header in STAT_COLUMNS}
+    return stats
+
+
+def write_stats(filename: str, seasons: Dict[int, Dict[int, Dict[str, float]]], card_ids: Iterable[int]) -> None:
+    """
+    Write a stats file, replacing the one there atomically so open maps of it keep reading the old one
+
+    :param seasons: the stats of every Card by Card id, by season
+    :param card_ids: the ids of the Cards the file has rows for
+    """
+    card_ids = sorted(card_ids)
+    first_season = min(seasons)
+    count = max(seasons) - first_season + 1
+    columns = []
+    for column, _ in STAT_COLUMNS:
+        values = array("f", bytes(4 * len(card_ids) * count))
+        for season, season_stats in seasons.items():
+            for row, card_id in enumerate(card_ids):
+                stats = season_stats.get(card_id)
+                if stats is not None:
+                    values[row * count + season - first_season] = stats[column]
+        columns.append(values)
+
+    partial_filename = f"{filename}.{os.getpid()}.partial"
+    with open(partial_filename, "wb") as file:
+        file.write(HEADER.pack(MAGIC, first_season, count, len(card_ids), len(STAT_COLUMNS)))
+        for column, _ in STAT_COLUMNS:
+            file.write(column.encode("ascii").ljust(STAT_NAME_SIZE, b"\0"))
+        file.write(array("i", card_ids).tobytes())
+        for values in columns:
+            file.write(values.tobytes())
+    os.replace(partial_filename, filename)
+
+
+def build_stats(filename: str, cards_filename: str, season_filenames: Dict[int, str]) -> None:
+    """
+    Build a stats file from one csv file per season, matching players to Cards by name
+    """
+    card_ids = {row["name"]: card_id for card_id, row in enumerate(read_card_rows(cards_filename), start=1)}
+    seasons = {season: read_season(season_filename, card_ids) for season, season_filename in season_filenames.items()}
+    write_stats(filename, seasons, card_ids.values())
+
+
+class SeasonStats:
+    """
+    SeasonStats reads a stats file through a read only memory map. Opening it only reads the header, the pages of
+    the arrays are loaded by the OS as they are used and are shared by every process mapping the file.
+    """
+
+    def __init__(self, filename: str):
+        with open(filename, "rb") as file:
+            self.map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.first_season, self.seasons, cards, stats = HEADER.unpack_from(self.map)
+        if magic != MAGIC:
+            raise ValueError(f"{filename} is not a stats file")
+        offset = HEADER.size
+        names = [self.map[offset + i * STAT_NAME_SIZE:offset + (i + 1) * STAT_NAME_SIZE].rstrip(b"\0").decode("ascii")
+                 for i in range(stats)]
+        offset += stats * STAT_NAME_SIZE
+        self.view = memoryview(self.map)
+        self.card_ids = self.view[offset:offset + 4 * cards].cast("i")
+        offset += 4 * cards
+        size = 4 * cards * self.seasons
+        self.columns: Dict[str, memoryview] = {}
+        for name in names:
+            self.columns[name] = self.view[offset:offset + size].cast("f")
+            offset += size
+
+    @property
+    def last_season(self) -> int:
+        return self.first_season + self.seasons - 1
+
+    def __row(self, card_id: int) -> Optional[int]:
+        """
+        private function to find the row of a Card by bisecting the sorted Card ids
+        """
+        row = bisect.bisect_left(self.card_ids, card_id)
+        return row if row < len(self.card_ids) and self.card_ids[row] == card_id else None
+
+    def __range(self, row: int, first: int, last: int) -> slice:
+        """
+        private function to get the slice of the arrays holding the seasons first to last of a row
+        """
+        first, last = max(first, self.first_season), min(last, self.last_season)
+        start = row * self.seasons + first - self.first_season
+        return slice(start, start + max(last - first + 1, 0))
+
+    def career(self, card_id: int, stats: Optional[List[str]] = None) -> List[Tuple[int, Dict[str, float]]]:
+        """
+        :param stats: the stats to read, every one if None
+        :return: (season, stats) of every season the Card's player played, oldest first
+        """
+        row = self.__row(card_id)
+        if row is None:
+            return []
+        seasons = self.__range(row, self.first_season, self.last_season)
+        games = self.columns["gp"][seasons]
+        values = {name: self.columns[name][seasons].tolist() for name in stats or self.columns}
+        return [(self.first_season + i, {name: values[name][i] for name in values})
+                for i in range(len(games)) if games[i] > 0]
+
+    def aggregate(self, card_ids: Iterable[int], first: int, last: int,
+                  stats: Optional[List[str]] = None) -> Dict[int, Dict[str, float]]:
+        """
+        Aggregate the seasons first to last of each Card: TOTAL_STATS are summed and the other stats are averaged,
+        weighted by the games played. Each one is computed over the slices of the arrays without a Python loop per
+        season.
+
+        :return: the aggregated stats by Card id, without the Cards whose players did not play in the range
+        """
+        totals = {}
+        gp = self.columns["gp"]
+        for card_id in card_ids:
+            row = self.__row(card_id)
+            if row is None:
+                continue
+            seasons = self.__range(row, first, last)
+            games = gp[seasons]
+            played = sum(games)
+            if played <= 0:
+                continue
+            totals[card_id] = {
+                name: sum(self.columns[name][seasons]) if name in TOTAL_STATS
+                else sum(map(operator.mul, self.columns[name][seasons], games)) / played
+                for name in stats or self.columns
+            }
+        return totals
+
+    def close(self) -> None:
+        self.card_ids.release()
+        for column in self.columns.values():
+            column.release()
+        self.view.release()
+        self.map.close()
+
+
+def open_stats(filename: str, cards_filename: str) -> SeasonStats:
+    """
+    Open the stats file, building it from the card catalog as the CATALOG_SEASON if it does not exist
+    """
+    if not os.path.exists(filename):
+        build_stats(filename, cards_filename, {CATALOG_SEASON: cards_filename})
+    return SeasonStats(filename)
+
+
+# the stats of every process, see get_season_stats()
+season_stats: Optional[SeasonStats] = None
+season_stats_lock = threading.Lock()
+
+
+def get_season_stats() -> SeasonStats:
+    """
+    :return: the stats in stats_filename, opened on first use so that starting a process does not map the file, or
+             build it when it is missing
+    """
+    global season_stats
+    if season_stats is None:
+        with season_stats_lock:
+            if season_stats is None:
+                season_stats = open_stats(stats_filename, cards_filename)
+    return season_stats
@@ -0,0 +1,1181 @@
+"""
+Storage backends for the QueryEngine. A backend hands out transactions, the QueryEngine keeps the game rules and only
+talks to storage through the StorageTransaction methods below.
+"""
+import csv
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from contextlib import closing, contextmanager
+from datetime import datetime
+from typing import Any, Callable, ContextManager, Dict, Iterator, List, Optional, Set, Tuple, Type
+
+from app.market import MARKET_PERIODS, bucket_start, tally
+from app.models import Card, Trade, User, ArchivedTrade, Dashboard, CardActivity, MarketBucket, CARD_SUMMARY_COLUMNS, \
+    MARKET_STATS, EVENT_ACQUIRE, create_card, create_trade, create_user, create_archived_trade, create_dashboard, \
+    trade_summary_row, NoOutputError, ConflictError
+from app.search import fts_prefix_query
+from app.write_queue import WriteQueue
+
+# columns of Cards that are loaded from the csv file, in insert order, with the csv header each one comes from
+CARD_CSV_COLUMNS = [
+    ("name", "NAME", str), ("team", "TEAM", str), ("pos", "POS", str), ("age", "AGE", float), ("gp", "GP", int),
+    ("mpg", "MPG", float), ("fta", "FTA", int), ("ft_pct", "FTpct", float), ("two_pa", "2PA", int),
+    ("two_p_pct", "2Ppct", float), ("three_pa", "3PA", int), ("three_p_pct", "3Ppct", float),
+    ("shooting_pct", "SHOOTINGpct", float), ("ppointspg", "PPOINTSPG", float), ("reboundspg", "REBOUNDSPG", float),
+    ("assistspg", "ASSISTSPG", float), ("stealspg", "STEALSPG", float), ("blockspg", "BLOCKSPG", float),
+    ("image", "IMAGE", str),
+]
+
+# the counter columns of CardMarket and MarketRollups, with the parts of the statements that add to them and sum them
+MARKET_COLUMNS = ", ".join(MARKET_STATS)
+MARKET_VALUES = ", ".join("?" * len(MARKET_STATS))
+MARKET_UPDATES = ", ".join(f"{stat} = {stat} + excluded.{stat}" for stat in MARKET_STATS)
+MARKET_SUMS = ", ".join(f"sum({stat})" for stat in MARKET_STATS)
+# the Cards with the most of a stat over all time, a scan of CardMarket, which has at most a row per Card
+MARKET_LEADERS = f"select CardMarket.card_id, Cards.name, {MARKET_COLUMNS}, held_since from CardMarket " \
+                 f"join Cards on Cards.id = CardMarket.card_id where {{stat}} > 0 " \
+                 f"order by {{stat}} desc, CardMarket.card_id limit ?"
+
+# columns added after the first release as (table, column, definition), applied to databases created before them
+ADDED_COLUMNS = [
+    ("Cards", "owner", "integer references Users"),
+    ("Users", "version", "integer not null default 0"),
+    ("Trades", "version", "integer not null default 0"),
+    ("Trades", "created", "timestamp"),
+    ("Trades", "updated", "timestamp"),
+    ("Cards", "points", "integer"),
+    ("Users", "score", "integer not null default 0"),
+]
+
+# bump when the example data loaded into new databases changes, so images holding the old data are not restored
+IMAGE_FORMAT = 1
+
+
+def json_list_adapter(l: List) -> bytes:
+    return json.dumps(l).encode("utf-8")
+
+
+def json_list_converter(data: bytes) -> List[int]:
+    return json.loads(data.decode("utf-8"))
+
+
+sqlite3.register_adapter(list, json_list_adapter)
+sqlite3.register_converter("json", json_list_converter)
+
+
+def read_card_rows(cards_filename: str) -> Iterator[Dict[str, Any]]:
+    """
+    Read the card catalog csv file
+
+    :return: one dict per card, keyed by Cards column name, with the values converted to their column types
+    """
+    with open(cards_filename, 'r') as cards_file:
+        for row in csv.DictReader(cards_file):
+            yield {column: convert(row[header]) for column, header, convert in CARD_CSV_COLUMNS}
+
+
+def database_image_filename(image_dir: str, schema_filename: str, cards_filename: str) -> str:
+    """
+    :return: the prebuilt database image for the current schema, Card data and example data. Its name carries a hash
+        of them, so an image built from anything else is never restored.
+    """
+    digest = hashlib.sha256(str(IMAGE_FORMAT).encode("utf-8"))
+    for filename in (schema_filename, cards_filename):
+        with open(filename, 'rb') as file:
+            digest.update(file.read())
+    return os.path.join(image_dir, f"trading_card_image-{digest.hexdigest()[:16]}.db")
+
+
+class StorageTransaction(ABC):
+    """
+    The operations a backend supports inside one transaction. Lookups raise NoOutputError when the row is missing and
+    the version checked updates raise ConflictError when the row changed since it was read.
+    """
+
+    def __init__(self):
+        # ids of the Users whose rows this transaction changed, so caches can drop them once it commits
+        self.touched_users: Set[int] = set()
+        # seq of the last ownership event this transaction appended, None if it appended none
+        self.last_event_seq: Optional[int] = None
+        # (user_id, old score, new score) of every team score this transaction changed, old is None for new Users and
+        # new is None for deleted ones
+        self.score_changes: List[Tuple[int, Optional[int], Optional[int]]] = []
+        # (user ids, event) to publish to those Users once this transaction has committed
+        self.notifications: List[Tuple[Set[int], Dict[str, Any]]] = []
+        # ids of the Users whose Dashboards this transaction made stale without changing their rows, the Dashboards
+        # of the touched Users are refreshed as well
+        self.stale_dashboards: Set[int] = set()
+        # (card_id, move) of every market move this transaction made, in order, added to the market roll-ups before it
+        # commits
+        self.market_moves: List[Tuple[int, str]] = []
+
+    @abstractmethod
+    def get_card(self, card_id: int) -> Card:
+        ...
+
+    @abstractmethod
+    def get_card_by_name(self, card_name: str) -> Card:
+        ...
+
+    @abstractmethod
+    def all_cards(self) -> List[Card]:
+        ...
+
+    @abstractmethod
+    def available_cards(self) -> List[Card]:
+        ...
+
+    @abstractmethod
+    def get_user(self, user_id: int) -> User:
+        ...
+
+    @abstractmethod
+    def get_user_by_name(self, username: str) -> User:
+        ...
+
+    @abstractmethod
+    def user_exists(self, username: str) -> bool:
+        ...
+
+    @abstractmethod
+    def all_users(self) -> List[User]:
+        ...
+
+    @abstractmethod
+    def card_names(self, card_ids: Set[int]) -> Dict[int, str]:
+        """
+        :return: the names of the Cards with the ids as {card_id: name}, ids of no Card are left out
+        """
+
+    @abstractmethod
+    def user_names(self, user_ids: Set[int]) -> Dict[int, str]:
+        """
+        :return: the names of the Users with the ids as {user_id: name}, ids of no User are left out
+        """
+
+    @abstractmethod
+    def cards_after(self, after_id: int, limit: int) -> List[Card]:
+        """
+        :return: at most limit Cards with an id above after_id, by id
+        """
+
+    @abstractmethod
+    def users_after(self, after_id: int, limit: int) -> List[User]:
+        """
+        :return: at most limit Users with an id above after_id, by id
+        """
+
+    @abstractmethod
+    def trades_after(self, after_id: int, limit: int) -> List[Trade]:
+        """
+        :return: at most limit Trades with an id above after_id, by id
+        """
+
+    @abstractmethod
+    def get_trade(self, trade_id: int) -> Trade:
+        ...
+
+    @abstractmethod
+    def find_trade(self, user1_id: int, user1_cards: List[int], user2_id: int, user2_cards: List[int],
+                   user1_confirmed: Optional[bool] = None, user2_confirmed: Optional[bool] = None) -> Optional[Trade]:
+        """
+        Find a Trade by its values. The card lists are compared in order. The confirmed flags are only compared when
+        they are given.
+        """
+
+    @abstractmethod
+    def insert_user(self, username: str, hashed_pass: str, access: int, last_seen: datetime) -> int:
+        """
+        Insert a User with no cards, no trades and a score of 0
+
+        :return: the id of the new User
+        :raise sqlite3.IntegrityError: if the username is taken
+        """
+
+    @abstractmethod
+    def restore_user(self, u: User) -> None:
+        """
+        Insert a User as it was exported, keeping its id, cards and trades, with a score of 0. The Cards it holds
+        become owned by it.
+        """
+
+    @abstractmethod
+    def restore_trade(self, t: Trade) -> None:
+        """
+        Insert a Trade as it was exported, keeping its id, confirmations and times
+        """
+
+    @abstractmethod
+    def delete_user(self, user_id: int) -> None:
+        """
+        Delete a User and its wants. The User must not hold Cards or Trades any more.
+        """
+
+    @abstractmethod
+    def set_last_seen(self, user_id: int, last_seen: datetime) -> None:
+        ...
+
+    @abstractmethod
+    def set_user_cards(self, u: User, cards: List[int]) -> None:
+        """
+        Replace the card ids of the User if it is still at u.version, then bump u.version
+        """
+
+    @abstractmethod
+    def set_user_trades(self, u: User, trades: List[int]) -> None:
+        """
+        Replace the trade ids of the User if it is still at u.version, then bump u.version
+        """
+
+    @abstractmethod
+    def claim_card(self, card_id: int, user_id: int) -> bool:
+        """
+        Make the User the owner of the Card if nobody owns it
+
+        :return: true if the User now owns the Card
+        """
+
+    @abstractmethod
+    def release_card(self, card_id: int, user_id: int) -> None:
+        """
+        Clear the owner of the Card
+
+        :raise ConflictError: if the Card is not owned by the User
+        """
+
+    @abstractmethod
+    def set_card_owned(self, card_id: int, owned: bool) -> None:
+        ...
+
+    @abstractmethod
+    def insert_trade(self, user1_id: int, user1_cards: List[int], user2_id: int, user2_cards: List[int]) -> int:
+        """
+        Insert a Trade with its created and updated times set to now
+
+        :return: the id of the new Trade
+        """
+
+    @abstractmethod
+    def set_trade_confirmed(self, t: Trade, user_number: int, confirmed: bool) -> None:
+        """
+        Set user1_confirmed or user2_confirmed of the Trade if it is still at t.version, then bump t.version and set
+        its updated time to now
+
+        :param user_number: 1 or 2
+        """
+
+    @abstractmethod
+    def archive_trade(self, trade_id: int, status: str) -> None:
+        """
+        Move the Trade out of the Trades table into the archive
+
+        :param status: why the Trade left, one of the TRADE_ constants of app.models
+        """
+
+    @abstractmethod
+    def stale_trade_ids(self, updated_before: datetime, limit: int) -> List[int]:
+        """
+        :return: the ids of at most limit Trades last updated before updated_before, oldest first
+        """
+
+    @abstractmethod
+    def archived_trades(self, user_id: int, before_archive_id: Optional[int], limit: int) -> List[ArchivedTrade]:
+        """
+        Page through the archived Trades of a User, newest first
+
+        :param before_archive_id: only return archive entries older than this one, None for the first page
+        """
+
+    @abstractmethod
+    def append_event(self, kind: str, user_id: Optional[int], card_id: Optional[int] = None,
+                     trade_id: Optional[int] = None) -> int:
+        """
+        Append an entry to the ownership ledger and set last_event_seq
+
+        :param kind: one of the EVENT_ constants of app.models
+        :return: the seq of the new entry, seqs only ever increase
+        """
+
+    @abstractmethod
+    def event_seq_at(self, at: datetime) -> int:
+        """
+        :return: the seq of the last ownership event recorded at or before at, 0 if there is none
+        """
+
+    @abstractmethod
+    def ownership_changes(self, after_seq: int, until_seq: int) -> Iterator[Tuple[str, int, int]]:
+        """
+        :return: (kind, user_id, card_id) of the acquire and drop events with after_seq < seq <= until_seq, in seq
+            order
+        """
+
+    @abstractmethod
+    def latest_snapshot_seq(self) -> int:
+        """
+        :return: the seq the latest ownership snapshot was taken at, 0 if there is none
+        """
+
+    @abstractmethod
+    def snapshot_ownership(self, seq: int) -> None:
+        """
+        Record the current owner of every owned Card as the state of the ledger after the event seq
+        """
+
+    @abstractmethod
+    def snapshot_at(self, seq: int) -> Tuple[int, Dict[int, int]]:
+        """
+        :return: the seq of the latest snapshot taken at or before seq and its owners as {card_id: user_id}, (0, {})
+            if there is none
+        """
+
+    @abstractmethod
+    def add_user_score(self, user_id: int, delta: int) -> None:
+        """
+        Add delta to the team score of the User and record the change in score_changes
+        """
+
+    @abstractmethod
+    def set_card_points(self, points: Dict[int, int]) -> None:
+        """
+        :param points: the new score of each Card as {card_id: points}
+        """
+
+    @abstractmethod
+    def rescore_users(self) -> None:
+        """
+        Set the team score of every User to the sum of the points of the Cards they own
+        """
+
+    @abstractmethod
+    def score_counts(self) -> List[Tuple[int, int]]:
+        """
+        :return: (score, number of Users with that score) for every score some User has
+        """
+
+    @abstractmethod
+    def top_users(self, after: Optional[Tuple[int, int]], limit: int) -> List[User]:
+        """
+        Page through the Users by team score, highest first and by id among equal scores
+
+        :param after: (score, user_id) of the last User of the previous page, None for the first page
+        """
+
+    @abstractmethod
+    def add_want(self, user_id: int, card_id: int) -> None:
+        """
+        Record that the User wants the Card, does nothing if they already do
+        """
+
+    @abstractmethod
+    def remove_want(self, user_id: int, card_id: int) -> None:
+        ...
+
+    @abstractmethod
+    def user_wants(self, user_id: int) -> List[int]:
+        """
+        :return: the ids of the Cards the User wants
+        """
+
+    @abstractmethod
+    def want_edges(self, user_id: int) -> List[Tuple[int, int]]:
+        """
+        :return: (card_id, owner_id) for every owned Card the User wants
+        """
+
+    @abstractmethod
+    def wanters_of_cards_of(self, user_id: int) -> List[Tuple[int, int]]:
+        """
+        :return: (wanter_id, card_id) for every User wanting one of the Cards the User owns
+        """
+
+    @abstractmethod
+    def search_cards(self, text: str, limit: int) -> List[Card]:
+        """
+        :return: at most limit Cards whose name, team or position has a word starting with every word of text,
+            ignoring case and accents
+        """
+
+    @abstractmethod
+    def search_users(self, text: str, limit: int) -> List[User]:
+        """
+        :return: at most limit Users whose name has a word starting with every word of text, ignoring case and accents
+        """
+
+    def refresh_dashboards(self, user_ids: Set[int]) -> None:
+        """
+        Bring the stored Dashboards of the Users up to date with their Cards and Trades, and drop those of Users that
+        no longer exist. Backends that build Dashboards when they are read need not store anything.
+        """
+        pass
+
+    @abstractmethod
+    def dashboard(self, user_id: int) -> Dashboard:
+        """
+        :raise NoOutputError: if there is no User with the id
+        """
+
+    @abstractmethod
+    def record_market(self, moves: List[Tuple[int, str]], at: datetime) -> None:
+        """
+        Add market moves to the counters of their Cards and to the buckets of every roll-up period at falls in
+
+        :param moves: (card_id, one of the MARKET_ moves of app.models) in the order they were made
+        """
+
+    @abstractmethod
+    def card_activity(self, card_id: int) -> CardActivity:
+        """
+        :return: the market counters of the Card over all time, all 0 if it never moved
+        :raise NoOutputError: if there is no Card with the id
+        """
+
+    @abstractmethod
+    def market_leaders(self, stat: str, limit: int) -> List[CardActivity]:
+        """
+        :param stat: one of MARKET_STATS of app.models
+        :return: at most limit Cards with the highest non-zero stat over all time, highest first and by id among equal
+            ones
+        """
+
+    @abstractmethod
+    def market_window(self, period: str, since: datetime, stat: str, limit: int) -> List[CardActivity]:
+        """
+        Add up the buckets of a roll-up period starting at or after since per Card
+
+        :param period: one of the MARKET_PERIODS of app.market
+        :return: at most limit Cards with the highest non-zero stat in the buckets, highest first and by id among equal
+            ones
+        """
+
+    @abstractmethod
+    def market_buckets(self, period: str, since: datetime) -> List[MarketBucket]:
+        """
+        :return: the totals over all Cards of every bucket of the period starting at or after since that has any,
+            oldest first
+        """
+
+    def log_changes(self, origin: str, changes: List[Tuple[str, Optional[int]]], keep: int) -> None:
+        """
+        Append to the change log that other processes sharing the store read, and drop all but its last keep rows.
+        Only used by shared backends, a store no other process writes to keeps no log.
+
+        :param origin: the process making the changes
+        :param changes: (kind, row id) of each thing the changes made stale in caches
+        """
+
+    def last_change_seq(self) -> int:
+        """
+        :return: the seq of the latest change logged, 0 if there is none
+        """
+        return 0
+
+    def changes_after(self, seq: int) -> Optional[List[Tuple[int, str, str, Optional[int]]]]:
+        """
+        :return: (seq, origin, kind, row id) of the changes logged after seq in seq order, None if some of them have
+            been dropped already
+        """
+        return []
+
+
+class StorageBackend(ABC):
+    """
+    Base class for the places a QueryEngine can keep its data
+    """
+
+    # whether other processes may write to the store as well, their writes are found through the change log
+    shared = False
+
+    @abstractmethod
+    def initialize(self) -> bool:
+        """
+        Create the store if needed and bring it up to the current schema
+
+        :return: true if the store was created empty and needs its example data
+        """
+
+    @abstractmethod
+    def read(self) -> ContextManager[StorageTransaction]:
+        """
+        :return: a context manager giving a transaction for reads only
+        """
+
+    def snapshot(self) -> ContextManager[StorageTransaction]:
+        """
+        :return: a context manager giving a transaction for reads only that sees one state of the store however long
+            it is held, while writes go on
+        """
+        return self.read()
+
+    @abstractmethod
+    def write(self, command: Callable[[StorageTransaction], Any]) -> Any:
+        """
+        Run the command atomically. Either all of its changes are kept or, if it raises, none of them are.
+
+        :return: the result of the command
+        """
+
+    def data_changed(self) -> bool:
+        """
+        :return: whether anything may have been committed to the store since the last call, cheap enough to call
+            often
+        """
+        return True
+
+    def close(self) -> None:
+        pass
+
+
+class SQLiteTransaction(StorageTransaction):
+    """
+    StorageTransaction over an open sqlite3 connection
+    """
+
+    def __init__(self, conn: sqlite3.Connection):
+        super().__init__()
+        self.conn = conn
+
+    def get_card(self, card_id: int) -> Card:
+        query = "select * from Cards where id = ?"
+        output = self.conn.execute(query, (card_id,)).fetchone()
+        if output is None:
+            raise NoOutputError(query, f"No Card with id: {card_id}")
+        return create_card(output)
+
+    def get_card_by_name(self, card_name: str) -> Card:
+        query = "select * from Cards where name = ?"
+        output = self.conn.execute(query, (card_name,)).fetchone()
+        if output is None:
+            raise NoOutputError(query, f"No Card with name: {card_name}")
+        return create_card(output)
+
+    def all_cards(self) -> List[Card]:
+        return [create_card(row) for row in self.conn.execute("select * from Cards")]
+
+    def available_cards(self) -> List[Card]:
+        return [create_card(row) for row in self.conn.execute("select * from Cards where owned = 0")]
+
+    def get_user(self, user_id: int) -> User:
+        query = "select * from Users where id = ?"
+        output = self.conn.execute(query, (user_id,)).fetchone()
+        if output is None:
+            raise NoOutputError(query, f"No User with id: {user_id}")
+        return create_user(output)
+
+    def get_user_by_name(self, username: str) -> User:
+        query = "select * from Users where name = ?"
+        output = self.conn.execute(query, (username,)).fetchone()
+        if output is None:
+            raise NoOutputError(query, f"No User with username: {username}")
+        return create_user(output)
+
+    def user_exists(self, username: str) -> bool:
+        return self.conn.execute("select 1 from Users where name = ?", (username,)).fetchone() is not None
+
+    def all_users(self) -> List[User]:
+        return [create_user(row) for row in self.conn.execute("select * from Users")]
+
+    def card_names(self, card_ids: Set[int]) -> Dict[int, str]:
+        query = "select id, name from Cards where id in (select value from json_each(?))"
+        return dict(self.conn.execute(query, (json.dumps(sorted(card_ids)),)))
+
+    def user_names(self, user_ids: Set[int]) -> Dict[int, str]:
+        query = "select id, name from Users where id in (select value from json_each(?))"
+        return dict(self.conn.execute(query, (json.dumps(sorted(user_ids)),)))
+
+    def cards_after(self, after_id: int, limit: int) -> List[Card]:
+        rows = self.conn.execute("select * from Cards where id > ? order by id limit ?", (after_id, limit))
+        return [create_card(row) for row in rows]
+
+    def users_after(self, after_id: int, limit: int) -> List[User]:
+        rows = self.conn.execute("select * from Users where id > ? order by id limit ?", (after_id, limit))
+        return [create_user(row) for row in rows]
+
+    def trades_after(self, after_id: int, limit: int) -> List[Trade]:
+        rows = self.conn.execute("select * from Trades where id > ? order by id limit ?", (after_id, limit))
+        return [create_trade(row) for row in rows]
+
+    def get_trade(self, trade_id: int) -> Trade:
+        query = "select * from Trades where id = ?"
+        output = self.conn.execute(query, (trade_id,)).fetchone()
+        if output is None:
+            raise NoOutputError(query, f"No Trade with id: {trade_id}")
+        return create_trade(output)
+
+    def find_trade(self, user1_id: int, user1_cards: List[int], user2_id: int, user2_cards: List[int],
+                   user1_confirmed: Optional[bool] = None, user2_confirmed: Optional[bool] = None) -> Optional[Trade]:
+        query = "select * from Trades where user1_id = ? and user1_cards = ? and user2_id = ? and user2_cards = ?"
+        data = [user1_id, list(user1_cards), user2_id, list(user2_cards)]
+        if user1_confirmed is not None:
+            query += " and user1_confirmed = ?"
+            data.append(user1_confirmed)
+        if user2_confirmed is not None:
+            query += " and user2_confirmed = ?"
+            data.append(user2_confirmed)
+        output = self.conn.execute(query + " limit 1", data).fetchone()
+        return None if output is None else create_trade(output)
+
+    def insert_user(self, username: str, hashed_pass: str, access: int, last_seen: datetime) -> int:
+        query = "insert into Users (name, hashed_pass, access, last_seen, cards, trades) values (?, ?, ?, ?, ?, ?)"
+        data = str(username), str(hashed_pass), int(access), last_seen, list(), list()
+        user_id = self.conn.execute(query, data).lastrowid
+        self.touched_users.add(user_id)
+        self.score_changes.append((user_id, None, 0))
+        return user_id
+
+    def restore_user(self, u: User) -> None:
+        query = "insert into Users (id, name, hashed_pass, access, last_seen, cards, trades) values (?, ?, ?, ?, ?, ?, ?)"
+        self.conn.execute(query, (u.unique_id, u.name, u.hashed_pass, int(u.access), u.last_seen, sorted(u.cards),
+                                  sorted(u.trades)))
+        self.conn.executemany("update Cards set owned = 1, owner = ? where id = ?",
+                              [(u.unique_id, card_id) for card_id in u.cards])
+        self.touched_users.add(u.unique_id)
+        self.score_changes.append((u.unique_id, None, 0))
+
+    def restore_trade(self, t: Trade) -> None:
+        query = "insert into Trades (id, user1_id, user1_cards, user1_confirmed, user2_id, user2_cards, " \
+                "user2_confirmed, created, updated) values (?, ?, ?, ?, ?, ?, ?, ?, ?)"
+        self.conn.execute(query, (t.unique_id, t.user1_id, sorted(t.user1_cards), t.user1_confirmed, t.user2_id,
+                                  sorted(t.user2_cards), t.user2_confirmed, t.created, t.updated))
+
+    def delete_user(self, user_id: int) -> None:
+        u = self.get_user(user_id)
+        self.conn.execute("delete from Wants where user_id = ?", (u.unique_id,))
+        self.conn.execute("delete from Dashboards where user_id = ?", (u.unique_id,))
+        self.conn.execute("delete from Users where id = ?", (u.unique_id,))
+        self.touched_users.add(u.unique_id)
+        self.score_changes.append((u.unique_id, u.score, None))
+
+    def set_last_seen(self, user_id: int, last_seen: datetime) -> None:
+        self.conn.execute("update Users set last_seen = ? where id = ?", (last_seen, user_id))
+
+    def set_user_cards(self, u: User, cards: List[int]) -> None:
+        query = "update Users set cards = ?, version = version + 1 where id = ? and version = ?"
+        if self.conn.execute(query, (cards, u.unique_id, u.version)).rowcount != 1:
+            raise ConflictError("Users", u.unique_id)
+        self.touched_users.add(u.unique_id)
+        u.cards = set(cards)
+        u.version += 1
+
+    def set_user_trades(self, u: User, trades: List[int]) -> None:
+        query = "update Users set trades = ?, version = version + 1 where id = ? and version = ?"
+        if self.conn.execute(query, (trades, u.unique_id, u.version)).rowcount != 1:
+            raise ConflictError("Users", u.unique_id)
+        self.touched_users.add(u.unique_id)
+        u.trades = set(trades)
+        u.version += 1
+
+    def claim_card(self, card_id: int, user_id: int) -> bool:
+        query = "update Cards set owner = ?, owned = 1 where id = ? and owner is null"
+        return self.conn.execute(query, (user_id, card_id)).rowcount == 1
+
+    def release_card(self, card_id: int, user_id: int) -> None:
+        query = "update Cards set owner = null, owned = 0 where id = ? and owner = ?"
+        if self.conn.execute(query, (card_id, user_id)).rowcount != 1:
+            raise ConflictError("Cards", card_id)
+
+    def set_card_owned(self, card_id: int, owned: bool) -> None:
+        if owned:
+            self.conn.execute("update Cards set owned = 1 where id = ?", (card_id,))
+        else:
+            self.conn.execute("update Cards set owned = 0, owner = null where id = ?", (card_id,))
+
+    def insert_trade(self, user1_id: int, user1_cards: List[int], user2_id: int, user2_cards: List[int]) -> int:
+        query = "insert into Trades (user1_id, user1_cards, user2_id, user2_cards, created, updated) " \
+                "values (?, ?, ?, ?, ?, ?)"
+        now = datetime.utcnow()
+        data = int(user1_id), list(user1_cards), int(user2_id), list(user2_cards), now, now
+        return self.conn.execute(query, data).lastrowid
+
+    def set_trade_confirmed(self, t: Trade, user_number: int, confirmed: bool) -> None:
+        column = {1: "user1_confirmed", 2: "user2_confirmed"}[user_number]
+        query = f"update Trades set {column} = ?, version = version + 1, updated = ? where id = ? and version = ?"
+        now = datetime.utcnow()
+        if self.conn.execute(query, (confirmed, now, t.unique_id, t.version)).rowcount != 1:
+            raise ConflictError("Trades", t.unique_id)
+        setattr(t, column, confirmed)
+        t.version += 1
+        t.updated = now
+        self.stale_dashboards.update((t.user1_id, t.user2_id))
+
+    def archive_trade(self, trade_id: int, status: str) -> None:
+        self.conn.execute("insert into TradeArchive (trade_id, user1_id, user1_cards, user1_confirmed, user2_id, "
+                          "user2_cards, user2_confirmed, created, updated, archived, status) "
+                          "select id, user1_id, user1_cards, user1_confirmed, user2_id, user2_cards, user2_confirmed, "
+                          "created, updated, ?, ? from Trades where id = ?", (datetime.utcnow(), status, trade_id))
+        self.conn.execute("delete from Trades where id = ?", (trade_id,))
+
+    def stale_trade_ids(self, updated_before: datetime, limit: int) -> List[int]:
+        query = "select id from Trades where updated < ? order by updated limit ?"
+        return [row[0] for row in self.conn.execute(query, (updated_before, limit))]
+
+    def archived_trades(self, user_id: int, before_archive_id: Optional[int], limit: int) -> List[ArchivedTrade]:
+        query = "select * from TradeArchive where (user1_id = ? or user2_id = ?) and archive_id < ? " \
+                "order by archive_id desc limit ?"
+        before = before_archive_id if before_archive_id is not None else 2 ** 63 - 1
+        rows = self.conn.execute(query, (user_id, user_id, before, limit))
+        return [create_archived_trade(row) for row in rows]
+
+    def append_event(self, kind: str, user_id: Optional[int], card_id: Optional[int] = None,
+                     trade_id: Optional[int] = None) -> int:
+        query = "insert into OwnershipEvents (at, kind, user_id, card_id, trade_id) values (?, ?, ?, ?, ?)"
+        self.last_event_seq = self.conn.execute(query, (datetime.utcnow(), kind, user_id, card_id, trade_id)).lastrowid
+        return self.last_event_seq
+
+    def event_seq_at(self, at: datetime) -> int:
+        row = self.conn.execute("select max(seq) from OwnershipEvents where at <= ?", (at,)).fetchone()
+        return row[0] or 0
+
+    def ownership_changes(self, after_seq: int, until_seq: int) -> Iterator[Tuple[str, int, int]]:
+        query = "select kind, user_id, card_id from OwnershipEvents " \
+                "where seq > ? and seq <= ? and card_id is not null order by seq"
+        return self.conn.execute(query, (after_seq, until_seq))
+
+    def latest_snapshot_seq(self) -> int:
+        return self.conn.execute("select max(seq) from OwnershipSnapshots").fetchone()[0] or 0
+
+    def snapshot_ownership(self, seq: int) -> None:
+        owners = [list(row) for row in self.conn.execute("select id, owner from Cards where owner is not null")]
+        self.conn.execute("insert or replace into OwnershipSnapshots (seq, taken, owners) values (?, ?, ?)",
+                          (seq, datetime.utcnow(), owners))
+
+    def snapshot_at(self, seq: int) -> Tuple[int, Dict[int, int]]:
+        query = "select seq, owners from OwnershipSnapshots where seq <= ? order by seq desc limit 1"
+        row = self.conn.execute(query, (seq,)).fetchone()
+        if row is None:
+            return 0, {}
+        return row[0], {card_id: user_id for card_id, user_id in row[1]}
+
+    def add_user_score(self, user_id: int, delta: int) -> None:
+        self.conn.execute("update Users set score = score + ? where id = ?", (delta, user_id))
+        score = self.conn.execute("select score from Users where id = ?", (user_id,)).fetchone()[0]
+        self.touched_users.add(user_id)
+        self.score_changes.append((user_id, score - delta, score))
+
+    def set_card_points(self, points: Dict[int, int]) -> None:
+        self.conn.executemany("update Cards set points = ? where id = ?",
+                              [(card_points, card_id) for card_id, card_points in points.items()])
+
+    def rescore_users(self) -> None:
+        # one update per owner, a correlated subquery per User would be far slower on many Users
+        self.conn.execute("update Users set score = 0 where score != 0")
+        totals = self.conn.execute("select owner, sum(points) from Cards where owner is not null group by owner")
+        self.conn.executemany("update Users set score = ? where id = ?", [(total, owner) for owner, total in totals])
+
+    def score_counts(self) -> List[Tuple[int, int]]:
+        return self.conn.execute("select score, count(*) from Users group by score").fetchall()
+
+    def top_users(self, after: Optional[Tuple[int, int]], limit: int) -> List[User]:
+        if after is None:
+            rows = self.conn.execute("select * from Users order by score desc, id limit ?", (limit,))
+        else:
+            # score <= ? bounds the walk over users_score, the or alone would read it from the top
+            query = "select * from Users where score <= ? and (score < ? or id > ?) order by score desc, id limit ?"
+            rows = self.conn.execute(query, (after[0], after[0], after[1], limit))
+        return [create_user(row) for row in rows]
+
+    def add_want(self, user_id: int, card_id: int) -> None:
+        self.conn.execute("insert or ignore into Wants (user_id, card_id) values (?, ?)", (user_id, card_id))
+
+    def remove_want(self, user_id: int, card_id: int) -> None:
+        self.conn.execute("delete from Wants where user_id = ? and card_id = ?", (user_id, card_id))
+
+    def user_wants(self, user_id: int) -> List[int]:
+        return [row[0] for row in self.conn.execute("select card_id from Wants where user_id = ?", (user_id,))]
+
+    def want_edges(self, user_id: int) -> List[Tuple[int, int]]:
+        query = "select Wants.card_id, Cards.owner from Wants join Cards on Cards.id = Wants.card_id " \
+                "where Wants.user_id = ? and Cards.owner is not null"
+        return self.conn.execute(query, (user_id,)).fetchall()
+
+    def wanters_of_cards_of(self, user_id: int) -> List[Tuple[int, int]]:
+        query = "select Wants.user_id, Wants.card_id from Cards join Wants on Wants.card_id = Cards.id " \
+                "where Cards.owner = ?"
+        return self.conn.execute(query, (user_id,)).fetchall()
+
+    def log_changes(self, origin: str, changes: List[Tuple[str, Optional[int]]], keep: int) -> None:
+        self.conn.executemany("insert into Changes (origin, kind, row_id) values (?, ?, ?)",
+                              [(origin, kind, row_id) for kind, row_id in changes])
+        self.conn.execute("delete from Changes where seq <= ?", (self.last_change_seq() - keep,))
+
+    def last_change_seq(self) -> int:
+        return self.conn.execute("select max(seq) from Changes").fetchone()[0] or 0
+
+    def changes_after(self, seq: int) -> Optional[List[Tuple[int, str, str, Optional[int]]]]:
+        changes = self.conn.execute("select seq, origin, kind, row_id from Changes where seq > ? order by seq",
+                                    (seq,)).fetchall()
+        if changes and changes[0][0] != seq + 1:
+            return None
+        return changes
+
+    def search_cards(self, text: str, limit: int) -> List[Card]:
+        match = fts_prefix_query(text)
+        if match is None:
+            return []
+        # no order by, so the full text index stops after limit matches instead of ranking all of them
+        query = "select Cards.* from CardSearch join Cards on Cards.id = CardSearch.rowid " \
+                "where CardSearch match ? limit ?"
+        return [create_card(row) for row in self.conn.execute(query, (match, limit))]
+
+    def search_users(self, text: str, limit: int) -> List[User]:
+        match = fts_prefix_query(text)
+        if match is None:
+            return []
+        query = "select Users.* from UserSearch join Users on Users.id = UserSearch.rowid " \
+                "where UserSearch match ? limit ?"
+        return [create_user(row) for row in self.conn.execute(query, (match, limit))]
+
+    def refresh_dashboards(self, user_ids: Set[int]) -> None:
+        for user_id in user_ids:
+            row = self.conn.execute("select cards, trades from Users where id = ?", (user_id,)).fetchone()
+            if row is None:
+                self.conn.execute("delete from Dashboards where user_id = ?", (user_id,))
+                continue
+            card_rows, trade_rows = self.__dashboard_rows(user_id, row[0], row[1])
+            self.conn.execute("insert or replace into Dashboards (user_id, cards, trades) values (?, ?, ?)",
+                              (user_id, card_rows, trade_rows))
+
+    def dashboard(self, user_id: int) -> Dashboard:
+        row = self.conn.execute("select cards, trades from Dashboards where user_id = ?", (user_id,)).fetchone()
+        if row is not None:
+            return create_dashboard(user_id, row[0], row[1])
+        # a User written before its Dashboard was stored, which migrate_database() should have prevented
+        u = self.get_user(user_id)
+        return create_dashboard(user_id, *self.__dashboard_rows(user_id, sorted(u.cards), sorted(u.trades)))
+
+    def __dashboard_rows(self, user_id: int, card_ids: List[int], trade_ids: List[int]) -> Tuple[List, List]:
+        """
+        private function to read the rows of the Dashboard of a User holding the Cards and Trades
+        """
+        query = f"select {', '.join(CARD_SUMMARY_COLUMNS)} from Cards " \
+                f"where id in (select value from json_each(?)) order by id"
+        card_rows = [list(row) for row in self.conn.execute(query, (json.dumps(card_ids),))]
+        query = "select Trades.*, Users.name from Trades join Users " \
+                "on Users.id = case when Trades.user1_id = ? then Trades.user2_id else Trades.user1_id end " \
+                "where Trades.id in (select value from json_each(?)) order by Trades.id"
+        trade_rows = [trade_summary_row(create_trade(row[:-1]), user_id, row[-1])
+                      for row in self.conn.execute(query, (user_id, json.dumps(trade_ids)))]
+        return card_rows, trade_rows
+
+    def record_market(self, moves: List[Tuple[int, str]], at: datetime) -> None:
+        def held_since(card_id: int) -> Optional[datetime]:
+            row = self.conn.execute("select held_since from CardMarket where card_id = ?", (card_id,)).fetchone()
+            return row[0] if row is not None else None
+
+        counters, starts = tally(moves, at, held_since)
+        self.conn.executemany(f"insert into CardMarket (card_id, {MARKET_COLUMNS}) values (?, {MARKET_VALUES}) "
+                              f"on conflict (card_id) do update set {MARKET_UPDATES}",
+                              [(card_id, *row) for card_id, row in counters.items()])
+        self.conn.executemany("update CardMarket set held_since = ? where card_id = ?",
+                              [(since, card_id) for card_id, since in starts.items()])
+        for period in MARKET_PERIODS:
+            bucket = bucket_start(period, at)
+            self.conn.executemany(f"insert into MarketRollups (period, bucket, card_id, {MARKET_COLUMNS}) "
+                                  f"values (?, ?, ?, {MARKET_VALUES}) "
+                                  f"on conflict (period, bucket, card_id) do update set {MARKET_UPDATES}",
+                                  [(period, bucket, card_id, *row) for card_id, row in counters.items()])
+
+    def card_activity(self, card_id: int) -> CardActivity:
+        query = f"select Cards.name, CardMarket.card_id, {MARKET_COLUMNS}, held_since from Cards " \
+                f"left join CardMarket on CardMarket.card_id = Cards.id where Cards.id = ?"
+        row = self.conn.execute(query, (card_id,)).fetchone()
+        if row is None:
+            raise NoOutputError(f"Cards[id={card_id}]", f"No Card with id: {card_id}")
+        if row[1] is None:
+            return CardActivity(card_id, row[0])
+        return CardActivity(card_id, row[0], *row[2:])
+
+    def market_leaders(self, stat: str, limit: int) -> List[CardActivity]:
+        return [CardActivity(*row) for row in self.conn.execute(MARKET_LEADERS.format(stat=stat), (limit,))]
+
+    def market_window(self, period: str, since: datetime, stat: str, limit: int) -> List[CardActivity]:
+        query = f"select MarketRollups.card_id, Cards.name, {MARKET_SUMS} from MarketRollups " \
+                f"join Cards on Cards.id = MarketRollups.card_id where period = ? and bucket >= ? " \
+                f"group by MarketRollups.card_id having sum({stat}) > 0 " \
+                f"order by sum({stat}) desc, MarketRollups.card_id limit ?"
+        return [CardActivity(*row) for row in self.conn.execute(query, (period, since, limit))]
+
+    def market_buckets(self, period: str, since: datetime) -> List[MarketBucket]:
+        query = f"select bucket, {MARKET_SUMS} from MarketRollups where period = ? and bucket >= ? " \
+                f"group by bucket order by bucket"
+        return [MarketBucket(*row) for row in self.conn.execute(query, (period, since))]
+
+
+class SQLiteBackend(StorageBackend):
+    """
+    StorageBackend keeping its data in a sqlite3 database file. Reads each open a short lived connection, writes are
+    handed to a WriteQueue whose thread owns the only write connection.
+    """
+
+    def __init__(self, db_filename: str, schema_filename: str, cards_filename: str, image_dir: Optional[str] = None,
+                 connection_factory: Type[sqlite3.Connection] = sqlite3.Connection):
+        """
+        :param db_filename: the database file, or ":memory:" for a private in-memory database shared by the
+            connections of this backend
+        :param image_dir: where prebuilt database images are kept. A new database is restored from the current image
+            when there is one instead of being loaded from the Card data, and starts out with the example data in it.
+        :param connection_factory: the class of the connections the transactions run on, see app/query_plans.py
+        """
+        self.db_filename = db_filename
+        self.schema_filename = schema_filename
+        self.cards_filename = cards_filename
+        self.image_dir = image_dir
+        self.connection_factory = connection_factory
+        self.writer: Optional[WriteQueue] = None
+        self.writer_lock = threading.Lock()
+        self.memory_uri: Optional[str] = None
+        self.memory_anchor: Optional[sqlite3.Connection] = None
+        if db_filename == ":memory:":
+            self.memory_uri = f"file:query-engine-{id(self)}?mode=memory&cache=shared"
+        self.shared = self.memory_uri is None
+        self.watcher: Optional[sqlite3.Connection] = None
+        self.watcher_lock = threading.Lock()
+        self.data_version: Optional[int] = None
+
+    def connect(self) -> sqlite3.Connection:
+        """
+        :return: a new sqlite3 connection to the database file
+        """
+        if self.memory_uri is not None:
+            return sqlite3.connect(self.memory_uri, detect_types=sqlite3.PARSE_DECLTYPES, uri=True,
+                                   factory=self.connection_factory)
+        return sqlite3.connect(self.db_filename, detect_types=sqlite3.PARSE_DECLTYPES, factory=self.connection_factory)
+
+    def initialize(self) -> bool:
+        if self.memory_uri is not None and self.memory_anchor is None:
+            # a shared in-memory database lives only as long as one of its connections is open
+            self.memory_anchor = self.connect()
+        if self.memory_uri is None and os.path.exists(self.db_filename):
+            self.migrate_database()
+            return False
+        if self.image_dir is not None:
+            image_filename = database_image_filename(self.image_dir, self.schema_filename, self.cards_filename)
+            if os.path.exists(image_filename):
+                self.restore_image(image_filename)
+                return False
+        self.load_database()
+        return True
+
+    def restore_image(self, image_filename: str) -> None:
+        """
+        Create the database as a copy of a prebuilt image. The copy is made with the sqlite backup API, and a database
+        file only appears under its name once it is complete. The example Trades in it are dated to the restore, as
+        they would be had they been created now, so they are not expired for the age of the image.
+        """
+        now = datetime.utcnow()
+        with closing(sqlite3.connect(image_filename)) as image:
+            if self.memory_uri is not None:
+                image.backup(self.memory_anchor)
+                self.memory_anchor.execute("update Trades set created = ?, updated = ?", (now, now))
+                self.memory_anchor.commit()
+                return
+            partial_filename = self.db_filename + ".restoring"
+            with closing(sqlite3.connect(partial_filename)) as conn:
+                image.backup(conn)
+                conn.execute("update Trades set created = ?, updated = ?", (now, now))
+                conn.commit()
+            os.replace(partial_filename, self.db_filename)
+
+    def save_image(self, image_filename: str) -> None:
+        """
+        Write a copy of the database to image_filename as one self-contained file, replacing an older image at once
+        """
+        partial_filename = image_filename + ".building"
+        with closing(self.connect()) as conn, closing(sqlite3.connect(partial_filename)) as image:
+            conn.backup(image)
+            image.execute("pragma journal_mode = delete")
+        os.replace(partial_filename, image_filename)
+
+    def load_database(self) -> None:
+        """
+        Create the tables and load the Card data into the Cards table
+        """
+        with closing(self.connect()) as conn:
+            with open(self.schema_filename, 'rt') as schema_file:
+                conn.executescript(schema_file.read())
+
+            columns = [column for column, _, _ in CARD_CSV_COLUMNS]
+            sql = f"insert into Cards ({', '.join(columns)}) values ({', '.join(':' + c for c in columns)})"
+            conn.executemany(sql, read_card_rows(self.cards_filename))
+            conn.commit()
+
+    def migrate_database(self) -> None:
+        """
+        Bring an existing database up to the current schema. Missing columns are added, then missing tables and
+        indexes are created from the schema file. Card owners are filled in from the Users' card lists when the owner
+        column is first added, and existing Trades get the time of the migration as their created and updated times. A
+        database without an ownership ledger gets a snapshot of its current owners to start the ledger from, one
+        without search indexes has them built and one without Dashboards has them stored. The market roll-ups start
+        empty, with the holdings of the Cards owned at the time.
+        """
+        now = datetime.utcnow()
+        with closing(self.connect()) as conn:
+            for table, column, definition in ADDED_COLUMNS:
+                columns = {row[1] for row in conn.execute(f"pragma table_info({table})")}
+                if column in columns:
+                    continue
+                conn.execute(f"alter table {table} add column {column} {definition}")
+                if (table, column) == ("Cards", "owner"):
+                    conn.execute("update Cards set owner = (select Users.id from Users, json_each(Users.cards) "
+                                 "where json_each.value = Cards.id)")
+                elif table == "Trades" and column in ("created", "updated"):
+                    conn.execute(f"update Trades set {column} = ?", (now,))
+            conn.commit()
+
+            existing = {row[0] for row in conn.execute("select name from sqlite_master")}
+            trades = conn.execute("select sql from sqlite_master where type = 'table' and name = 'Trades'").fetchone()
+            if trades is not None and "autoincrement" not in trades[0].lower():
+                self.__rebuild_trades(conn)
+            # after the columns exist, so indexes on new columns can be created
+            with open(self.schema_filename, 'rt') as schema_file:
+                conn.executescript(schema_file.read())
+
+            # search indexes only follow inserts through triggers, rows from before them are indexed here
+            for search_table in ("CardSearch", "UserSearch"):
+                if search_table not in existing:
+                    conn.execute(f"insert into {search_table} ({search_table}) values ('rebuild')")
+            conn.commit()
+
+            # Dashboards are stored as Users are written, the ones of Users from before them are stored here
+            if "Dashboards" not in existing:
+                user_ids = {row[0] for row in conn.execute("select id from Users")}
+                SQLiteTransaction(conn).refresh_dashboards(user_ids)
+                conn.commit()
+
+            # the holdings of Cards owned before the market roll-ups start at their last acquire in the ledger, or now
+            if "CardMarket" not in existing:
+                conn.execute("insert into CardMarket (card_id, held_since) select Cards.id, coalesce(acquired.at, ?) "
+                             "from Cards left join (select card_id, max(at) as at from OwnershipEvents where kind = ? "
+                             "group by card_id) as acquired on acquired.card_id = Cards.id "
+                             "where Cards.owner is not null", (now, EVENT_ACQUIRE))
+                conn.commit()
+
+            # cards owned before the ledger existed are its starting state
+            if conn.execute("select count(*) from OwnershipSnapshots").fetchone()[0] == 0 \
+                    and conn.execute("select count(*) from OwnershipEvents").fetchone()[0] == 0:
+                SQLiteTransaction(conn).snapshot_ownership(0)
+                conn.commit()
+
+    @staticmethod
+    def __rebuild_trades(conn: sqlite3.Connection) -> None:
+        """
+        private function to rebuild a Trades table from before its ids were autoincrement, which handed the id of the
+        newest Trade out again once it was archived. New ids start above every id of a Trade or an archived one. The
+        indexes of the table are dropped with it and created again from the schema file afterwards.
+        """
+        sql = conn.execute("select sql from sqlite_master where type = 'table' and name = 'Trades'").fetchone()[0]
+        sql = re.sub(r"^create table \"?Trades\"?", "create table TradesRebuilt", sql, flags=re.IGNORECASE)
+        sql = re.sub(r"\bid integer primary key\b", "id integer primary key autoincrement", sql, count=1,
+                     flags=re.IGNORECASE)
+        last_ids = [conn.execute("select coalesce(max(id), 0) from Trades").fetchone()[0]]
+        if conn.execute("select 1 from sqlite_master where name = 'TradeArchive'").fetchone() is not None:
+            last_ids.append(conn.execute("select coalesce(max(trade_id), 0) from TradeArchive").fetchone()[0])
+        conn.execute("begin")
+        conn.execute(sql)
+        conn.execute("insert into TradesRebuilt select * from Trades")
+        conn.execute("drop table Trades")
+        conn.execute("alter table TradesRebuilt rename to Trades")
+        conn.execute("delete from sqlite_sequence where name = 'Trades'")
+        conn.execute("insert into sqlite_sequence (name, seq) values ('Trades', ?)", (max(last_ids),))
+        conn.commit()
+
+    @contextmanager
+    def read(self) -> Iterator[StorageTransaction]:
+        # readers must not linger, an open WAL reader that is never closed makes new connections fail to open
+        with closing(self.connect()) as conn:
+            yield SQLiteTransaction(conn)
+
+    @contextmanager
+    def snapshot(self) -> Iterator[StorageTransaction]:
+        if self.memory_uri is not None:
+            # a shared in-memory database has no WAL, and a reader holding its tables would make the writer fail with
+            # "database table is locked", so the snapshot reads a private copy instead
+            with closing(self.connect()) as conn, \
+                    closing(sqlite3.connect(":memory:", detect_types=sqlite3.PARSE_DECLTYPES,
+                                            factory=self.connection_factory)) as copy:
+                conn.backup(copy)
+                conn.close()
+                yield SQLiteTransaction(copy)
+            return
+        # one read transaction, WAL keeps the pages it started with for it while the writer commits
+        with closing(self.connect()) as conn:
+            conn.execute("begin")
+            try:
+                yield SQLiteTransaction(conn)
+            finally:
+                conn.rollback()
+
+    def write(self, command: Callable[[StorageTransaction], Any]) -> Any:
+        return self.__writer().execute(lambda conn: command(SQLiteTransaction(conn)))
+
+    def backup(self, target_filename: str, pages: int, pause: float,
+               progress: Optional[Callable[[int, int], None]] = None) -> None:
+        """
+        Copy the database to target_filename while it stays in use, with the sqlite online backup API. The copy runs
+        on the writer thread, so writes made meanwhile go through the same connection and update the copy instead of
+        restarting it. It is made pages pages at a time, and between steps the writer commits the writes queued
+        within pause seconds. The file only appears under its name once it is complete.
+
+        :param progress: called with the number of pages left and the total after each step
+        """
+        partial_filename = target_filename + ".partial"
+
+        def task(conn: sqlite3.Connection, commit_waiting: Callable[[float], None]) -> None:
+            def step(status: int, remaining: int, total: int) -> None:
+                if progress is not None:
+                    progress(remaining, total)
+                commit_waiting(pause)
+
+            with closing(sqlite3.connect(partial_filename)) as target:
+                conn.backup(target, pages=pages, progress=step)
+                target.execute("pragma journal_mode = delete")
+
+        if os.path.exists(partial_filename):
+            os.remove(partial_filename)
+        self.__writer().execute_long(task)
+        os.replace(partial_filename, target_filename)
+
+    def __writer(self) -> WriteQueue:
+        if self.writer is None:
+            with self.writer_lock:
+                if self.writer is None:
+                    self.writer = WriteQueue(self.__connect_writer)
+        return self.writer
+
+    def __connect_writer(self) -> sqlite3.Connection:
+        """
+        open the writer thread's connection. WAL lets readers keep working while it writes.
+        """
+        conn = self.connect()
+        conn.execute("pragma journal_mode = wal")
+        conn.execute("pragma synchronous = normal")
+        return conn
+
+    def data_changed(self) -> bool:
+        """
+        Compare the data_version of a connection kept open for this. It changes whenever another connection, this
+        process's writer included, commits to the database, and reading it costs no more than a look at the WAL index.
+        """
+        with self.watcher_lock:
+            if self.watcher is None:
+                self.watcher = sqlite3.connect(self.db_filename, check_same_thread=False)
+            data_version = self.watcher.execute("pragma data_version").fetchone()[0]
+            changed = data_version != self.data_version
+            self.data_version = data_version
+            return changed
+
+    def close(self) -> None:
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+        with self.watcher_lock:
+            if self.watcher is not None:
+                self.watcher.close()
+                self.watcher = None
+        if self.memory_anchor is not None:
+            self.memory_anchor.close()
+            self.memory_anchor = None
@@ -0,0 +1,71 @@
+"""
+Background thread that expires Trades nobody has touched for a while
+"""
+import logging
+import threading
+from datetime import datetime, timedelta
+from typing import Optional
+
+from app.query_engine import QueryEngine, EXPIRE_BATCH
+
+# how long an open Trade may go without being confirmed or unconfirmed before it expires
+TRADE_TTL = timedelta(days=14)
+# how often the sweeper looks for stale Trades
+SWEEP_INTERVAL = timedelta(minutes=10)
+
+logger = logging.getLogger(__name__)
+
+
+class TradeSweeper:
+    """
+    TradeSweeper periodically moves stale Trades into the archive. Every batch is its own short write so the sweeper
+    never holds the writer for long, and a batch that comes back short means there is nothing left to sweep.
+    """
+
+    def __init__(self, engine: QueryEngine, ttl: timedelta = TRADE_TTL, interval: timedelta = SWEEP_INTERVAL,
+                 batch_size: int = EXPIRE_BATCH):
+        self.engine = engine
+        self.ttl = ttl
+        self.interval = interval
+        self.batch_size = batch_size
+        self.stopped = threading.Event()
+        self.thread: Optional[threading.Thread] = None
+        self.expired: int = 0
+
+    def sweep_once(self) -> int:
+        """
+        Expire every Trade last updated longer than ttl ago
+
+        :return: how many Trades were expired
+        """
+        cutoff = datetime.utcnow() - self.ttl
+        total = 0
+        while True:
+            count = self.engine.expire_trades(cutoff, self.batch_size)
+            total += count
+            if count < self.batch_size:
+                break
+        self.expired += total
+        return total
+
+    def start(self) -> None:
+        """
+        Start sweeping on a daemon thread, does nothing if already started
+        """
+        if self.thread is not None:
+            return
+        self.thread = threading.Thread(target=self.__run, name="trade-sweeper", daemon=True)
+        self.thread.start()
+
+    def stop(self) -> None:
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def __run(self) -> None:
+        while not self.stopped.wait(self.interval.total_seconds()):
+            try:
+                self.sweep_once()
+            except Exception:  # keep sweeping, the next run may succeed
+                logger.exception("Expiring stale trades failed")
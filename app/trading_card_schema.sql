@@ -19,7 +19,9 @@ create table if not exists Cards (
     assistspg real not null,
     stealspg real not null,
     blockspg real not null,
-    image text not null
+    image text not null,
+    owner integer references Users,
+    points integer
 );
 
 create table if not exists Users (
@@ -29,15 +31,129 @@ create table if not exists Users (
     access text not null,
     last_seen timestamp not null,
     cards json,
-    trades json
+    trades json,
+    version integer not null default 0,
+    score integer not null default 0
 );
 
+create index if not exists users_score on Users (score desc, id);
+
 create table if not exists Trades (
-    id integer primary key,
+    id integer primary key autoincrement,
     user1_id integer not null references Users,
     user1_cards json,
     user1_confirmed integer not null default 0,
     user2_id integer not null references Users,
     user2_cards json,
-    user2_confirmed integer not null default 0
-);
\ No newline at end of file
+    user2_confirmed integer not null default 0,
+    version integer not null default 0,
+    created timestamp,
+    updated timestamp
+);
+
+create index if not exists trades_updated on Trades (updated);
+create index if not exists trades_users on Trades (user1_id, user2_id);
+
+create table if not exists TradeArchive (
+    archive_id integer primary key,
+    trade_id integer not null,
+    user1_id integer not null references Users,
+    user1_cards json,
+    user1_confirmed integer not null,
+    user2_id integer not null references Users,
+    user2_cards json,
+    user2_confirmed integer not null,
+    created timestamp,
+    updated timestamp,
+    archived timestamp not null,
+    status text not null
+);
+
+create index if not exists trade_archive_user1 on TradeArchive (user1_id, archive_id);
+create index if not exists trade_archive_user2 on TradeArchive (user2_id, archive_id);
+
+create table if not exists OwnershipEvents (
+    seq integer primary key,
+    at timestamp not null,
+    kind text not null,
+    user_id integer,
+    card_id integer,
+    trade_id integer
+);
+
+create table if not exists OwnershipSnapshots (
+    seq integer primary key,
+    taken timestamp not null,
+    owners json not null
+);
+
+create index if not exists ownership_events_at on OwnershipEvents (at);
+
+create index if not exists cards_owner on Cards (owner);
+create index if not exists cards_owned on Cards (owned);
+
+create table if not exists Wants (
+    user_id integer not null references Users,
+    card_id integer not null references Cards,
+    primary key (user_id, card_id)
+) without rowid;
+
+create index if not exists wants_card on Wants (card_id, user_id);
+
+create virtual table if not exists CardSearch using fts5(
+    name, team, pos, content = 'Cards', content_rowid = 'id', tokenize = 'unicode61 remove_diacritics 2',
+    prefix = '1 2 3'
+);
+
+create virtual table if not exists UserSearch using fts5(
+    name, content = 'Users', content_rowid = 'id', tokenize = 'unicode61 remove_diacritics 2', prefix = '1 2 3'
+);
+
+create trigger if not exists cards_search_insert after insert on Cards begin
+    insert into CardSearch (rowid, name, team, pos) values (new.id, new.name, new.team, new.pos);
+end;
+
+create trigger if not exists users_search_insert after insert on Users begin
+    insert into UserSearch (rowid, name) values (new.id, new.name);
+end;
+
+create trigger if not exists users_search_delete after delete on Users begin
+    insert into UserSearch (UserSearch, rowid, name) values ('delete', old.id, old.name);
+end;
+
+create table if not exists Changes (
+    seq integer primary key autoincrement,
+    origin text not null,
+    kind text not null,
+    row_id integer
+);
+
+create table if not exists Dashboards (
+    user_id integer primary key references Users,
+    cards json not null,
+    trades json not null
+);
+
+create table if not exists CardMarket (
+    card_id integer primary key references Cards,
+    offered integer not null default 0,
+    traded integer not null default 0,
+    acquired integer not null default 0,
+    dropped integer not null default 0,
+    holds integer not null default 0,
+    held_seconds real not null default 0,
+    held_since timestamp
+);
+
+create table if not exists MarketRollups (
+    period text not null,
+    bucket timestamp not null,
+    card_id integer not null references Cards,
+    offered integer not null default 0,
+    traded integer not null default 0,
+    acquired integer not null default 0,
+    dropped integer not null default 0,
+    holds integer not null default 0,
+    held_seconds real not null default 0,
+    primary key (period, bucket, card_id)
+) without rowid;
@@ -0,0 +1,103 @@
+"""
+Bounded cache of the Users loaded for sessions, kept coherent with writes by per-user version counters
+"""
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from typing import Callable, Dict, Iterable, Tuple
+
+from app.models import User, copy_user
+
+# how many User snapshots are kept before the least recently used one is dropped
+USER_CACHE_SIZE = 4096
+
+
+class UserCache:
+    """
+    LRU cache of User snapshots. Every write that touches a User bumps that User's version, and a snapshot is only
+    served while the version it was read at is still current. The version is read before the User row so a snapshot
+    that raced with a write is never stored as current.
+    """
+
+    def __init__(self, capacity: int = USER_CACHE_SIZE):
+        self.capacity = capacity
+        self.lock = threading.Lock()
+        self.entries: "OrderedDict[int, Tuple[int, User]]" = OrderedDict()
+        self.versions: Dict[int, int] = {}
+        # bumped by clear() so a snapshot read before it is never stored after it
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, user_id: int, load: Callable[[int], User]) -> User:
+        """
+        Get the User from the cache, or load it and remember it
+
+        :param user_id: the id of the User
+        :param load: called with user_id to read the User when the cache has no current snapshot
+        :return: a copy of the User that the caller may change freely
+        """
+        with self.lock:
+            version = self.versions.get(user_id, 0)
+            generation = self.generation
+            entry = self.entries.get(user_id)
+            if entry is not None and entry[0] == version:
+                self.entries.move_to_end(user_id)
+                self.hits += 1
+                return copy_user(entry[1])
+            self.misses += 1
+
+        u = load(user_id)
+
+        with self.lock:
+            if self.versions.get(user_id, 0) == version and self.generation == generation:
+                self.entries[user_id] = version, copy_user(u)
+                self.entries.move_to_end(user_id)
+                while len(self.entries) > self.capacity:
+                    self.entries.popitem(last=False)
+                    self.evictions += 1
+        return u
+
+    def invalidate(self, user_ids: Iterable[int]) -> None:
+        """
+        Bump the version of the Users, called after a write touching them has committed
+        """
+        with self.lock:
+            for user_id in user_ids:
+                self.versions[user_id] = self.versions.get(user_id, 0) + 1
+                if self.entries.pop(user_id, None) is not None:
+                    self.invalidations += 1
+
+    def clear(self) -> None:
+        """
+        Drop every snapshot, called when it is no longer known which Users have changed
+        """
+        with self.lock:
+            self.generation += 1
+            self.invalidations += len(self.entries)
+            self.entries.clear()
+
+    def touch(self, user_id: int, last_seen: datetime) -> None:
+        """
+        Update last_seen of a cached snapshot in place. last_seen is not part of the game state so it does not bump
+        the version.
+        """
+        with self.lock:
+            entry = self.entries.get(user_id)
+            if entry is not None:
+                entry[1].last_seen = last_seen
+
+    def stats(self) -> Dict[str, float]:
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self.entries),
+                "capacity": self.capacity,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
@@ -0,0 +1,206 @@
+"""
+Single writer thread that owns the only write connection to the database
+"""
+import queue
+import sqlite3
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable, List, Optional, Tuple, Union
+
+WriteCommand = Callable[[sqlite3.Connection], Any]
+# a long task gets the write connection and a function to call between its steps, see WriteQueue.execute_long
+LongTask = Callable[[sqlite3.Connection, Callable[[float], None]], Any]
+
+# how many queued commands may share one transaction
+MAX_BATCH = 64
+
+
+class _Long:
+    """
+    Marks a LongTask in the command queue
+    """
+    __slots__ = ("task",)
+
+    def __init__(self, task: LongTask):
+        self.task = task
+
+
+QueueItem = Tuple[Union[WriteCommand, _Long], Future]
+
+
+class WriteQueue:
+    """
+    WriteQueue serializes every mutating database operation onto one thread. Commands are submitted through a queue
+    and the writer groups several of them into one transaction (group commit). Each command runs inside its own
+    savepoint so a failing command only rolls back its own changes and never the rest of the batch.
+    """
+
+    def __init__(self, connect: Callable[[], sqlite3.Connection], max_batch: int = MAX_BATCH):
+        """
+        :param connect: a function returning a new sqlite3 connection, called once on the writer thread
+        :param max_batch: the maximum number of commands committed together
+        """
+        self.connect = connect
+        self.max_batch = max_batch
+        self.commands: "queue.Queue[Optional[QueueItem]]" = queue.Queue()
+        # a long task taken from the queue while a batch was being collected, it runs after that batch
+        self.held: Optional[QueueItem] = None
+        self.closed = False
+        self.thread = threading.Thread(target=self.__run, name="query-engine-writer", daemon=True)
+        self.thread.start()
+
+    def submit(self, command: WriteCommand) -> Future:
+        """
+        Queue a command to be run on the writer thread
+
+        :param command: a function that takes the write connection and returns a result
+        :return: a Future that resolves to the result of the command once its transaction has committed
+        """
+        future: Future = Future()
+        if threading.current_thread() is self.thread:
+            raise RuntimeError("WriteQueue.submit() called from the writer thread")
+        self.commands.put((command, future))
+        return future
+
+    def execute(self, command: WriteCommand) -> Any:
+        """
+        Submit a command and block until it has been committed
+
+        :return: the result of the command
+        :raise: any exception raised by the command or by the commit
+        """
+        return self.submit(command).result()
+
+    def execute_long(self, task: LongTask) -> Any:
+        """
+        Run a long task on the writer thread, outside of any transaction, and block until it is done. Between its
+        steps the task calls the function it is given with a number of seconds. That call commits the commands queued
+        in the meantime, waiting up to that long for the first one. Writes are held up by one step of the task at
+        most, never by all of it.
+
+        :return: the result of the task
+        """
+        future: Future = Future()
+        if threading.current_thread() is self.thread:
+            raise RuntimeError("WriteQueue.execute_long() called from the writer thread")
+        self.commands.put((_Long(task), future))
+        return future.result()
+
+    def close(self) -> None:
+        """
+        Stop the writer thread after the commands already queued have been committed
+        """
+        self.commands.put(None)
+        self.thread.join()
+
+    def __next_batch(self, timeout: Optional[float] = None) -> List[QueueItem]:
+        """
+        Block for the first command, at most timeout seconds if given, then drain whatever else is already waiting,
+        up to max_batch commands. A long task is returned on its own, and one found after other commands is held
+        for the next call. Taking the close marker sets closed.
+
+        :return: the batch, empty if the queue is closed or nothing came within timeout
+        """
+        if self.held is not None:
+            item, self.held = self.held, None
+            return [item]
+        if self.closed:
+            return []
+        try:
+            item = self.commands.get(timeout=timeout)
+        except queue.Empty:
+            return []
+        if item is not None and isinstance(item[0], _Long):
+            return [item]
+
+        batch = []
+        while item is not None:
+            if isinstance(item[0], _Long):
+                self.held = item
+                return batch
+            batch.append(item)
+            if len(batch) >= self.max_batch:
+                return batch
+            try:
+                item = self.commands.get_nowait()
+            except queue.Empty:
+                return batch
+        self.closed = True
+        return batch
+
+    def __commit_waiting(self, conn: sqlite3.Connection, timeout: float) -> None:
+        """
+        Commit the commands queued while a long task runs, called by the task between its steps
+        """
+        if self.held is not None:
+            return  # a second long task is waiting, it runs once this one is done
+        batch = self.__next_batch(timeout)
+        if batch and not isinstance(batch[0][0], _Long):
+            self.__commit(conn, batch)
+        elif batch:
+            self.held = batch[0]
+
+    def __run_long(self, conn: sqlite3.Connection, item: QueueItem) -> None:
+        long, future = item
+        try:
+            result = long.task(conn, lambda timeout: self.__commit_waiting(conn, timeout))
+        except Exception as err:
+            if conn.in_transaction:
+                conn.execute("rollback")
+            future.set_exception(err)
+        else:
+            future.set_result(result)
+
+    def __commit(self, conn: sqlite3.Connection, batch: List[QueueItem]) -> None:
+        """
+        Run the commands of the batch in one transaction, each in its own savepoint, and resolve their futures once it
+        has committed
+        """
+        results = []
+        try:
+            conn.execute("begin immediate")
+        except sqlite3.Error as err:
+            for _, future in batch:
+                future.set_exception(err)
+            return
+        for command, future in batch:
+            conn.execute("savepoint command")
+            try:
+                result = command(conn)
+            except Exception as err:  # only this command's changes are undone
+                conn.execute("rollback to command")
+                conn.execute("release command")
+                results.append((future, None, err))
+            else:
+                conn.execute("release command")
+                results.append((future, result, None))
+
+        try:
+            conn.execute("commit")
+        except sqlite3.Error as err:
+            if conn.in_transaction:
+                conn.execute("rollback")
+            for future, _, _ in results:
+                future.set_exception(err)
+            return
+
+        for future, result, err in results:
+            if err is not None:
+                future.set_exception(err)
+            else:
+                future.set_result(result)
+
+    def __run(self) -> None:
+        conn = self.connect()
+        conn.isolation_level = None  # transactions are managed explicitly below
+        while True:
+            batch = self.__next_batch()
+            if not batch:
+                if self.closed and self.held is None:
+                    break
+                continue
+            if isinstance(batch[0][0], _Long):
+                self.__run_long(conn, batch[0])
+            else:
+                self.__commit(conn, batch)
+        conn.close()
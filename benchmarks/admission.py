@@ -0,0 +1,118 @@
+"""
+Write latency of well-behaved Users while one client hammers the write routes, with and without admission control.
+Well-behaved Users add and drop a Card every WELL_BEHAVED_PAUSE seconds. The abusive client has OPEN_TRADES trades
+on offer, so every Card it drops makes the writer look through all of them, and it adds and drops a Card from
+ABUSIVE_THREADS threads without pausing but for NETWORK_DELAY per request. The app runs in this process on a database
+in a temporary directory, the delay stands in for the network between it and the client, without which the client
+threads would never let go of the GIL. Run with python benchmarks/admission.py [seconds].
+"""
+import datetime
+import logging
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root)
+
+directory = tempfile.mkdtemp()
+os.environ["TRADING_CARD_DB"] = os.path.join(directory, "trading_card_data.db")
+os.environ["TRADING_CARD_LEAGUES"] = os.path.join(directory, "trading_card_leagues.db")
+os.environ["TRADING_CARD_BACKUP_DIR"] = os.path.join(directory, "backups")
+
+from app import app  # noqa: E402
+from app.admission import AdmissionController, MAX_WRITES_IN_FLIGHT  # noqa: E402
+from app import admission as admission_module  # noqa: E402
+from app.leagues import leagues  # noqa: E402
+from app.login_helper import hash_pw  # noqa: E402
+
+WELL_BEHAVED = 4
+WELL_BEHAVED_PAUSE = 0.25
+ABUSIVE_THREADS = 6
+OPEN_TRADES = 200
+# the Cards the abusive client trades with, and the one it keeps adding and dropping
+TRADED_CARDS = (100, 101, 102, 103)
+HAMMERED_CARD = 104
+NETWORK_DELAY = 0.001
+PASSWORD = "abcdef12"
+
+
+def client_for(username: str):
+    client = app.test_client()
+    client.post('/login', data={'username': username, 'password': PASSWORD})
+    return client
+
+
+def well_behaved(username: str, card_id: int, stop: threading.Event, latencies) -> None:
+    client = client_for(username)
+    while not stop.is_set():
+        for path in ('/add_cards', '/remove_card'):
+            start = time.perf_counter()
+            client.post(path, data={'card_id': str(card_id)})
+            latencies.append(time.perf_counter() - start)
+        time.sleep(WELL_BEHAVED_PAUSE)
+
+
+def abusive(stop: threading.Event, statuses) -> None:
+    client = client_for("abuser")
+    while not stop.is_set():
+        for path in ('/add_cards', '/remove_card'):
+            status = client.post(path, data={'card_id': str(HAMMERED_CARD)}).status_code
+            statuses[status] = statuses.get(status, 0) + 1
+            time.sleep(NETWORK_DELAY)
+
+
+def phase(name: str, seconds: float, abusive_threads: int = ABUSIVE_THREADS) -> None:
+    stop = threading.Event()
+    latencies = []
+    statuses = {}
+    threads = [threading.Thread(target=well_behaved, args=(f"user{i}", 10 + i, stop, latencies))
+               for i in range(WELL_BEHAVED)]
+    threads += [threading.Thread(target=abusive, args=(stop, statuses)) for _ in range(abusive_threads)]
+    for thread in threads:
+        thread.start()
+    time.sleep(seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    cuts = statistics.quantiles(latencies, n=100)
+    print(f"{name}")
+    print(f"  well-behaved writes: {len(latencies)}  p50 {cuts[49] * 1000:6.1f} ms  p99 {cuts[98] * 1000:7.1f} ms")
+    if abusive_threads:
+        print(f"  abusive client: {dict(sorted(statuses.items()))}")
+
+
+def main(seconds: float = 10) -> None:
+    app.logger.setLevel(logging.CRITICAL)  # the abusive client's lost races are expected
+    now = datetime.datetime.utcnow()
+    hashed_pass = hash_pw(PASSWORD)
+    for username in ["abuser"] + [f"user{i}" for i in range(WELL_BEHAVED)]:
+        leagues.add_user(username, hashed_pass, 1, now)
+    abuser_id = leagues.get_user_from_username("abuser").unique_id
+    engine = leagues.for_user(abuser_id)
+    engine.add_cards_to_user(abuser_id, list(TRADED_CARDS))
+    partner_cards = range(20, 20 + OPEN_TRADES // len(TRADED_CARDS))
+    for card_id in partner_cards:
+        partner_id = leagues.add_user(f"partner{card_id}", hashed_pass, 1, now)
+        engine.add_card_to_user(partner_id, card_id)
+        engine.create_trades(abuser_id, [([own_card], partner_id, [card_id]) for own_card in TRADED_CARDS])
+
+    phase("no abusive client", seconds, 0)
+    admission_module.admission = AdmissionController(rates={route_class: (1e9, 1e9)
+                                                            for route_class in admission_module.ROUTE_RATES},
+                                                     max_in_flight=1000)
+    phase("no admission control", seconds)
+    admission_module.admission = AdmissionController()
+    phase(f"admission control, {MAX_WRITES_IN_FLIGHT} writes in flight", seconds)
+    print(f"  decisions: {admission_module.admission.stats()}")
+
+
+if __name__ == "__main__":
+    try:
+        main(*(float(arg) for arg in sys.argv[1:2]))
+    finally:
+        shutil.rmtree(directory)
@@ -0,0 +1,72 @@
+"""
+Sign-up and login benchmark. Fills the league directory with members, then times checking whether free and taken
+usernames are available through the AuthService, whose Bloom filter answers most free names without a read, against
+asking the directory every time, and reports how many of the free names still went to the directory. It then times
+logging in and the size of the filter. The app is imported with its databases in a temporary directory.
+Run with python benchmarks/auth.py [members] [checks].
+"""
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+work_dir = tempfile.mkdtemp()
+os.environ.update(TRADING_CARD_DB=os.path.join(work_dir, "trading_card_data.db"),
+                  TRADING_CARD_LEAGUES=os.path.join(work_dir, "trading_card_leagues.db"),
+                  TRADING_CARD_BACKUP_DIR=os.path.join(work_dir, "backups"),
+                  TRADING_CARD_ASSET_DIR=os.path.join(work_dir, "assets"),
+                  TRADING_CARD_STATS=os.path.join(work_dir, "catalog_stats.bin"))
+sys.path.insert(0, root)
+
+from app.auth import AuthService  # noqa: E402
+from app.leagues import leagues  # noqa: E402
+
+LOGINS = 200
+
+
+def timed(function, *args) -> float:
+    start = time.perf_counter()
+    function(*args)
+    return (time.perf_counter() - start) * 1000
+
+
+def main(members: int = 100000, checks: int = 5000) -> None:
+    try:
+        leagues.initialize()
+        with leagues.connect() as conn:
+            league_id = conn.execute("select id from Leagues order by id limit 1").fetchone()[0]
+            conn.executemany("insert into Members (name, league_id) values (?, ?)",
+                             ((f"member{i}", league_id) for i in range(members)))
+        auth = AuthService(leagues)
+        rng = random.Random(1)
+        free = [f"newcomer{i}" for i in range(checks)]
+        taken = [f"member{rng.randrange(members)}" for _ in range(checks)]
+
+        built = timed(auth.load)
+        stats = auth.stats()
+        print(f"{members} members, filter built in {built:.0f} ms, {len(auth.usernames.bits) / 2 ** 10:.0f} KiB "
+              f"for {stats['capacity']} usernames")
+        for label, names in (("free", free), ("taken", taken)):
+            before = auth.stats()["lookups"]
+            filtered = [timed(auth.username_available, name) for name in names]
+            lookups = auth.stats()["lookups"] - before
+            direct = [timed(leagues.check_user_exists, name) for name in names]
+            print(f"{label:5}  filter p50 {statistics.median(filtered) * 1000:7.1f} us  "
+                  f"{lookups / len(names):6.1%} read the directory   "
+                  f"directory p50 {statistics.median(direct) * 1000:7.1f} us")
+
+        for i in range(LOGINS):
+            auth.register(f"login{i}", "password12", 1)
+        logins = [timed(auth.login, f"login{i}", "password12") for i in range(LOGINS)]
+        print(f"login p50 {statistics.median(logins):.2f} ms, locate and one read of the User")
+    finally:
+        leagues.close()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:3]))
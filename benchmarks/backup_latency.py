@@ -0,0 +1,116 @@
+"""
+Request latency while an online backup runs. A database of the given size is generated (once, it is reused), then
+threads run a mix of User reads and Card writes through the QueryEngine while nothing else runs, while a paced
+backup runs with BACKUP_PAGES and BACKUP_PAUSE, and while an unpaced backup copies everything in one step. Run with
+python benchmarks/backup_latency.py <database file> [gigabytes].
+"""
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root)
+
+from app import schema_filename  # noqa: E402
+from app.backup import BACKUP_PAGES, BACKUP_PAUSE  # noqa: E402
+from app.models import ConflictError  # noqa: E402
+from app.query_engine import QueryEngine, cards_filename  # noqa: E402
+from app.storage import SQLiteBackend  # noqa: E402
+
+USERS = 200000
+THREADS = 4
+WRITE_RATIO = 0.1
+BASELINE_SECONDS = 5
+
+
+def generate(db_filename: str, gigabytes: float) -> None:
+    engine = QueryEngine(SQLiteBackend(db_filename, schema_filename, cards_filename), test_data=False)
+    engine.initialize_database()
+    engine.backend.close()
+    with sqlite3.connect(db_filename) as conn:
+        conn.execute("pragma journal_mode = wal")
+        conn.execute("with recursive n(i) as (select 1 union all select i + 1 from n where i < ?) "
+                     "insert into Users (name, hashed_pass, access, last_seen, cards, trades) "
+                     "select 'user' || i, hex(randomblob(32)), 1, '2021-01-01 00:00:00', '[]', '[]' from n",
+                     (USERS,))
+        conn.commit()
+        # the ownership ledger of a long running game makes up the bulk of the file
+        while os.path.getsize(db_filename) < gigabytes * 2 ** 30:
+            conn.execute("with recursive n(i) as (select 1 union all select i + 1 from n where i < 1000000) "
+                         "insert into OwnershipEvents (at, kind, user_id, card_id) "
+                         "select '2021-01-01 00:00:00', 'acquire', abs(random()) % ? + 1, abs(random()) % 140 + 1 "
+                         "from n", (USERS,))
+            conn.commit()
+        conn.execute("pragma wal_checkpoint(truncate)")
+
+
+def load(engine: QueryEngine, stop: threading.Event, reads, writes, seed: int) -> None:
+    rng = random.Random(seed)
+    while not stop.is_set():
+        user_id = rng.randint(1, USERS)
+        start = time.perf_counter()
+        if rng.random() < WRITE_RATIO:
+            try:
+                cards = engine.get_user_from_id(user_id).cards
+                if cards:
+                    engine.remove_card_from_user(user_id, next(iter(cards)))
+                else:
+                    engine.add_card_to_user(user_id, rng.randint(1, 140))
+            except (ConflictError, ValueError):
+                pass
+            writes.append(time.perf_counter() - start)
+        else:
+            engine.get_user_from_id(user_id)
+            reads.append(time.perf_counter() - start)
+
+
+def percentiles(latencies) -> str:
+    if len(latencies) < 2:
+        return "no requests"
+    cuts = statistics.quantiles(latencies, n=100)
+    return f"p50 {cuts[49] * 1000:6.2f} ms  p99 {cuts[98] * 1000:7.2f} ms  max {max(latencies) * 1000:8.1f} ms"
+
+
+def phase(engine: QueryEngine, name: str, during) -> None:
+    stop = threading.Event()
+    reads, writes = [], []
+    threads = [threading.Thread(target=load, args=(engine, stop, reads, writes, seed)) for seed in range(THREADS)]
+    for thread in threads:
+        thread.start()
+    start = time.perf_counter()
+    during()
+    elapsed = time.perf_counter() - start
+    stop.set()
+    for thread in threads:
+        thread.join()
+    print(f"{name} ({elapsed:.1f} s, {len(reads) + len(writes)} requests)")
+    print(f"  reads   {percentiles(reads)}")
+    print(f"  writes  {percentiles(writes)}")
+
+
+def main(db_filename: str, gigabytes: float = 2.0) -> None:
+    if not os.path.exists(db_filename):
+        generate(db_filename, gigabytes)
+    print(f"database {os.path.getsize(db_filename) / 2 ** 30:.2f} GiB")
+    engine = QueryEngine(SQLiteBackend(db_filename, schema_filename, cards_filename), test_data=False)
+    engine.initialize_database()
+    target = os.path.join(tempfile.mkdtemp(dir=os.path.dirname(os.path.abspath(db_filename))), "backup.db")
+    try:
+        phase(engine, "no backup", lambda: time.sleep(BASELINE_SECONDS))
+        phase(engine, f"paced backup, {BACKUP_PAGES} pages per step, {BACKUP_PAUSE * 1000:g} ms pause",
+              lambda: engine.backend.backup(target, BACKUP_PAGES, BACKUP_PAUSE))
+        phase(engine, "unpaced backup, one step", lambda: engine.backend.backup(target, -1, 0))
+    finally:
+        engine.backend.close()
+        if os.path.exists(target):
+            os.remove(target)
+        os.rmdir(os.path.dirname(target))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1], *(float(arg) for arg in sys.argv[2:]))
@@ -0,0 +1,98 @@
+"""
+Multi-process cache coherence check. Several processes share one database and run a mixed load of cached User
+reads and Card writes. Every cached read is compared with the database, and a stale one is timed from the commit of
+the first write it missed. Run with python benchmarks/cache_coherence.py [processes] [seconds].
+
+Staleness stays below the poll interval, and an interval too long to ever poll shows what it would be without the
+change log.
+"""
+import datetime
+import multiprocessing
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root)
+
+from app import schema_filename  # noqa: E402
+from app.models import ConflictError  # noqa: E402
+from app.query_engine import QueryEngine, cards_filename  # noqa: E402
+from app.storage import SQLiteBackend  # noqa: E402
+
+USERS = 20
+WRITE_RATIO = 0.05
+INTERVALS = (0.5, 0.1, float("inf"))
+
+
+def worker(db_filename, seed, interval, duration, commits, results):
+    rng = random.Random(seed)
+    engine = QueryEngine(SQLiteBackend(db_filename, schema_filename, cards_filename), test_data=False)
+    engine.change_feed.interval = interval
+    user_ids = [engine.get_user_from_username(f"user{i}").unique_id for i in range(USERS)]
+    reads = stale = 0
+    max_staleness = 0.0
+    end = time.time() + duration
+    while time.time() < end:
+        user_id = rng.choice(user_ids)
+        if rng.random() < WRITE_RATIO:
+            cards = engine.get_user_from_id(user_id).cards
+            try:
+                if len(cards) >= 5 or (cards and rng.random() < 0.5):
+                    engine.remove_card_from_user(user_id, next(iter(cards)))
+                elif not engine.add_card_to_user(user_id, rng.randint(1, 140)):
+                    continue
+            except (ConflictError, ValueError):  # lost a race with another process
+                continue
+            commits[user_id, engine.get_user_from_id(user_id).version] = time.time()
+        else:
+            cached = engine.get_session_user(user_id)
+            now = time.time()
+            reads += 1
+            if cached.version < engine.get_user_from_id(user_id).version:
+                committed = commits.get((user_id, cached.version + 1))
+                if committed is not None:
+                    stale += 1
+                    max_staleness = max(max_staleness, now - committed)
+    results.put((reads, stale, max_staleness, engine.user_cache.stats()["hit_rate"]))
+    engine.backend.close()
+
+
+def run(processes: int, duration: float, interval: float) -> None:
+    work_dir = tempfile.mkdtemp()
+    try:
+        db_filename = os.path.join(work_dir, "trading_card_data.db")
+        engine = QueryEngine(SQLiteBackend(db_filename, schema_filename, cards_filename), test_data=False)
+        for i in range(USERS):
+            engine.add_user(f"user{i}", "", 1, datetime.datetime.utcnow())
+        engine.backend.close()
+
+        with multiprocessing.Manager() as manager:
+            commits, results = manager.dict(), manager.Queue()
+            workers = [multiprocessing.Process(target=worker, args=(db_filename, seed, interval, duration, commits,
+                                                                    results)) for seed in range(processes)]
+            for process in workers:
+                process.start()
+            for process in workers:
+                process.join()
+            totals = [results.get() for _ in workers]
+    finally:
+        shutil.rmtree(work_dir)
+
+    reads = sum(total[0] for total in totals)
+    stale = sum(total[1] for total in totals)
+    hit_rate = sum(total[0] * total[3] for total in totals) / reads
+    print(f"poll interval {interval:>4} s: {reads} cached reads, hit rate {hit_rate:.1%}, "
+          f"stale {stale / reads:.1%}, max staleness {max(total[2] for total in totals) * 1000:.0f} ms")
+
+
+def main(processes: int = 4, duration: float = 5.0) -> None:
+    for interval in INTERVALS:
+        run(processes, duration, interval)
+
+
+if __name__ == "__main__":
+    main(*(float(arg) if i else int(arg) for i, arg in enumerate(sys.argv[1:])))
@@ -0,0 +1,142 @@
+"""
+Compare-and-set stress run against a SQLiteBackend, in two parts.
+
+- One free Card: every round THREADS threads, each for a User of its own, try to add the same free Card at once. Exactly
+  one of them must get it. The others must be refused or, having conflicted MAX_RETRIES times, get a ConflictError, and
+  the Card's owner must be the winner, who is the only User holding it. The winner drops the Card for the next round.
+- One busy User: MAX_CARDS threads add and drop Cards of their own on the same User, so the version check of the User
+  row keeps failing and the writes are retried. It reports the conflicts that were retried and the writes that still
+  conflicted after MAX_RETRIES attempts and raised ConflictError. It then checks that the User holds exactly the Cards
+  owned by them.
+
+Every broken check is printed and the run exits with status 1. Run with python benchmarks/cas_stress.py [threads]
+[rounds] [steps].
+"""
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from typing import Dict, List
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root)
+
+from app import schema_filename  # noqa: E402
+from app.models import ConflictError  # noqa: E402
+from app.query_engine import MAX_CARDS, MAX_RETRIES, QueryEngine, cards_filename  # noqa: E402
+from app.storage import SQLiteBackend  # noqa: E402
+
+
+def race(engine: QueryEngine, user_ids: List[int], card_id: int) -> Dict[str, List[int]]:
+    """
+    Have every User try to add the Card at the same time
+
+    :return: the ids of the Users who got the Card, were refused and got a ConflictError, under "won", "refused" and
+             "conflicted"
+    """
+    outcomes: Dict[str, List[int]] = {"won": [], "refused": [], "conflicted": []}
+    lock = threading.Lock()
+    start_line = threading.Barrier(len(user_ids))
+
+    def contender(user_id: int) -> None:
+        start_line.wait()
+        try:
+            outcome = "won" if engine.add_card_to_user(user_id, card_id) else "refused"
+        except ConflictError:
+            outcome = "conflicted"
+        with lock:
+            outcomes[outcome].append(user_id)
+
+    threads = [threading.Thread(target=contender, args=(user_id,)) for user_id in user_ids]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return outcomes
+
+
+def one_free_card(engine: QueryEngine, threads: int, rounds: int) -> List[str]:
+    for i in range(threads):
+        engine.add_user(f"racer{i}", "", 1, datetime.utcnow())
+    user_ids = sorted(user.unique_id for user in engine.get_all_users())
+    card_id = min(card.id for card in engine.get_available_cards())
+    violations = []
+    totals = {"won": 0, "refused": 0, "conflicted": 0}
+    start = time.perf_counter()
+    for number in range(rounds):
+        outcomes = race(engine, user_ids, card_id)
+        for outcome, racers in outcomes.items():
+            totals[outcome] += len(racers)
+        card = engine.get_card_from_id(card_id)
+        holders = [user_id for user_id in user_ids if card_id in engine.get_user_from_id(user_id).cards]
+        if len(outcomes["won"]) != 1:
+            violations.append(f"round {number}: {len(outcomes['won'])} Users got Card {card_id}")
+        elif holders != outcomes["won"] or card.owner != outcomes["won"][0] or not card.owned:
+            violations.append(f"round {number}: Card {card_id} is owned={card.owned} by {card.owner} and held by "
+                              f"{holders}, {outcomes['won'][0]} won it")
+        for user_id in holders:
+            engine.remove_card_from_user(user_id, card_id)
+    elapsed = time.perf_counter() - start
+    print(f"one free Card: {rounds} rounds of {threads} threads in {elapsed:.2f} s, {totals['won']} won, "
+          f"{totals['refused']} refused, {totals['conflicted']} conflicted")
+    return violations
+
+
+def one_busy_user(engine: QueryEngine, steps: int) -> List[str]:
+    engine.add_user("busy", "", 1, datetime.utcnow())
+    user_id = engine.get_user_from_username("busy").unique_id
+    card_ids = sorted(card.id for card in engine.get_available_cards())[:MAX_CARDS]
+    exhausted = [0] * len(card_ids)
+    conflicts_before = engine.conflicts
+
+    def worker(number: int) -> None:
+        card_id = card_ids[number]
+        for _ in range(steps):
+            try:
+                if card_id in engine.get_user_from_id(user_id).cards:
+                    engine.remove_card_from_user(user_id, card_id)
+                else:
+                    engine.add_card_to_user(user_id, card_id)
+            except ConflictError:
+                exhausted[number] += 1
+
+    threads = [threading.Thread(target=worker, args=(number,)) for number in range(len(card_ids))]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    print(f"one busy User: {len(card_ids)} threads x {steps} steps in {elapsed:.2f} s, "
+          f"{engine.conflicts - conflicts_before} conflicts retried, {sum(exhausted)} writes gave up after "
+          f"{MAX_RETRIES} attempts")
+
+    violations = []
+    held = engine.get_user_from_id(user_id).cards
+    for card_id in card_ids:
+        card = engine.get_card_from_id(card_id)
+        if (card_id in held) != (card.owner == user_id) or card.owned != (card.owner is not None):
+            violations.append(f"Card {card_id} is owned={card.owned} by {card.owner}, the busy User holds {held}")
+    return violations
+
+
+def main(threads: int = 32, rounds: int = 50, steps: int = 200) -> None:
+    work_dir = tempfile.mkdtemp()
+    try:
+        engine = QueryEngine(SQLiteBackend(os.path.join(work_dir, "trading_card_data.db"), schema_filename,
+                                           cards_filename), test_data=False)
+        violations = one_free_card(engine, threads, rounds) + one_busy_user(engine, steps)
+        engine.backend.close()
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    for message in violations:
+        print(f"VIOLATION {message}")
+    if violations:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:4]))
@@ -0,0 +1,88 @@
+"""
+Dashboard benchmark. A User holds 5 Cards and has 200 open Trades, each with a different User. It times reading the
+dashboard the way the page used to, get_user_cards and get_user_trades, against get_dashboard, counts the statements
+each runs, and times the whole page. It also times creating and confirming a Trade, the writes that now refresh the
+Dashboards of both its Users. The database is created in a temporary directory, run with
+python benchmarks/dashboard.py [runs].
+"""
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CARDS = 5
+TRADES = 200
+
+
+def timed(function, runs: int) -> str:
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        function()
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    return f"p50 {statistics.median(timings):7.2f} ms  p99 {timings[int(len(timings) * 0.99) - 1]:7.2f} ms"
+
+
+def main(runs: int = 200) -> None:
+    work_dir = tempfile.mkdtemp()
+    os.environ.update(TRADING_CARD_DB=os.path.join(work_dir, "trading_card_data.db"),
+                      TRADING_CARD_LEAGUES=os.path.join(work_dir, "trading_card_leagues.db"),
+                      TRADING_CARD_BACKUP_DIR=os.path.join(work_dir, "backups"),
+                      TRADING_CARD_ASSET_DIR=os.path.join(work_dir, "assets"))
+    sys.path.insert(0, root)
+    try:
+        from app import app, schema_filename
+        from app.login_helper import hash_pw
+        from app.query_engine import QueryEngine, engine, cards_filename
+        from app.query_plans import StatementRegistry
+        from app.storage import SQLiteBackend
+
+        now = datetime.utcnow()
+        engine.add_user("dash", hash_pw("dash1234"), 1, now)
+        user_id = engine.get_user_from_username("dash").unique_id
+        engine.add_cards_to_user(user_id, list(range(20, 20 + CARDS)))
+        for i in range(TRADES):
+            engine.add_user(f"partner{i}", "x", 1, now)
+            partner_id = engine.get_user_from_username(f"partner{i}").unique_id
+            assert engine.create_trade(user_id, [20 + i % CARDS], partner_id, [])
+
+        registry = StatementRegistry()
+        counting = QueryEngine(SQLiteBackend(os.environ["TRADING_CARD_DB"], schema_filename, cards_filename,
+                                             connection_factory=registry.connection_class()), test_data=False)
+        counting.initialize_database()
+        for label, read in (("get_user_cards + get_user_trades",
+                             lambda: (counting.get_user_cards(user_id), counting.get_user_trades(user_id))),
+                            ("get_dashboard", lambda: counting.get_dashboard(user_id))):
+            registry.clear()
+            read()
+            statements = sum(statement.uses for statement in registry.statements.values())
+            print(f"{label:<34} {statements:4} statements  {timed(read, runs)}")
+        counting.backend.close()
+
+        client = app.test_client()
+        client.post("/login", data={"username": "dash", "password": "dash1234"})
+        print(f"{'GET /dashboard':<34} {'':15} {timed(lambda: client.get('/dashboard').get_data(), runs)}")
+
+        engine.add_user("partner", "x", 1, now)
+        partner_id = engine.get_user_from_username("partner").unique_id
+
+        def create_and_confirm():
+            engine.create_trade(user_id, [20], partner_id, [])
+            t = engine.get_trade_from_values(user_id, [20], partner_id, [])
+            engine.user_confirm_trade(engine.get_user_from_id(user_id), t)
+            engine.delete_trade(t.unique_id)
+
+        print(f"{'create, confirm and delete a Trade':<34} {'':15} {timed(create_and_confirm, max(runs // 4, 1))}")
+        engine.backend.close()
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:2]))
@@ -0,0 +1,87 @@
+"""
+Leaderboard benchmark. Fills a new database with Users holding random team scores, then times loading the Fenwick
+tree of score counts, a rank lookup against counting the Users with a higher score in SQL, leaderboard pages near the
+top and deep down, and adding a Card, which moves the User in the tree. Every rank looked up is checked against the
+count. Run with python benchmarks/leaderboard.py [users] [lookups].
+"""
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from contextlib import closing
+from datetime import datetime
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root)
+
+from app import schema_filename  # noqa: E402
+from app.query_engine import MAX_CARDS, QueryEngine, cards_filename  # noqa: E402
+from app.storage import SQLiteBackend  # noqa: E402
+
+PAGE = 50
+# how many pages down the deep page is
+DEEP_PAGES = 100
+# how many Cards are added, each a different free Card
+ADDS = 100
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return (time.perf_counter() - start) * 1000, result
+
+
+def main(users: int = 10 ** 6, lookups: int = 1000) -> None:
+    work_dir = tempfile.mkdtemp()
+    try:
+        backend = SQLiteBackend(os.path.join(work_dir, "trading_card_data.db"), schema_filename, cards_filename)
+        engine = QueryEngine(backend, test_data=False)
+        engine.initialize_database()
+        # scores a team of MAX_CARDS Cards can reach
+        highest = sum(sorted((card.points or 0 for card in engine.get_all_cards()), reverse=True)[:MAX_CARDS])
+        rng = random.Random(0)
+        now = datetime.utcnow()
+        with closing(backend.connect()) as conn:
+            conn.executemany("insert into Users (name, hashed_pass, access, last_seen, cards, trades, score) "
+                             "values (?, ?, ?, ?, ?, ?, ?)",
+                             ((f"user{i}", "", 1, now, [], [], rng.randrange(highest + 1)) for i in range(users)))
+            conn.commit()
+        print(f"{users} Users, scores 0 to {highest}")
+
+        elapsed, _ = timed(engine.get_user_rank, 1)
+        print(f"loading the counts        {elapsed:9.2f} ms")
+        ranks, counts, wrong = [], [], 0
+        with closing(backend.connect()) as conn:
+            for _ in range(lookups):
+                user_id = rng.randint(1, users)
+                elapsed, rank = timed(engine.get_user_rank, user_id)
+                ranks.append(elapsed)
+                start = time.perf_counter()
+                counted = conn.execute("select count(*) + 1 from Users where score > "
+                                       "(select score from Users where id = ?)", (user_id,)).fetchone()[0]
+                counts.append((time.perf_counter() - start) * 1000)
+                wrong += rank != counted
+        print(f"rank lookup p50           {statistics.median(ranks):9.3f} ms   "
+              f"{'ok' if not wrong else f'{wrong} WRONG'}")
+        print(f"counting in SQL p50       {statistics.median(counts):9.3f} ms")
+
+        elapsed, page = timed(engine.get_leaderboard, None, PAGE)
+        print(f"first page                {elapsed:9.2f} ms")
+        for _ in range(DEEP_PAGES):
+            page = engine.get_leaderboard((page[-1][1].score, page[-1][1].unique_id), PAGE)
+        elapsed, _ = timed(engine.get_leaderboard, (page[-1][1].score, page[-1][1].unique_id), PAGE)
+        print(f"page {DEEP_PAGES + 2:<20} {elapsed:9.2f} ms")
+
+        adds = [timed(engine.add_card_to_user, rng.randint(1, users), card_id)[0]
+                for card_id in rng.sample(sorted(engine.get_all_card_ids()), ADDS)]
+        print(f"add_card_to_user p50      {statistics.median(adds):9.2f} ms")
+        backend.close()
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:3]))
@@ -0,0 +1,93 @@
+"""
+Aggregate write throughput as the Users are spread over more leagues. For each number of leagues a fresh directory
+of league databases is made and the same number of Users is divided over the leagues. Then worker processes, each
+with its own LeagueRouter as the processes of a deployment would have, add and drop Cards for random Users for a
+while. Run with python benchmarks/league_writes.py [processes] [seconds].
+
+With one league every process queues for the one database's write lock, with more leagues they mostly write to
+different files. How much that buys depends on the cores there are to run the processes on.
+"""
+import datetime
+import os
+import multiprocessing
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root)
+
+from app import schema_filename  # noqa: E402
+from app.leagues import LeagueRouter  # noqa: E402
+from app.models import ConflictError  # noqa: E402
+from app.query_engine import QueryEngine, cards_filename  # noqa: E402
+from app.storage import SQLiteBackend  # noqa: E402
+
+USERS = 64
+LEAGUES = (1, 2, 4, 8)
+CARDS = 140
+
+
+def writer(directory: str, seed: int, seconds: float, results) -> None:
+    rng = random.Random(seed)
+    default = QueryEngine(SQLiteBackend(os.path.join(directory, "default.db"), schema_filename, cards_filename),
+                          test_data=False)
+    router = LeagueRouter(os.path.join(directory, "leagues.db"), default)
+    user_ids = [router.get_user_from_username(f"user{i}").unique_id for i in range(USERS)]
+    writes = conflicts = 0
+    end = time.time() + seconds
+    while time.time() < end:
+        user_id = rng.choice(user_ids)
+        engine = router.for_user(user_id)
+        try:
+            cards = engine.get_user_from_id(user_id).cards
+            if cards:
+                engine.remove_card_from_user(user_id, next(iter(cards)))
+            else:
+                engine.add_card_to_user(user_id, rng.randint(1, CARDS))
+            writes += 1
+        except (ConflictError, ValueError):
+            conflicts += 1
+    router.close()
+    default.backend.close()
+    results.put((writes, conflicts))
+
+
+def run(league_count: int, processes: int, seconds: float) -> None:
+    directory = tempfile.mkdtemp()
+    try:
+        default = QueryEngine(SQLiteBackend(os.path.join(directory, "default.db"), schema_filename, cards_filename),
+                              test_data=False)
+        router = LeagueRouter(os.path.join(directory, "leagues.db"), default)
+        for i in range(1, league_count):
+            router.create_league(f"league{i}")
+        for i in range(USERS):
+            router.add_user(f"user{i}", "x", 1, datetime.datetime.utcnow())
+        router.close()
+        default.backend.close()
+
+        results = multiprocessing.Queue()
+        workers = [multiprocessing.Process(target=writer, args=(directory, seed, seconds, results))
+                   for seed in range(processes)]
+        for worker in workers:
+            worker.start()
+        counts = [results.get() for _ in workers]
+        for worker in workers:
+            worker.join()
+        writes = sum(count for count, _ in counts)
+        conflicts = sum(count for _, count in counts)
+        print(f"{league_count} leagues: {writes / seconds:8.0f} writes/s  ({conflicts} conflicts or lost races)")
+    finally:
+        shutil.rmtree(directory)
+
+
+def main(processes: int = 4, seconds: float = 10) -> None:
+    print(f"{processes} processes, {os.cpu_count()} cpus")
+    for league_count in LEAGUES:
+        run(league_count, processes, seconds)
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:2]), *(float(arg) for arg in sys.argv[2:3]))
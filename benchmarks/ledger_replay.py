@@ -0,0 +1,97 @@
+"""
+Ownership ledger benchmark. Generates a random history of acquire and drop events over CARDS Cards, appends it to the
+OwnershipEvents table of a new database with a snapshot every SNAPSHOT_INTERVAL events, as the QueryEngine takes them,
+and times rebuilding the owners:
+- replay() over the events held in memory
+- a full replay of the ledger read from SQLite
+- QueryEngine.get_ownership_at_seq, which loads the nearest snapshot and replays only the events after it
+Every rebuilt state is checked against the owners worked out while generating the events. Run with
+python benchmarks/ledger_replay.py [events].
+"""
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from contextlib import closing
+from datetime import datetime
+from typing import Dict, List, Tuple
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root)
+
+from app import schema_filename  # noqa: E402
+from app.ledger import SNAPSHOT_INTERVAL, replay  # noqa: E402
+from app.models import EVENT_ACQUIRE, EVENT_DROP  # noqa: E402
+from app.query_engine import QueryEngine, cards_filename  # noqa: E402
+from app.storage import SQLiteBackend, SQLiteTransaction  # noqa: E402
+
+CARDS = 500
+USERS = 1000
+
+
+def generate(count: int) -> Tuple[List[Tuple[str, int, int]], Dict[int, int]]:
+    """
+    :return: the events as (kind, user_id, card_id) and the owners after them
+    """
+    rng = random.Random(0)
+    owners: Dict[int, int] = {}
+    events = []
+    for _ in range(count):
+        card_id = rng.randrange(1, CARDS + 1)
+        if card_id in owners:
+            events.append((EVENT_DROP, owners.pop(card_id), card_id))
+        else:
+            owners[card_id] = rng.randrange(1, USERS + 1)
+            events.append((EVENT_ACQUIRE, owners[card_id], card_id))
+    return events, owners
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return (time.perf_counter() - start) * 1000, result
+
+
+def main(count: int = 10 ** 7) -> None:
+    work_dir = tempfile.mkdtemp()
+    try:
+        events, owners = generate(count)
+        elapsed, state = timed(replay, {}, events)
+        print(f"{count} events over {CARDS} Cards")
+        print(f"replay() in memory           {elapsed / 1000:8.2f} s   {'ok' if state == owners else 'WRONG'}")
+
+        db_filename = os.path.join(work_dir, "trading_card_data.db")
+        backend = SQLiteBackend(db_filename, schema_filename, cards_filename)
+        backend.initialize()
+        now = datetime.utcnow()
+        with closing(backend.connect()) as conn:
+            start = time.perf_counter()
+            conn.executemany("insert into OwnershipEvents (at, kind, user_id, card_id) values (?, ?, ?, ?)",
+                             ((now, kind, user_id, card_id) for kind, user_id, card_id in events))
+            snapshots, state = [], {}
+            for seq in range(SNAPSHOT_INTERVAL, count + 1, SNAPSHOT_INTERVAL):
+                replay(state, events[seq - SNAPSHOT_INTERVAL:seq])
+                snapshots.append((seq, now, [[card_id, user_id] for card_id, user_id in state.items()]))
+            conn.executemany("insert into OwnershipSnapshots (seq, taken, owners) values (?, ?, ?)", snapshots)
+            conn.commit()
+            print(f"appending the ledger          {time.perf_counter() - start:8.2f} s   "
+                  f"{len(snapshots)} snapshots")
+            elapsed, state = timed(replay, {}, SQLiteTransaction(conn).ownership_changes(0, count))
+            print(f"full replay from SQLite       {elapsed / 1000:8.2f} s   {'ok' if state == owners else 'WRONG'}")
+
+        engine = QueryEngine(backend, test_data=False)
+        engine.get_ownership_at_seq(0)
+        # right at a snapshot, the longest tail after one and halfway through an interval
+        for seq in (count, count - 1, count // 2 + SNAPSHOT_INTERVAL // 2):
+            expected = owners if seq == count else replay({}, events[:seq])
+            elapsed, state = timed(engine.get_ownership_at_seq, seq)
+            print(f"snapshot and tail at {seq:<9} {elapsed:8.2f} ms  {'ok' if state == expected else 'WRONG'}")
+        backend.close()
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:2]))
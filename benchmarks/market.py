@@ -0,0 +1,153 @@
+"""
+Market analytics benchmark. Virtual Users acquire, drop and trade Cards, then every round writes another HISTORY_DAYS
+days of past activity straight into the ownership ledger, the trade archive and the roll-ups, as if the game had run
+that much longer. After each round the reads of the market page, which only read the roll-ups, are timed next to
+working out the most traded and most dropped Cards ad hoc from the trade archive and the ledger. The time a write
+spends on the roll-ups is shown by the time of an acquire and a drop. Run with python benchmarks/market.py [rounds]
+[steps].
+"""
+import os
+import random
+import shutil
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from contextlib import closing
+from datetime import datetime, timedelta
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root)
+
+from app import schema_filename  # noqa: E402
+from app.market import MARKET_PERIODS, bucket_start  # noqa: E402
+from app.models import EVENT_ACQUIRE, EVENT_DROP, QueryEngineError, TRADE_COMPLETED  # noqa: E402
+from app.query_engine import MAX_CARDS, QueryEngine, cards_filename  # noqa: E402
+from app.storage import SQLiteBackend  # noqa: E402
+
+USERS = 50
+TOP = 10
+READS = 20
+# the days of past activity every round adds, and how many Cards are acquired and dropped and traded each day
+HISTORY_DAYS = 30
+MOVES_PER_DAY = 2000
+TRADES_PER_DAY = 200
+
+
+def step(engine: QueryEngine, rng: random.Random, user_ids, card_ids) -> None:
+    user = engine.get_user_from_id(rng.choice(user_ids))
+    roll = rng.random()
+    if roll < 0.4 and len(user.cards) < MAX_CARDS:
+        engine.add_card_to_user(user.unique_id, rng.choice(card_ids))
+    elif roll < 0.7 and user.cards:
+        engine.remove_card_from_user(user.unique_id, rng.choice(sorted(user.cards)))
+    elif user.cards:
+        other = engine.get_user_from_id(rng.choice([user_id for user_id in user_ids if user_id != user.unique_id]))
+        if other.cards and engine.create_trade(user.unique_id, [min(user.cards)], other.unique_id, [min(other.cards)]):
+            t = engine.get_trade_from_values(user.unique_id, [min(user.cards)], other.unique_id, [min(other.cards)])
+            engine.user_confirm_trade(user, t)
+            engine.user_confirm_trade(other, engine.get_trade_from_id(t.unique_id))
+
+
+def add_history(db_filename: str, rng: random.Random, first_day: int, user_ids, card_ids) -> None:
+    """
+    Write HISTORY_DAYS days of activity ending first_day days ago into the ledger, the trade archive and the roll-ups
+    """
+    today = bucket_start("day", datetime.utcnow())
+    events, trades = [], []
+    rollups = {}
+    for day in range(first_day, first_day + HISTORY_DAYS):
+        start = today - timedelta(days=day)
+        for _ in range(MOVES_PER_DAY):
+            at = start + timedelta(seconds=rng.randrange(86400))
+            kind, card_id = rng.choice((EVENT_ACQUIRE, EVENT_DROP)), rng.choice(card_ids)
+            events.append((at, kind, rng.choice(user_ids), card_id))
+            for period in MARKET_PERIODS:
+                row = rollups.setdefault((period, bucket_start(period, at), card_id), [0, 0, 0, 0])
+                row[2 if kind == EVENT_ACQUIRE else 3] += 1
+        for _ in range(TRADES_PER_DAY):
+            at = start + timedelta(seconds=rng.randrange(86400))
+            cards = rng.sample(card_ids, 2)
+            trades.append((rng.choice(user_ids), [cards[0]], rng.choice(user_ids), [cards[1]], at, TRADE_COMPLETED))
+            for card_id in cards:
+                for period in MARKET_PERIODS:
+                    rollups.setdefault((period, bucket_start(period, at), card_id), [0, 0, 0, 0])[1] += 1
+    with closing(sqlite3.connect(db_filename)) as conn:
+        conn.executemany("insert into OwnershipEvents (at, kind, user_id, card_id) values (?, ?, ?, ?)", events)
+        conn.executemany("insert into TradeArchive (trade_id, user1_id, user1_cards, user1_confirmed, user2_id, "
+                         "user2_cards, user2_confirmed, archived, status) "
+                         "values (0, ?, json(?), 1, ?, json(?), 1, ?, ?)",
+                         [(user1, str(cards1), user2, str(cards2), at, status)
+                          for user1, cards1, user2, cards2, at, status in trades])
+        conn.executemany("insert into MarketRollups (period, bucket, card_id, offered, traded, acquired, dropped) "
+                         "values (?, ?, ?, ?, ?, ?, ?)", [(*key, *row) for key, row in rollups.items()])
+        conn.commit()
+
+
+def market_page(engine: QueryEngine) -> None:
+    now = datetime.utcnow()
+    engine.get_market_leaders("traded", TOP)
+    engine.get_market_window("day", bucket_start("day", now) - timedelta(days=6), "traded", TOP)
+    engine.get_market_activity("hour", bucket_start("hour", now) - timedelta(hours=23))
+    engine.get_market_activity("day", bucket_start("day", now) - timedelta(days=29))
+
+
+def ad_hoc(db_filename: str) -> None:
+    with closing(sqlite3.connect(db_filename)) as conn:
+        conn.execute("select value, count(*) from (select value from TradeArchive, json_each(user1_cards) "
+                     "where status = ? union all select value from TradeArchive, json_each(user2_cards) "
+                     "where status = ?) group by value order by count(*) desc limit ?",
+                     (TRADE_COMPLETED, TRADE_COMPLETED, TOP)).fetchall()
+        conn.execute("select card_id, count(*) from OwnershipEvents where kind = ? group by card_id "
+                     "order by count(*) desc limit ?", (EVENT_DROP, TOP)).fetchall()
+
+
+def timed(function, *args) -> float:
+    start = time.perf_counter()
+    function(*args)
+    return (time.perf_counter() - start) * 1000
+
+
+def main(rounds: int = 4, steps: int = 1500) -> None:
+    work_dir = tempfile.mkdtemp()
+    try:
+        db_filename = os.path.join(work_dir, "trading_card_data.db")
+        engine = QueryEngine(SQLiteBackend(db_filename, schema_filename, cards_filename), test_data=False)
+        for i in range(USERS):
+            engine.add_user(f"user{i}", "", 1, datetime.utcnow())
+        user_ids = sorted(user.unique_id for user in engine.get_all_users())
+        card_ids = sorted(engine.get_all_card_ids())[:100]
+        rng = random.Random(1)
+        for number in range(1, rounds + 1):
+            start = time.perf_counter()
+            for _ in range(steps):
+                try:
+                    step(engine, rng, user_ids, card_ids)
+                except QueryEngineError:
+                    pass
+            per_step = (time.perf_counter() - start) * 1000 / steps
+            add_history(db_filename, rng, 1 + (number - 1) * HISTORY_DAYS, user_ids, card_ids)
+            with closing(sqlite3.connect(db_filename)) as conn:
+                events = conn.execute("select count(*) from OwnershipEvents").fetchone()[0]
+                archived = conn.execute("select count(*) from TradeArchive").fetchone()[0]
+            page = statistics.median(timed(market_page, engine) for _ in range(READS))
+            scan = statistics.median(timed(ad_hoc, db_filename) for _ in range(READS))
+            print(f"{number * HISTORY_DAYS:4} days, {events:7} ledger events, {archived:6} archived trades "
+                  f"({per_step:.2f} ms a step): market page {page:6.2f} ms  ad hoc from the ledger {scan:7.2f} ms")
+
+        user_id = user_ids[0]
+        for card_id in sorted(engine.get_user_from_id(user_id).cards):
+            engine.remove_card_from_user(user_id, card_id)
+        free = sorted(card.id for card in engine.get_available_cards())[:MAX_CARDS]
+        acquires = [timed(engine.add_card_to_user, user_id, card_id) for card_id in free]
+        drops = [timed(engine.remove_card_from_user, user_id, card_id) for card_id in free]
+        print(f"acquire p50 {statistics.median(acquires):.2f} ms  drop p50 {statistics.median(drops):.2f} ms, "
+              f"roll-ups included")
+        engine.backend.close()
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:3]))
@@ -0,0 +1,62 @@
+"""
+Bytes per page view. Logs in as an example User and requests every page, and the stylesheet it links, once sending
+no Accept-Encoding, which is what every client got before responses were compressed, and once for each content coding
+the app can send. A first view loads the page and the stylesheet, a repeat view only the page: the fingerprinted
+stylesheet is immutable, where the plain static one was revalidated once its max-age of 12 hours had run out.
+Response headers are not counted. The database is created in a temporary directory, run with
+python benchmarks/page_bytes.py.
+"""
+import os
+import re
+import shutil
+import sys
+import tempfile
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PAGES = ["/dashboard", "/add_cards", "/create_trade", "/trade_history", "/leaderboard", "/wants", "/trade_cycles",
+         "/view_users"]
+
+
+def page_bytes(client, path: str, encoding: str) -> int:
+    headers = {"Accept-Encoding": encoding} if encoding else {}
+    response = client.get(path, headers=headers)
+    assert response.status_code == 200, (path, response.status_code)
+    assert response.headers.get("Content-Encoding") in (encoding or None, None), path
+    size = len(response.get_data())
+    response.close()
+    return size
+
+
+def main() -> None:
+    work_dir = tempfile.mkdtemp()
+    os.environ.update(TRADING_CARD_DB=os.path.join(work_dir, "trading_card_data.db"),
+                      TRADING_CARD_LEAGUES=os.path.join(work_dir, "trading_card_leagues.db"),
+                      TRADING_CARD_BACKUP_DIR=os.path.join(work_dir, "backups"),
+                      TRADING_CARD_ASSET_DIR=os.path.join(work_dir, "assets"))
+    sys.path.insert(0, root)
+    try:
+        from app import app
+        from app.assets import ENCODINGS
+
+        client = app.test_client()
+        client.post("/login", data={"username": "chuck", "password": "test1234"})
+        stylesheet = re.search(r'href="(/assets/[^"]+\.css)"', client.get("/dashboard").get_data(as_text=True))[1]
+        encodings = [""] + [encoding for encoding, _ in ENCODINGS]
+        sizes = {encoding: {path: page_bytes(client, path, encoding) for path in PAGES} for encoding in encodings}
+        css = {encoding: page_bytes(client, stylesheet, encoding) for encoding in encodings}
+
+        print(f"{'page':<16}" + "".join(f"{encoding or 'identity':>10}" for encoding in encodings))
+        for path in PAGES:
+            print(f"{path:<16}" + "".join(f"{sizes[encoding][path]:>10}" for encoding in encodings))
+        print(f"{'stylesheet':<16}" + "".join(f"{css[encoding]:>10}" for encoding in encodings))
+        for encoding in encodings:
+            html = sum(sizes[encoding].values()) / len(PAGES)
+            print(f"{encoding or 'identity':<9} mean bytes per first view {html + css[encoding]:8.0f}  "
+                  f"per repeat view {html:8.0f}")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,209 @@
+"""
+Query plan regression check. Seeds a large database, runs every public QueryEngine method against it while recording
+the SQL the storage runs, and then explains and times each recorded statement, see app/query_plans.py. It fails on a
+statement that scans a table without being listed in EXPECTED_SCANS, and on a plan that differs from the snapshot in
+benchmarks/query_plans.json, so a schema or query change shows which plans it changed. Statements that got much
+slower than the snapshot and QueryEngine methods the run did not reach are reported without failing. Run with
+python benchmarks/query_plans.py [--update], --update writes the new plans and timings to the snapshot instead.
+"""
+import inspect
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+from datetime import datetime, timedelta
+from itertools import islice
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root)
+
+from app import schema_filename  # noqa: E402
+from app.models import NoOutputError, QueryEngineError, TradeCycleStep  # noqa: E402
+from app.query_engine import QueryEngine, cards_filename  # noqa: E402
+from app.query_plans import StatementRegistry, check_plans, load_snapshot, save_snapshot  # noqa: E402
+from app.scoring import ScoringFormula  # noqa: E402
+from app.storage import SQLiteBackend  # noqa: E402
+
+SNAPSHOT_FILENAME = os.path.join(os.path.dirname(os.path.abspath(__file__)), "query_plans.json")
+# rows added to the example data, so a scan costs what it would in a busy league. The added Trades are not in the
+# trades of their Users and are dated in the future, so they are never expired
+USERS = 50000
+TRADES = 20000
+ARCHIVED_TRADES = 100000
+OWNERSHIP_EVENTS = 200000
+WANTS = 50000
+CHANGES = 50000
+
+
+def generate(db_filename: str) -> None:
+    engine = QueryEngine(SQLiteBackend(db_filename, schema_filename, cards_filename))
+    engine.initialize_database()
+    engine.backend.close()
+    numbers = "with recursive n(i) as (select 1 union all select i + 1 from n where i < ?) "
+    with sqlite3.connect(db_filename) as conn:
+        conn.execute(numbers + "insert into Users (name, hashed_pass, access, last_seen, cards, trades) "
+                     "select 'user' || i, hex(randomblob(32)), 1, '2021-01-01 00:00:00', '[]', '[]' from n",
+                     (USERS,))
+        conn.execute(numbers + "insert into Trades (user1_id, user1_cards, user2_id, user2_cards, created, updated) "
+                     "select abs(random()) % ? + 5, '[]', abs(random()) % ? + 5, '[]', "
+                     "'2100-01-01 00:00:00', '2100-01-01 00:00:00' from n", (TRADES, USERS, USERS))
+        conn.execute(numbers + "insert into TradeArchive (trade_id, user1_id, user1_cards, user1_confirmed, user2_id, "
+                     "user2_cards, user2_confirmed, created, updated, archived, status) "
+                     "select i + 1000000, abs(random()) % ? + 1, '[]', 1, abs(random()) % ? + 1, '[]', 1, "
+                     "'2021-01-01 00:00:00', '2021-01-01 00:00:00', '2021-01-01 00:00:00', 'completed' from n",
+                     (ARCHIVED_TRADES, USERS, USERS))
+        conn.execute(numbers + "insert into OwnershipEvents (at, kind, user_id, card_id) "
+                     "select '2021-01-01 00:00:00', 'acquire', abs(random()) % ? + 1, abs(random()) % 140 + 1 from n",
+                     (OWNERSHIP_EVENTS, USERS))
+        conn.execute(numbers + "insert or ignore into Wants (user_id, card_id) "
+                     "select abs(random()) % ? + 5, abs(random()) % 140 + 1 from n", (WANTS, USERS))
+        conn.execute(numbers + "insert into Changes (origin, kind, row_id) "
+                     "select 'seed', 'user', abs(random()) % ? + 1 from n", (CHANGES, USERS))
+        conn.commit()
+
+
+class CallRecorder:
+    """
+    Passes attribute lookups through to the QueryEngine and remembers which methods were looked up
+    """
+
+    def __init__(self, engine: QueryEngine):
+        self.engine = engine
+        self.called = set()
+
+    def __getattr__(self, name: str):
+        self.called.add(name)
+        return getattr(self.engine, name)
+
+
+def attempt(method, *args, **kwargs):
+    try:
+        return method(*args, **kwargs)
+    except (NoOutputError, QueryEngineError):
+        return None
+
+
+def workload(e) -> None:
+    """
+    Call every public QueryEngine method, with the example Users chuck (1), nolan (2), dean (3) and george (4)
+    """
+    now = datetime.utcnow()
+    e.get_all_users()
+    e.get_all_card_ids()
+    e.get_all_cards()
+    list(e.iter_cards())
+    list(islice(e.iter_users(), 1000))
+    list(islice(e.export_state(), 10))
+    attempt(e.restore_state, [])
+    e.get_card_from_id(1)
+    e.get_card_from_name(e.get_card_from_id(1).name)
+    e.get_card_names([1, 2, 3])
+    e.get_user_names([1, 2, 3])
+    e.get_trade_from_id(1)
+    e.get_trade_from_values(1, [2], 2, [4])
+    e.get_user_from_id(1)
+    e.get_session_user(1)
+    e.get_available_cards()
+    e.get_user_from_username("nolan")
+    e.get_login_user(2, "nolan")
+    e.get_user_cards(1)
+    e.get_user_trades(1)
+    e.get_dashboard(1)
+    e.get_card_activity(1)
+    e.get_market_leaders()
+    e.get_market_window("day", now - timedelta(days=7))
+    e.get_market_activity("hour", now - timedelta(days=1))
+    e.check_user_exists("nolan")
+    e.update_user_last_seen(e.get_user_from_id(3))
+    e.check_card_owned(1)
+    e.set_card_owned(100)
+    e.set_card_not_owned(100)
+
+    e.add_user("query_plans", "x", 1, now)
+    user_id = e.get_user_from_username("query_plans").unique_id
+    e.add_card_to_user(user_id, 20)
+    e.remove_card_from_user(user_id, 20)
+    e.add_cards_to_user(user_id, [21, 22])
+    e.remove_cards_from_user(user_id, [21, 22])
+    e.remove_user(user_id)
+
+    e.check_valid_trade(1, {3}, 2, {5})
+    e.create_trade(1, [3], 2, [5])
+    trade = e.get_trade_from_values(1, [3], 2, [5])
+    e.user_confirm_trade(e.get_user_from_id(1), trade)
+    e.user_unconfirm_trade(e.get_user_from_id(1), e.get_trade_from_id(trade.unique_id))
+    e.unconfirm_all_trades(1)
+    e.user_confirm_trade(e.get_user_from_id(1), e.get_trade_from_id(trade.unique_id))
+    e.user_confirm_trade(e.get_user_from_id(2), e.get_trade_from_id(trade.unique_id))
+    attempt(e.do_trade, trade.unique_id)
+    e.create_trades(1, [([5], 3, [9])])
+    e.delete_trade(e.get_trade_from_values(1, [5], 3, [9]).unique_id)
+    e.expire_trades(now - timedelta(days=365 * 3), limit=10)
+    e.get_trade_history(1)
+    e.get_trade_history(1, before=10 ** 9)
+
+    e.get_ownership_at(now)
+    e.get_ownership_at_seq(1)
+    e.get_user_rank(1)
+    page = e.get_leaderboard(limit=10)
+    e.get_leaderboard(after=(page[-1][1].score, page[-1][1].unique_id), limit=10)
+
+    e.add_want(1, 11)
+    e.add_want(4, 7)
+    e.add_want(3, 2)
+    e.get_user_wants(1)
+    cycles = e.find_trade_cycles(1)
+    attempt(e.execute_trade_cycle, cycles[0] if cycles else [TradeCycleStep(4, 11, 1)])
+    e.remove_want(1, 11)
+    e.search_cards("le")
+    e.search_users("user1")
+    e.set_scoring(ScoringFormula({"ppointspg": 1.0}))
+    e.set_scoring(ScoringFormula())
+
+
+def main(update: bool = False) -> None:
+    work_dir = tempfile.mkdtemp()
+    try:
+        db_filename = os.path.join(work_dir, "trading_card_data.db")
+        generate(db_filename)
+        registry = StatementRegistry()
+        engine = QueryEngine(SQLiteBackend(db_filename, schema_filename, cards_filename,
+                                           connection_factory=registry.connection_class()), test_data=False)
+        engine.initialize_database()
+        registry.clear()
+        calls = CallRecorder(engine)
+        workload(calls)
+        engine.backend.close()
+
+        public = {name for name, _ in inspect.getmembers(QueryEngine, inspect.isfunction) if not name.startswith("_")}
+        not_called = sorted(public - calls.called - {"initialize_database", "load_test_data"})
+        snapshot = None if update or not os.path.exists(SNAPSHOT_FILENAME) else load_snapshot(SNAPSHOT_FILENAME)
+        report = check_plans(db_filename, list(registry.statements.values()), snapshot)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    for sql, plan in report.plans.items():
+        print(f"{plan['ms']:9.3f} ms  {plan['uses']:5}x  {sql}")
+        for step in plan["plan"]:
+            print(f"{'':25}{step}")
+    print(f"\n{len(report.plans)} statements")
+    for sql, scans in report.unexpected_scans.items():
+        print(f"UNEXPECTED SCAN {sql}\n    {'; '.join(scans)}")
+    for sql, before in report.changed_plans.items():
+        print(f"PLAN CHANGED {sql}\n    was: {'; '.join(before)}\n    now: {'; '.join(report.plans[sql]['plan'])}")
+    for sql, before_ms in report.slower.items():
+        print(f"slower {sql}: {before_ms:.3f} ms -> {report.plans[sql]['ms']:.3f} ms")
+    for sql in report.missing:
+        print(f"not run any more: {sql}")
+    if not_called:
+        print(f"QueryEngine methods not exercised: {', '.join(not_called)}")
+    if update:
+        save_snapshot(SNAPSHOT_FILENAME, report)
+        print(f"wrote {SNAPSHOT_FILENAME}")
+    elif report.failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main("--update" in sys.argv[1:])
@@ -0,0 +1,81 @@
+"""
+Search benchmark. Fills a new database with Users whose generated names mix accents and separators, then times
+searching them by the start of a word through the full text index, with random prefixes of 1 to 6 characters taken
+from the names: the storage search on its own, and QueryEngine.search_users with each prefix asked twice, so half of
+the searches hit the search cache. Every prefix must find at least one User. Run with
+python benchmarks/search.py [users] [searches].
+"""
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from contextlib import closing
+from datetime import datetime
+from typing import List
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root)
+
+from app import schema_filename  # noqa: E402
+from app.query_engine import QueryEngine, cards_filename  # noqa: E402
+from app.search import SEARCH_LIMIT  # noqa: E402
+from app.storage import SQLiteBackend  # noqa: E402
+
+# the pieces the User names are made of
+SYLLABLES = ["ka", "lo", "mi", "ne", "ru", "so", "ta", "vi", "ze", "do", "an", "el", "jo", "ić", "é"]
+
+
+def name(rng: random.Random, number: int) -> str:
+    first = "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4)))
+    last = "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 3)))
+    return f"{first}{'_' if number % 3 == 0 else ' '}{last}{number}"
+
+
+def percentiles(times: List[float]) -> str:
+    times = sorted(times)
+    return f"p50 {statistics.median(times):7.3f} ms   p99 {times[int(len(times) * 0.99)]:7.3f} ms"
+
+
+def main(users: int = 10 ** 6, searches: int = 2000) -> None:
+    work_dir = tempfile.mkdtemp()
+    try:
+        backend = SQLiteBackend(os.path.join(work_dir, "trading_card_data.db"), schema_filename, cards_filename)
+        engine = QueryEngine(backend, test_data=False)
+        engine.initialize_database()
+        rng = random.Random(0)
+        now = datetime.utcnow()
+        with closing(backend.connect()) as conn:
+            start = time.perf_counter()
+            conn.executemany("insert into Users (name, hashed_pass, access, last_seen, cards, trades) "
+                             "values (?, ?, ?, ?, ?, ?)",
+                             ((name(rng, number), "", 1, now, [], []) for number in range(users)))
+            conn.commit()
+            print(f"{users} Users inserted and indexed in {time.perf_counter() - start:.1f} s")
+            names = [row[0] for row in conn.execute("select name from Users order by random() limit ?",
+                                                    (searches,))]
+        prefixes = [n[:rng.randint(1, 6)] for n in names]
+
+        times, empty = [], 0
+        for prefix in prefixes:
+            start = time.perf_counter()
+            with backend.read() as tx:
+                empty += not tx.search_users(prefix, SEARCH_LIMIT)
+            times.append((time.perf_counter() - start) * 1000)
+        print(f"storage search_users    {percentiles(times)}   {'ok' if not empty else f'{empty} found NOTHING'}")
+
+        times = []
+        for prefix in prefixes + prefixes:
+            start = time.perf_counter()
+            engine.search_users(prefix)
+            times.append((time.perf_counter() - start) * 1000)
+        print(f"engine search_users     {percentiles(times)}")
+        backend.close()
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:3]))
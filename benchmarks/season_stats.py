@@ -0,0 +1,125 @@
+"""
+Season stats benchmark. Writes a history of 20 seasons of 5000 players with random stats, then measures opening it
+as a memory mapped SeasonStats and how much the resident memory grew, reading careers, and aggregating a range of
+seasons for every player. Next to it the same history is loaded from one csv file per season into dicts, as
+reading it into Python objects at startup would. The app is imported with its databases in a temporary directory.
+Run with python benchmarks/season_stats.py [players] [seasons].
+"""
+import csv
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+work_dir = tempfile.mkdtemp()
+os.environ.update(TRADING_CARD_DB=os.path.join(work_dir, "trading_card_data.db"),
+                  TRADING_CARD_LEAGUES=os.path.join(work_dir, "trading_card_leagues.db"),
+                  TRADING_CARD_BACKUP_DIR=os.path.join(work_dir, "backups"),
+                  TRADING_CARD_ASSET_DIR=os.path.join(work_dir, "assets"),
+                  TRADING_CARD_STATS=os.path.join(work_dir, "catalog_stats.bin"))
+sys.path.insert(0, root)
+
+from app.season_stats import STAT_COLUMNS, TOTAL_STATS, SeasonStats, read_season, write_stats  # noqa: E402
+
+FIRST_SEASON = 2001
+# the seasons aggregated for every player
+RANGE = (2011, 2020)
+CAREER_READS = 1000
+
+
+def rss() -> int:
+    """
+    :return: the resident memory of the process in bytes
+    """
+    with open("/proc/self/statm") as statm:
+        return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+
+def generate(players: int, seasons: int):
+    rng = random.Random(1)
+    history = {season: {} for season in range(FIRST_SEASON, FIRST_SEASON + seasons)}
+    for card_id in range(1, players + 1):
+        start = rng.randrange(FIRST_SEASON, FIRST_SEASON + seasons)
+        for season in range(start, min(start + rng.randint(1, 15), FIRST_SEASON + seasons)):
+            history[season][card_id] = {column: float(rng.randint(1, 82)) if column == "gp" else rng.random() * 30
+                                        for column, _ in STAT_COLUMNS}
+    return history
+
+
+def write_csv(filename: str, season_stats) -> None:
+    with open(filename, "w", newline="") as file:
+        writer = csv.writer(file)
+        writer.writerow(["NAME"] + [header for _, header in STAT_COLUMNS])
+        for card_id, stats in season_stats.items():
+            writer.writerow([f"player{card_id}"] + [stats[column] for column, _ in STAT_COLUMNS])
+
+
+def aggregate_dicts(history, card_ids, first, last):
+    totals = {}
+    for card_id in card_ids:
+        seasons = [history[season][card_id] for season in range(first, last + 1) if card_id in history[season]]
+        played = sum(stats["gp"] for stats in seasons)
+        if played:
+            totals[card_id] = {column: sum(stats[column] for stats in seasons) if column in TOTAL_STATS
+                               else sum(stats[column] * stats["gp"] for stats in seasons) / played
+                               for column, _ in STAT_COLUMNS}
+    return totals
+
+
+def timed(function) -> float:
+    start = time.perf_counter()
+    function()
+    return (time.perf_counter() - start) * 1000
+
+
+def main(players: int = 5000, seasons: int = 20) -> None:
+    try:
+        filename = os.path.join(work_dir, "season_stats.bin")
+        history = generate(players, seasons)
+        write_stats(filename, history, range(1, players + 1))
+        card_ids = list(range(1, players + 1))
+        rng = random.Random(2)
+        size = os.path.getsize(filename)
+        for season, season_stats in history.items():
+            write_csv(os.path.join(work_dir, f"{season}.csv"), season_stats)
+        del history, season_stats
+
+        before = rss()
+        start = time.perf_counter()
+        stats = SeasonStats(filename)
+        opened = (time.perf_counter() - start) * 1000
+        after_open = rss() - before
+        careers = [timed(lambda: stats.career(rng.choice(card_ids))) for _ in range(CAREER_READS)]
+        after_careers = rss() - before
+        aggregated = timed(lambda: stats.aggregate(card_ids, *RANGE))
+        after_aggregate = rss() - before
+        print(f"{players} players x {seasons} seasons, {len(STAT_COLUMNS)} stats, file {size / 2 ** 20:.1f} MiB")
+        print(f"mmap   open {opened:9.3f} ms  RSS +{after_open / 2 ** 20:6.2f} MiB  "
+              f"career p50 {statistics.median(careers):.3f} ms  RSS +{after_careers / 2 ** 20:6.2f} MiB  "
+              f"aggregate {RANGE[0]}-{RANGE[1]} of all {aggregated:8.1f} ms  "
+              f"RSS +{after_aggregate / 2 ** 20:6.2f} MiB")
+        stats.close()
+
+        before = rss()
+        start = time.perf_counter()
+        names = {f"player{card_id}": card_id for card_id in card_ids}
+        history = {season: read_season(os.path.join(work_dir, f"{season}.csv"), names)
+                   for season in range(FIRST_SEASON, FIRST_SEASON + seasons)}
+        loaded = (time.perf_counter() - start) * 1000
+        after_load = rss() - before
+        careers = [timed(lambda: [(season, history[season][card_id]) for season in history
+                                  if card_id in history[season]]) for card_id in rng.choices(card_ids, k=CAREER_READS)]
+        aggregated = timed(lambda: aggregate_dicts(history, card_ids, *RANGE))
+        print(f"csv    load {loaded:9.3f} ms  RSS +{after_load / 2 ** 20:6.2f} MiB  "
+              f"career p50 {statistics.median(careers):.3f} ms  {'':17}"
+              f"aggregate {RANGE[0]}-{RANGE[1]} of all {aggregated:8.1f} ms")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:3]))
@@ -0,0 +1,245 @@
+"""
+Concurrent trade simulation. Virtual Users buy and drop Cards and propose, confirm, unconfirm, execute and cancel
+Trades at random against the real QueryEngine, from several threads in each of several processes sharing one
+database. After every step the step's thread checks the invariants on a snapshot of the whole store:
+- no Card is held by more than one User
+- the owned flag and owner of every Card agree with the Cards the Users hold
+- no User holds more than MAX_CARDS Cards
+- every open Trade only offers Cards its Users hold and is in the trades of both of them
+- every User's team score is the sum of the points of their Cards
+
+It reports the operations per second and every violation with the seed, process, thread and step it was found at.
+Every thread draws its steps from its own generator seeded from --seed, so a run with one process and one thread
+replays exactly, and a concurrent run replays the same steps in a possibly different interleaving. Run with
+python benchmarks/simulation.py [--processes N] [--threads N] [--users N] [--steps N] [--seed N] [--check-every N]
+[--memory]. --check-every 0 only checks once every thread is done, which shows the throughput without the checks, and
+--memory runs the threads of one process against a MemoryBackend.
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from typing import List, Tuple
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root)
+
+from app import schema_filename  # noqa: E402
+from app.memory_storage import MemoryBackend  # noqa: E402
+from app.models import QueryEngineError  # noqa: E402
+from app.query_engine import MAX_CARDS, QueryEngine, cards_filename  # noqa: E402
+from app.storage import SQLiteBackend  # noqa: E402
+
+# the operations a virtual User picks from, with their weights
+OPERATIONS = (("buy", 4), ("drop", 2), ("propose", 3), ("confirm", 4), ("unconfirm", 1), ("execute", 1),
+              ("cancel", 1))
+# how many of the Cards of the catalog the virtual Users go after, fewer make more of them collide
+CARDS = 40
+# how many of the last steps of a thread are listed with a violation it found
+HISTORY = 5
+
+
+def open_engine(db_filename: str) -> QueryEngine:
+    return QueryEngine(SQLiteBackend(db_filename, schema_filename, cards_filename), test_data=False)
+
+
+def check_invariants(engine: QueryEngine) -> List[str]:
+    """
+    :return: a message for every invariant the store breaks, read in one snapshot
+    """
+    violations = []
+    with engine.backend.snapshot() as tx:
+        cards = {card.id: card for card in tx.all_cards()}
+        users = {user.unique_id: user for user in tx.all_users()}
+        trades = []
+        after_id = 0
+        while True:
+            page = tx.trades_after(after_id, 1000)
+            trades.extend(page)
+            if len(page) < 1000:
+                break
+            after_id = page[-1].unique_id
+
+    holders = Counter(card_id for user in users.values() for card_id in user.cards)
+    for card_id, count in holders.items():
+        if count > 1:
+            violations.append(f"Card {card_id} is held by {count} Users")
+    for user in users.values():
+        if len(user.cards) > MAX_CARDS:
+            violations.append(f"User {user.unique_id} holds {len(user.cards)} Cards")
+        for card_id in user.cards:
+            card = cards.get(card_id)
+            if card is None or not card.owned or card.owner != user.unique_id:
+                violations.append(f"User {user.unique_id} holds Card {card_id}, which is not owned by them: "
+                                  f"owned={card and card.owned} owner={card and card.owner}")
+        score = sum(cards[card_id].points or 0 for card_id in user.cards if card_id in cards)
+        if user.score != score:
+            violations.append(f"User {user.unique_id} has a score of {user.score}, their Cards are worth {score}")
+    for card in cards.values():
+        if (card.owned or card.owner is not None) and holders[card.id] == 0:
+            violations.append(f"Card {card.id} is owned={card.owned} by {card.owner}, but no User holds it")
+    for trade in trades:
+        for user_id, offered in ((trade.user1_id, trade.user1_cards), (trade.user2_id, trade.user2_cards)):
+            user = users.get(user_id)
+            if user is None:
+                violations.append(f"Trade {trade.unique_id} is with User {user_id}, who does not exist")
+                continue
+            if not offered <= user.cards:
+                violations.append(f"Trade {trade.unique_id} offers Cards {sorted(offered - user.cards)} "
+                                  f"User {user_id} does not hold")
+            if trade.unique_id not in user.trades:
+                violations.append(f"Trade {trade.unique_id} is not in the trades of User {user_id}")
+    open_trades = {trade.unique_id for trade in trades}
+    for user in users.values():
+        for trade_id in user.trades - open_trades:
+            violations.append(f"User {user.unique_id} has Trade {trade_id}, which is not open")
+    return violations
+
+
+def step(engine: QueryEngine, rng: random.Random, user_id: int, user_ids: List[int], card_ids: List[int]) -> str:
+    """
+    Make one random move for the User
+
+    :return: what was done, for the history of the thread
+    """
+    operation = rng.choices([name for name, _ in OPERATIONS], [weight for _, weight in OPERATIONS])[0]
+    user = engine.get_user_from_id(user_id)
+    if operation == "buy":
+        card_id = rng.choice(card_ids)
+        return f"buy {card_id}: {engine.add_card_to_user(user_id, card_id)}"
+    if operation == "drop" and user.cards:
+        card_id = rng.choice(sorted(user.cards))
+        engine.remove_card_from_user(user_id, card_id)
+        return f"drop {card_id}"
+    if operation == "propose":
+        other_id = rng.choice([other_id for other_id in user_ids if other_id != user_id])
+        other = engine.get_user_from_id(other_id)
+        own_cards = rng.sample(sorted(user.cards), rng.randint(0, len(user.cards)))
+        other_cards = rng.sample(sorted(other.cards), rng.randint(0, len(other.cards)))
+        if not own_cards and not other_cards:
+            return "propose nothing"
+        created = engine.create_trade(user_id, own_cards, other_id, other_cards)
+        return f"propose {own_cards} to {other_id} for {other_cards}: {created}"
+    if operation in ("confirm", "unconfirm", "execute", "cancel") and user.trades:
+        trade_id = rng.choice(sorted(user.trades))
+        trade = engine.get_trade_from_id(trade_id)
+        if operation == "confirm":
+            return f"confirm {trade_id}: {engine.user_confirm_trade(user, trade)}"
+        if operation == "unconfirm":
+            engine.user_unconfirm_trade(user, trade)
+            return f"unconfirm {trade_id}"
+        if operation == "execute":
+            return f"execute {trade_id}: {engine.do_trade(trade_id)}"
+        engine.delete_trade(trade_id)
+        return f"cancel {trade_id}"
+    return f"{operation} nothing"
+
+
+def run_thread(engine: QueryEngine, seed: int, process: int, thread: int, user_ids: List[int], card_ids: List[int],
+               steps: int, check_every: int, results: list) -> None:
+    rng = random.Random(f"{seed}-{process}-{thread}")
+    history: List[str] = []
+    operations = refused = 0
+    violations = []
+    for number in range(steps):
+        user_id = rng.choice(user_ids)
+        try:
+            done = step(engine, rng, user_id, user_ids, card_ids)
+        except (QueryEngineError, ValueError) as err:  # a Trade or Card that changed since it was read
+            done = f"refused: {type(err).__name__} {err}"
+            refused += 1
+        operations += 1
+        history = (history + [f"user {user_id} {done}"])[-HISTORY:]
+        if check_every and (number + 1) % check_every == 0:
+            found = check_invariants(engine)
+            if found:
+                violations.append((seed, process, thread, number, list(history), found))
+    results.append((operations, refused, violations))
+
+
+def run_process(db_filename: str, seed: int, process: int, threads: int, steps: int, check_every: int,
+                engine: QueryEngine = None, queue=None) -> List[Tuple[int, int, list]]:
+    engine = engine if engine is not None else open_engine(db_filename)
+    user_ids = sorted(user.unique_id for user in engine.get_all_users())
+    card_ids = sorted(engine.get_all_card_ids())[:CARDS]
+    results = []
+    workers = [threading.Thread(target=run_thread, args=(engine, seed, process, thread, user_ids, card_ids, steps,
+                                                         check_every, results)) for thread in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    if queue is not None:
+        queue.put(results)
+        engine.backend.close()
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Run random concurrent trading and check the invariants.")
+    parser.add_argument("--processes", type=int, default=2)
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--users", type=int, default=12)
+    parser.add_argument("--steps", type=int, default=300, help="steps of every thread")
+    parser.add_argument("--seed", type=int, default=random.randrange(10 ** 6))
+    parser.add_argument("--check-every", type=int, default=1, help="steps between checks, 0 to check at the end")
+    parser.add_argument("--memory", action="store_true", help="one process against a MemoryBackend")
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp()
+    try:
+        db_filename = os.path.join(work_dir, "trading_card_data.db")
+        engine = QueryEngine(MemoryBackend(cards_filename), test_data=False) if args.memory \
+            else open_engine(db_filename)
+        for i in range(args.users):
+            engine.add_user(f"user{i}", "", 1, datetime.utcnow())
+
+        start = time.perf_counter()
+        if args.memory or args.processes == 1:
+            results = run_process(db_filename, args.seed, 0, args.threads, args.steps, args.check_every, engine)
+        else:
+            queue = multiprocessing.Queue()
+            workers = [multiprocessing.Process(target=run_process, args=(db_filename, args.seed, process,
+                                                                         args.threads, args.steps,
+                                                                         args.check_every, None, queue))
+                       for process in range(args.processes)]
+            for worker in workers:
+                worker.start()
+            results = [result for _ in workers for result in queue.get()]
+            for worker in workers:
+                worker.join()
+        elapsed = time.perf_counter() - start
+        final = check_invariants(engine)
+        engine.backend.close()
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    operations = sum(result[0] for result in results)
+    refused = sum(result[1] for result in results)
+    violations = [violation for result in results for violation in result[2]]
+    backend = "memory" if args.memory else f"{args.processes if args.processes > 1 else 1} processes"
+    print(f"seed {args.seed}, {backend} x {args.threads} threads, {args.users} users: {operations} operations "
+          f"in {elapsed:.2f} s, {operations / elapsed:.0f} ops/s, {refused} refused, "
+          f"checked every {args.check_every or 'never'} steps")
+    for seed, process, thread, number, history, found in violations[:20]:
+        print(f"VIOLATION seed {seed} process {process} thread {thread} step {number}")
+        for line in history:
+            print(f"    {line}")
+        for message in found:
+            print(f"  {message}")
+    for message in final:
+        print(f"VIOLATION at the end: {message}")
+    if violations or final:
+        print(f"{len(violations)} violations during the run, {len(final)} at the end, replay with --seed {args.seed}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
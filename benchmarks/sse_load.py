@@ -0,0 +1,77 @@
+"""
+Server-sent events load benchmark. Subscribes many listeners to an EventHub, spread over fewer Users, and measures the
+memory each Subscription takes with tracemalloc. Then it starts one waiting thread per Subscription, as the threaded
+server runs one per /events/trades connection, measures the resident memory each idle connection adds, and times
+publishing one event to every User until each waiting thread has received its event. Every Subscription must get
+exactly one delivery. Run with python benchmarks/sse_load.py [subscribers] [users].
+"""
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from typing import List
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root)
+
+from app.events import EventHub, Subscription  # noqa: E402
+
+# seconds a waiting thread waits for its event before giving up
+WAIT = 15
+# the stack of each waiting thread, far below the default, as a server with many connections would set it
+THREAD_STACK = 256 * 1024
+
+
+def rss() -> int:
+    """
+    :return: the resident memory of this process in bytes
+    """
+    with open("/proc/self/status") as status:
+        for line in status:
+            if line.startswith("VmRSS"):
+                return int(line.split()[1]) * 1024
+    return 0
+
+
+def main(subscribers: int = 10000, users: int = 5000) -> None:
+    hub = EventHub()
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    subscriptions = [hub.subscribe(i % users) for i in range(subscribers)]
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    size = sum(stat.size_diff for stat in after.compare_to(before, "filename"))
+    print(f"{subscribers} Subscriptions over {users} Users")
+    print(f"memory per Subscription        {size / subscribers:9.0f} B")
+
+    delivered: List[int] = []
+
+    def wait(subscription: Subscription) -> None:
+        events = hub.take(subscription, WAIT)
+        while events == []:
+            events = hub.take(subscription, WAIT)
+        delivered.append(len(events or ()))
+
+    threading.stack_size(THREAD_STACK)
+    idle = rss()
+    threads = [threading.Thread(target=wait, args=(subscription,), daemon=True) for subscription in subscriptions]
+    for thread in threads:
+        thread.start()
+    time.sleep(1)
+    print(f"resident memory per connection {(rss() - idle) / subscribers / 1024:9.1f} KiB")
+
+    start = time.perf_counter()
+    for user_id in range(users):
+        hub.publish({user_id}, {"type": "trade_confirmed", "trade_id": user_id})
+    published = time.perf_counter() - start
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    print(f"publish                        {published * 10 ** 6 / users:9.1f} us per event")
+    print(f"every connection served after  {elapsed * 1000:9.0f} ms   "
+          f"{'ok' if delivered == [1] * subscribers else f'{sum(delivered)}/{subscribers} DELIVERED'}")
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:3]))
@@ -0,0 +1,75 @@
+"""
+Startup benchmark. Each run starts a new interpreter and times importing the app, the first request, and the first
+request that needs the database, which creates it. The databases and every file the app builds are kept in a
+temporary directory, as the tests do, run with python benchmarks/startup.py [runs].
+
+cold    no databases and no image, the Card data and example data are loaded
+image   no databases, the database is restored from the prebuilt image (built first if missing)
+warm    the databases already exist
+"""
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CHILD = """
+import json, time
+start = time.perf_counter()
+from app import app
+imported = time.perf_counter()
+client = app.test_client()
+client.get('/login')
+first_request = time.perf_counter()
+client.post('/login', data={'username': 'chuck', 'password': 'test1234'})
+client.get('/dashboard')
+first_data_request = time.perf_counter()
+print(json.dumps({"import": imported - start, "first request": first_request - imported,
+                  "first data request": first_data_request - first_request}))
+"""
+
+
+def run_once(work_dir: str, data_dir: str, image_dir: str) -> dict:
+    env = dict(os.environ, TRADING_CARD_DB=os.path.join(data_dir, "trading_card_data.db"),
+               TRADING_CARD_LEAGUES=os.path.join(data_dir, "trading_card_leagues.db"),
+               TRADING_CARD_IMAGE_DIR=image_dir,
+               TRADING_CARD_BACKUP_DIR=os.path.join(work_dir, "backups"),
+               TRADING_CARD_TEMPLATE_CACHE=os.path.join(work_dir, "template_cache"),
+               TRADING_CARD_ASSET_DIR=os.path.join(work_dir, "assets"),
+               TRADING_CARD_STATS=os.path.join(work_dir, "season_stats.bin"))
+    output = subprocess.run([sys.executable, "-c", CHILD], cwd=root, env=env, check=True,
+                            capture_output=True, text=True).stdout
+    return json.loads(output.splitlines()[-1])
+
+
+def main(runs: int = 10) -> None:
+    sys.path.insert(0, root)
+    from app.db_image import build_image
+
+    work_dir = tempfile.mkdtemp()
+    try:
+        empty_dir = os.path.join(work_dir, "no-image")
+        os.mkdir(empty_dir)
+        build_image(work_dir)
+        # the databases of the app and of its leagues, removed before each run that starts without them
+        data_dir = os.path.join(work_dir, "data")
+
+        for mode in ("cold", "image", "warm"):
+            timings = []
+            for _ in range(runs):
+                if mode != "warm" or not os.path.exists(data_dir):
+                    shutil.rmtree(data_dir, ignore_errors=True)
+                    os.mkdir(data_dir)
+                timings.append(run_once(work_dir, data_dir, empty_dir if mode == "cold" else work_dir))
+            print(f"{mode:6}" + "".join(f"  {name} {statistics.median(t[name] for t in timings) * 1000:7.1f} ms"
+                                        for name in timings[0]))
+    finally:
+        shutil.rmtree(work_dir)
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:]))
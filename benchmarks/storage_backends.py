@@ -0,0 +1,75 @@
+"""
+Storage backend benchmark. The same QueryEngine workload runs against a SQLiteBackend on a database file, a
+SQLiteBackend on ":memory:" and a MemoryBackend: every User adds a Card, reads their Cards, drops the Card and lists the
+available Cards. It reports the operations per second of each backend and checks that all three end up with the same
+Users, owners and scores. Run with python benchmarks/storage_backends.py [users] [rounds].
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime
+from typing import Dict, Tuple
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root)
+
+from app import schema_filename  # noqa: E402
+from app.memory_storage import MemoryBackend  # noqa: E402
+from app.query_engine import QueryEngine, cards_filename  # noqa: E402
+from app.storage import SQLiteBackend  # noqa: E402
+
+
+def workload(engine: QueryEngine, users: int, rounds: int) -> int:
+    """
+    :return: the number of operations made
+    """
+    for i in range(users):
+        engine.add_user(f"user{i}", "", 1, datetime(2020, 1, 1))
+    user_ids = sorted(user.unique_id for user in engine.get_all_users())
+    card_ids = sorted(engine.get_all_card_ids())
+    # the Cards moved in the rounds, the rest are kept
+    moved, kept = card_ids[:len(card_ids) // 2], card_ids[len(card_ids) // 2:]
+    operations = 0
+    for number in range(rounds):
+        for i, user_id in enumerate(user_ids):
+            card_id = moved[(i + number) % len(moved)]
+            engine.add_card_to_user(user_id, card_id)
+            engine.get_user_cards(user_id)
+            engine.remove_card_from_user(user_id, card_id)
+            engine.get_available_cards()
+            operations += 4
+        # one User keeps a Card every round, so the backends end up with something to compare
+        engine.add_card_to_user(user_ids[number % len(user_ids)], kept[number % len(kept)])
+    return operations
+
+
+def state(engine: QueryEngine) -> Dict[str, Tuple]:
+    return dict(sorted((user.name, (tuple(sorted(user.cards)), user.score)) for user in engine.get_all_users()))
+
+
+def main(users: int = 200, rounds: int = 3) -> None:
+    work_dir = tempfile.mkdtemp()
+    try:
+        backends = {"sqlite file": SQLiteBackend(os.path.join(work_dir, "trading_card_data.db"), schema_filename,
+                                                 cards_filename),
+                    "sqlite :memory:": SQLiteBackend(":memory:", schema_filename, cards_filename),
+                    "memory": MemoryBackend(cards_filename)}
+        states = {}
+        for label, backend in backends.items():
+            engine = QueryEngine(backend, test_data=False)
+            start = time.perf_counter()
+            operations = workload(engine, users, rounds)
+            elapsed = time.perf_counter() - start
+            print(f"{label:16} {operations / elapsed:8.0f} ops/s")
+            states[label] = state(engine)
+            backend.close()
+        print("same end state on every backend" if len({repr(s) for s in states.values()}) == 1
+              else "END STATES DIFFER")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:3]))
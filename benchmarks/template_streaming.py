@@ -0,0 +1,142 @@
+"""
+Benchmark of the list pages. Each measurement starts a new interpreter over a league holding a given number of Users
+or Cards and times one request of the view users or the add cards page to its first byte and to its last byte, and
+how much the peak RSS of the process grew while it was served. "buffered" is how the pages used to be made, the whole
+list read and the page rendered before anything is sent, "streamed" is the page rendered as it is sent. It also times
+loading every template in a new process without and with the compiled templates in the bytecode cache. Databases are
+created in a temporary directory, run with python benchmarks/template_streaming.py [items ...].
+"""
+import json
+import os
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CHILD = """
+import json, resource, sys, time
+from flask import render_template
+from flask_login import current_user, login_required
+from werkzeug.test import EnvironBuilder
+from app import app
+from app.routes import league_engine
+
+page, mode = sys.argv[1], sys.argv[2]
+
+
+@app.route("/buffered/view_users")
+@login_required
+def buffered_view_users():
+    users = league_engine().get_all_users()
+    users.remove(current_user)
+    return render_template("view_users.html", title="View Users", users=users)
+
+
+@app.route("/buffered/add_cards")
+@login_required
+def buffered_add_cards():
+    available_cards = league_engine().get_available_cards()
+    return render_template("add_cards.html", title="Add Cards", available_cards=available_cards, search="")
+
+
+client = app.test_client()
+login = client.post("/login", data={"username": "chuck", "password": "test1234"})
+cookie = login.headers["Set-Cookie"].split(";")[0]
+client.get("/dashboard")
+baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+path = ("/buffered/" if mode == "buffered" else "/") + page
+environ = EnvironBuilder(path=path, headers={"Cookie": cookie}).get_environ()
+start = time.perf_counter()
+body = app.wsgi_app(environ, lambda status, headers, exc_info=None: None)
+size, first_byte = 0, None
+for chunk in body:
+    if chunk and first_byte is None:
+        first_byte = time.perf_counter()
+    size += len(chunk)
+last_byte = time.perf_counter()
+getattr(body, "close", lambda: None)()
+peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print(json.dumps({"ttfb": first_byte - start, "total": last_byte - start, "bytes": size,
+                  "rss": (peak - baseline) / 1024}))
+"""
+
+COMPILE_CHILD = """
+import json, time
+from app import app
+start = time.perf_counter()
+for name in app.jinja_env.list_templates():
+    app.jinja_env.get_template(name)
+print(json.dumps({"load": time.perf_counter() - start}))
+"""
+
+
+def generate(db_filename: str, items: int) -> None:
+    """
+    Add items Users and items Cards beyond the catalog to the example data, so every listing holds at least items
+    """
+    with sqlite3.connect(db_filename) as conn:
+        conn.execute("with recursive n(i) as (select 1 union all select i + 1 from n where i < ?) "
+                     "insert into Users (name, hashed_pass, access, last_seen, cards, trades) "
+                     "select 'user' || i, hex(randomblob(32)), 1, '2021-01-01 00:00:00', '[]', '[]' from n",
+                     (items,))
+        columns = [row[1] for row in conn.execute("pragma table_info(Cards)")
+                   if row[1] not in ("id", "name", "owned", "owner", "points")]
+        conn.execute(f"with recursive n(i) as (select 1 union all select i + 1 from n where i < ?) "
+                     f"insert into Cards (name, {', '.join(columns)}) "
+                     f"select Cards.name || ' ' || n.i, {', '.join('Cards.' + c for c in columns)} "
+                     f"from (select * from Cards where id = (select min(id) from Cards)) as Cards, n", (items,))
+        conn.commit()
+
+
+def run_child(script: str, env: dict, *args: str) -> dict:
+    output = subprocess.run([sys.executable, "-c", script, *args], cwd=root, env=env, check=True,
+                            capture_output=True, text=True).stdout
+    return json.loads(output.splitlines()[-1])
+
+
+def main(sizes) -> None:
+    sys.path.insert(0, root)
+    from app.db_image import build_image
+
+    work_dir = tempfile.mkdtemp()
+    try:
+        build_image(work_dir)
+        for items in sizes:
+            data_dir = os.path.join(work_dir, str(items))
+            os.mkdir(data_dir)
+            env = dict(os.environ, TRADING_CARD_DB=os.path.join(data_dir, "trading_card_data.db"),
+                       TRADING_CARD_LEAGUES=os.path.join(data_dir, "trading_card_leagues.db"),
+                       TRADING_CARD_IMAGE_DIR=work_dir, TRADING_CARD_BACKUP_DIR=os.path.join(data_dir, "backups"),
+                       TRADING_CARD_TEMPLATE_CACHE=os.path.join(work_dir, "template_cache"))
+            # the first start creates the database, the items are added before the league directory is made
+            subprocess.run([sys.executable, "-c", "from app.query_engine import engine; engine.initialize_database()"],
+                           cwd=root, env=env, check=True)
+            generate(env["TRADING_CARD_DB"], items)
+            for page in ("view_users", "add_cards"):
+                for mode in ("buffered", "streamed"):
+                    result = run_child(CHILD, env, page, mode)
+                    print(f"{items:>7} {page:<10} {mode:<9} first byte {result['ttfb'] * 1000:8.1f} ms  "
+                          f"last byte {result['total'] * 1000:8.1f} ms  peak RSS +{result['rss']:7.1f} MiB  "
+                          f"{result['bytes'] / 2 ** 20:6.1f} MiB sent")
+
+        cache_dir = os.path.join(work_dir, "compile_cache")
+        env = dict(os.environ, TRADING_CARD_DB=os.path.join(work_dir, "compile.db"),
+                   TRADING_CARD_LEAGUES=os.path.join(work_dir, "compile_leagues.db"),
+                   TRADING_CARD_TEMPLATE_CACHE=cache_dir)
+        compiled = []
+        for _ in range(5):
+            shutil.rmtree(cache_dir, ignore_errors=True)
+            compiled.append(run_child(COMPILE_CHILD, env)["load"])
+        cached = [run_child(COMPILE_CHILD, env)["load"] for _ in range(5)]
+        print(f"loading every template, compiled: {min(compiled) * 1000:.1f} ms  "
+              f"from the bytecode cache: {min(cached) * 1000:.1f} ms")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main([int(arg) for arg in sys.argv[1:]] or [10000, 100000])
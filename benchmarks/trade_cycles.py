@@ -0,0 +1,104 @@
+"""
+Trade cycle benchmark. Fills a new database with a want graph of Users who each own CARDS_PER_USER Cards and want
+random Cards of other Users, then times QueryEngine.find_trade_cycles for a sample of Users and carrying out the first
+cycle found for others with QueryEngine.execute_trade_cycle. Afterwards every User's Cards are checked against the
+owners of the Cards. Run with python benchmarks/trade_cycles.py [users] [wants per user].
+"""
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from contextlib import closing
+from datetime import datetime
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root)
+
+from app import schema_filename  # noqa: E402
+from app.query_engine import QueryEngine, cards_filename  # noqa: E402
+from app.storage import SQLiteBackend  # noqa: E402
+
+CARDS_PER_USER = 5
+# the generated Cards start above the ids of the card catalog
+FIRST_CARD_ID = 1000
+# how many Users the search is timed for
+SEARCHES = 500
+# how many Users get the first cycle found for them carried out
+EXECUTES = 3000
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return (time.perf_counter() - start) * 1000, result
+
+
+def card_id(user_id: int, number: int) -> int:
+    return FIRST_CARD_ID + user_id * CARDS_PER_USER + number
+
+
+def main(users: int = 10 ** 5, wants: int = 10) -> None:
+    work_dir = tempfile.mkdtemp()
+    try:
+        backend = SQLiteBackend(os.path.join(work_dir, "trading_card_data.db"), schema_filename, cards_filename)
+        engine = QueryEngine(backend, test_data=False)
+        engine.initialize_database()
+        rng = random.Random(0)
+        now = datetime.utcnow()
+        with closing(backend.connect()) as conn:
+            conn.executemany("insert into Users (id, name, hashed_pass, access, last_seen, cards, trades) "
+                             "values (?, ?, ?, ?, ?, ?, ?)",
+                             ((user_id, f"user{user_id}", "", 1, now,
+                               [card_id(user_id, number) for number in range(CARDS_PER_USER)], [])
+                              for user_id in range(1, users + 1)))
+            conn.executemany("insert into Cards (id, owned, name, team, pos, age, gp, mpg, fta, ft_pct, two_pa, "
+                             "two_p_pct, three_pa, three_p_pct, shooting_pct, ppointspg, reboundspg, assistspg, "
+                             "stealspg, blockspg, image, owner, points) "
+                             "values (?, 1, ?, '', '', 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, '', ?, 0)",
+                             ((card_id(user_id, number), f"card{user_id}_{number}", user_id)
+                              for user_id in range(1, users + 1) for number in range(CARDS_PER_USER)))
+            edges = set()
+            for user_id in range(1, users + 1):
+                for _ in range(wants):
+                    owner_id = rng.randint(1, users)
+                    if owner_id != user_id:
+                        edges.add((user_id, card_id(owner_id, rng.randrange(CARDS_PER_USER))))
+            conn.executemany("insert into Wants (user_id, card_id) values (?, ?)", edges)
+            conn.commit()
+        print(f"{users} Users, {users * CARDS_PER_USER} Cards, {len(edges)} wants")
+
+        searches, found = [], 0
+        for user_id in rng.sample(range(1, users + 1), min(SEARCHES, users)):
+            elapsed, cycles = timed(engine.find_trade_cycles, user_id)
+            searches.append(elapsed)
+            found += bool(cycles)
+        searches.sort()
+        print(f"find_trade_cycles p50     {statistics.median(searches):9.2f} ms")
+        print(f"find_trade_cycles p99     {searches[int(len(searches) * 0.99)]:9.2f} ms   "
+              f"{found}/{len(searches)} Users have a trade")
+
+        executes, done = [], 0
+        for user_id in range(1, min(EXECUTES, users) + 1):
+            cycles = engine.find_trade_cycles(user_id, limit=1)
+            if cycles:
+                elapsed, carried_out = timed(engine.execute_trade_cycle, cycles[0])
+                executes.append(elapsed)
+                done += carried_out
+        if executes:
+            print(f"execute_trade_cycle p50   {statistics.median(executes):9.2f} ms   "
+                  f"{done}/{len(executes)} carried out")
+
+        with closing(backend.connect()) as conn:
+            wrong = conn.execute("select count(*) from Users where json_array_length(cards) != "
+                                 "(select count(*) from Cards where owner = Users.id)").fetchone()[0]
+        print("Cards agree with their owners" if not wrong else f"{wrong} Users DISAGREE with the Cards they own")
+        backend.close()
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:3]))
@@ -0,0 +1,144 @@
+"""
+Write queue benchmark. CLIENTS threads add a Card to their own User and remove it again through the QueryEngine, whose
+writes all go to the single writer thread of a SQLiteBackend, first with the writer committing every command on its
+own and then with it grouping up to MAX_BATCH queued commands in one transaction. The same load is then run as one
+small update per write, once with every write opening its own connection and committing it, as the QueryEngine did
+before the writer, and once through a WriteQueue. It reports the operations per second and the median and p99 latency
+of a write. Run with python benchmarks/write_queue.py [clients] [ops].
+"""
+import os
+import shutil
+import sqlite3
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from contextlib import closing
+from datetime import datetime
+from typing import Callable, List, Tuple
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root)
+
+from app import schema_filename  # noqa: E402
+from app.query_engine import QueryEngine, cards_filename  # noqa: E402
+from app.storage import SQLiteBackend  # noqa: E402
+from app.write_queue import MAX_BATCH, WriteQueue  # noqa: E402
+
+# how long a connection of its own waits for the database lock before giving up, in seconds
+BUSY_TIMEOUT = 60
+
+
+def run_clients(clients: int, ops: int, operation: Callable[[int, int], None]) -> Tuple[float, List[float]]:
+    """
+    Run ops operations split over clients threads, the thread number and the number of the operation are passed to
+    operation
+
+    :return: the wall time in seconds and the latency of every operation in ms
+    """
+    latencies: List[float] = []
+    lock = threading.Lock()
+    start_line = threading.Barrier(clients + 1)
+
+    def client(number: int) -> None:
+        own = []
+        start_line.wait()
+        for i in range(ops // clients):
+            start = time.perf_counter()
+            operation(number, i)
+            own.append((time.perf_counter() - start) * 1000)
+        with lock:
+            latencies.extend(own)
+
+    threads = [threading.Thread(target=client, args=(number,)) for number in range(clients)]
+    for thread in threads:
+        thread.start()
+    start_line.wait()
+    start = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - start, latencies
+
+
+def report(label: str, elapsed: float, latencies: List[float]) -> None:
+    latencies.sort()
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+    print(f"{label:36} {len(latencies) / elapsed:8.0f} ops/s  p50 {statistics.median(latencies):8.2f} ms  "
+          f"p99 {p99:8.2f} ms")
+
+
+def engine_run(work_dir: str, clients: int, ops: int, max_batch: int) -> None:
+    db_filename = os.path.join(work_dir, f"engine_{max_batch}.db")
+    engine = QueryEngine(SQLiteBackend(db_filename, schema_filename, cards_filename), test_data=False)
+    for i in range(clients):
+        engine.add_user(f"client{i}", "", 1, datetime.utcnow())
+    engine.backend.writer.max_batch = max_batch
+    user_ids = sorted(user.unique_id for user in engine.get_all_users())
+    card_ids = sorted(engine.get_all_card_ids())[:clients]
+
+    def operation(number: int, i: int) -> None:
+        if i % 2 == 0:
+            engine.add_card_to_user(user_ids[number], card_ids[number])
+        else:
+            engine.remove_card_from_user(user_ids[number], card_ids[number])
+
+    report(f"QueryEngine, max batch {max_batch}", *run_clients(clients, ops, operation))
+    engine.backend.close()
+
+
+def raw_database(work_dir: str, name: str, clients: int) -> str:
+    db_filename = os.path.join(work_dir, name)
+    with closing(sqlite3.connect(db_filename)) as conn:
+        conn.execute("pragma journal_mode = wal")
+        conn.execute("create table Counters (id integer primary key, value integer not null)")
+        conn.executemany("insert into Counters (id, value) values (?, 0)", ((i,) for i in range(clients)))
+        conn.commit()
+    return db_filename
+
+
+def update(conn: sqlite3.Connection, number: int) -> None:
+    conn.execute("update Counters set value = value + 1 where id = ?", (number,))
+
+
+def connection_per_write(work_dir: str, clients: int, ops: int) -> None:
+    db_filename = raw_database(work_dir, "own_connections.db", clients)
+
+    def operation(number: int, _: int) -> None:
+        with closing(sqlite3.connect(db_filename, timeout=BUSY_TIMEOUT, isolation_level=None)) as conn:
+            conn.execute("pragma synchronous = normal")
+            conn.execute("begin immediate")
+            update(conn, number)
+            conn.execute("commit")
+
+    report("update, connection per write", *run_clients(clients, ops, operation))
+
+
+def write_queue_run(work_dir: str, clients: int, ops: int) -> None:
+    db_filename = raw_database(work_dir, "write_queue.db", clients)
+
+    def connect() -> sqlite3.Connection:
+        conn = sqlite3.connect(db_filename)
+        conn.execute("pragma synchronous = normal")
+        return conn
+
+    writer = WriteQueue(connect)
+    report(f"update, WriteQueue, max batch {MAX_BATCH}",
+           *run_clients(clients, ops, lambda number, _: writer.execute(lambda conn: update(conn, number))))
+    writer.close()
+
+
+def main(clients: int = 32, ops: int = 1600) -> None:
+    work_dir = tempfile.mkdtemp()
+    try:
+        print(f"{clients} clients, {ops // clients * clients} writes")
+        for max_batch in (1, MAX_BATCH):
+            engine_run(work_dir, clients, ops, max_batch)
+        connection_per_write(work_dir, clients, ops)
+        write_queue_run(work_dir, clients, ops)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:3]))
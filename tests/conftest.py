@@ -0,0 +1,64 @@
+"""
+Shared fixtures. The app is imported with its databases and build directories in a temporary directory, as the
+benchmarks do, so a test run leaves nothing behind in app/.
+"""
+import os
+import shutil
+import sys
+import tempfile
+
+import pytest
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+work_dir = tempfile.mkdtemp()
+os.environ.update(TRADING_CARD_DB=os.path.join(work_dir, "trading_card_data.db"),
+                  TRADING_CARD_LEAGUES=os.path.join(work_dir, "trading_card_leagues.db"),
+                  TRADING_CARD_IMAGE_DIR=os.path.join(work_dir, "images"),
+                  TRADING_CARD_BACKUP_DIR=os.path.join(work_dir, "backups"),
+                  TRADING_CARD_TEMPLATE_CACHE=os.path.join(work_dir, "template_cache"),
+                  TRADING_CARD_ASSET_DIR=os.path.join(work_dir, "assets"),
+                  TRADING_CARD_STATS=os.path.join(work_dir, "catalog_stats.bin"))
+sys.path.insert(0, root)
+
+from app import schema_filename  # noqa: E402
+from app.leagues import USER_LEAGUES_SIZE, LeagueRouter  # noqa: E402
+from app.memory_storage import MemoryBackend  # noqa: E402
+from app.query_engine import QueryEngine, cards_filename  # noqa: E402
+from app.storage import SQLiteBackend, StorageBackend  # noqa: E402
+
+
+def pytest_sessionfinish(session, exitstatus) -> None:
+    shutil.rmtree(work_dir, ignore_errors=True)
+
+
+@pytest.fixture(params=["sqlite", "memory"])
+def backend(request) -> StorageBackend:
+    """
+    A new store with the Card data loaded and nothing else, for each of the backends
+    """
+    if request.param == "sqlite":
+        store: StorageBackend = SQLiteBackend(":memory:", schema_filename, cards_filename)
+    else:
+        store = MemoryBackend(cards_filename)
+    assert store.initialize()
+    yield store
+    store.close()
+
+
+def memory_engine(db_filename: str = "") -> QueryEngine:
+    """
+    :return: a QueryEngine over a new in-memory store with the Card data, to open as any league
+    """
+    return QueryEngine(MemoryBackend(cards_filename), test_data=False)
+
+
+@pytest.fixture
+def router(request, tmp_path) -> LeagueRouter:
+    """
+    A LeagueRouter with its directory in tmp_path and every league in memory. The size of its cache of Users' leagues
+    is the param of indirect parametrization, USER_LEAGUES_SIZE without one.
+    """
+    router = LeagueRouter(str(tmp_path / "leagues.db"), memory_engine(), memory_engine,
+                          cache_size=getattr(request, "param", USER_LEAGUES_SIZE))
+    yield router
+    router.close()
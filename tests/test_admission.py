@@ -0,0 +1,37 @@
+"""
+Tests of the token buckets of the AdmissionController
+"""
+from app.admission import AdmissionController
+
+
+def controller(max_buckets: int = 3):
+    now = [0.0]
+    return AdmissionController(rates={"cards": (2.0, 2)}, clock=lambda: now[0], max_buckets=max_buckets), now
+
+
+def test_bucket_refills_at_its_rate():
+    admission, now = controller()
+    assert [admission.take(1, "cards") for _ in range(3)] == [0.0, 0.0, 0.5]
+    now[0] = 0.5
+    assert admission.take(1, "cards") == 0.0
+    assert admission.take(1, "cards") == 0.5
+    assert admission.stats()["limited"] == {"cards": 2}
+
+
+def test_least_recently_used_bucket_is_dropped():
+    admission, now = controller()
+    for key in (1, 2, 3):
+        admission.take(key, "cards")
+    admission.take(1, "cards")
+    admission.take(4, "cards")
+    assert list(admission.buckets) == [(3, "cards"), (1, "cards"), (4, "cards")]
+    # the bucket of 1 was kept, it has no tokens left
+    assert admission.take(1, "cards") == 0.5
+
+
+def test_buckets_never_exceed_the_cap():
+    admission, now = controller(max_buckets=100)
+    for key in range(1000):
+        admission.take(key, "cards")
+        assert len(admission.buckets) <= 100
+    assert admission.stats()["buckets"] == 100
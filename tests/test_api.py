@@ -0,0 +1,53 @@
+"""
+Tests of the JSON API, through the Flask test client against the app's databases in the temporary directory
+"""
+import pytest
+
+from app import app
+from app.admission import admission
+
+PASSWORD = "test1234"
+
+
+@pytest.fixture
+def client():
+    # every test starts with full token buckets, so the requests of earlier tests do not get it limited
+    admission.buckets.clear()
+    client = app.test_client()
+    response = client.post("/api/v1/login", json={"username": "chuck", "password": PASSWORD})
+    assert response.status_code == 200
+    yield client
+    client.post("/api/v1/logout")
+
+
+def own_trades(client):
+    return sorted(t["id"] for t in client.get("/api/v1/me").get_json()["trades"])
+
+
+@pytest.mark.parametrize("card_ids", ["12", 12, None, {"1": 2}, ["x"], [None], [[1]]])
+def test_cards_reject_malformed_card_ids(client, card_ids):
+    cards = client.get("/api/v1/me").get_json()["cards"]
+    for method in (client.post, client.delete):
+        response = method("/api/v1/me/cards", json={"card_ids": card_ids})
+        assert response.status_code == 400
+        assert "card_ids" in response.get_json()["error"]
+    assert client.get("/api/v1/me").get_json()["cards"] == cards
+
+
+@pytest.mark.parametrize("trade", [{"own_cards": "12", "other_user_id": 2, "other_cards": [4]},
+                                   {"own_cards": [1], "other_user_id": 2, "other_cards": "4"},
+                                   {"own_cards": [1], "other_user_id": "nolan", "other_cards": [4]},
+                                   {"own_cards": [1], "other_user_id": 2}])
+def test_create_trades_rejects_malformed_trades(client, trade):
+    trades = own_trades(client)
+    response = client.post("/api/v1/trades", json={"trades": [trade]})
+    assert response.status_code == 400
+    assert "own_cards" in response.get_json()["error"]
+    assert own_trades(client) == trades
+
+
+def test_create_trades(client):
+    response = client.post("/api/v1/trades", json={"trades": [{"own_cards": [3], "other_user_id": 2,
+                                                               "other_cards": [5]}]})
+    assert response.status_code == 200
+    assert response.get_json() == {"created": [True]}
@@ -0,0 +1,40 @@
+"""
+Tests of building the fingerprinted and precompressed static assets and of loading their manifest
+"""
+import gzip
+import json
+import os
+
+from app import assets
+
+
+def test_build_compresses_only_missing_copies(tmp_path, monkeypatch):
+    static_dir, build_dir = tmp_path / "static", tmp_path / "build"
+    (static_dir / "css").mkdir(parents=True)
+    (static_dir / "css" / "style.css").write_bytes(b"body { color: black; }\n" * 100)
+    manifest = assets.build_assets(str(static_dir), str(build_dir))
+    target = build_dir / manifest["css/style.css"]
+    assert gzip.decompress((build_dir / (manifest["css/style.css"] + ".gz")).read_bytes()) == target.read_bytes()
+
+    def compress(*args, **kwargs):
+        raise AssertionError("an asset was compressed again")
+
+    monkeypatch.setattr(assets.gzip, "compress", compress)
+    if assets.brotli is not None:
+        monkeypatch.setattr(assets.brotli, "compress", compress)
+    assert assets.build_assets(str(static_dir), str(build_dir)) == manifest
+    assert json.loads((build_dir / assets.MANIFEST_NAME).read_text()) == manifest
+
+
+def test_manifest_is_read_not_built(tmp_path, monkeypatch):
+    manifest = {"css/style.css": "css/style.0123456789ab.css"}
+    (tmp_path / assets.MANIFEST_NAME).write_text(json.dumps(manifest))
+
+    def build_assets(static_dir, build_dir):
+        raise AssertionError("the assets were built")
+
+    monkeypatch.setattr(assets, "asset_dir", str(tmp_path))
+    monkeypatch.setattr(assets, "build_assets", build_assets)
+    monkeypatch.setattr(assets, "manifest", None)
+    assert assets.load_manifest() == manifest
+    assert os.listdir(tmp_path) == [assets.MANIFEST_NAME]
@@ -0,0 +1,90 @@
+"""
+Tests of signing up and logging in through the AuthService, and of the Bloom filter of usernames it keeps
+"""
+import threading
+from datetime import datetime
+
+import pytest
+
+from app.auth import AuthService
+from app.leagues import DEFAULT_LEAGUE
+from app.models import QueryEngineError
+
+LAST_SEEN = datetime(2020, 1, 1)
+PASSWORD = "password12"
+# how long a test waits for another thread
+THREAD_WAIT = 5.0
+
+
+def test_add_user_name_taken(router):
+    engine = router.engine(DEFAULT_LEAGUE)
+    engine.add_user("alice", "hash", 1, LAST_SEEN)
+    with pytest.raises(QueryEngineError):
+        engine.add_user("alice", "hash", 1, LAST_SEEN)
+    assert [u.name for u in engine.get_all_users()] == ["alice"]
+
+
+def test_failed_league_add_removes_the_member(router):
+    # a User the league has but the directory does not, which copies the Users of a new default league
+    router.initialize()
+    router.engine(DEFAULT_LEAGUE).add_user("alice", "hash", 1, LAST_SEEN, 1000)
+    with pytest.raises(QueryEngineError):
+        router.add_user("alice", "hash", 1, LAST_SEEN, DEFAULT_LEAGUE)
+    assert not router.check_user_exists("alice")
+    assert not router.user_leagues
+    assert router.add_user("bob", "hash", 1, LAST_SEEN, DEFAULT_LEAGUE) is not None
+
+
+def test_login(router):
+    auth = AuthService(router)
+    user_id = auth.register("alice", PASSWORD, 1)
+    engine = router.engine(DEFAULT_LEAGUE)
+    assert auth.login("alice", "wrong") is None
+    assert auth.login("nobody", PASSWORD) is None
+    misses = engine.user_cache.stats()["misses"]
+    u = auth.login("alice", PASSWORD)
+    assert (u.unique_id, u.name) == (user_id, "alice")
+    # the session of the User is loaded from what logging in read
+    assert engine.get_session_user(user_id).name == "alice"
+    assert engine.user_cache.stats()["misses"] <= misses + 1
+
+
+def test_filter_grows(router):
+    auth = AuthService(router, capacity=8, refresh_interval=0)
+    auth.load()
+    for i in range(30):
+        assert auth.username_available(f"user{i}")
+        assert auth.register(f"user{i}", PASSWORD, 1) is not None
+        assert not auth.username_available(f"user{i}")
+    assert auth.stats()["capacity"] >= 30
+    assert auth.stats()["usernames"] >= 30
+
+
+def test_refresh_does_not_hold_the_lock(router, monkeypatch):
+    auth = AuthService(router, refresh_interval=0)
+    router.add_user("taken", "hash", 1, LAST_SEEN)
+    auth.load()
+    reading, release = threading.Event(), threading.Event()
+    members_after = router.members_after
+
+    def slow_members_after(after_id, limit):
+        reading.set()
+        assert release.wait(THREAD_WAIT)
+        return members_after(after_id, limit)
+
+    monkeypatch.setattr(router, "members_after", slow_members_after)
+    refresher = threading.Thread(target=auth.username_available, args=("someone",))
+    refresher.start()
+    try:
+        assert reading.wait(THREAD_WAIT)
+        # answered while the other thread is still reading the directory for the filter
+        answers = []
+        checker = threading.Thread(target=lambda: answers.extend(auth.username_available(username)
+                                                                 for username in ("taken", "free")))
+        checker.start()
+        checker.join(THREAD_WAIT / 5)
+        assert answers == [False, True]
+    finally:
+        release.set()
+        refresher.join(THREAD_WAIT)
+    assert not refresher.is_alive()
@@ -0,0 +1,79 @@
+"""
+Tests of moving Users between leagues when a step of the move fails, and of the bounded cache of their leagues
+"""
+from datetime import datetime
+
+import pytest
+
+from app.leagues import DEFAULT_LEAGUE
+from app.models import NoOutputError
+
+LAST_SEEN = datetime(2020, 1, 1)
+
+# every test has a router that caches the leagues of 3 Users
+pytestmark = pytest.mark.parametrize("router", [3], indirect=True)
+
+
+@pytest.fixture(autouse=True)
+def east(router) -> None:
+    """
+    A second league, 2, for the Users to move to
+    """
+    router.create_league("east")
+
+
+def test_failed_move_is_undone_and_can_be_retried(router, monkeypatch):
+    user_id = router.add_user("alice", "hash", 1, LAST_SEEN, DEFAULT_LEAGUE)
+    source, target = router.engine(DEFAULT_LEAGUE), router.engine(2)
+    source.add_cards_to_user(user_id, [1, 2])
+
+    def fail(_):
+        raise RuntimeError("the old league is unavailable")
+
+    with monkeypatch.context() as patch:
+        patch.setattr(source, "remove_user", fail)
+        with pytest.raises(RuntimeError):
+            router.move_user(user_id, 2)
+    router.user_leagues.clear()
+    assert router.league_of(user_id) == DEFAULT_LEAGUE
+    assert source.get_user_from_id(user_id).cards == {1, 2}
+    with pytest.raises(NoOutputError):
+        target.get_user_from_id(user_id)
+    assert not target.get_card_from_id(1).owned
+
+    assert router.move_user(user_id, 2) == [1, 2]
+    assert router.league_of(user_id) == 2
+    assert target.get_user_from_id(user_id).cards == {1, 2}
+    with pytest.raises(NoOutputError):
+        source.get_user_from_id(user_id)
+
+
+def test_move_replaces_a_copy_left_by_an_interrupted_move(router):
+    user_id = router.add_user("bob", "hash", 1, LAST_SEEN, DEFAULT_LEAGUE)
+    router.engine(DEFAULT_LEAGUE).add_cards_to_user(user_id, [3])
+    u = router.engine(DEFAULT_LEAGUE).get_user_from_id(user_id)
+    router.engine(2).add_user(u.name, u.hashed_pass, u.access, u.last_seen, u.unique_id)
+    router.engine(2).add_cards_to_user(user_id, [4])
+
+    assert router.move_user(user_id, 2) == [3]
+    assert router.engine(2).get_user_from_id(user_id).cards == {3}
+    assert not router.engine(2).get_card_from_id(4).owned
+
+
+def test_league_cache_is_bounded(router):
+    user_ids = [router.add_user(f"user{i}", "hash", 1, LAST_SEEN) for i in range(5)]
+    assert list(router.user_leagues) == user_ids[2:]
+    router.league_of(user_ids[2])
+    router.league_of(user_ids[0])
+    assert list(router.user_leagues) == [user_ids[4], user_ids[2], user_ids[0]]
+    assert all(router.league_of(user_id) == router.locate(f"user{i}")[1] for i, user_id in enumerate(user_ids))
+    assert len(router.user_leagues) == 3
+
+
+def test_rebalance_skips_members_the_league_does_not_have(router):
+    user_ids = [router.add_user(f"user{i}", "hash", 1, LAST_SEEN, DEFAULT_LEAGUE) for i in range(4)]
+    # left in the directory by a failed step, the league no longer has them
+    for user_id in user_ids[1:]:
+        router.engine(DEFAULT_LEAGUE).remove_user(user_id)
+    assert router.rebalance() == [(user_ids[0], DEFAULT_LEAGUE, 2)]
+    assert router.league_of(user_ids[0]) == 2
@@ -0,0 +1,31 @@
+"""
+Tests of the pages, through the Flask test client against the app's databases in the temporary directory
+"""
+from datetime import datetime
+
+import pytest
+
+from app import app
+from app.leagues import leagues
+
+PASSWORD = "test1234"
+
+
+@pytest.fixture
+def client():
+    client = app.test_client()
+    response = client.post("/login", data={"username": "chuck", "password": PASSWORD})
+    assert response.status_code == 302
+    yield client
+    client.get("/logout")
+
+
+def test_create_trade_with_a_user_of_another_league(client):
+    league = leagues.create_league("far away")
+    other_user_id = leagues.add_user("stranger", "hash", 1, datetime(2020, 1, 1), league.id)
+    response = client.post("/create_trade", data={"own_cards": ["1"], "other_user_id": str(other_user_id),
+                                                  "other_cards": ["5"]})
+    assert response.status_code == 302
+    assert response.headers["Location"].endswith("/create_trade")
+    with client.session_transaction() as session:
+        assert session["_flashes"] == [("message", "There is no such user in your league")]
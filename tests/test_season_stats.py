@@ -0,0 +1,15 @@
+"""
+Tests of opening the per-season stats file on first use
+"""
+from app import season_stats
+
+
+def test_stats_are_opened_on_first_use(tmp_path, monkeypatch):
+    filename = tmp_path / "season_stats.bin"
+    monkeypatch.setattr(season_stats, "stats_filename", str(filename))
+    monkeypatch.setattr(season_stats, "season_stats", None)
+    assert not filename.exists()
+    stats = season_stats.get_season_stats()
+    assert filename.exists()
+    assert (stats.first_season, stats.last_season) == (season_stats.CATALOG_SEASON, season_stats.CATALOG_SEASON)
+    assert season_stats.get_season_stats() is stats
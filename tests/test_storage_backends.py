@@ -0,0 +1,571 @@
+"""
+Conformance tests of the storage backends. Every test runs against SQLiteBackend(":memory:") and MemoryBackend, which
+must behave the same through every StorageTransaction method, roll back a failed write completely, give snapshots
+that do not see later writes and refuse version checked updates of rows that changed since they were read.
+"""
+import sqlite3
+import threading
+from contextlib import closing
+from datetime import datetime, timedelta
+from typing import List
+
+import pytest
+
+from app import schema_filename
+from app.market import bucket_start
+from app.memory_storage import MemoryBackend
+from app.models import Trade, User, ConflictError, NoOutputError, EVENT_ACQUIRE, EVENT_DROP, EVENT_TRADE_CREATED, \
+    MARKET_ACQUIRED, MARKET_DROPPED, MARKET_TRADED, TRADE_CANCELLED, TRADE_COMPLETED
+from app.query_engine import cards_filename
+from app.storage import SQLiteBackend, StorageBackend, StorageTransaction, read_card_rows
+
+LAST_SEEN = datetime(2020, 1, 1)
+# how long a test waits for a write made from another thread
+WRITE_WAIT = 1.0
+
+
+def add_user(backend: StorageBackend, name: str) -> int:
+    return backend.write(lambda tx: tx.insert_user(name, f"hash-{name}", 1, LAST_SEEN))
+
+
+def give_cards(backend: StorageBackend, user_id: int, card_ids: List[int]) -> None:
+    """
+    Make the User own the Cards, as the QueryEngine does when a User acquires them
+    """
+    def command(tx: StorageTransaction) -> None:
+        u = tx.get_user(user_id)
+        for card_id in card_ids:
+            assert tx.claim_card(card_id, user_id)
+        tx.set_user_cards(u, sorted(u.cards | set(card_ids)))
+
+    backend.write(command)
+
+
+def add_trade(backend: StorageBackend, user1_id: int, user1_cards: List[int], user2_id: int,
+              user2_cards: List[int]) -> int:
+    def command(tx: StorageTransaction) -> int:
+        trade_id = tx.insert_trade(user1_id, user1_cards, user2_id, user2_cards)
+        for user_id in (user1_id, user2_id):
+            u = tx.get_user(user_id)
+            tx.set_user_trades(u, sorted(u.trades | {trade_id}))
+        return trade_id
+
+    return backend.write(command)
+
+
+def test_cards(backend):
+    rows = list(read_card_rows(cards_filename))
+    with backend.read() as tx:
+        card = tx.get_card(1)
+        assert (card.id, card.name, card.team, card.owned, card.owner) == (1, rows[0]["name"], rows[0]["team"],
+                                                                            False, None)
+        assert tx.get_card_by_name(rows[1]["name"]).id == 2
+        assert sorted(card.id for card in tx.all_cards()) == list(range(1, len(rows) + 1))
+        assert sorted(card.id for card in tx.available_cards()) == list(range(1, len(rows) + 1))
+        assert [card.id for card in tx.cards_after(0, 3)] == [1, 2, 3]
+        assert [card.id for card in tx.cards_after(len(rows) - 1, 3)] == [len(rows)]
+        assert tx.card_names({1, 2, len(rows) + 1}) == {1: rows[0]["name"], 2: rows[1]["name"]}
+        assert tx.card_names(set()) == {}
+        with pytest.raises(NoOutputError):
+            tx.get_card(len(rows) + 1)
+        with pytest.raises(NoOutputError):
+            tx.get_card_by_name("Nobody At All")
+
+
+def test_users(backend):
+    alice, bob, carol = (add_user(backend, name) for name in ("alice", "bob", "carol"))
+    assert alice < bob < carol
+    with backend.read() as tx:
+        u = tx.get_user(bob)
+        assert (u.unique_id, u.name, u.hashed_pass, int(u.access), u.cards, u.trades, u.version, u.score) == \
+               (bob, "bob", "hash-bob", 1, set(), set(), 0, 0)
+        assert tx.get_user_by_name("carol").unique_id == carol
+        assert tx.user_exists("alice") and not tx.user_exists("dave")
+        assert tx.get_user_by_name("alice").hashed_pass == "hash-alice"
+        assert sorted(u.unique_id for u in tx.all_users()) == [alice, bob, carol]
+        assert [u.unique_id for u in tx.users_after(alice, 1)] == [bob]
+        assert [u.unique_id for u in tx.users_after(alice, 10)] == [bob, carol]
+        assert tx.user_names({alice, carol, carol + 1}) == {alice: "alice", carol: "carol"}
+        for lookup in (lambda: tx.get_user(carol + 1), lambda: tx.get_user_by_name("dave")):
+            with pytest.raises(NoOutputError):
+                lookup()
+
+
+def test_insert_user_name_taken(backend):
+    add_user(backend, "alice")
+    with pytest.raises(sqlite3.IntegrityError):
+        add_user(backend, "alice")
+    with backend.read() as tx:
+        assert len(tx.all_users()) == 1
+
+
+def test_set_last_seen(backend):
+    alice = add_user(backend, "alice")
+    backend.write(lambda tx: tx.set_last_seen(alice, LAST_SEEN + timedelta(days=1)))
+    with backend.read() as tx:
+        assert tx.get_user(alice).last_seen == LAST_SEEN + timedelta(days=1)
+
+
+def test_set_user_cards_and_trades(backend):
+    alice = add_user(backend, "alice")
+
+    def command(tx: StorageTransaction) -> None:
+        u = tx.get_user(alice)
+        tx.set_user_cards(u, [1, 2])
+        assert (u.cards, u.version) == ({1, 2}, 1)
+        tx.set_user_trades(u, [7])
+        assert (u.trades, u.version) == ({7}, 2)
+        assert alice in tx.touched_users
+
+    backend.write(command)
+    with backend.read() as tx:
+        u = tx.get_user(alice)
+        assert (u.cards, u.trades, u.version) == ({1, 2}, {7}, 2)
+
+
+def test_claim_and_release_card(backend):
+    alice, bob = add_user(backend, "alice"), add_user(backend, "bob")
+    assert backend.write(lambda tx: tx.claim_card(5, alice))
+    assert not backend.write(lambda tx: tx.claim_card(5, bob))
+    with backend.read() as tx:
+        card = tx.get_card(5)
+        assert (card.owned, card.owner) == (True, alice)
+        assert 5 not in {card.id for card in tx.available_cards()}
+    with pytest.raises(ConflictError):
+        backend.write(lambda tx: tx.release_card(5, bob))
+    backend.write(lambda tx: tx.release_card(5, alice))
+    with backend.read() as tx:
+        card = tx.get_card(5)
+        assert (card.owned, card.owner) == (False, None)
+        assert 5 in {card.id for card in tx.available_cards()}
+
+
+def test_set_card_owned(backend):
+    backend.write(lambda tx: tx.set_card_owned(3, True))
+    with backend.read() as tx:
+        assert tx.get_card(3).owned
+        assert 3 not in {card.id for card in tx.available_cards()}
+    backend.write(lambda tx: tx.set_card_owned(3, False))
+    with backend.read() as tx:
+        assert not tx.get_card(3).owned
+        assert 3 in {card.id for card in tx.available_cards()}
+
+
+def test_trades(backend):
+    alice, bob = add_user(backend, "alice"), add_user(backend, "bob")
+    first = add_trade(backend, alice, [1], bob, [2])
+    second = add_trade(backend, alice, [3, 4], bob, [])
+    with backend.read() as tx:
+        t = tx.get_trade(first)
+        assert (t.user1_id, t.user1_cards, t.user1_confirmed, t.user2_id, t.user2_cards, t.user2_confirmed) == \
+               (alice, {1}, False, bob, {2}, False)
+        assert t.created is not None and t.updated is not None
+        assert tx.find_trade(alice, [3, 4], bob, []).unique_id == second
+        assert tx.find_trade(alice, [1], bob, [2], user1_confirmed=False).unique_id == first
+        assert tx.find_trade(alice, [1], bob, [2], user1_confirmed=True) is None
+        assert tx.find_trade(bob, [2], alice, [1]) is None
+        assert [t.unique_id for t in tx.trades_after(0, 10)] == [first, second]
+        assert [t.unique_id for t in tx.trades_after(first, 10)] == [second]
+        assert tx.get_user(alice).trades == {first, second}
+        with pytest.raises(NoOutputError):
+            tx.get_trade(second + 1)
+
+
+def test_set_trade_confirmed(backend):
+    alice, bob = add_user(backend, "alice"), add_user(backend, "bob")
+    trade_id = add_trade(backend, alice, [1], bob, [2])
+
+    def command(tx: StorageTransaction) -> None:
+        t = tx.get_trade(trade_id)
+        tx.set_trade_confirmed(t, 2, True)
+        assert (t.user2_confirmed, t.version) == (True, 1)
+
+    backend.write(command)
+    with backend.read() as tx:
+        t = tx.get_trade(trade_id)
+        assert (t.user1_confirmed, t.user2_confirmed, t.version) == (False, True, 1)
+        assert tx.find_trade(alice, [1], bob, [2], user2_confirmed=True).unique_id == trade_id
+
+
+def test_stale_and_archived_trades(backend):
+    alice, bob = add_user(backend, "alice"), add_user(backend, "bob")
+    trade_ids = [add_trade(backend, alice, [card_id], bob, []) for card_id in (1, 2, 3)]
+    with backend.read() as tx:
+        assert tx.stale_trade_ids(datetime.utcnow() + timedelta(seconds=1), 2) == trade_ids[:2]
+        assert tx.stale_trade_ids(datetime(2000, 1, 1), 10) == []
+
+    backend.write(lambda tx: tx.archive_trade(trade_ids[0], TRADE_COMPLETED))
+    backend.write(lambda tx: tx.archive_trade(trade_ids[1], TRADE_CANCELLED))
+    with backend.read() as tx:
+        with pytest.raises(NoOutputError):
+            tx.get_trade(trade_ids[0])
+        assert [t.unique_id for t in tx.trades_after(0, 10)] == [trade_ids[2]]
+        page = tx.archived_trades(alice, None, 1)
+        assert [(entry.trade_id, entry.status, entry.user1_cards) for entry in page] == \
+               [(trade_ids[1], TRADE_CANCELLED, {2})]
+        older = tx.archived_trades(bob, page[-1].archive_id, 10)
+        assert [(entry.trade_id, entry.status) for entry in older] == [(trade_ids[0], TRADE_COMPLETED)]
+        assert older[0].archived is not None
+        assert tx.archived_trades(bob + 1, None, 10) == []
+
+
+def test_archived_trade_id_not_reused(backend):
+    alice, bob = add_user(backend, "alice"), add_user(backend, "bob")
+    trade_ids = [add_trade(backend, alice, [card_id], bob, []) for card_id in (1, 2)]
+    backend.write(lambda tx: tx.archive_trade(trade_ids[-1], TRADE_CANCELLED))
+    assert add_trade(backend, alice, [3], bob, []) == trade_ids[-1] + 1
+
+
+def test_migrate_trades_to_autoincrement(tmp_path):
+    """
+    A database whose Trades ids were not autoincrement hands out ids above every archived one after migrating
+    """
+    with open(schema_filename) as schema_file:
+        old_schema = schema_file.read().replace("id integer primary key autoincrement,\n    user1_id",
+                                                "id integer primary key,\n    user1_id")
+    old_schema_filename = str(tmp_path / "old_schema.sql")
+    with open(old_schema_filename, "w") as schema_file:
+        schema_file.write(old_schema)
+    db_filename = str(tmp_path / "trading_card_data.db")
+    old = SQLiteBackend(db_filename, old_schema_filename, cards_filename)
+    assert old.initialize()
+    alice, bob = add_user(old, "alice"), add_user(old, "bob")
+    trade_ids = [add_trade(old, alice, [card_id], bob, []) for card_id in (1, 2)]
+    old.write(lambda tx: tx.archive_trade(trade_ids[-1], TRADE_CANCELLED))
+    old.close()
+
+    migrated = SQLiteBackend(db_filename, schema_filename, cards_filename)
+    assert not migrated.initialize()
+    with migrated.read() as tx:
+        assert [t.unique_id for t in tx.trades_after(0, 10)] == trade_ids[:1]
+    assert add_trade(migrated, alice, [3], bob, []) == trade_ids[-1] + 1
+    with closing(migrated.connect()) as conn:
+        indexes = {row[0] for row in conn.execute("select name from sqlite_master where tbl_name = 'Trades'")}
+    assert {"trades_updated", "trades_users"} <= indexes
+    migrated.close()
+
+
+def test_restore_user_and_trade(backend):
+    alice = User(40, "alice", "hash-alice", 1, LAST_SEEN, {4, 5}, {9})
+    trade = Trade(9, 40, {4}, True, 41, set(), False, created=LAST_SEEN, updated=LAST_SEEN)
+
+    def command(tx: StorageTransaction) -> None:
+        tx.restore_user(alice)
+        tx.restore_trade(trade)
+
+    backend.write(command)
+    with backend.read() as tx:
+        u = tx.get_user(alice.unique_id)
+        assert (u.name, u.cards, u.trades, u.score) == ("alice", {4, 5}, {9}, 0)
+        assert tx.get_card(4).owner == alice.unique_id and tx.get_card(5).owned
+        t = tx.get_trade(9)
+        assert (t.user1_id, t.user1_cards, t.user1_confirmed, t.created) == (alice.unique_id, {4}, True, LAST_SEEN)
+    # the ids of new rows follow the restored ones
+    assert add_user(backend, "bob") == alice.unique_id + 1
+    assert add_trade(backend, alice.unique_id, [], alice.unique_id + 1, []) == 10
+    with pytest.raises(sqlite3.IntegrityError):
+        backend.write(lambda tx: tx.restore_user(alice))
+
+
+def test_delete_user(backend):
+    alice, bob = add_user(backend, "alice"), add_user(backend, "bob")
+    backend.write(lambda tx: tx.add_want(alice, 1))
+    give_cards(backend, bob, [1])
+    backend.write(lambda tx: tx.delete_user(alice))
+    with backend.read() as tx:
+        assert not tx.user_exists("alice")
+        assert [u.unique_id for u in tx.all_users()] == [bob]
+        assert tx.wanters_of_cards_of(bob) == []
+    with pytest.raises(NoOutputError):
+        backend.write(lambda tx: tx.delete_user(alice))
+
+
+def test_ownership_ledger(backend):
+    alice = add_user(backend, "alice")
+    before = datetime.utcnow() - timedelta(seconds=1)
+    give_cards(backend, alice, [1, 2])
+
+    def command(tx: StorageTransaction) -> List[int]:
+        seqs = [tx.append_event(EVENT_ACQUIRE, alice, 1), tx.append_event(EVENT_ACQUIRE, alice, 2),
+                tx.append_event(EVENT_TRADE_CREATED, alice, trade_id=1)]
+        assert tx.last_event_seq == seqs[-1]
+        tx.snapshot_ownership(seqs[1])
+        return seqs
+
+    seqs = backend.write(command)
+    assert seqs == sorted(seqs) and len(set(seqs)) == 3
+    backend.write(lambda tx: tx.append_event(EVENT_DROP, alice, 1))
+    with backend.read() as tx:
+        assert tx.event_seq_at(before) == 0
+        assert tx.event_seq_at(datetime.utcnow() + timedelta(seconds=1)) == seqs[-1] + 1
+        assert list(map(tuple, tx.ownership_changes(0, seqs[-1] + 1))) == \
+            [(EVENT_ACQUIRE, alice, 1), (EVENT_ACQUIRE, alice, 2), (EVENT_DROP, alice, 1)]
+        assert list(map(tuple, tx.ownership_changes(seqs[0], seqs[1]))) == [(EVENT_ACQUIRE, alice, 2)]
+        assert tx.latest_snapshot_seq() == seqs[1]
+        assert tx.snapshot_at(seqs[-1]) == (seqs[1], {1: alice, 2: alice})
+        assert tx.snapshot_at(seqs[0]) == (0, {})
+
+
+def test_scores_and_leaderboard(backend):
+    alice, bob, carol = (add_user(backend, name) for name in ("alice", "bob", "carol"))
+    give_cards(backend, alice, [1, 2])
+    give_cards(backend, bob, [3])
+
+    def command(tx: StorageTransaction) -> None:
+        tx.set_card_points({card.id: card.id * 100 for card in tx.all_cards()})
+        tx.rescore_users()
+
+    backend.write(command)
+    with backend.read() as tx:
+        assert tx.get_card(2).points == 200
+        assert [(u.unique_id, u.score) for u in tx.top_users(None, 10)] == [(alice, 300), (bob, 300), (carol, 0)]
+        assert [u.unique_id for u in tx.top_users((300, alice), 10)] == [bob, carol]
+        assert [u.unique_id for u in tx.top_users((300, bob), 1)] == [carol]
+        assert sorted(tx.score_counts()) == [(0, 1), (300, 2)]
+
+    def add_score(tx: StorageTransaction) -> None:
+        tx.add_user_score(carol, 50)
+        assert tx.score_changes == [(carol, 0, 50)] and carol in tx.touched_users
+
+    backend.write(add_score)
+    with backend.read() as tx:
+        assert tx.get_user(carol).score == 50
+
+
+def test_wants(backend):
+    alice, bob = add_user(backend, "alice"), add_user(backend, "bob")
+    give_cards(backend, bob, [1])
+
+    def command(tx: StorageTransaction) -> None:
+        tx.add_want(alice, 1)
+        tx.add_want(alice, 1)
+        tx.add_want(alice, 2)
+
+    backend.write(command)
+    with backend.read() as tx:
+        assert sorted(tx.user_wants(alice)) == [1, 2]
+        assert list(map(tuple, tx.want_edges(alice))) == [(1, bob)]
+        assert list(map(tuple, tx.wanters_of_cards_of(bob))) == [(alice, 1)]
+        assert tx.wanters_of_cards_of(alice) == []
+    backend.write(lambda tx: tx.remove_want(alice, 1))
+    backend.write(lambda tx: tx.remove_want(alice, 1))
+    with backend.read() as tx:
+        assert tx.user_wants(alice) == [2]
+        assert tx.want_edges(alice) == []
+
+
+def test_search(backend):
+    for name in ("José Calderón", "josh", "maria"):
+        add_user(backend, name)
+    with backend.read() as tx:
+        horford = tx.get_card_by_name("Al Horford").id
+        assert horford in {card.id for card in tx.search_cards("al hor", 10)}
+        assert [card.id for card in tx.search_cards("horf", 10)] == [horford]
+        assert len(tx.search_cards("a", 3)) == 3
+        assert tx.search_cards("", 10) == []
+        assert sorted(u.name for u in tx.search_users("jos", 10)) == ["José Calderón", "josh"]
+        assert [u.name for u in tx.search_users("jose cald", 10)] == ["José Calderón"]
+        assert tx.search_users("zz", 10) == []
+
+
+def test_dashboard(backend):
+    alice, bob = add_user(backend, "alice"), add_user(backend, "bob")
+    give_cards(backend, alice, [2, 1])
+    trade_id = add_trade(backend, alice, [1], bob, [])
+    backend.write(lambda tx: tx.refresh_dashboards({alice, bob}))
+    with backend.read() as tx:
+        dashboard = tx.dashboard(alice)
+        assert dashboard.user_id == alice
+        assert [card.id for card in dashboard.cards] == [1, 2]
+        assert [(t.unique_id, t.other_user_id, t.other_user_name, t.own_cards) for t in dashboard.trades] == \
+               [(trade_id, bob, "bob", [1])]
+        assert [t.other_user_name for t in tx.dashboard(bob).trades] == ["alice"]
+        with pytest.raises(NoOutputError):
+            tx.dashboard(bob + 1)
+
+
+def test_market(backend):
+    at = datetime.utcnow().replace(microsecond=0)
+    moves = [(1, MARKET_ACQUIRED), (1, MARKET_DROPPED), (2, MARKET_ACQUIRED), (2, MARKET_TRADED)]
+    backend.write(lambda tx: tx.record_market(moves, at))
+    backend.write(lambda tx: tx.record_market([(2, MARKET_TRADED)], at))
+    with backend.read() as tx:
+        first = tx.card_activity(1)
+        assert (first.acquired, first.dropped, first.holds, first.held_seconds, first.held_since) == (1, 1, 1, 0, None)
+        second = tx.card_activity(2)
+        assert (second.acquired, second.traded, second.holds, second.held_since) == (1, 2, 0, at)
+        untouched = tx.card_activity(3)
+        assert (untouched.name, untouched.acquired, untouched.held_since) == (tx.get_card(3).name, 0, None)
+        with pytest.raises(NoOutputError):
+            tx.card_activity(len(tx.all_cards()) + 1)
+        assert [(card.card_id, card.acquired) for card in tx.market_leaders(MARKET_ACQUIRED, 10)] == [(1, 1), (2, 1)]
+        assert [card.card_id for card in tx.market_leaders(MARKET_TRADED, 10)] == [2]
+        assert [card.card_id for card in tx.market_leaders(MARKET_ACQUIRED, 1)] == [1]
+        window = tx.market_window("day", bucket_start("day", at), MARKET_TRADED, 10)
+        assert [(card.card_id, card.traded) for card in window] == [(2, 2)]
+        assert tx.market_window("day", bucket_start("day", at) + timedelta(days=1), MARKET_TRADED, 10) == []
+        buckets = tx.market_buckets("hour", bucket_start("hour", at) - timedelta(hours=1))
+        assert [(bucket.start, bucket.acquired, bucket.dropped, bucket.traded) for bucket in buckets] == \
+               [(bucket_start("hour", at), 2, 1, 2)]
+
+
+def test_change_log():
+    backend = SQLiteBackend(":memory:", schema_filename, cards_filename)
+    backend.initialize()
+    try:
+        backend.write(lambda tx: tx.log_changes("one", [("user", 1), ("scores", None)], 10))
+        backend.write(lambda tx: tx.log_changes("two", [("user", 2)], 2))
+        with backend.read() as tx:
+            assert tx.last_change_seq() == 3
+            assert tx.changes_after(1) == [(2, "one", "scores", None), (3, "two", "user", 2)]
+            assert tx.changes_after(3) == []
+            # the first change was dropped to keep the last 2
+            assert tx.changes_after(0) is None
+    finally:
+        backend.close()
+
+
+def test_change_log_of_unshared_store():
+    backend = MemoryBackend(cards_filename)
+    backend.initialize()
+    assert not backend.shared
+    backend.write(lambda tx: tx.log_changes("one", [("user", 1)], 10))
+    with backend.read() as tx:
+        assert tx.last_change_seq() == 0
+        assert tx.changes_after(0) == []
+
+
+def test_failed_write_rolls_back(backend):
+    alice = add_user(backend, "alice")
+    at = datetime.utcnow()
+
+    def command(tx: StorageTransaction) -> None:
+        tx.insert_user("bob", "hash-bob", 1, LAST_SEEN)
+        u = tx.get_user(alice)
+        assert tx.claim_card(1, alice)
+        tx.set_user_cards(u, [1])
+        tx.add_user_score(alice, 100)
+        tx.add_want(alice, 2)
+        tx.insert_trade(alice, [1], alice, [])
+        tx.append_event(EVENT_ACQUIRE, alice, 1)
+        tx.snapshot_ownership(1)
+        tx.record_market([(1, MARKET_ACQUIRED)], at)
+        tx.set_last_seen(alice, at)
+        raise RuntimeError("the command failed")
+
+    with pytest.raises(RuntimeError):
+        backend.write(command)
+    with backend.read() as tx:
+        assert not tx.user_exists("bob")
+        u = tx.get_user(alice)
+        assert (u.cards, u.version, u.score, u.last_seen) == (set(), 0, 0, LAST_SEEN)
+        assert tx.get_card(1).owner is None and 1 in {card.id for card in tx.available_cards()}
+        assert tx.user_wants(alice) == []
+        assert tx.trades_after(0, 10) == []
+        assert list(tx.ownership_changes(0, 100)) == []
+        assert tx.latest_snapshot_seq() == 0
+        assert tx.card_activity(1).acquired == 0
+    # the ids handed out by the failed write are handed out again
+    assert add_user(backend, "bob") == alice + 1
+
+
+def test_conflicting_user_update(backend):
+    alice = add_user(backend, "alice")
+    with backend.read() as tx:
+        stale = tx.get_user(alice)
+    give_cards(backend, alice, [1])
+
+    def command(tx: StorageTransaction) -> None:
+        assert tx.claim_card(2, alice)
+        tx.set_user_cards(stale, [2])
+
+    with pytest.raises(ConflictError) as raised:
+        backend.write(command)
+    assert (raised.value.table, raised.value.row_id) == ("Users", alice)
+    with pytest.raises(ConflictError):
+        backend.write(lambda tx: tx.set_user_trades(stale, [1]))
+    with backend.read() as tx:
+        u = tx.get_user(alice)
+        assert (u.cards, u.trades, u.version) == ({1}, set(), 1)
+        # the claim of the conflicting write was rolled back with it
+        assert tx.get_card(2).owner is None
+
+
+def test_conflicting_trade_update(backend):
+    alice, bob = add_user(backend, "alice"), add_user(backend, "bob")
+    trade_id = add_trade(backend, alice, [1], bob, [2])
+    with backend.read() as tx:
+        stale = tx.get_trade(trade_id)
+    backend.write(lambda tx: tx.set_trade_confirmed(tx.get_trade(trade_id), 1, True))
+    with pytest.raises(ConflictError) as raised:
+        backend.write(lambda tx: tx.set_trade_confirmed(stale, 2, True))
+    assert (raised.value.table, raised.value.row_id) == ("Trades", trade_id)
+    with backend.read() as tx:
+        t = tx.get_trade(trade_id)
+        assert (t.user1_confirmed, t.user2_confirmed, t.version) == (True, False, 1)
+
+
+def test_conflicting_updates_of_deleted_user(backend):
+    alice = add_user(backend, "alice")
+    with backend.read() as tx:
+        stale = tx.get_user(alice)
+    backend.write(lambda tx: tx.delete_user(alice))
+    with pytest.raises(ConflictError):
+        backend.write(lambda tx: tx.set_user_cards(stale, [1]))
+
+
+def test_snapshot_isolation(backend):
+    alice = add_user(backend, "alice")
+    written = threading.Event()
+    errors = []
+
+    def writer() -> None:
+        try:
+            add_user(backend, "bob")
+            give_cards(backend, alice, [1])
+        except Exception as err:
+            errors.append(err)
+        written.set()
+
+    with backend.snapshot() as tx:
+        assert [u.name for u in tx.all_users()] == ["alice"]
+        thread = threading.Thread(target=writer)
+        thread.start()
+        # a backend may hold writes off until the snapshot is released or let them commit meanwhile, either way the
+        # snapshot keeps seeing the state it started with
+        written.wait(WRITE_WAIT)
+        assert [u.name for u in tx.all_users()] == ["alice"]
+        assert tx.get_user(alice).cards == set()
+        assert tx.get_card(1).owner is None
+    thread.join()
+    assert errors == []
+    with backend.snapshot() as tx:
+        assert sorted(u.name for u in tx.all_users()) == ["alice", "bob"]
+        assert tx.get_card(1).owner == alice
+
+
+def test_concurrent_claims_of_one_card(backend):
+    user_ids = [add_user(backend, f"user{i}") for i in range(8)]
+    start_line = threading.Barrier(len(user_ids))
+    claimed = []
+
+    def claim(user_id: int) -> None:
+        start_line.wait()
+        if backend.write(lambda tx: tx.claim_card(1, user_id)):
+            claimed.append(user_id)
+
+    threads = [threading.Thread(target=claim, args=(user_id,)) for user_id in user_ids]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(claimed) == 1
+    with backend.read() as tx:
+        assert tx.get_card(1).owner == claimed[0]
+
+
+def test_abstract_base_classes():
+    with pytest.raises(TypeError):
+        StorageBackend()
+    with pytest.raises(TypeError):
+        StorageTransaction()